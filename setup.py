@@ -13,8 +13,19 @@ setup(
     tests_require    = test_requirements,
     install_requires = ['redis_bus_python>=0.0.2',
 			'tornado>=4.3',
+			'numpy>=1.8',
 			] + test_requirements,
 
+    # The modules run as modules.learning_analytics inside a Course Builder
+    # tree, which must be on the path of these scripts:
+    entry_points = {
+        'console_scripts': [
+            'schoolbus-handler = modules.learning_analytics.schoolbus_cli:main',
+            'schoolbus-mastery-export = modules.learning_analytics.mastery_export:main',
+            'schoolbus-traffic-replay = modules.learning_analytics.traffic_replay:main',
+        ],
+    },
+
     # Unit tests; they are initiated via 'python setup.py test'
     #test_suite       = 'nose.collector', 
 
@@ -0,0 +1,305 @@
+"""Threshold and top-k index of at-risk students.
+
+Instructors want to be alerted when a student's mastery of a skill or objective
+falls below a threshold, and to list the k weakest students of an objective.
+Scanning every student per query does not scale, so the AtRiskIndex keeps, for
+every skill and objective, the students bucketed by their current estimate:
+
+    * An update moves a student between two buckets in O(1).
+    * "Who is below t" returns the buckets below t wholesale and only filters
+      the bucket containing t.
+    * "The k weakest" walks the buckets upward and sorts only the buckets it
+      takes students from.
+    * The size, mean, histogram and number of at-risk students of a cohort
+      come from the bucket sizes and a running sum, without copying the
+      cohort.
+
+Objective estimates are the means maintained by ObjectiveMasteryAggregates.
+Whenever an update moves a student across the alert threshold, a crossing event
+is passed to the on_crossing callback, e.g. for publishing on the bus.
+"""
+
+
+class MasteryBuckets(object):
+    """Estimates of one skill or objective, bucketed by value."""
+
+    def __init__(self, num_buckets):
+        self._num_buckets = num_buckets
+        self._buckets = [{} for _ in range(num_buckets)]
+        self._values = {}
+        # Sum of the estimates, for the mean:
+        self._total = 0.0
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, student_id):
+        return student_id in self._values
+
+    def _bucket_index(self, value):
+        return max(0, min(int(value * self._num_buckets),
+                          self._num_buckets - 1))
+
+    def get(self, student_id):
+        return self._values.get(student_id)
+
+    def set(self, student_id, value):
+        """Set the estimate of a student.
+
+        Returns:
+            float. The previous estimate, or None if the student was not
+                indexed.
+        """
+        old_value = self._values.get(student_id)
+        if old_value is not None:
+            del self._buckets[self._bucket_index(old_value)][student_id]
+            self._total -= old_value
+        self._buckets[self._bucket_index(value)][student_id] = value
+        self._values[student_id] = value
+        self._total += value
+        return old_value
+
+    def remove(self, student_id):
+        old_value = self._values.pop(student_id, None)
+        if old_value is not None:
+            del self._buckets[self._bucket_index(old_value)][student_id]
+            self._total -= old_value
+
+    @property
+    def total(self):
+        """The sum of the estimates of all students."""
+        return self._total
+
+    def count_below(self, threshold):
+        """Count the students whose estimate is strictly below threshold."""
+        if threshold <= 0:
+            return 0
+        boundary = self._bucket_index(threshold)
+        count = sum(len(bucket) for bucket in self._buckets[:boundary])
+        return count + sum(1 for value in self._buckets[boundary].values()
+                           if value < threshold)
+
+    def below(self, threshold):
+        """Get the students whose estimate is strictly below threshold.
+
+        Returns:
+            dict. Student id to estimate.
+        """
+        result = {}
+        if threshold <= 0:
+            return result
+        boundary = self._bucket_index(threshold)
+        for bucket in self._buckets[:boundary]:
+            result.update(bucket)
+        for student_id, value in self._buckets[boundary].items():
+            if value < threshold:
+                result[student_id] = value
+        return result
+
+    def values(self):
+        """Get the estimates of all students.
+
+        Returns:
+            dict. Student id to estimate.
+        """
+        return dict(self._values)
+
+    def histogram(self, num_bins):
+        """Count the students in num_bins equal-width bins over [0, 1].
+
+        Bins are unions of buckets, so num_bins should divide the number of
+        buckets for the bins to be of equal width.
+        """
+        counts = [0] * num_bins
+        for index, bucket in enumerate(self._buckets):
+            counts[index * num_bins // self._num_buckets] += len(bucket)
+        return counts
+
+    def lowest(self, k):
+        """Get the k students with the lowest estimates.
+
+        Returns:
+            list. (student id, estimate) tuples in ascending order of estimate.
+        """
+        result = []
+        for bucket in self._buckets:
+            if len(result) >= k:
+                break
+            if bucket:
+                result.extend(sorted(
+                    bucket.items(), key=lambda item: (item[1], item[0])))
+        return result[:k]
+
+
+class AtRiskIndex(object):
+    """Per-skill and per-objective mastery buckets of the students in a course.
+
+    Register skills_changed as a SkillsUpdater listener after the listener of
+    the ObjectiveMasteryAggregates, so objective means are current when the
+    index reads them.
+    """
+
+    DEFAULT_THRESHOLD = 0.4
+    DEFAULT_NUM_BUCKETS = 100
+
+    SKILL = 'skill'
+    OBJECTIVE = 'objective'
+
+    def __init__(self, skills_map, objective_aggregates,
+                 threshold=DEFAULT_THRESHOLD, num_buckets=DEFAULT_NUM_BUCKETS,
+                 on_crossing=None):
+        """Create an empty index.
+
+        Args:
+            skills_map: SkillsMap. The skills map of the course.
+            objective_aggregates: ObjectiveMasteryAggregates. The source of
+                objective estimates.
+            threshold: float. Estimates below this value count as at risk.
+            num_buckets: int. The number of equal-width buckets over [0, 1].
+            on_crossing: callable. Called with a crossing event dict whenever
+                an indexed student moves across threshold.
+        """
+        self._skills_map = skills_map
+        self._objective_aggregates = objective_aggregates
+        self._threshold = threshold
+        self._num_buckets = num_buckets
+        self._on_crossing = on_crossing
+        self._indexes = {self.SKILL: {}, self.OBJECTIVE: {}}
+
+    @property
+    def threshold(self):
+        return self._threshold
+
+    def _buckets(self, kind, item_id):
+        buckets = self._indexes[kind].get(item_id)
+        if buckets is None:
+            buckets = MasteryBuckets(self._num_buckets)
+            self._indexes[kind][item_id] = buckets
+        return buckets
+
+    def _set(self, kind, item_id, student_id, value):
+        old_value = self._buckets(kind, item_id).set(student_id, value)
+        # Students entering the index are not reported; only changes of side
+        # for students already tracked are.
+        if (self._on_crossing is None or old_value is None or
+                (old_value < self._threshold) == (value < self._threshold)):
+            return
+        self._on_crossing({
+            'kind': kind,
+            'id': item_id,
+            'student_id': student_id,
+            'direction': 'below' if value < self._threshold else 'above',
+            'value': value,
+            'threshold': self._threshold})
+
+    def skills_changed(self, student_id, student_skills, changed):
+        """Re-bucket the changed skills and their objectives.
+
+        Has the signature of a SkillsUpdater listener.
+        """
+        objective_ids = set()
+        for skill_id in changed:
+            self._set(self.SKILL, skill_id, student_id,
+                      student_skills[skill_id])
+            objective_ids.update(
+                self._skills_map.get_objectives_for_skill(skill_id))
+        for objective_id in objective_ids:
+            self._set(self.OBJECTIVE, objective_id, student_id,
+                      self._objective_aggregates.get_mean(
+                          student_id, objective_id))
+
+    def forget_student(self, student_id):
+        for index in self._indexes.values():
+            for buckets in index.values():
+                buckets.remove(student_id)
+
+    def students_below(self, kind, item_id, threshold=None):
+        """Get the students whose estimate is below a threshold.
+
+        Args:
+            kind: str. SKILL or OBJECTIVE.
+            item_id: str. The id of the skill or objective.
+            threshold: float. Defaults to the alert threshold of the index.
+
+        Returns:
+            dict. Student id to estimate.
+        """
+        buckets = self._indexes[kind].get(item_id)
+        if buckets is None:
+            return {}
+        return buckets.below(
+            self._threshold if threshold is None else threshold)
+
+    def get_cohort(self, kind, item_id):
+        """Get the estimates of all indexed students.
+
+        Args:
+            kind: str. SKILL or OBJECTIVE.
+            item_id: str. The id of the skill or objective.
+
+        Returns:
+            dict. Student id to estimate.
+        """
+        buckets = self._indexes[kind].get(item_id)
+        if buckets is None:
+            return {}
+        return buckets.values()
+
+    def summarize(self, kind, item_id, num_bins=10):
+        """Get the aggregates of the indexed students.
+
+        Costs a pass over the bucket sizes and over the bucket holding the
+        threshold, rather than over all students.
+
+        Args:
+            kind: str. SKILL or OBJECTIVE.
+            item_id: str. The id of the skill or objective.
+            num_bins: int. The number of equal-width histogram bins.
+
+        Returns:
+            dict. The 'num_students', their 'mean' estimate (None if there are
+                none), the 'histogram' as by histogram(), and 'num_at_risk',
+                the number of students below the alert threshold.
+        """
+        buckets = self._indexes[kind].get(item_id)
+        if buckets is None:
+            buckets = MasteryBuckets(self._num_buckets)
+        num_students = len(buckets)
+        return {
+            'num_students': num_students,
+            'mean': buckets.total / num_students if num_students else None,
+            'histogram': buckets.histogram(num_bins),
+            'num_at_risk': buckets.count_below(self._threshold),
+        }
+
+    def histogram(self, kind, item_id, num_bins=10):
+        """Count the indexed students by estimate.
+
+        Args:
+            kind: str. SKILL or OBJECTIVE.
+            item_id: str. The id of the skill or objective.
+            num_bins: int. The number of equal-width bins over [0, 1].
+
+        Returns:
+            list. The number of students in each bin, lowest first.
+        """
+        buckets = self._indexes[kind].get(item_id)
+        if buckets is None:
+            return [0] * num_bins
+        return buckets.histogram(num_bins)
+
+    def weakest(self, kind, item_id, k):
+        """Get the k students with the lowest estimates.
+
+        Args:
+            kind: str. SKILL or OBJECTIVE.
+            item_id: str. The id of the skill or objective.
+            k: int. The maximum number of students to return.
+
+        Returns:
+            list. (student id, estimate) tuples in ascending order of estimate.
+        """
+        buckets = self._indexes[kind].get(item_id)
+        if buckets is None:
+            return []
+        return buckets.lowest(k)
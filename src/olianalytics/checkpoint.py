@@ -0,0 +1,296 @@
+"""Periodic checkpoints for fast restarts of the SchoolBus module.
+
+Without checkpoints a restarted module re-parses every course's skills and
+resources maps and starts with an empty student-state cache, which then has to
+warm up again from incoming events. A Checkpointer periodically writes a
+snapshot of the handler to local disk:
+
+    * the compiled SkillsMap and ResourcesMap objects of each course,
+    * the hot student state of each course,
+    * the position of the last processed bus message.
+
+Snapshots are pickled with the highest protocol, which loads far faster than
+parsing the XML maps, and are written atomically: the data goes to a temporary
+file that is renamed into place only once it is complete, so a crash while
+checkpointing leaves the previous snapshot intact. The newest few snapshots are
+kept. Once started, a Checkpointer writes its periodic snapshots on a thread of
+its own, so that no thread processing student actions waits for one.
+
+A snapshot file is a sequence of pickles rather than one, so that the student
+state need not be in memory at once, neither when writing nor when reading:
+
+    * a preamble, {'format': FORMAT, 'version': VERSION},
+    * the snapshot, with the 'students' of each course left out,
+    * (course id, [(student id, student state), ...]) records of up to
+      STUDENTS_PER_RECORD students each,
+    * None,
+
+followed by the bytes of END_MARKER. Snapshots of another version, e.g. with
+pickled maps that no longer match the code, and truncated ones are rejected
+by read_snapshot(); read_latest() then falls back to the previous snapshot.
+
+The 'students' of a course may be given as a dict or as any iterable of
+(student id, student state) pairs, e.g. a generator reading them from a cache.
+"""
+
+import glob
+import logging
+import os
+import pickle
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+FORMAT = 'schoolbus-checkpoint'
+# Increase when the layout or the pickled classes, e.g. SkillsMap, change:
+VERSION = 2
+END_MARKER = b'\nend of schoolbus checkpoint\n'
+
+STUDENTS_PER_RECORD = 1000
+
+
+def write_snapshot(snapshot, snapshot_file):
+    """Pickle a snapshot to a file, streaming the students of its courses."""
+    header = snapshot
+    streams = []
+    if isinstance(snapshot, dict) and isinstance(snapshot.get('courses'), dict):
+        header = dict(snapshot, courses={})
+        for course_id, course in snapshot['courses'].items():
+            header['courses'][course_id] = dict(
+                (key, value) for key, value in course.items()
+                if key != 'students')
+            students = course.get('students', ())
+            if isinstance(students, dict):
+                students = students.items()
+            streams.append((course_id, students))
+    try:
+        pickle.dump({'format': FORMAT, 'version': VERSION}, snapshot_file,
+                    pickle.HIGHEST_PROTOCOL)
+        pickle.dump(header, snapshot_file, pickle.HIGHEST_PROTOCOL)
+        for course_id, students in streams:
+            record = []
+            for student in students:
+                record.append(student)
+                if len(record) == STUDENTS_PER_RECORD:
+                    pickle.dump((course_id, record), snapshot_file,
+                                pickle.HIGHEST_PROTOCOL)
+                    record = []
+            if record:
+                pickle.dump((course_id, record), snapshot_file,
+                            pickle.HIGHEST_PROTOCOL)
+        pickle.dump(None, snapshot_file, pickle.HIGHEST_PROTOCOL)
+        snapshot_file.write(END_MARKER)
+    finally:
+        # Generators release what they hold, e.g. locks, even on failure:
+        for _, students in streams:
+            if hasattr(students, 'close'):
+                students.close()
+
+
+def read_snapshot(path):
+    """Read a snapshot without loading its students.
+
+    Returns:
+        tuple. The snapshot without the 'students' of its courses, and a
+            generator of (course id, student id, student state) tuples in the
+            order they were written.
+
+    Raises:
+        ValueError: The file is not a complete snapshot of this version.
+    """
+    snapshot_file = open(path, 'rb')
+    try:
+        # A snapshot is complete once its end marker is written:
+        snapshot_file.seek(0, os.SEEK_END)
+        if snapshot_file.tell() < len(END_MARKER):
+            raise ValueError('%s is truncated' % path)
+        snapshot_file.seek(-len(END_MARKER), os.SEEK_END)
+        if snapshot_file.read() != END_MARKER:
+            raise ValueError('%s is truncated' % path)
+        snapshot_file.seek(0)
+        preamble = pickle.load(snapshot_file)
+        if not isinstance(preamble, dict) or preamble.get('format') != FORMAT:
+            raise ValueError('%s is not a checkpoint' % path)
+        if preamble.get('version') != VERSION:
+            raise ValueError('%s is of version %s, not %s' % (
+                path, preamble.get('version'), VERSION))
+        header = pickle.load(snapshot_file)
+    except Exception:
+        snapshot_file.close()
+        raise
+
+    def students():
+        with snapshot_file:
+            while True:
+                record = pickle.load(snapshot_file)
+                if record is None:
+                    return
+                course_id, course_students = record
+                for student_id, student_state in course_students:
+                    yield course_id, student_id, student_state
+
+    return header, students()
+
+
+def load_snapshot(path):
+    """Read a snapshot, with the students of each course as a dict."""
+    return _load_students(*read_snapshot(path))
+
+
+def _load_students(snapshot, students):
+    if isinstance(snapshot, dict) and isinstance(snapshot.get('courses'), dict):
+        for course in snapshot['courses'].values():
+            course['students'] = {}
+    for course_id, student_id, student_state in students:
+        snapshot['courses'][course_id]['students'][student_id] = student_state
+    return snapshot
+
+
+class Checkpointer(object):
+    """Writes and finds snapshots in a local directory."""
+
+    FILE_PREFIX = 'checkpoint-'
+    FILE_SUFFIX = '.pickle'
+    DEFAULT_INTERVAL = 5 * 60
+    DEFAULT_KEEP = 2
+
+    def __init__(self, directory, interval=DEFAULT_INTERVAL,
+                 keep=DEFAULT_KEEP):
+        """Create a checkpointer.
+
+        Args:
+            directory: str. The directory holding the snapshots. Created if
+                it does not exist.
+            interval: float. Minimum seconds between periodic snapshots.
+            keep: int. The number of newest snapshots to keep.
+        """
+        self._directory = directory
+        self._interval = interval
+        self._keep = keep
+        self._last_save = time.time()
+        # Serializes writing and pruning, and claiming periodic snapshots:
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def _snapshot_paths(self):
+        # Zero-padded millisecond timestamps sort chronologically by name.
+        return sorted(glob.glob(os.path.join(
+            self._directory, self.FILE_PREFIX + '*' + self.FILE_SUFFIX)))
+
+    def save(self, snapshot, now=None):
+        """Atomically write a snapshot.
+
+        Args:
+            snapshot: object. Any picklable object, usually a dict.
+            now: float. Seconds since the epoch. Defaults to the current time.
+
+        Returns:
+            str. The path of the written snapshot.
+        """
+        if now is None:
+            now = time.time()
+        path = os.path.join(self._directory, '%s%015d%s' % (
+            self.FILE_PREFIX, int(now * 1000), self.FILE_SUFFIX))
+        tmp_path = path + '.tmp'
+        with self._lock:
+            with open(tmp_path, 'wb') as snapshot_file:
+                write_snapshot(snapshot, snapshot_file)
+                snapshot_file.flush()
+                os.fsync(snapshot_file.fileno())
+            os.rename(tmp_path, path)
+            self._last_save = now
+
+            for old_path in self._snapshot_paths()[:-self._keep]:
+                os.remove(old_path)
+        return path
+
+    def maybe_save(self, make_snapshot, now=None):
+        """Write a snapshot if the interval has passed since the last one.
+
+        Args:
+            make_snapshot: callable. Returns the snapshot; only called if a
+                snapshot is due.
+            now: float. Seconds since the epoch. Defaults to the current time.
+
+        Returns:
+            str. The path of the written snapshot, or None if none was due.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            if now - self._last_save < self._interval:
+                return None
+            # Claimed, so that concurrent callers do not save it again:
+            self._last_save = now
+        return self.save(make_snapshot(), now=now)
+
+    def start(self, make_snapshot):
+        """Write a snapshot every interval seconds on a background thread.
+
+        Args:
+            make_snapshot: callable. Returns the snapshot to write.
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(make_snapshot,),
+            name='schoolbus-checkpointer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, make_snapshot):
+        while not self._stop.wait(
+                max(0, self._last_save + self._interval - time.time())):
+            try:
+                self.maybe_save(make_snapshot)
+            except Exception:
+                logger.exception('Failed to write a checkpoint')
+
+    def stop(self):
+        """Stop the background thread, waiting for a snapshot in progress."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def latest_path(self):
+        """Get the path of the newest snapshot, or None if there is none."""
+        paths = self._snapshot_paths()
+        return paths[-1] if paths else None
+
+    def read_latest(self):
+        """Read the newest readable snapshot without loading its students.
+
+        Snapshots that cannot be read, e.g. truncated ones or ones of another
+        version, are skipped with a warning in favor of older ones.
+
+        Returns:
+            tuple. As returned by read_snapshot(), or (None, None) if there
+                is no readable snapshot.
+        """
+        for path in reversed(self._snapshot_paths()):
+            try:
+                return read_snapshot(path)
+            except Exception as e:
+                # Unpickling raises all kinds of errors for stale classes:
+                logger.warning('Skipping unreadable checkpoint %s: %s',
+                               path, e)
+        return None, None
+
+    def load_latest(self):
+        """Load the newest readable snapshot, students included.
+
+        Returns:
+            object. The snapshot, or None if there is none.
+        """
+        snapshot, students = self.read_latest()
+        if snapshot is None:
+            return None
+        return _load_students(snapshot, students)
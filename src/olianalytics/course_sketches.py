@@ -0,0 +1,282 @@
+"""Streaming approximate analytics of the student actions of a course.
+
+Per-resource correctness rates, per-skill attempt volumes, distinct student
+counts and the most attempted problems are too expensive to recompute exactly
+from EventEntity. CourseSketches maintains them incrementally, in fixed memory,
+from the same student actions that drive the BKT updates:
+
+    * CountMinSketch estimates how often a key occurred. Estimates never fall
+      short of the true count and exceed it by at most epsilon times the
+      total count, with probability 1 - delta.
+    * HyperLogLog estimates the number of distinct keys, with a relative
+      standard error of 1.04 / sqrt(2 ** precision).
+    * SpaceSaving tracks the heavy hitters: any key occurring more often than
+      the total count divided by the capacity is guaranteed to be listed.
+
+Merging two sketches gives the sketch of the combined streams, so every worker
+thread keeps its own sketches and the handler merges them when it publishes a
+summary.
+"""
+
+import hashlib
+import heapq
+import math
+import struct
+
+
+def _hash_key(key):
+    """Two independent 64 bit hashes of a key."""
+    if not isinstance(key, bytes):
+        key = (u'%s' % key).encode('utf-8')
+    return struct.unpack('<QQ', hashlib.sha1(key).digest()[:16])
+
+
+class CountMinSketch(object):
+    """Approximate counts of keys in a stream."""
+
+    @classmethod
+    def from_error_bounds(cls, epsilon, delta):
+        """Create the smallest sketch meeting the given error bounds.
+
+        Args:
+            epsilon: float. Overestimates stay below epsilon times the total
+                count...
+            delta: float. ...except with this probability.
+
+        Returns:
+            CountMinSketch. The sketch.
+        """
+        return cls(int(math.ceil(math.e / epsilon)),
+                   int(math.ceil(math.log(1.0 / delta))))
+
+    def __init__(self, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self.total = 0
+        self._rows = [[0] * width for _ in range(depth)]
+
+    def _columns(self, key):
+        hash1, hash2 = _hash_key(key)
+        hash2 |= 1
+        return [(hash1 + row * hash2) % self.width for row in range(self.depth)]
+
+    def add(self, key, count=1):
+        self.total += count
+        for row, column in zip(self._rows, self._columns(key)):
+            row[column] += count
+
+    def estimate(self, key):
+        """Get an upper bound of the count of key."""
+        return min(row[column]
+                   for row, column in zip(self._rows, self._columns(key)))
+
+    def merge(self, other):
+        """Add the counts of a sketch with the same dimensions."""
+        assert (self.width, self.depth) == (other.width, other.depth), (
+            'Cannot merge count-min sketches of different dimensions')
+        self.total += other.total
+        for row, other_row in zip(self._rows, other._rows):
+            for column, count in enumerate(other_row):
+                if count:
+                    row[column] += count
+
+
+class HyperLogLog(object):
+    """Approximate number of distinct keys in a stream."""
+
+    def __init__(self, precision=12):
+        assert 4 <= precision <= 16, 'Precision must be between 4 and 16'
+        self.precision = precision
+        self._num_registers = 1 << precision
+        self._registers = bytearray(self._num_registers)
+
+    def add(self, key):
+        hash1, _ = _hash_key(key)
+        index = hash1 >> (64 - self.precision)
+        remaining = (hash1 << self.precision) & 0xFFFFFFFFFFFFFFFF
+        # Position of the first 1 bit after the index bits:
+        rank = 1
+        max_rank = 64 - self.precision + 1
+        while rank < max_rank and not remaining & (1 << 63):
+            remaining <<= 1
+            rank += 1
+        if rank > self._registers[index]:
+            self._registers[index] = rank
+
+    def count(self):
+        """Estimate the number of distinct keys added."""
+        num_registers = self._num_registers
+        alpha = 0.7213 / (1 + 1.079 / num_registers)
+        estimate = alpha * num_registers ** 2 / sum(
+            2.0 ** -register for register in self._registers)
+        # bytearray.count() takes no int on Python 2:
+        num_zeros = sum(1 for register in self._registers if register == 0)
+        if estimate <= 2.5 * num_registers and num_zeros:
+            # Linear counting is more accurate for small cardinalities.
+            estimate = num_registers * math.log(
+                float(num_registers) / num_zeros)
+        return int(round(estimate))
+
+    def merge(self, other):
+        assert self.precision == other.precision, (
+            'Cannot merge HyperLogLogs of different precision')
+        for index, register in enumerate(other._registers):
+            if register > self._registers[index]:
+                self._registers[index] = register
+
+
+class SpaceSaving(object):
+    """The most frequent keys of a stream, with bounded counts."""
+
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        # key -> [count, maximum overestimation]
+        self._counters = {}
+        # One (count, key) entry per key. Hits leave the entry of their key
+        # as it is, so its count may lag behind that of the counter.
+        self._heap = []
+
+    def _smallest(self):
+        """Get the (count, key) of the smallest counter in O(log capacity).
+
+        Counts only grow, so a lagging entry is below the count of its key;
+        it is brought up to date and sifted down until the top is current.
+        Each hit causes at most one such update, so misses stay O(log
+        capacity) amortized.
+        """
+        while True:
+            count, key = self._heap[0]
+            current = self._counters[key][0]
+            if count == current:
+                return count, key
+            heapq.heapreplace(self._heap, (current, key))
+
+    def _min_count(self):
+        if len(self._counters) < self.capacity:
+            return 0
+        return self._smallest()[0]
+
+    def add(self, key, count=1):
+        counter = self._counters.get(key)
+        if counter is not None:
+            counter[0] += count
+        elif len(self._counters) < self.capacity:
+            self._counters[key] = [count, 0]
+            heapq.heappush(self._heap, (count, key))
+        else:
+            # Replace the smallest key, inheriting its count as error:
+            min_count, smallest = self._smallest()
+            del self._counters[smallest]
+            self._counters[key] = [min_count + count, min_count]
+            heapq.heapreplace(self._heap, (min_count + count, key))
+
+    def top(self, num_keys=None):
+        """Get the most frequent keys.
+
+        Returns:
+            list. (key, count, error) tuples by decreasing count. The true
+                count lies between count - error and count.
+        """
+        ranked = sorted(self._counters.items(),
+                        key=lambda item: (-item[1][0], item[0]))
+        return [(key, count, error)
+                for key, (count, error) in ranked[:num_keys]]
+
+    def merge(self, other):
+        """Combine with another summary of the same capacity.
+
+        A key missing from a full summary may still have occurred up to that
+        summary's minimum count, which is added to its count and error.
+        """
+        own_min = self._min_count()
+        other_min = other._min_count()
+        merged = {}
+        for key in set(self._counters) | set(other._counters):
+            count, error = self._counters.get(key, (own_min, own_min))
+            other_count, other_error = other._counters.get(
+                key, (other_min, other_min))
+            merged[key] = [count + other_count, error + other_error]
+        ranked = sorted(merged.items(), key=lambda item: -item[1][0])
+        self._counters = dict(ranked[:self.capacity])
+        self._heap = [(counter[0], key) for key, counter in self._counters.items()]
+        heapq.heapify(self._heap)
+
+
+class CourseSketches(object):
+    """The sketches of one course."""
+
+    def __init__(self, epsilon=0.001, delta=0.01, precision=12,
+                 num_heavy_hitters=100):
+        """Create empty sketches.
+
+        Args:
+            epsilon: float. Error bound of the count-min sketches.
+            delta: float. Failure probability of the count-min sketches.
+            precision: int. Precision of the distinct student counter.
+            num_heavy_hitters: int. Capacity of the top problems summary.
+        """
+        self.num_events = 0
+        self.resource_attempts = CountMinSketch.from_error_bounds(
+            epsilon, delta)
+        self.resource_correct = CountMinSketch.from_error_bounds(
+            epsilon, delta)
+        self.skill_attempts = CountMinSketch.from_error_bounds(epsilon, delta)
+        self.students = HyperLogLog(precision)
+        self.top_resources = SpaceSaving(num_heavy_hitters)
+
+    def observe(self, payload, skill_ids):
+        """Count one student action.
+
+        Args:
+            payload: dict. The student action.
+            skill_ids: iterable. The skills the action measured.
+        """
+        resource_id = payload.get('resource_id')
+        self.num_events += 1
+        self.students.add(payload.get('student_id'))
+        if resource_id is not None:
+            self.resource_attempts.add(resource_id)
+            if payload.get('result'):
+                self.resource_correct.add(resource_id)
+            self.top_resources.add(resource_id)
+        for skill_id in skill_ids:
+            self.skill_attempts.add(skill_id)
+
+    def merge(self, other):
+        self.num_events += other.num_events
+        self.resource_attempts.merge(other.resource_attempts)
+        self.resource_correct.merge(other.resource_correct)
+        self.skill_attempts.merge(other.skill_attempts)
+        self.students.merge(other.students)
+        self.top_resources.merge(other.top_resources)
+
+    def summary(self, skill_ids, num_resources=10):
+        """Summarize the course for publication.
+
+        Args:
+            skill_ids: iterable. The skills to report attempt volumes of.
+            num_resources: int. The number of most attempted resources to
+                report.
+
+        Returns:
+            dict. JSON-serializable summary.
+        """
+        resources = []
+        for resource_id, _, _ in self.top_resources.top(
+                num_resources):
+            attempts = self.resource_attempts.estimate(resource_id)
+            correct = min(self.resource_correct.estimate(resource_id),
+                          attempts)
+            resources.append({
+                'resource_id': resource_id,
+                'attempts': attempts,
+                'correct_rate': float(correct) / attempts if attempts else None,
+            })
+        return {
+            'num_events': self.num_events,
+            'distinct_students': self.students.count(),
+            'skill_attempts': dict(
+                (skill_id, self.skill_attempts.estimate(skill_id))
+                for skill_id in skill_ids),
+            'top_resources': resources,
+        }
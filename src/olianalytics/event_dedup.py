@@ -0,0 +1,203 @@
+"""Bounded-memory suppression of redelivered student actions.
+
+Redis bus reconnects and upstream retries can deliver the same problem_check
+more than once. BKT updates are not idempotent, so every duplicate would skew
+the estimates. The EventDeduplicator sits in front of the updater and drops
+events whose fingerprint it has seen recently. Fingerprints build on the
+event timestamp or the bus message id, so that a student resubmitting the same
+answer is not mistaken for a redelivery; events with neither pass unchecked.
+
+Fingerprints are kept in a rotating Bloom filter: two generations of a
+fixed-size bit array. New fingerprints go into the current generation, lookups
+consult both. The current generation is retired once it holds its capacity or
+its time window has passed, which bounds memory no matter how many events
+arrive, while any fingerprint is remembered for at least one full generation.
+
+The price is a small, configurable rate of false positives, i.e. first-time
+events that are wrongly dropped. Each generation is sized so that the combined
+false positive rate of both stays within the requested budget.
+"""
+
+import hashlib
+import json
+import math
+import struct
+import time
+
+
+def event_fingerprint(payload, message_id=None):
+    """Compute the fingerprint of a student action.
+
+    A student may legitimately submit the same answer twice, so identical
+    payloads are not enough to recognize a redelivery. Actions that carry a
+    timestamp are identified by their whole payload, timestamp included;
+    others by the id of the bus message that carried them, which redelivery
+    preserves.
+
+    Args:
+        payload: dict. The decoded student action.
+        message_id: str. The id of the bus message, if it has one.
+
+    Returns:
+        str. A 20 byte digest, or None if the action has neither a timestamp
+            nor a message id and cannot be told apart from a resubmission.
+    """
+    if payload.get('time') is not None:
+        key = json.dumps(payload, sort_keys=True)
+    elif message_id is not None:
+        key = u'id:%s' % message_id
+    else:
+        return None
+    return hashlib.sha1(key.encode('utf-8')).digest()
+
+
+class RotatingBloomFilter(object):
+    """Two-generation Bloom filter of fingerprints seen within a time window."""
+
+    @classmethod
+    def from_memory_cap(cls, max_bytes, error_rate, window):
+        """Create the largest filter fitting in max_bytes.
+
+        Args:
+            max_bytes: int. Memory for the bit arrays of both generations.
+            error_rate: float. The false positive budget.
+            window: float. Seconds after which a generation is retired.
+
+        Returns:
+            RotatingBloomFilter. The filter.
+        """
+        num_bits = max_bytes * 8 // 2
+        capacity = int(num_bits * math.log(2) ** 2 / -math.log(
+            error_rate / 2.0))
+        return cls(max(capacity, 1), error_rate, window)
+
+    def __init__(self, capacity, error_rate, window):
+        """Create an empty filter.
+
+        Args:
+            capacity: int. The number of fingerprints per generation.
+            error_rate: float. The false positive budget over both
+                generations.
+            window: float. Seconds after which a generation is retired, even
+                if it has not reached capacity.
+        """
+        assert 0 < error_rate < 1, 'Error rate must be between 0 and 1'
+        generation_rate = error_rate / 2.0
+        self._capacity = capacity
+        self._window = window
+        self._num_bits = max(8, int(math.ceil(
+            -capacity * math.log(generation_rate) / math.log(2) ** 2)))
+        self._num_hashes = max(1, int(round(
+            float(self._num_bits) / capacity * math.log(2))))
+        self._current = bytearray(self._num_bits // 8 + 1)
+        self._previous = bytearray(len(self._current))
+        self._count = 0
+        self._started = None
+        self.num_rotations = 0
+
+    @property
+    def num_bytes(self):
+        return len(self._current) + len(self._previous)
+
+    @property
+    def num_hashes(self):
+        return self._num_hashes
+
+    def _bit_positions(self, fingerprint):
+        # Kirsch-Mitzenmacher double hashing over two halves of the digest.
+        hash1, hash2 = struct.unpack('<QQ', fingerprint[:16])
+        hash2 |= 1
+        return [(hash1 + i * hash2) % self._num_bits
+                for i in range(self._num_hashes)]
+
+    @staticmethod
+    def _contains(bits, positions):
+        for position in positions:
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def _rotate(self):
+        self._previous = self._current
+        self._current = bytearray(len(self._previous))
+        self._count = 0
+        self.num_rotations += 1
+
+    def add(self, fingerprint, now=None):
+        """Add a fingerprint, reporting whether it was probably present.
+
+        Args:
+            fingerprint: str. At least 16 bytes, e.g. from event_fingerprint.
+            now: float. Seconds since the epoch. Defaults to the current time.
+
+        Returns:
+            bool. True if the fingerprint was (probably) seen before.
+        """
+        if now is None:
+            now = time.time()
+        if self._started is None:
+            self._started = now
+        elif (self._count >= self._capacity or
+              now - self._started >= self._window):
+            self._rotate()
+            self._started = now
+
+        positions = self._bit_positions(fingerprint)
+        if self._contains(self._current, positions):
+            return True
+        seen = self._contains(self._previous, positions)
+        for position in positions:
+            self._current[position >> 3] |= 1 << (position & 7)
+        self._count += 1
+        return seen
+
+
+class EventDeduplicator(object):
+    """Drops student actions that were already delivered recently."""
+
+    DEFAULT_MAX_BYTES = 4 * 1024 * 1024
+    DEFAULT_ERROR_RATE = 1e-6
+    DEFAULT_WINDOW = 15 * 60
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES,
+                 error_rate=DEFAULT_ERROR_RATE, window=DEFAULT_WINDOW):
+        """Create a deduplicator.
+
+        Args:
+            max_bytes: int. The memory cap of the fingerprint filter.
+            error_rate: float. The budget of first-time events wrongly
+                dropped as duplicates.
+            window: float. Seconds for which fingerprints are at least
+                remembered, unless the traffic exceeds the filter capacity.
+        """
+        self._filter = RotatingBloomFilter.from_memory_cap(
+            max_bytes, error_rate, window)
+        self.num_events = 0
+        self.num_duplicates = 0
+        # Events without a timestamp or message id, passed unchecked:
+        self.num_unkeyed = 0
+
+    @property
+    def num_bytes(self):
+        return self._filter.num_bytes
+
+    def is_duplicate(self, payload, now=None, message_id=None):
+        """Record an event and report whether it is a duplicate.
+
+        Args:
+            payload: dict. The decoded student action.
+            now: float. Seconds since the epoch. Defaults to the current time.
+            message_id: str. The id of the bus message that carried it.
+
+        Returns:
+            bool. True if the event should be dropped.
+        """
+        self.num_events += 1
+        fingerprint = event_fingerprint(payload, message_id)
+        if fingerprint is None:
+            self.num_unkeyed += 1
+            return False
+        if self._filter.add(fingerprint, now=now):
+            self.num_duplicates += 1
+            return True
+        return False
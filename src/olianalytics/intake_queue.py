@@ -0,0 +1,249 @@
+"""Bounded queue between bus intake and processing.
+
+The BusAdapter delivers student actions on its own thread. Processing them
+there means a burst piles up work without limit. Instead the handler puts
+actions into an IntakeQueue of fixed size, and worker threads take them out in
+batches. What happens when the queue is full is decided by its overflow policy:
+
+    * BLOCK makes the bus thread wait for room, pushing back on the bus.
+    * DROP_OLDEST discards the oldest queued item to make room.
+    * DROP_LOWEST_PRIORITY discards the oldest item of the lowest priority
+      present, or the new item if nothing queued has a lower priority.
+    * SPILL appends items to a local disk log while the queue is full and
+      reads them back, in order and with their priority, as room frees up.
+
+A spill log left behind by a crash may hold actions that were already
+processed, since items are read back before the log is removed. A new queue
+therefore never reads it: it renames it to <spill path>.<time>.stale and logs
+a warning, so that an operator can inspect or replay it.
+
+Items keep their arrival order across priorities. The queue counts what it
+sheds and spills, and reports these counts and its depth through stats().
+"""
+
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class QueueEmpty(Exception):
+    """Raised by IntakeQueue.get_batch when no item arrived in time."""
+
+
+class IntakeQueue(object):
+    """Bounded FIFO queue with configurable overflow policy."""
+
+    BLOCK = 'block'
+    DROP_OLDEST = 'drop-oldest'
+    DROP_LOWEST_PRIORITY = 'drop-lowest-priority'
+    SPILL = 'spill'
+    POLICIES = (BLOCK, DROP_OLDEST, DROP_LOWEST_PRIORITY, SPILL)
+
+    def __init__(self, max_size, policy=BLOCK, spill_path=None):
+        """Create an empty queue.
+
+        Args:
+            max_size: int. The maximum number of items held in memory, at
+                least 1.
+            policy: str. One of POLICIES.
+            spill_path: str. The disk log for the SPILL policy. Items must
+                then be JSON-serializable.
+
+        Raises:
+            ValueError: max_size is below 1.
+        """
+        if max_size < 1:
+            raise ValueError('Queue size must be at least 1, not %r' % max_size)
+        assert policy in self.POLICIES, 'Unknown policy %s' % policy
+        assert policy != self.SPILL or spill_path, 'SPILL needs a spill_path'
+        self._max_size = max_size
+        self._policy = policy
+        self._spill_path = spill_path
+        # priority -> deque of (sequence number, item)
+        self._queues = {}
+        self._size = 0
+        self._sequence = 0
+        self._unfinished = 0
+        self._spill_writer = None
+        self._spill_reader = None
+        self._num_spilled_pending = 0
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._all_done = threading.Condition(self._lock)
+        self.num_put = 0
+        self.num_shed = 0
+        self.num_spilled = 0
+        self.max_depth = 0
+        if spill_path and os.path.exists(spill_path):
+            stale_path = '%s.%d.stale' % (spill_path, int(time.time()))
+            os.rename(spill_path, stale_path)
+            logger.warning('Moved the spill log of an earlier run to %s.',
+                           stale_path)
+
+    def __len__(self):
+        with self._lock:
+            return self._size + self._num_spilled_pending
+
+    def _append(self, item, priority):
+        self._queues.setdefault(priority, collections.deque()).append(
+            (self._sequence, item))
+        self._sequence += 1
+        self._size += 1
+        self.max_depth = max(self.max_depth, self._size)
+
+    def _pop_oldest(self, priorities=None):
+        oldest = None
+        for priority in priorities or self._queues:
+            queue = self._queues.get(priority)
+            if queue and (oldest is None or
+                          queue[0][0] < self._queues[oldest][0][0]):
+                oldest = priority
+        self._size -= 1
+        return self._queues[oldest].popleft()[1]
+
+    def _spill(self, item, priority):
+        if self._spill_writer is None:
+            self._spill_writer = open(self._spill_path, 'a')
+            self._spill_reader = open(self._spill_path, 'r')
+        self._spill_writer.write(json.dumps([priority, item]) + '\n')
+        self._spill_writer.flush()
+        self._num_spilled_pending += 1
+        self.num_spilled += 1
+
+    def _refill_from_spill(self):
+        while self._num_spilled_pending and self._size < self._max_size:
+            line = self._spill_reader.readline()
+            self._num_spilled_pending -= 1
+            priority, item = json.loads(line)
+            self._append(item, priority)
+        if not self._num_spilled_pending and self._spill_writer is not None:
+            self._spill_writer.close()
+            self._spill_reader.close()
+            self._spill_writer = self._spill_reader = None
+            os.remove(self._spill_path)
+
+    def put(self, item, priority=0, timeout=None):
+        """Add an item, applying the overflow policy if the queue is full.
+
+        Args:
+            item: object. The item.
+            priority: int. Higher priorities are shed last by
+                DROP_LOWEST_PRIORITY. Ignored by the other policies.
+            timeout: float. For BLOCK, the maximum seconds to wait for room.
+
+        Returns:
+            bool. Whether the item was queued (or spilled); False if it was
+                shed or the wait for room timed out.
+        """
+        with self._lock:
+            self.num_put += 1
+            if self._policy == self.SPILL:
+                if self._num_spilled_pending or self._size >= self._max_size:
+                    self._spill(item, priority)
+                    self._unfinished += 1
+                    self._not_empty.notify()
+                    return True
+            elif self._size >= self._max_size:
+                if self._policy == self.BLOCK:
+                    deadline = None if timeout is None else (
+                        time.time() + timeout)
+                    while self._size >= self._max_size:
+                        remaining = None if deadline is None else (
+                            deadline - time.time())
+                        if remaining is not None and remaining <= 0:
+                            self.num_shed += 1
+                            return False
+                        self._not_full.wait(remaining)
+                elif self._policy == self.DROP_OLDEST:
+                    self._pop_oldest()
+                    self._shed_one()
+                else:
+                    present = [p for p, queue in self._queues.items() if queue]
+                    lowest = min(present)
+                    if priority <= lowest:
+                        self.num_shed += 1
+                        return False
+                    self._pop_oldest([lowest])
+                    self._shed_one()
+            self._append(item, priority)
+            self._unfinished += 1
+            self._not_empty.notify()
+            return True
+
+    def _shed_one(self):
+        self.num_shed += 1
+        self._unfinished -= 1
+
+    def get_batch(self, max_items, timeout=None):
+        """Remove up to max_items items in arrival order.
+
+        Waits for the first item only; then returns whatever is queued.
+        Call task_done once per returned item after processing it.
+
+        Args:
+            max_items: int. The maximum batch size.
+            timeout: float. The maximum seconds to wait for the first item.
+
+        Returns:
+            list. The items.
+
+        Raises:
+            QueueEmpty: No item arrived within timeout.
+        """
+        with self._lock:
+            if self._policy == self.SPILL:
+                self._refill_from_spill()
+            deadline = None if timeout is None else time.time() + timeout
+            while not self._size:
+                remaining = None if deadline is None else (
+                    deadline - time.time())
+                if remaining is not None and remaining <= 0:
+                    raise QueueEmpty()
+                self._not_empty.wait(remaining)
+                if self._policy == self.SPILL:
+                    self._refill_from_spill()
+            batch = []
+            while self._size and len(batch) < max_items:
+                batch.append(self._pop_oldest())
+            self._not_full.notify(len(batch))
+            return batch
+
+    def task_done(self, num_items=1):
+        with self._lock:
+            self._unfinished -= num_items
+            if self._unfinished <= 0:
+                self._all_done.notify_all()
+
+    def join(self, timeout=None):
+        """Wait until every queued item has been processed.
+
+        Returns:
+            bool. True if the queue drained, False on timeout.
+        """
+        with self._lock:
+            deadline = None if timeout is None else time.time() + timeout
+            while self._unfinished > 0:
+                remaining = None if deadline is None else (
+                    deadline - time.time())
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._all_done.wait(remaining)
+            return True
+
+    def stats(self):
+        """Get the depth and the shed and spill counts of the queue."""
+        with self._lock:
+            return {
+                'depth': self._size,
+                'spilled_pending': self._num_spilled_pending,
+                'max_depth': self.max_depth,
+                'num_put': self.num_put,
+                'num_shed': self.num_shed,
+                'num_spilled': self.num_spilled,
+            }
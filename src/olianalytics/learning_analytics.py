@@ -17,42 +17,134 @@
 
 __author__ = 'John Orr (jorr@google.com)'
 
+import logging
+
 from controllers import utils
 from models import custom_modules
 from models import models
 from models import transforms
+from modules.learning_analytics import skills_map_dao
 from modules.learning_analytics import skills_models
 
+from google.appengine.api import namespace_manager
+from google.appengine.api import taskqueue
+from google.appengine.ext import db
+from google.appengine.ext import deferred
+
 
 class AnalyticsUpdater(object):
+    """Applies the events of each student in order, in batches.
+
+    The request handler appends each event to the student's pending events,
+    a student property written in a transaction, so that the events of a
+    student keep the order in which they arrived. A deferred task then
+    applies all pending events of the student with one transactional read
+    and write of the student's skills. Concurrent tasks for one student
+    cannot overwrite each other's updates: whichever runs first applies the
+    whole batch, in order, and the others find nothing pending.
+    """
 
     PROPERTY_KEY = 'learning-analytics'
+    PENDING_KEY = 'learning-analytics-pending'
 
     def __init__(self):
-        pass
-
-    def _get_or_create_student_property(self, student):
-        # TODO(jorr): Make this a method in models.models.StudentPropertyEntity
-        entity = models.StudentPropertyEntity.get(student, self.PROPERTY_KEY)
+        # The skills map is parsed again only when its XML changes:
+        self._skills_map_xml = None
+        self._skills_map = None
+
+    def _get_or_create_property(self, user_id, property_name):
+        # Read by key rather than through memcache, which transactions
+        # do not cover:
+        key_name = models.StudentPropertyEntity.create_key(
+            user_id, property_name)
+        entity = models.StudentPropertyEntity.get_by_key_name(key_name)
         if not entity:
-            entity = models.StudentPropertyEntity.create(
-                student=student, property_name=self.PROPERTY_KEY)
-            entity.put()
+            entity = models.StudentPropertyEntity(
+                key_name=key_name, name=property_name)
         return entity
 
-    def update_student(self, student, payload):
-        student_skills_entity = self._get_or_create_student_property(student)
-        student_skills_dict = transforms.loads(student_skills_entity.value)
-
-        skills_map_dto = skills_models.SkillsMapDAO.load_or_create()
-        skills_map = skills_models.SkillsMap.from_xml(
-            skills_map_dto.skills_map_xml)
-
+    def _get_skills_map(self):
+        skills_map_xml = skills_map_dao.SkillsMapDAO.load_or_create(
+            ).skills_map_xml
+        if skills_map_xml != self._skills_map_xml:
+            self._skills_map = skills_models.SkillsMap.from_xml(skills_map_xml)
+            self._skills_map_xml = skills_map_xml
+        return self._skills_map
+
+    def add_pending(self, user_id, payload_json):
+        """Append an event to the events of a student not applied yet."""
+
+        def append():
+            entity = self._get_or_create_property(user_id, self.PENDING_KEY)
+            pending = transforms.loads(entity.value or '[]')
+            pending.append(payload_json)
+            entity.value = transforms.dumps(pending)
+            entity.put()
+        db.run_in_transaction(append)
+
+    def apply_pending(self, user_id):
+        """Apply the pending events of a student in arrival order.
+
+        Returns:
+            list. The payloads (str) of the events applied, oldest first.
+        """
+        skills_map = self._get_skills_map()
+
+        def apply_all():
+            pending_entity = self._get_or_create_property(
+                user_id, self.PENDING_KEY)
+            pending = transforms.loads(pending_entity.value or '[]')
+            if not pending:
+                return []
+            skills_entity = self._get_or_create_property(
+                user_id, self.PROPERTY_KEY)
+            student_skills_dict = transforms.loads(skills_entity.value or '{}')
+            for payload_json in pending:
+                self.update_skills(
+                    student_skills_dict, skills_map,
+                    transforms.loads(payload_json))
+            skills_entity.value = transforms.dumps(student_skills_dict)
+            pending_entity.value = transforms.dumps([])
+            db.put([skills_entity, pending_entity])
+            return pending
+        # The pending events and the skills are two entity groups:
+        return db.run_in_transaction_options(
+            db.create_transaction_options(xg=True), apply_all)
+
+    def update_skills(self, student_skills_dict, skills_map, payload):
+        """Apply one event to a student's skills, in place."""
         # TODO(jorr): Use the event payload data and the skills map to update
         # the skill scores in the student skills data
+        pass
+
+
+# Reused by the tasks an instance runs, so that it keeps its parsed skills map:
+updater = AnalyticsUpdater()
+
+
+def apply_events(namespace, source, user):
+    """Record the pending events of a student and update the student's skills.
 
-        student_skills_entity.value = transforms.dumps(student_skills_dict)
-        student_skills_entity.put()
+    Runs as a deferred task, which keeps the skills update and the skills map
+    parse off the request that received the event. One task is queued per
+    event, but tasks may run concurrently and in any order, so each applies
+    all the events pending at the time, and later ones may find none.
+
+    Args:
+        namespace: str. The namespace of the course the events arrived in.
+        source: str. The event source recorded with the entities.
+        user: users.User. The user who caused the events.
+    """
+    old_namespace = namespace_manager.get_namespace()
+    try:
+        namespace_manager.set_namespace(namespace)
+        # The events are recorded once their skill updates are committed, so
+        # that a retried task does not record them twice:
+        for payload_json in updater.apply_pending(user.user_id()):
+            # Goes through record() so that the event listeners see the event:
+            models.EventEntity.record(source, user, payload_json)
+    finally:
+        namespace_manager.set_namespace(old_namespace)
 
 
 class AnalyticsEventRestHandler(utils.BaseRESTHandler):
@@ -62,7 +154,7 @@ class AnalyticsEventRestHandler(utils.BaseRESTHandler):
     XSRF_TOKEN = 'learning-analytics-event'
 
     def post(self):
-        """Receives event and puts it into datastore."""
+        """Receives event and defers recording it and updating skills."""
 
         request = transforms.loads(self.request.get('request'))
         if not self.assert_xsrf_token_or_fail(request, self.XSRF_TOKEN, {}):
@@ -78,11 +170,20 @@ class AnalyticsEventRestHandler(utils.BaseRESTHandler):
             return
 
         payload_json = request.get('payload')
-        models.EventEntity.record(self.EVENT_SOURCE, user, payload_json)
-
-        course = self.get_course()
+        try:
+            transforms.loads(payload_json)
+        except (TypeError, ValueError):
+            transforms.send_json_response(self, 400, 'Malformed payload')
+            return
 
-        AnalyticsUpdater().update_student(user, transforms.loads(payload_json))
+        try:
+            updater.add_pending(user.user_id(), payload_json)
+            deferred.defer(apply_events, namespace_manager.get_namespace(),
+                           self.EVENT_SOURCE, user)
+        except (db.Error, taskqueue.Error):
+            logging.exception('Failed to queue learning analytics event')
+            transforms.send_json_response(self, 503, 'Event not queued')
+            return
 
         transforms.send_json_response(self, 200, 'OK')
 
@@ -15,16 +15,37 @@
 
 import functools
 import json
+import logging
+import os
+import signal
+import tempfile
 import threading
+import time
+import zlib
 
 from redis_bus_python.bus_message import BusMessage
 from redis_bus_python.redis_bus import BusAdapter 
 
+from modules.learning_analytics import at_risk_index
+from modules.learning_analytics import course_sketches
+from modules.learning_analytics import event_dedup
+from modules.learning_analytics import intake_queue
+from modules.learning_analytics import map_replay
+from modules.learning_analytics import memory_report
+from modules.learning_analytics import objective_mastery
+from modules.learning_analytics import prerequisite_propagation
+from modules.learning_analytics import profiler_hook
+from modules.learning_analytics import publication_filter
+from modules.learning_analytics import skills_models
+from modules.learning_analytics import skills_updater
+from modules.learning_analytics import state_versions
+
 
 __author__ = 'John Orr (jorr@google.com)'
 
 # Butchered by Andreas Paepcke to illustrate attachment to SchoolBus
 
+logger = logging.getLogger(__name__)
 
 
 # from controllers import utils
@@ -70,24 +91,582 @@ class AnalyticsSchoolbusHandler(object):
     
     STUDENT_ACTION_TOPIC      = 'studentAction'
     NEW_SKILL_MAP_ENTRY_TOPIC = 'skillmapUpdate'
+    AT_RISK_TOPIC             = 'atRiskAlert'
+    STATS_TOPIC               = 'schoolbusStats'
+    CONTROL_TOPIC             = 'schoolbusControl'
+    ANALYTICS_TOPIC           = 'courseAnalytics'
+    MEMORY_TOPIC              = 'schoolbusMemory'
 
-    def __init__(self):
-        self.busAdapter = BusAdapter()
-        self.busAdapter.subscribeToTopic(AnalyticsSchoolbusHandler.STUDENT_ACTION_TOPIC, 
-                                         functools.partial(self.new_student_info))
+    # Commands accepted on the control topic, and the methods
+    # they call with the remaining message fields as arguments:
+    CONTROL_COMMANDS = {'profile'     : 'start_profile',
+                        'reload_maps' : 'reload_course_maps',
+                        'stats'       : 'publish_stats',
+                        'memory'      : 'publish_memory_report'}
+
+    # Students that stream_students() reads per taking of the course lock:
+    STUDENTS_PER_CHUNK = 1000
+
+    # Event types shed last by the drop-lowest-priority overflow policy;
+    # all other event types have priority 0:
+    EVENT_PRIORITIES = {'problem_check' : 1}
+
+    def __init__(self, course_maps=None, mastery_dir=None, deduplicator=None,
+                 checkpointer=None, make_store=None,
+                 make_publication_filter=None, make_estimator=None,
+                 keep_history=False,
+                 bus_adapter=None,
+                 student_action_topic=STUDENT_ACTION_TOPIC,
+                 skill_map_update_topic=NEW_SKILL_MAP_ENTRY_TOPIC,
+                 at_risk_topic=AT_RISK_TOPIC,
+                 control_topic=CONTROL_TOPIC,
+                 analytics_topic=ANALYTICS_TOPIC,
+                 num_workers=1, batch_size=100, queue_size=10000,
+                 overflow_policy=intake_queue.IntakeQueue.BLOCK,
+                 spill_dir=None, stats_interval=60, analytics_interval=60,
+                 stale_interval=60, profile_dir=None, coordinator=None):
+        '''
+        Prepare to keep skill estimates of the courses listed
+        in course_maps up to date. Events for other courses are
+        only echoed to the bus. Nothing is subscribed until
+        start() is called.
         
-        # Hang till keyboard_interrupt:
+        :param course_maps: dict mapping course ids to (SkillsMap, ResourcesMap) tuples,
+            or to callables returning one. A callable is only called if the
+            checkpoint holds no maps of the course, so that parsing is
+            deferred until it turns out to be needed.
+        :param mastery_dir: if provided, directory in which a memory-mapped
+            student x skill matrix is kept for each course.
+        :param deduplicator: EventDeduplicator that drops redelivered events.
+            Defaults to one with standard memory cap and error budget.
+        :param checkpointer: if provided, Checkpointer to warm-start from and
+            to periodically write snapshots to. Maps of courses missing from
+            course_maps are taken from the snapshot.
+        :param make_store: callable taking a course id and returning a new
+            student state store for the course. Defaults to the in-memory
+            StudentStateStore.
+        :param make_publication_filter: callable returning a new
+            PublicationFilter for a course, which decides which estimate
+            changes are published. Defaults to one with standard thresholds.
+        :param make_estimator: callable returning the BKTEstimator that
+            updates the estimates of a course, e.g. a ForgettingBKTEstimator.
+            Defaults to the standard BKTEstimator.
+        :param keep_history: whether to log every student's attempts, so
+            that update_course_maps() can recompute the students affected
+            by a map edit.
+        :param bus_adapter: BusAdapter to use. Created by start() if omitted.
+        :param student_action_topic: topic on which student actions arrive.
+        :param skill_map_update_topic: topic for significant estimate
+            changes, and for notices of actions in untracked courses.
+        :param at_risk_topic: topic for at-risk threshold crossings.
+        :param control_topic: topic on which operator commands arrive,
+            JSON objects with a 'command' from CONTROL_COMMANDS.
+        :param analytics_topic: topic for the approximate course analytics.
+        :param num_workers: number of threads processing student actions.
+            Students are partitioned among the workers, so the actions of
+            one student are processed in arrival order. With 0 workers,
+            actions are processed on the bus thread as they arrive.
+        :param batch_size: maximum number of actions a worker takes from
+            its queue at a time.
+        :param queue_size: capacity of each worker's intake queue.
+        :param overflow_policy: what to do with actions arriving at a full
+            queue; one of IntakeQueue.POLICIES.
+        :param spill_dir: directory for the disk logs of the spill policy.
+        :param stats_interval: seconds between publications of queue and
+            dedup statistics on STATS_TOPIC by serve_forever().
+        :param analytics_interval: seconds between publications of course
+            analytics on analytics_topic by serve_forever().
+        :param stale_interval: seconds between sweeps of serve_forever()
+            that publish the estimate changes the publication filters
+            suppressed longer than their max_staleness ago.
+        :param profile_dir: directory for the output of profiling sessions.
+            Defaults to the system's temporary directory.
+        :param coordinator: PartitionCoordinator for running several
+            instances side by side. The handler then takes student
+            actions from the partition topics the coordinator claims
+            rather than from student_action_topic.
+        '''
+        self.deduplicator = deduplicator or event_dedup.EventDeduplicator()
+        self.mastery_dir = mastery_dir
+        self.checkpointer = checkpointer
+        self.make_store = make_store or (
+            lambda course_id: skills_updater.StudentStateStore())
+        self.make_publication_filter = (
+            make_publication_filter or publication_filter.PublicationFilter)
+        self.make_estimator = (
+            make_estimator or skills_models.BKTEstimator.get_standard_estimator)
+        self.publication_filters = {}
+        # Significant changes collected while a thread applies an action:
+        self.significant = threading.local()
+        self.keep_history = keep_history
+        self.attempt_histories = {}
+        self.busAdapter = bus_adapter
+        self.student_action_topic = student_action_topic
+        self.skill_map_update_topic = skill_map_update_topic
+        self.at_risk_topic = at_risk_topic
+        self.control_topic = control_topic
+        self.analytics_topic = analytics_topic
+        self.profile_dir = profile_dir
+        self.profile_session = None
+        self.coordinator = coordinator
+        self.exit_event = threading.Event()
+        self.num_workers = num_workers
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.spill_dir = spill_dir
+        self.stats_interval = stats_interval
+        self.analytics_interval = analytics_interval
+        self.stale_interval = stale_interval
+        self.intake_queues = []
+        self.workers = []
+        self.workers_stop = threading.Event()
+        # Serialize updates of a course's shared indexes across workers:
+        self.course_locks = {}
+        self.position_lock = threading.Lock()
+        # Course sketches of each processing thread, merged on publication:
+        self.thread_sketches = threading.local()
+        self.sketch_sets = []
+        self.sketch_sets_lock = threading.Lock()
+        self.updaters = {}
+        self.objective_mastery = {}
+        self.prerequisites = {}
+        self.mastery_matrices = {}
+        self.at_risk = {}
+        # Versions of each course's state, for the caches of readers:
+        self.state_versions = {}
+        # Resource recommenders, built on first use and dropped when
+        # the maps of their course change:
+        self.recommenders = {}
+        self.memory_accountant = memory_report.MemoryAccountant()
+        # Time and id of the last processed bus message, the count of
+        # processed messages, and that of all messages taken off the bus,
+        # including duplicates, shed and malformed ones:
+        self.position = {'time': None, 'id': None, 'num_processed': 0,
+                         'num_consumed': 0, 'num_malformed': 0}
+
+        snapshot, students = None, None
+        if checkpointer is not None:
+            # The students are loaded as they are read, see restore():
+            snapshot, students = checkpointer.read_latest()
+        course_maps = dict(course_maps or {})
+        if snapshot is not None:
+            for course_id, course in snapshot['courses'].items():
+                if callable(course_maps.get(course_id, None)) or course_id not in course_maps:
+                    course_maps[course_id] = (course['skills_map'], course['resources_map'])
+        for course_id, maps in course_maps.items():
+            if callable(maps):
+                # Not in the checkpoint, so parsed after all:
+                maps = maps()
+            skills_map, resources_map = maps
+            self.add_course(course_id, skills_map, resources_map)
+        if snapshot is not None:
+            self.restore(snapshot, students)
+
+    def start(self):
+        '''
+        Connect to the bus if needed, and subscribe to student
+        actions and operator commands.
+        '''
+        if self.busAdapter is None:
+            self.busAdapter = BusAdapter()
+        for worker_num in range(self.num_workers):
+            spill_path = None
+            if self.spill_dir is not None:
+                spill_path = os.path.join(self.spill_dir, 'intake-%d.log' % worker_num)
+            queue = intake_queue.IntakeQueue(
+                self.queue_size, self.overflow_policy, spill_path=spill_path)
+            worker = threading.Thread(target=self._work, args=(queue,),
+                                      name='schoolbus-worker-%d' % worker_num)
+            worker.daemon = True
+            self.intake_queues.append(queue)
+            self.workers.append(worker)
+            worker.start()
+        if self.checkpointer is not None:
+            # Snapshots are written on a thread of their own:
+            self.checkpointer.start(self.snapshot)
+        self.busAdapter.subscribeToTopic(self.control_topic,
+                                         functools.partial(self.handle_control))
+        if self.coordinator is not None:
+            self.coordinator.start(self)
+            logger.info('Started oli analytics bus module as partition node %s.',
+                        self.coordinator.instance_id)
+            return
+        self.busAdapter.subscribeToTopic(self.student_action_topic, 
+                                         functools.partial(self.new_student_info))
+        logger.info('Started oli analytics bus module on topic %s.',
+                    self.student_action_topic)
+
+    def serve_forever(self):
+        '''
+        Hang till stop() is called or keyboard_interrupt,
+        then close the module.
+        '''
+        # [interval, publishing method, time of last publication]:
+        periodic = [[self.stats_interval, self.publish_stats, time.time()],
+                    [self.analytics_interval, self.publish_analytics, time.time()],
+                    [self.stale_interval, self.publish_stale, time.time()]]
         try:
-            print('Starting oli analytics bus module.')
-            self.exit_event = threading.Event().wait()
+            # Waiting with a timeout keeps the wait interruptible:
+            while not self.exit_event.wait(1):
+                for task in periodic:
+                    if time.time() - task[2] >= task[0]:
+                        # A failing publisher must not stop the others,
+                        # nor ingestion:
+                        try:
+                            task[1]()
+                        except Exception:
+                            logger.exception('Periodic task %s failed',
+                                             task[1].__name__)
+                        task[2] = time.time()
         except KeyboardInterrupt:
-            print('Exiting oli analytics bus module.')
+            pass
+        finally:
+            logger.info('Exiting oli analytics bus module.')
+            self.close()
+
+    def stop(self):
+        self.exit_event.set()
+
+    def close(self, drain_timeout=30):
+        '''
+        Unsubscribe, finish queued actions, write a final
+        checkpoint and release the mastery matrices.
+        
+        :param drain_timeout: maximum seconds to wait for the
+            intake queues to drain.
+        '''
+        if self.coordinator is not None:
+            # Hands all partitions over to the remaining nodes:
+            self.coordinator.stop()
+        elif self.busAdapter is not None:
+            self.busAdapter.unsubscribeFromTopic(self.student_action_topic)
+        if self.busAdapter is not None:
+            self.busAdapter.unsubscribeFromTopic(self.control_topic)
+        if not self.wait_for_intake(drain_timeout):
+            logger.warning('Closing with unprocessed student actions queued.')
+        self.workers_stop.set()
+        for worker in self.workers:
+            worker.join()
+        session = self.profile_session
+        if session is not None:
+            session.finish()
+        if self.checkpointer is not None:
+            self.checkpointer.stop()
+            self.checkpointer.save(self.snapshot())
+        for updater in self.updaters.values():
+            if hasattr(updater.store, 'close'):
+                updater.store.close()
+        for matrix in self.mastery_matrices.values():
+            matrix.close()
+        self.mastery_matrices = {}
+
+    def add_course(self, course_id, skills_map, resources_map):
+        '''
+        Start keeping skill estimates for the students of a course,
+        and prerequisite-adjusted estimates if its skills map has
+        prerequisites.
+        
+        :param course_id: the course id as it appears in student actions.
+        :param skills_map: SkillsMap of the course.
+        :param resources_map: ResourcesMap of the course.
+        '''
+        updater = skills_updater.SkillsUpdater(
+            skills_map, resources_map, estimator=self.make_estimator(),
+            store=self.make_store(course_id))
+        self.course_locks[course_id] = threading.Lock()
+        aggregates = objective_mastery.ObjectiveMasteryAggregates(skills_map)
+        updater.add_listener(aggregates.skills_changed)
+        self.updaters[course_id] = updater
+        self.objective_mastery[course_id] = aggregates
+        if self.keep_history:
+            self.attempt_histories[course_id] = map_replay.AttemptHistory()
+        if skills_map.has_prerequisites:
+            propagator = prerequisite_propagation.PrerequisitePropagator(skills_map)
+            updater.add_listener(propagator.skills_changed)
+            self.prerequisites[course_id] = propagator
+        at_risk = at_risk_index.AtRiskIndex(
+            skills_map, aggregates,
+            on_crossing=functools.partial(self.publish_at_risk, course_id))
+        updater.add_listener(at_risk.skills_changed)
+        self.at_risk[course_id] = at_risk
+        self.publication_filters[course_id] = self.make_publication_filter()
+        updater.add_listener(functools.partial(self._check_significance, course_id))
+        if self.mastery_dir is not None:
+            # NumPy is only needed when matrices are kept:
+            from modules.learning_analytics import mastery_matrix
+            matrix = mastery_matrix.MasteryMatrix.open(
+                mastery_matrix.matrix_path(self.mastery_dir, course_id),
+                [skill.id for skill in skills_map.skills])
+            updater.add_listener(matrix.skills_changed)
+            self.mastery_matrices[course_id] = matrix
+        # Last, so a new version is only seen once all indexes are updated:
+        versions = state_versions.StateVersions(skills_map)
+        updater.add_listener(versions.skills_changed)
+        self.state_versions[course_id] = versions
+
+    def update_course_maps(self, course_id, skills_map, resources_map):
+        '''
+        Switch a course to an edited resources map. With
+        keep_history, the estimates of the students who attempted
+        resources whose skills changed are recomputed for these
+        skills only; otherwise just later actions use the edit.
+        Edits of skills, objectives or prerequisites need a
+        restart with the new maps.
+        
+        :param course_id: the course whose maps were edited.
+        :param skills_map: the SkillsMap the edit refers to.
+        :param resources_map: the edited ResourcesMap.
+        :return: MapDiff listing the changed links.
+        '''
+        updater = self.updaters[course_id]
+        with self.course_locks[course_id]:
+            diff = map_replay.diff_maps(updater.skills_map, updater.resources_map,
+                                        skills_map, resources_map)
+            if diff.skills_map_changed:
+                raise ValueError('Skills map of course %s changed: %s; restart with the new maps.' %
+                                 (course_id, diff))
+            updater.set_resources_map(resources_map)
+            # Rebuilt with the new maps by the next recommend():
+            self.recommenders.pop(course_id, None)
+            self.state_versions[course_id].invalidate()
+            history = self.attempt_histories.get(course_id, None)
+            if history is None:
+                logger.warning('No attempt history for course %s; existing estimates keep the old map.',
+                               course_id)
+                return diff
+            self.significant.updates = {}
+            try:
+                affected = map_replay.replay(updater, diff, history)
+                updates = self.significant.updates
+            finally:
+                self.significant.updates = None
+        logger.info('Applied %s to course %s, recomputing %d students.',
+                    diff, course_id, len(affected))
+        # Subscribers learn of the recomputed estimates like of any others:
+        for student_id, student_updates in sorted(updates.items()):
+            self._publish_updates(course_id, student_id, None, student_updates)
+        return diff
+
+    def reload_course_maps(self, course_id, skills_map, resources_map):
+        '''
+        Control command: read edited map files of a course and
+        apply them with update_course_maps().
+        
+        :param skills_map: path of the skills map XML file.
+        :param resources_map: path of the resources map XML file.
+        '''
+        with open(skills_map) as skills_file:
+            new_skills_map = skills_models.SkillsMap.from_xml(skills_file.read())
+        with open(resources_map) as resources_file:
+            new_resources_map = skills_models.ResourcesMap.from_xml(
+                resources_file.read(), skills_map=new_skills_map)
+        self.update_course_maps(course_id, new_skills_map, new_resources_map)
+
+    def _make_recommender(self, skills_map, resources_map, estimator):
+        # NumPy is imported with the recommender:
+        from modules.learning_analytics import recommender
+        return recommender.ResourceGainIndex(
+            skills_map, resources_map, estimator,
+            skills_updater.SkillsUpdater.DEFAULT_PRIOR)
+
+    def recommend(self, course_id, student_id, k=5, objective_id=None,
+                  exclude_attempted=False):
+        '''
+        Recommend the resources whose attempt most increases a
+        student's expected mastery, with the course's
+        ResourceGainIndex.
+        
+        :param course_id: the course of the student.
+        :param student_id: the student to recommend resources to.
+        :param k: maximum number of resources to recommend.
+        :param objective_id: if provided, only the skills of this
+            objective count.
+        :param exclude_attempted: whether to leave out the resources
+            the student attempted; needs keep_history.
+        :return: list of (resource id, expected gain) tuples, best first.
+        '''
+        updater = self.updaters[course_id]
+        index = self.recommenders.get(course_id, None)
+        if index is None:
+            with self.course_locks[course_id]:
+                resources_map = updater.resources_map
+            # Built on first use and outside the lock, so that NumPy is
+            # only imported for recommendations and actions are not held up:
+            index = self._make_recommender(
+                updater.skills_map, resources_map, updater.estimator)
+            with self.course_locks[course_id]:
+                # Unless the maps were edited meanwhile:
+                if updater.resources_map is resources_map:
+                    index = self.recommenders.setdefault(course_id, index)
+        with self.course_locks[course_id]:
+            estimates = updater.get_estimates(student_id)
+            exclude = set()
+            if exclude_attempted and course_id in self.attempt_histories:
+                for _, attempt in self.attempt_histories[course_id].get_attempts(student_id):
+                    exclude.add(attempt.get('resource_id'))
+                    exclude.update(attempt.get('answers') or ())
+        return index.recommend(estimates, k=k, objective_id=objective_id,
+                               exclude=exclude)
+
+    def snapshot(self):
+        '''
+        Capture compiled maps, student state and bus position
+        for a checkpoint. The students of each course are a
+        generator reading them from the course's store as the
+        checkpoint is written, see stream_students().
+        '''
+        courses = {}
+        for course_id, updater in sorted(self.updaters.items()):
+            with self.course_locks[course_id]:
+                courses[course_id] = {
+                    'skills_map'    : updater.skills_map,
+                    'resources_map' : updater.resources_map,
+                    'students'      : self.stream_students(course_id),
+                    }
+                if course_id in self.attempt_histories:
+                    courses[course_id]['history'] = list(
+                        self.attempt_histories[course_id].items())
+        with self.position_lock:
+            position = dict(self.position)
+        return {'courses' : courses, 'position' : position}
+
+    def stream_students(self, course_id):
+        '''
+        Yield the (student id, state) pairs of a course from its
+        store, a chunk at a time, e.g. when the store is a cache
+        that would otherwise load every student from disk. Each
+        chunk is read under the course lock, which is released
+        while the consumer writes it, so that workers wait for
+        one chunk at most. Students added after the first chunk
+        are left for the next checkpoint.
+        '''
+        store = self.updaters[course_id].store
+        lock = self.course_locks[course_id]
+        # A cache is read without promoting the students:
+        read = getattr(store, 'peek', store.get)
+        with lock:
+            student_ids = list(store.student_ids)
+        for start in range(0, len(student_ids), self.STUDENTS_PER_CHUNK):
+            with lock:
+                chunk = [(student_id, read(student_id))
+                         for student_id in student_ids[start:start + self.STUDENTS_PER_CHUNK]
+                         if student_id in store]
+            for student in chunk:
+                yield student
+
+    def restore(self, snapshot, students=None):
+        '''
+        Warm-start from a checkpoint: load the student state of
+        known courses and rebuild the derived indexes from it.
+        
+        :param snapshot: dict as returned by snapshot().
+        :param students: iterable of (course id, student id, state)
+            tuples, e.g. from checkpoint.read_snapshot(), so that the
+            students need not all be in memory at once. Defaults to
+            the 'students' dicts of the snapshot's courses.
+        '''
+        if students is None:
+            students = ((course_id, student_id, student_skills)
+                        for course_id, course in snapshot['courses'].items()
+                        for student_id, student_skills in course['students'].items())
+        for course_id, course in snapshot['courses'].items():
+            if course_id in self.attempt_histories:
+                self.attempt_histories[course_id].load(course.get('history', ()))
+        for course_id, student_id, student_skills in students:
+            if course_id in self.updaters:
+                self.load_student(course_id, student_id, student_skills)
+        # Counters missing from older checkpoints keep starting at zero:
+        self.position.update(snapshot['position'])
+
+    def load_student(self, course_id, student_id, student_skills):
+        '''
+        Store a student's full skill state, e.g. from a checkpoint
+        or a partition handoff, and rebuild the derived indexes.
+        The caller holds the course lock if workers are running.
+        '''
+        updater = self.updaters[course_id]
+        updater.store.put(student_id, student_skills)
+        self.objective_mastery[course_id].load_student(student_id, student_skills)
+        if course_id in self.prerequisites:
+            self.prerequisites[course_id].load_student(student_id, student_skills)
+        changed = dict((skill_id, None) for skill_id in student_skills
+                       if skill_id != updater.TIMESTAMPS_KEY)
+        # Students entering the index raise no crossing alerts:
+        self.at_risk[course_id].skills_changed(student_id, student_skills, changed)
+        if course_id in self.mastery_matrices:
+            self.mastery_matrices[course_id].skills_changed(
+                student_id, student_skills, changed)
+        self.state_versions[course_id].skills_changed(
+            student_id, student_skills, changed)
+
+    def forget_student(self, course_id, student_id):
+        '''
+        Drop a student from the store, the derived indexes and
+        the attempt history of a course, e.g. after handing the
+        student to another node. The caller holds the course
+        lock if workers are running.
+        '''
+        self.updaters[course_id].store.delete(student_id)
+        self.objective_mastery[course_id].forget_student(student_id)
+        self.at_risk[course_id].forget_student(student_id)
+        self.publication_filters[course_id].forget_student(student_id)
+        self.state_versions[course_id].forget_student(student_id)
+        if course_id in self.prerequisites:
+            self.prerequisites[course_id].forget_student(student_id)
+        if course_id in self.mastery_matrices:
+            self.mastery_matrices[course_id].forget_student(student_id)
+        if course_id in self.attempt_histories:
+            self.attempt_histories[course_id].forget_student(student_id)
+
+    def export_students(self, belongs):
+        '''
+        Remove the students a predicate selects from all courses
+        and return their state, for a partition handoff.
         
+        :param belongs: callable taking a student id.
+        :return: dict mapping course ids to dicts with the
+            'students' and, with keep_history, 'history' of
+            the selected students, as in snapshot().
+        '''
+        courses = {}
+        for course_id, updater in sorted(self.updaters.items()):
+            with self.course_locks[course_id]:
+                students = dict((student_id, student_skills)
+                                for student_id, student_skills in list(updater.store.items())
+                                if belongs(student_id))
+                courses[course_id] = {'students' : students}
+                history = self.attempt_histories.get(course_id, None)
+                if history is not None:
+                    courses[course_id]['history'] = [
+                        (student_id, history.get_attempts(student_id))
+                        for student_id, _ in list(history.items())
+                        if belongs(student_id)]
+                for student_id in students:
+                    self.forget_student(course_id, student_id)
+        return courses
+
+    def import_students(self, courses):
+        '''
+        Load the student state another node exported.
+        
+        :param courses: dict as returned by export_students().
+        '''
+        for course_id, course in courses.items():
+            if course_id not in self.updaters:
+                continue
+            with self.course_locks[course_id]:
+                if course_id in self.attempt_histories:
+                    self.attempt_histories[course_id].load(course.get('history', ()))
+                for student_id, student_skills in course['students'].items():
+                    self.load_student(course_id, student_id, student_skills)
+
     def new_student_info(self, busMsg):
         try:
             payload = json.loads(busMsg.content)
         except ValueError:
-            print('Payload of bus msg fromn Lagunita is not proper JSON: %s' % busMsg.content)
+            logger.warning('Payload of bus msg from Lagunita is not proper JSON: %s', busMsg.content)
+            self._count_consumed(malformed=True)
             return
         # Now you have a dict like this:
         #        
@@ -98,12 +677,176 @@ class AnalyticsSchoolbusHandler(object):
         #   'result': False,
         #   'course_id': u'HumanitiesSciences/NCP-101/OnGoing'
         # }
- 
-        # **** Do your skill map update as per AnalyticsEventRestHandler below
- 
-        #********
-        print("Payload: '%s'" % payload)
-        #********
+
+        if self.deduplicator.is_duplicate(
+                payload, message_id=getattr(busMsg, 'id', None)):
+            self._count_consumed()
+            return
+
+        item = {'payload' : payload,
+                'time'    : getattr(busMsg, 'time', None),
+                'id'      : getattr(busMsg, 'id', None)}
+        if not self.intake_queues:
+            self._process(item)
+            return
+        # Same student, same queue, so per-student order is kept:
+        student_id = u'%s' % payload.get('student_id', None)
+        shard = zlib.crc32(student_id.encode('utf-8')) % len(self.intake_queues)
+        priority = self.EVENT_PRIORITIES.get(payload.get('event_type', None), 0)
+        if not self.intake_queues[shard].put(item, priority=priority):
+            logger.debug('Shed student action: %s', payload)
+            self._count_consumed()
+
+    def _count_consumed(self, malformed=False):
+        with self.position_lock:
+            self.position['num_consumed'] += 1
+            if malformed:
+                self.position['num_malformed'] += 1
+
+    def _work(self, queue):
+        '''
+        Worker thread: process batches of queued student
+        actions until workers_stop is set.
+        '''
+        while not self.workers_stop.is_set():
+            try:
+                batch = queue.get_batch(self.batch_size, timeout=0.5)
+            except intake_queue.QueueEmpty:
+                continue
+            try:
+                for item in batch:
+                    try:
+                        self._process(item)
+                    except Exception:
+                        logger.exception('Failed to process student action %s', item)
+            finally:
+                queue.task_done(len(batch))
+
+    def wait_for_intake(self, timeout=None):
+        '''
+        Wait until all queued student actions are processed.
+        
+        :param timeout: maximum seconds to wait.
+        :return: True if the queues drained in time.
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        for queue in self.intake_queues:
+            remaining = None if deadline is None else max(0, deadline - time.time())
+            if not queue.join(remaining):
+                return False
+        return True
+
+    def _process(self, item):
+        # Testing one attribute is all that profiling costs while off:
+        session = self.profile_session
+        try:
+            if session is None:
+                self.process_action(item)
+            else:
+                session.run(self.process_action, item)
+        finally:
+            # Failed actions are consumed all the same:
+            self._count_consumed()
+
+    def _check_significance(self, course_id, student_id, student_skills, changed):
+        '''
+        SkillsUpdater listener: collect the skill and objective
+        estimates changed by the action being processed or by
+        a map replay that the course's publication filter lets
+        through, by student.
+        '''
+        updates = getattr(self.significant, 'updates', None)
+        if updates is None:
+            # Not applying a bus action nor replaying, e.g. loading students.
+            return
+        skills_map = self.updaters[course_id].skills_map
+        aggregates = self.objective_mastery[course_id]
+        pub_filter = self.publication_filters[course_id]
+        now = time.time()
+        candidates = [(pub_filter.SKILL, skill_id, student_skills[skill_id])
+                      for skill_id in sorted(changed)]
+        objective_ids = set()
+        for skill_id in changed:
+            objective_ids.update(skills_map.get_objectives_for_skill(skill_id))
+        candidates.extend(
+            (pub_filter.OBJECTIVE, objective_id, aggregates.get_mean(student_id, objective_id))
+            for objective_id in sorted(objective_ids))
+        for kind, item_id, value in candidates:
+            reason = pub_filter.check(student_id, kind, item_id, value, now)
+            if reason is not None:
+                updates.setdefault(student_id, []).append({'kind'   : kind,
+                                                           'id'     : item_id,
+                                                           'value'  : value,
+                                                           'reason' : reason})
+
+    def _publish_updates(self, course_id, student_id, resource_id, updates):
+        out_msg = BusMessage(content=json.dumps({'course_id'   : course_id,
+                                                 'student_id'  : student_id,
+                                                 'resource_id' : resource_id,
+                                                 'updates'     : updates}),
+                             topicName=self.skill_map_update_topic)
+        self.busAdapter.publish(out_msg)
+
+    def publish_stale(self, now=None):
+        '''
+        Publish the estimate changes that the publication filters
+        suppressed, and that became stale since, e.g. because the
+        student stopped practicing. Called by serve_forever().
+        
+        :param now: seconds since the epoch. Defaults to the current time.
+        '''
+        if now is None:
+            now = time.time()
+        for course_id, pub_filter in list(self.publication_filters.items()):
+            with self.course_locks[course_id]:
+                flushed = pub_filter.flush_stale(now)
+            updates = {}
+            for student_id, kind, item_id, value in flushed:
+                updates.setdefault(student_id, []).append({'kind'   : kind,
+                                                           'id'     : item_id,
+                                                           'value'  : value,
+                                                           'reason' : pub_filter.STALE})
+            for student_id, student_updates in sorted(updates.items()):
+                self._publish_updates(course_id, student_id, None, student_updates)
+
+    def process_action(self, item):
+        '''
+        Update skill estimates from one student action and
+        publish the significant changes. Actions of untracked
+        courses are echoed as a text notice.
+        
+        :param item: dict with the decoded 'payload' of the action,
+            and 'time' and 'id' of the bus message that carried it.
+        '''
+        payload = item['payload']
+        course_id = payload.get('course_id', None)
+        updater = self.updaters.get(course_id, None)
+        if updater is not None:
+            student_id = payload.get('student_id', None)
+            now = time.time()
+            with self.course_locks[course_id]:
+                self.significant.updates = {}
+                try:
+                    changed = updater.update_student(student_id, payload, now=now)
+                    updates = self.significant.updates.get(student_id, None)
+                finally:
+                    self.significant.updates = None
+                if course_id in self.attempt_histories:
+                    self.attempt_histories[course_id].record(student_id, payload, now)
+            self._observe(course_id, payload, changed)
+
+        with self.position_lock:
+            self.position['time'] = item['time']
+            self.position['id'] = item['id']
+            self.position['num_processed'] += 1
+
+        logger.debug("Payload: '%s'", payload)
+
+        if updater is not None:
+            if updates:
+                self._publish_updates(course_id, student_id,
+                                      payload.get('resource_id', None), updates)
+            return
 
         pub_content = 'Received Lagunita event %s: Student %s in course %s submitted %s for problem %s, which is %s.' %(
                        payload.get('event_type', None),
@@ -115,7 +858,197 @@ class AnalyticsSchoolbusHandler(object):
                        )
         
         out_msg = BusMessage(content=pub_content,
-                             topicName=AnalyticsSchoolbusHandler.NEW_SKILL_MAP_ENTRY_TOPIC)
+                             topicName=self.skill_map_update_topic)
+        self.busAdapter.publish(out_msg)
+
+    def handle_control(self, busMsg):
+        '''
+        Carry out an operator command from the control topic,
+        such as {"command": "profile", "mode": "deterministic", "messages": 500}.
+        '''
+        try:
+            command = json.loads(busMsg.content)
+            method_name = self.CONTROL_COMMANDS[command.pop('command')]
+        except (ValueError, KeyError, AttributeError, TypeError):
+            logger.warning('Ignoring malformed control message: %s', busMsg.content)
+            return
+        try:
+            getattr(self, method_name)(**command)
+        except (TypeError, ValueError, AssertionError) as e:
+            logger.warning('Control command %s failed: %s', busMsg.content, e)
+
+    def start_profile(self, mode=profiler_hook.ProfileSession.SAMPLING,
+                      messages=1000, seconds=None):
+        '''
+        Profile the processing of the next student actions.
+        The session ends after the given number of messages
+        or seconds, whichever comes first, and writes a
+        collapsed-stack file and a summary to profile_dir.
+        
+        :param mode: 'sampling' or 'deterministic'.
+        :param messages: number of actions to profile, or None.
+        :param seconds: duration of the session, or None.
+        :return: the new ProfileSession, or None if one is
+            already running.
+        '''
+        if self.profile_session is not None:
+            logger.info('Profiling session already running; request ignored.')
+            return None
+        output_prefix = os.path.join(
+            self.profile_dir or tempfile.gettempdir(),
+            'schoolbus-profile-%s-%d' % (mode, int(time.time() * 1000)))
+        self.profile_session = profiler_hook.ProfileSession(
+            output_prefix, mode=mode, max_messages=messages,
+            max_seconds=seconds, on_finish=self._profile_finished)
+        logger.info('Started %s profiling session.', mode)
+        return self.profile_session
+
+    def _profile_finished(self, session):
+        if self.profile_session is session:
+            self.profile_session = None
+
+    def install_profile_signal(self, signum=getattr(signal, 'SIGUSR1', None)):
+        '''
+        Start a profiling session with default settings whenever
+        the process receives signum. Must be called from the
+        main thread.
+        '''
+        signal.signal(signum, lambda signum, frame: self.start_profile())
+
+    def _observe(self, course_id, payload, skill_ids):
+        '''
+        Count a student action in this thread's course sketches.
+        '''
+        sketch_set = getattr(self.thread_sketches, 'sketch_set', None)
+        if sketch_set is None:
+            sketch_set = (threading.Lock(), {})
+            self.thread_sketches.sketch_set = sketch_set
+            with self.sketch_sets_lock:
+                self.sketch_sets.append(sketch_set)
+        lock, sketches = sketch_set
+        with lock:
+            if course_id not in sketches:
+                sketches[course_id] = course_sketches.CourseSketches()
+            sketches[course_id].observe(payload, skill_ids)
+
+    def get_analytics(self):
+        '''
+        Merge the course sketches of all processing threads.
+        
+        :return: dict mapping course ids to summaries as returned
+            by CourseSketches.summary().
+        '''
+        merged = {}
+        with self.sketch_sets_lock:
+            sketch_sets = list(self.sketch_sets)
+        for lock, sketches in sketch_sets:
+            with lock:
+                for course_id, sketch in sketches.items():
+                    if course_id not in merged:
+                        merged[course_id] = course_sketches.CourseSketches()
+                    merged[course_id].merge(sketch)
+        return dict(
+            (course_id, sketch.summary(
+                [skill.id for skill in self.updaters[course_id].skills_map.skills]))
+            for course_id, sketch in merged.items())
+
+    def publish_analytics(self):
+        for course_id, summary in sorted(self.get_analytics().items()):
+            out_msg = BusMessage(content=json.dumps(dict(summary, course_id=course_id)),
+                                 topicName=self.analytics_topic)
+            self.busAdapter.publish(out_msg)
+
+    def get_stats(self):
+        '''
+        Return intake queue depths, shed and spill counts,
+        duplicate counts, the figures of state stores that
+        report any, publication filter counts, the bus position
+        and, when partitioned, the partitions of this node.
+        '''
+        queues = [queue.stats() for queue in self.intake_queues]
+        intake = {}
+        for queue_stats in queues:
+            for key, value in queue_stats.items():
+                if key == 'max_depth':
+                    intake[key] = max(intake.get(key, 0), value)
+                else:
+                    intake[key] = intake.get(key, 0) + value
+        publication = {'num_checked' : 0, 'num_published' : 0}
+        for pub_filter in self.publication_filters.values():
+            for key, value in pub_filter.stats().items():
+                publication[key] += value
+        state = {}
+        for course_id, updater in self.updaters.items():
+            if hasattr(updater.store, 'stats'):
+                with self.course_locks[course_id]:
+                    state[course_id] = updater.store.stats()
+        with self.position_lock:
+            position = dict(self.position)
+        stats = {'intake'      : intake,
+                 'state'       : state,
+                 'publication' : publication,
+                 'queues'      : queues,
+                 'dedup'       : {'num_events'     : self.deduplicator.num_events,
+                                  'num_duplicates' : self.deduplicator.num_duplicates,
+                                  'num_unkeyed'    : self.deduplicator.num_unkeyed},
+                 'position'    : position}
+        if self.coordinator is not None:
+            stats['partitions'] = self.coordinator.stats()
+        return stats
+
+    def publish_stats(self):
+        out_msg = BusMessage(content=json.dumps(self.get_stats()),
+                             topicName=self.STATS_TOPIC)
+        self.busAdapter.publish(out_msg)
+
+    def get_memory_report(self):
+        '''
+        Estimate the resident bytes and object counts of the maps,
+        the student state and the derived indexes of each course,
+        and of the duplicate filter, the course sketches and the
+        intake queues, with their growth since the last report.
+        See memory_report.MemoryAccountant.report().
+        '''
+        derived = [('objective_mastery' , self.objective_mastery),
+                   ('prerequisites'     , self.prerequisites),
+                   ('at_risk'           , self.at_risk),
+                   ('publication_filter', self.publication_filters),
+                   ('attempt_history'   , self.attempt_histories),
+                   ('state_versions'    , self.state_versions),
+                   ('recommender'       , self.recommenders),
+                   ('mastery_matrix'    , self.mastery_matrices)]
+        structures = []
+        for course_id, updater in sorted(self.updaters.items()):
+            lock = self.course_locks[course_id]
+            prefix = 'course/%s/' % course_id
+            # Maps first: the indexes refer to them.
+            structures.append((prefix + 'skills_map', updater.skills_map, lock))
+            structures.append((prefix + 'resources_map', updater.resources_map, lock))
+            structures.append((prefix + 'student_state', updater.store, lock))
+            for name, indexes in derived:
+                if course_id in indexes:
+                    structures.append((prefix + name, indexes[course_id], lock))
+        structures.append(('deduplicator', self.deduplicator, None))
+        structures.append(('course_sketches', self.sketch_sets, self.sketch_sets_lock))
+        for worker_num, queue in enumerate(self.intake_queues):
+            structures.append(('intake_queue/%d' % worker_num, queue, None))
+        return self.memory_accountant.report(structures)
+
+    def publish_memory_report(self):
+        out_msg = BusMessage(content=json.dumps(self.get_memory_report()),
+                             topicName=self.MEMORY_TOPIC)
+        self.busAdapter.publish(out_msg)
+
+    def publish_at_risk(self, course_id, crossing):
+        '''
+        Publish a student's mastery crossing the at-risk threshold.
+        
+        :param course_id: course in which the crossing happened.
+        :param crossing: crossing event dict as produced by AtRiskIndex.
+        '''
+        content = dict(crossing, course_id=course_id)
+        out_msg = BusMessage(content=json.dumps(content),
+                             topicName=self.at_risk_topic)
         self.busAdapter.publish(out_msg)
         
 
@@ -181,4 +1114,5 @@ class AnalyticsSchoolbusHandler(object):
 
 
 if __name__ == "__main__":
-    AnalyticsSchoolbusHandler()
+    from modules.learning_analytics import schoolbus_cli
+    schoolbus_cli.main()
@@ -0,0 +1,244 @@
+"""In-process stand-in for the SchoolBus, for local multi-process setups.
+
+Running several handler processes against a Redis server is heavy for tests and
+development. A LocalBusServer is a small TCP publish/subscribe hub, and a
+LocalBusAdapter has the subscribeToTopic, unsubscribeFromTopic and publish
+methods of the redis_bus_python BusAdapter, so a handler or a
+PartitionCoordinator can use it in place of one.
+
+The wire format is one JSON object per line:
+
+    {"op": "sub", "topic": "studentAction"}
+    {"op": "unsub", "topic": "studentAction"}
+    {"op": "pub", "topic": "studentAction", "content": "...", "id": "...",
+     "time": 1479945600.0}
+
+The server forwards each pub line to all connections subscribed to its topic,
+including the publishing one. It handles the lines of a connection in order, so
+a subscription is in effect for all messages the subscriber publishes after
+it, as with Redis. Nothing is persisted: messages published while nobody
+subscribes are lost.
+
+Usage, to serve on port 5555 of the local host:
+
+    python -m modules.learning_analytics.local_bus --port 5555
+"""
+
+import argparse
+import json
+import logging
+import socket
+import threading
+import time
+import uuid
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+logger = logging.getLogger(__name__)
+
+
+class _Connection(socketserver.StreamRequestHandler):
+    """Reads the lines of one client and carries out their operations."""
+
+    def setup(self):
+        socketserver.StreamRequestHandler.setup(self)
+        self.write_lock = threading.Lock()
+
+    def handle(self):
+        server = self.server
+        try:
+            for line in self.rfile:
+                try:
+                    request = json.loads(line.decode('utf-8'))
+                    op = request['op']
+                    topic = request['topic']
+                except (ValueError, KeyError, TypeError):
+                    logger.warning('Ignoring malformed bus request: %r', line)
+                    continue
+                if op == 'sub':
+                    server.subscribe(topic, self)
+                elif op == 'unsub':
+                    server.unsubscribe(topic, self)
+                elif op == 'pub':
+                    server.route(topic, line)
+        finally:
+            server.unsubscribe_all(self)
+
+    def send(self, line):
+        with self.write_lock:
+            self.wfile.write(line)
+            self.wfile.flush()
+
+
+class LocalBusServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """Topic-based publish/subscribe hub over TCP."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        """Bind to host and port. Port 0 picks a free port.
+
+        Args:
+            host: str. The interface to listen on.
+            port: int. The port to listen on.
+        """
+        socketserver.TCPServer.__init__(self, (host, port), _Connection)
+        self._lock = threading.Lock()
+        # topic -> set of connections
+        self._subscribers = {}
+        self._thread = None
+
+    @property
+    def address(self):
+        """The (host, port) the server listens on."""
+        return self.server_address[:2]
+
+    def subscribe(self, topic, connection):
+        with self._lock:
+            self._subscribers.setdefault(topic, set()).add(connection)
+
+    def unsubscribe(self, topic, connection):
+        with self._lock:
+            self._subscribers.get(topic, set()).discard(connection)
+
+    def unsubscribe_all(self, connection):
+        with self._lock:
+            for connections in self._subscribers.values():
+                connections.discard(connection)
+
+    def route(self, topic, line):
+        with self._lock:
+            connections = list(self._subscribers.get(topic, ()))
+        for connection in connections:
+            try:
+                connection.send(line)
+            except (IOError, OSError):
+                self.unsubscribe_all(connection)
+
+    def start(self):
+        """Serve on a daemon thread."""
+        self._thread = threading.Thread(
+            target=self.serve_forever, name='local-bus-server')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class LocalBusMessage(object):
+    """A message delivered by a LocalBusAdapter."""
+
+    def __init__(self, content=None, topicName=None, id=None, time=None):
+        self.content = content
+        self.topicName = topicName
+        self.id = id
+        self.time = time
+
+
+class LocalBusAdapter(object):
+    """Client of a LocalBusServer with the interface of BusAdapter.
+
+    Callbacks run on the adapter's reader thread, one message at a time, in the
+    order the server sent them.
+    """
+
+    def __init__(self, host='127.0.0.1', port=5555):
+        """Connect to a LocalBusServer.
+
+        Args:
+            host: str. The host of the server.
+            port: int. The port of the server.
+        """
+        self._socket = socket.create_connection((host, port))
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._socket.makefile('rwb')
+        self._write_lock = threading.Lock()
+        self._callbacks = {}
+        self._closed = False
+        self._reader = threading.Thread(
+            target=self._read, name='local-bus-reader')
+        self._reader.daemon = True
+        self._reader.start()
+
+    def _send(self, request):
+        line = (json.dumps(request) + '\n').encode('utf-8')
+        with self._write_lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def _read(self):
+        try:
+            for line in self._file:
+                message = json.loads(line.decode('utf-8'))
+                callback = self._callbacks.get(message['topic'])
+                if callback is None:
+                    continue
+                try:
+                    callback(LocalBusMessage(
+                        content=message['content'],
+                        topicName=message['topic'],
+                        id=message.get('id'), time=message.get('time')))
+                except Exception:
+                    logger.exception('Callback for topic %s failed.',
+                                     message['topic'])
+        except (IOError, OSError, ValueError):
+            if not self._closed:
+                logger.exception('Lost connection to the local bus.')
+
+    def subscribeToTopic(self, topic, callback):
+        self._callbacks[topic] = callback
+        self._send({'op': 'sub', 'topic': topic})
+
+    def unsubscribeFromTopic(self, topic):
+        self._callbacks.pop(topic, None)
+        self._send({'op': 'unsub', 'topic': topic})
+
+    def publish(self, bus_message):
+        """Publish a message with content and topicName attributes."""
+        self._send({'op': 'pub',
+                    'topic': bus_message.topicName,
+                    'content': bus_message.content,
+                    'id': getattr(bus_message, 'id', None) or uuid.uuid4().hex,
+                    'time': time.time()})
+
+    def close(self):
+        self._closed = True
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except (IOError, OSError):
+            pass
+        self._socket.close()
+
+
+def parse_address(address):
+    """Split 'host:port' into (host, int port)."""
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Serve a local stand-in for the SchoolBus.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5555)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    server = LocalBusServer(args.host, args.port)
+    logger.info('Local bus listening on %s:%d.', *server.address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,342 @@
+"""Generator of synthetic skills and resources maps at arbitrary scale.
+
+The maps in the test fixtures hold a handful of skills. To see how SkillsMap
+and ResourcesMap behave with, say, 50k skills, 5k objectives and 1M resources,
+this module writes valid map XML of any size from a MapSpec. The XML is
+produced as a stream of chunks, so that maps far larger than memory can be
+written to disk.
+
+The shape of the maps is set by degree distributions:
+
+    skills_per_objective: how many skills each objective groups.
+    skills_per_resource: how many skills each resource measures.
+    skill_popularity: how the skills of resources are chosen. With 'zipf:S'
+        a few skills are measured by very many resources, as in real courses.
+    prerequisites_per_skill: how many earlier skills each skill requires.
+        Prerequisites always point to skills generated earlier, so they form
+        a DAG.
+
+Count distributions are written 'fixed:N', 'uniform:A-B' or
+'powerlaw:A-B:EXPONENT'; popularity is 'uniform' or 'zipf:S'.
+
+Usage, to write the 50k/5k/1M maps:
+
+    python -m modules.learning_analytics.map_generator --scale 1000 \
+        --out-dir /tmp/maps
+"""
+
+import argparse
+import bisect
+import os
+import random
+
+
+class CountDistribution(object):
+    """Distribution of small non-negative integer counts."""
+
+    def __init__(self, spec):
+        """Parse a distribution.
+
+        Args:
+            spec: str. 'fixed:N', 'uniform:A-B' or 'powerlaw:A-B:EXPONENT'.
+
+        Raises:
+            ValueError: The spec is malformed.
+        """
+        self.spec = spec
+        kind, _, args = spec.partition(':')
+        try:
+            if kind == 'fixed':
+                low = high = int(args)
+                weights = [1.0]
+            elif kind == 'uniform':
+                low, high = [int(bound) for bound in args.split('-')]
+                weights = [1.0] * (high - low + 1)
+            elif kind == 'powerlaw':
+                bounds, exponent = args.split(':')
+                low, high = [int(bound) for bound in bounds.split('-')]
+                weights = [max(count, 1) ** -float(exponent)
+                           for count in range(low, high + 1)]
+            else:
+                raise ValueError('Unknown distribution %s' % kind)
+        except (TypeError, ValueError) as e:
+            raise ValueError('Bad count distribution %r: %s' % (spec, e))
+        if low < 0 or high < low:
+            raise ValueError('Bad count distribution %r' % spec)
+        self._low = low
+        self._cumulative = _accumulate(weights)
+
+    @property
+    def mean(self):
+        previous = 0.0
+        total = 0.0
+        for offset, cumulative in enumerate(self._cumulative):
+            total += (self._low + offset) * (cumulative - previous)
+            previous = cumulative
+        return total / self._cumulative[-1]
+
+    def sample(self, rng):
+        return self._low + _draw(self._cumulative, rng)
+
+
+class Popularity(object):
+    """Distribution over the skills measured by resources."""
+
+    def __init__(self, spec, num_skills, rng):
+        """Parse a popularity distribution over num_skills skills.
+
+        Args:
+            spec: str. 'uniform' or 'zipf:S'.
+            num_skills: int. The number of skills.
+            rng: random.Random. Shuffles which skills are popular.
+
+        Raises:
+            ValueError: The spec is malformed.
+        """
+        kind, _, args = spec.partition(':')
+        self._num_skills = num_skills
+        if kind == 'uniform':
+            self._cumulative = None
+        elif kind == 'zipf':
+            try:
+                exponent = float(args)
+            except ValueError:
+                raise ValueError('Bad popularity %r' % spec)
+            self._cumulative = _accumulate(
+                (rank + 1) ** -exponent for rank in range(num_skills))
+            # Popularity does not follow the order of the skills:
+            self._skill_by_rank = list(range(num_skills))
+            rng.shuffle(self._skill_by_rank)
+        else:
+            raise ValueError('Unknown popularity %s' % kind)
+
+    def sample(self, rng):
+        if self._cumulative is None:
+            return rng.randrange(self._num_skills)
+        return self._skill_by_rank[_draw(self._cumulative, rng)]
+
+
+def _accumulate(weights):
+    cumulative = []
+    total = 0.0
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+    return cumulative
+
+
+def _draw(cumulative, rng):
+    return bisect.bisect_right(cumulative, rng.random() * cumulative[-1])
+
+
+def _sample_distinct(sample, count, limit):
+    """Draw up to count distinct values from sample(), giving up after a
+    bounded number of repeats so that skewed distributions terminate."""
+    values = []
+    seen = set()
+    for _ in range(4 * count + 10):
+        if len(values) == min(count, limit):
+            break
+        value = sample()
+        if value not in seen:
+            seen.add(value)
+            values.append(value)
+    return values
+
+
+class MapSpec(object):
+    """The size and shape of a pair of synthetic maps."""
+
+    def __init__(self, num_skills, num_objectives, num_resources,
+                 skills_per_objective='uniform:5-20',
+                 skills_per_resource='uniform:1-4',
+                 skill_popularity='zipf:1.0',
+                 prerequisites_per_skill='fixed:0', seed=0):
+        """Describe the maps to generate.
+
+        Args:
+            num_skills: int. The number of skills.
+            num_objectives: int. The number of objectives.
+            num_resources: int. The number of resources.
+            skills_per_objective: str. Count distribution.
+            skills_per_resource: str. Count distribution.
+            skill_popularity: str. Popularity distribution.
+            prerequisites_per_skill: str. Count distribution.
+            seed: int. Seed of the random generator; equal specs generate
+                equal maps.
+
+        Raises:
+            ValueError: A distribution is malformed.
+        """
+        self.num_skills = num_skills
+        self.num_objectives = num_objectives
+        self.num_resources = num_resources
+        self.skills_per_objective = CountDistribution(skills_per_objective)
+        self.skills_per_resource = CountDistribution(skills_per_resource)
+        self.skill_popularity = skill_popularity
+        # Checked here rather than halfway through a large map:
+        Popularity(skill_popularity, 1, random.Random(0))
+        self.prerequisites_per_skill = CountDistribution(
+            prerequisites_per_skill)
+        self.seed = seed
+
+    @classmethod
+    def at_scale(cls, scale, **kwargs):
+        """Create a spec with 50 skills, 5 objectives and 1000 resources
+        per unit of scale; scale 1000 is the 50k/5k/1M course."""
+        return cls(int(50 * scale), max(int(5 * scale), 1),
+                   int(1000 * scale), **kwargs)
+
+    def __repr__(self):
+        return 'MapSpec(%d skills, %d objectives, %d resources)' % (
+            self.num_skills, self.num_objectives, self.num_resources)
+
+
+def skill_id(index):
+    return 'skill_%d' % index
+
+
+def objective_id(index):
+    return 'objective_%d' % index
+
+
+def resource_id(index):
+    return 'resource_%d' % index
+
+
+def iter_skills_map_xml(spec):
+    """Generate the skills map of a spec.
+
+    Yields:
+        str. Successive chunks of the XML document.
+    """
+    rng = random.Random('skills-%d' % spec.seed)
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n<skills-map>\n    <skills>\n'
+    for index in range(spec.num_skills):
+        yield '        <skill id="%s">Synthetic skill %d</skill>\n' % (
+            skill_id(index), index)
+    yield '    </skills>\n    <objectives>\n'
+    for index in range(spec.num_objectives):
+        members = _sample_distinct(
+            lambda: rng.randrange(spec.num_skills),
+            spec.skills_per_objective.sample(rng), spec.num_skills)
+        yield ''.join(
+            ['        <objective id="%s">\n' % objective_id(index),
+             '            <description>Synthetic objective %d</description>\n'
+             % index,
+             '            <skills>\n'] +
+            ['                <skill idref="%s"/>\n' % skill_id(member)
+             for member in members] +
+            ['            </skills>\n        </objective>\n'])
+    yield '    </objectives>\n'
+    if spec.prerequisites_per_skill.mean > 0:
+        yield '    <prerequisites>\n'
+        for index in range(1, spec.num_skills):
+            required = _sample_distinct(
+                lambda: rng.randrange(index),
+                spec.prerequisites_per_skill.sample(rng), index)
+            if required:
+                yield ''.join(
+                    '        <prerequisite skill="%s" requires="%s"/>\n' % (
+                        skill_id(index), skill_id(member))
+                    for member in required)
+        yield '    </prerequisites>\n'
+    yield '</skills-map>\n'
+
+
+def iter_resources_map_xml(spec):
+    """Generate the resources map of a spec.
+
+    Yields:
+        str. Successive chunks of the XML document.
+    """
+    rng = random.Random('resources-%d' % spec.seed)
+    popularity = Popularity(spec.skill_popularity, spec.num_skills, rng)
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<resources id="synthetic_%d">\n' % spec.seed)
+    for index in range(spec.num_resources):
+        members = _sample_distinct(
+            lambda: popularity.sample(rng),
+            spec.skills_per_resource.sample(rng), spec.num_skills)
+        yield ''.join(
+            ['    <resource id="%s">\n        <skills>\n' % resource_id(index)] +
+            ['            <skill idref="%s"/>\n' % skill_id(member)
+             for member in members] +
+            ['        </skills>\n    </resource>\n'])
+    yield '</resources>\n'
+
+
+def write_maps(spec, out_dir):
+    """Write skills.xml and resources.xml of a spec to a directory.
+
+    Returns:
+        tuple. The paths of the skills map and the resources map.
+    """
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    paths = (os.path.join(out_dir, 'skills.xml'),
+             os.path.join(out_dir, 'resources.xml'))
+    for path, chunks in zip(paths, (iter_skills_map_xml(spec),
+                                    iter_resources_map_xml(spec))):
+        with open(path, 'w') as out_file:
+            out_file.writelines(chunks)
+    return paths
+
+
+def add_spec_arguments(parser):
+    """Add the options describing a MapSpec, except its size."""
+    parser.add_argument(
+        '--skills-per-objective', default='uniform:5-20',
+        help='count distribution (default: %(default)s)')
+    parser.add_argument(
+        '--skills-per-resource', default='uniform:1-4',
+        help='count distribution (default: %(default)s)')
+    parser.add_argument(
+        '--skill-popularity', default='zipf:1.0',
+        help='"uniform" or "zipf:S" (default: %(default)s)')
+    parser.add_argument(
+        '--prerequisites-per-skill', default='fixed:0',
+        help='count distribution (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def spec_options(args):
+    """Get the MapSpec keyword arguments from parsed options."""
+    return {'skills_per_objective': args.skills_per_objective,
+            'skills_per_resource': args.skills_per_resource,
+            'skill_popularity': args.skill_popularity,
+            'prerequisites_per_skill': args.prerequisites_per_skill,
+            'seed': args.seed}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Write synthetic skills and resources map XML.')
+    parser.add_argument(
+        '--scale', type=float, default=1,
+        help='50 skills, 5 objectives and 1000 resources per unit, unless '
+             'given explicitly (default: %(default)s)')
+    parser.add_argument('--skills', type=int)
+    parser.add_argument('--objectives', type=int)
+    parser.add_argument('--resources', type=int)
+    parser.add_argument('--out-dir', required=True)
+    add_spec_arguments(parser)
+    args = parser.parse_args(argv)
+
+    scaled = MapSpec.at_scale(args.scale)
+    try:
+        spec = MapSpec(
+            args.skills if args.skills is not None else scaled.num_skills,
+            args.objectives if args.objectives is not None
+            else scaled.num_objectives,
+            args.resources if args.resources is not None
+            else scaled.num_resources,
+            **spec_options(args))
+    except ValueError as e:
+        parser.error(str(e))
+    paths = write_maps(spec, args.out_dir)
+    print('Wrote %r to %s' % (spec, ', '.join(paths)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+"""Targeted recomputation of student estimates after a skills map edit.
+
+When a course team edits which skills a resource measures, only the students
+who attempted that resource can have different estimates, and only for the
+skills gained or lost by the resource. Rather than recomputing every student
+from scratch:
+
+    * diff_maps compares two versions of the SkillsMap and ResourcesMap and
+      lists the links that were added or removed.
+    * AttemptHistory logs each student's attempts and maintains an inverted
+      index from resources to the students who attempted them.
+    * replay combines both: it finds the affected (student, skill) pairs
+      through the index and has the SkillsUpdater recompute just those skills
+      from the students' logged attempts.
+
+A small edit therefore costs time proportional to the attempts of the affected
+students, not to the size of the course.
+"""
+
+
+def _resource_links(resources_map):
+    return set(
+        (resource_id, skill_id)
+        for resource_id in resources_map.resource_ids
+        for skill_id in resources_map.get_skills_for_resource(resource_id))
+
+
+class MapDiff(object):
+    """The links that differ between two versions of a course's maps.
+
+    Each attribute is a pair (added, removed) of sets:
+
+        skills: skill ids.
+        objective_links: (skill id, objective id) tuples.
+        prerequisites: (skill id, required skill id) tuples.
+        resource_links: (resource id, skill id) tuples.
+    """
+
+    def __init__(self, skills, objective_links, prerequisites,
+                 resource_links):
+        self.skills = skills
+        self.objective_links = objective_links
+        self.prerequisites = prerequisites
+        self.resource_links = resource_links
+
+    def __repr__(self):
+        return 'MapDiff(%s)' % ', '.join(
+            '%s: +%d -%d' % (name, len(added), len(removed))
+            for name, (added, removed) in (
+                ('skills', self.skills),
+                ('objective_links', self.objective_links),
+                ('prerequisites', self.prerequisites),
+                ('resource_links', self.resource_links)))
+
+    @property
+    def is_empty(self):
+        return not any(added or removed for added, removed in (
+            self.skills, self.objective_links, self.prerequisites,
+            self.resource_links))
+
+    @property
+    def skills_map_changed(self):
+        """Whether skills, objective links or prerequisites differ."""
+        return any(added or removed for added, removed in (
+            self.skills, self.objective_links, self.prerequisites))
+
+    def get_changed_resources(self):
+        """Get the skills each resource gained or lost.
+
+        Returns:
+            dict. Resource id to the set of skill ids whose link to the
+                resource was added or removed.
+        """
+        changed = {}
+        added, removed = self.resource_links
+        for resource_id, skill_id in added | removed:
+            changed.setdefault(resource_id, set()).add(skill_id)
+        return changed
+
+
+def diff_maps(old_skills_map, old_resources_map, new_skills_map,
+              new_resources_map):
+    """Compare two versions of a course's maps.
+
+    Args:
+        old_skills_map: SkillsMap. The current skills map.
+        old_resources_map: ResourcesMap. The current resources map.
+        new_skills_map: SkillsMap. The edited skills map.
+        new_resources_map: ResourcesMap. The edited resources map.
+
+    Returns:
+        MapDiff. The added and removed links.
+    """
+    def skill_ids(skills_map):
+        return set(skill.id for skill in skills_map.skills)
+
+    def objective_links(skills_map):
+        return set(
+            (skill_id, objective.id) for objective in skills_map.objectives
+            for skill_id in skills_map.get_skills_for_objective(objective.id))
+
+    def prerequisites(skills_map):
+        return set(
+            (skill.id, required_id) for skill in skills_map.skills
+            for required_id in skills_map.get_prerequisites(skill.id))
+
+    def added_removed(old, new):
+        return new - old, old - new
+
+    return MapDiff(
+        added_removed(skill_ids(old_skills_map), skill_ids(new_skills_map)),
+        added_removed(objective_links(old_skills_map),
+                      objective_links(new_skills_map)),
+        added_removed(prerequisites(old_skills_map),
+                      prerequisites(new_skills_map)),
+        added_removed(_resource_links(old_resources_map),
+                      _resource_links(new_resources_map)))
+
+
+class AttemptHistory(object):
+    """Per-student attempt log with a resource -> students inverted index."""
+
+    # Payload fields that SkillsUpdater reads.
+    FIELDS = ('resource_id', 'result', 'answers', 'correct_map')
+
+    def __init__(self):
+        # student id -> list of (time, trimmed payload)
+        self._attempts = {}
+        # resource id -> set of student ids
+        self._students_by_resource = {}
+
+    def __len__(self):
+        return len(self._attempts)
+
+    def record(self, student_id, payload, now):
+        """Log an attempt and index the resources it touched.
+
+        Args:
+            student_id: str. The id of the student.
+            payload: dict. The student action.
+            now: float. The time at which it was applied.
+        """
+        attempt = dict((field, payload[field]) for field in self.FIELDS
+                       if payload.get(field) is not None)
+        if attempt.get('answers'):
+            # Only the answered part ids matter for replay:
+            attempt['answers'] = dict.fromkeys(attempt['answers'])
+        self._attempts.setdefault(student_id, []).append((now, attempt))
+        resource_ids = [attempt.get('resource_id')]
+        resource_ids.extend(attempt.get('answers') or ())
+        for resource_id in resource_ids:
+            self._students_by_resource.setdefault(
+                resource_id, set()).add(student_id)
+
+    def get_attempts(self, student_id):
+        """Get the logged (time, payload) pairs of a student, oldest first."""
+        return list(self._attempts.get(student_id, ()))
+
+    def get_students(self, resource_id):
+        """Get the ids of the students who attempted a resource."""
+        return frozenset(self._students_by_resource.get(resource_id, ()))
+
+    def items(self):
+        """Get (student id, attempts) pairs, e.g. for a checkpoint."""
+        return self._attempts.items()
+
+    def forget_student(self, student_id):
+        """Drop a student's attempts and index entries."""
+        for _, attempt in self._attempts.pop(student_id, ()):
+            resource_ids = [attempt.get('resource_id')]
+            resource_ids.extend(attempt.get('answers') or ())
+            for resource_id in resource_ids:
+                students = self._students_by_resource.get(resource_id)
+                if students is not None:
+                    students.discard(student_id)
+                    if not students:
+                        del self._students_by_resource[resource_id]
+
+    def load(self, items):
+        """Add the attempts of (student id, attempts) pairs."""
+        for student_id, attempts in items:
+            for now, attempt in attempts:
+                self.record(student_id, attempt, now)
+
+
+def get_affected(diff, history, resources_map=None):
+    """Find the (student, skill) pairs a map edit can change.
+
+    Args:
+        diff: MapDiff. The edit, from diff_maps.
+        history: AttemptHistory. The attempts of the course's students.
+        resources_map: ResourcesMap. The edited resources map. If given, the
+            skills of a problem are recomputed too for the students who
+            answered one of its parts that the edit changed, since whether
+            the problem contributes them depends on how its parts resolve.
+
+    Returns:
+        dict. Student id to the set of skill ids to recompute.
+    """
+    changed = diff.get_changed_resources()
+    affected = {}
+    for resource_id, skill_ids in changed.items():
+        for student_id in history.get_students(resource_id):
+            affected.setdefault(student_id, set()).update(skill_ids)
+    if resources_map is not None:
+        for student_id, skill_ids in affected.items():
+            for _, attempt in history.get_attempts(student_id):
+                if any(part_id in changed
+                       for part_id in attempt.get('answers') or ()):
+                    skill_ids.update(resources_map.get_skills_for_resource(
+                        attempt.get('resource_id')))
+    return affected
+
+
+def replay(updater, diff, history):
+    """Recompute the estimates affected by a map edit.
+
+    The updater must already resolve actions through the edited maps.
+
+    Args:
+        updater: SkillsUpdater. The updater of the course.
+        diff: MapDiff. The edit, from diff_maps.
+        history: AttemptHistory. The attempts of the course's students.
+
+    Returns:
+        dict. Student id to the skills that were recomputed.
+    """
+    affected = get_affected(diff, history, updater.resources_map)
+    for student_id, skill_ids in affected.items():
+        updater.replay_skills(
+            student_id, skill_ids, history.get_attempts(student_id))
+    return affected
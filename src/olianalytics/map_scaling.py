@@ -0,0 +1,265 @@
+"""Scaling suite for SkillsMap and ResourcesMap.
+
+Generates maps of growing size with map_generator and measures, at each size:
+
+    parse_seconds: time of SkillsMap.from_xml plus ResourcesMap.from_xml.
+    peak_bytes: the peak of memory allocated while parsing, as traced by
+        tracemalloc in a second, untimed parse. Where tracemalloc is
+        unavailable (Python 2), the growth of the maximum resident set size
+        of a forked process that parses the maps instead, from
+        resource.getrusage(); it counts whole pages and the allocator's
+        slack, so it is coarser. A process per scale keeps the high-water
+        mark of one scale from hiding the next. None where neither is
+        available.
+    query_seconds: the mean latency of each lookup method, over random ids.
+
+It then fits the exponent k of cost ~ size^k for each measure, by least squares
+on a log-log scale, with size the bytes of XML parsed. Parsing should be
+linear (k = 1) and lookups constant (k = 0). Measures whose exponent exceeds
+the expected one by more than a tolerance are flagged as super-linear. Lookups
+get a wider tolerance, since cache misses slow them down somewhat as the maps
+outgrow the CPU caches.
+
+Usage, for scales 1 to 64 (up to 3200 skills and 64000 resources):
+
+    python -m modules.learning_analytics.map_scaling --scales 1,4,16,64
+"""
+
+import argparse
+import math
+import multiprocessing
+import random
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from modules.learning_analytics import map_generator
+from modules.learning_analytics import skills_models
+
+
+# Expected exponent of each measure in the size of the maps, and the
+# tolerated excess:
+EXPECTED_EXPONENTS = {
+    'parse_seconds': (1.0, 0.25),
+    'peak_bytes': (1.0, 0.25),
+}
+EXPECTED_QUERY_EXPONENT = (0.0, 0.5)
+
+QUERIES = (
+    ('get_skills_for_objective', 'skills_map', map_generator.objective_id,
+     'num_objectives'),
+    ('get_objectives_for_skill', 'skills_map', map_generator.skill_id,
+     'num_skills'),
+    ('get_prerequisites', 'skills_map', map_generator.skill_id, 'num_skills'),
+    ('get_skills_for_resource', 'resources_map', map_generator.resource_id,
+     'num_resources'),
+    ('get_resources_for_skill', 'resources_map', map_generator.skill_id,
+     'num_skills'),
+    ('get_objectives_for_resource', 'resources_map',
+     map_generator.resource_id, 'num_resources'),
+)
+
+
+def _parse(skills_xml, resources_xml):
+    skills_map = skills_models.SkillsMap.from_xml(skills_xml)
+    return {'skills_map': skills_map,
+            'resources_map': skills_models.ResourcesMap.from_xml(
+                resources_xml, skills_map=skills_map)}
+
+
+def _max_rss_bytes():
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes, except on OS X:
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def _report_rss_growth(skills_xml, resources_xml, results):
+    before = _max_rss_bytes()
+    _parse(skills_xml, resources_xml)
+    results.put(_max_rss_bytes() - before)
+
+
+def measure_rss_growth(skills_xml, resources_xml):
+    """Parse maps in a forked process and get its maximum RSS growth.
+
+    Returns:
+        int. The bytes by which the maximum resident set size of the process
+            grew while parsing, or None without the resource module.
+    """
+    if resource is None:
+        return None
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=_report_rss_growth, args=(skills_xml, resources_xml, results))
+    process.start()
+    growth = results.get()
+    process.join()
+    return growth
+
+
+def measure(spec, num_queries=1000):
+    """Parse the maps of a spec and time lookups on them.
+
+    Args:
+        spec: MapSpec. The maps to measure.
+        num_queries: int. The number of random lookups per method.
+
+    Returns:
+        dict. 'size' in bytes of XML, 'parse_seconds', 'peak_bytes' and
+            'query_seconds', a dict of method name to mean seconds.
+    """
+    skills_xml = ''.join(map_generator.iter_skills_map_xml(spec))
+    resources_xml = ''.join(map_generator.iter_resources_map_xml(spec))
+
+    start = time.time()
+    maps = _parse(skills_xml, resources_xml)
+    parse_seconds = time.time() - start
+    if tracemalloc is not None:
+        # Tracing slows parsing down, so it is not timed:
+        tracemalloc.start()
+        _parse(skills_xml, resources_xml)
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    else:
+        peak_bytes = measure_rss_growth(skills_xml, resources_xml)
+
+    rng = random.Random(spec.seed)
+    query_seconds = {}
+    for method_name, map_name, make_id, count_name in QUERIES:
+        ids = [make_id(rng.randrange(getattr(spec, count_name)))
+               for _ in range(num_queries)]
+        method = getattr(maps[map_name], method_name)
+        start = time.time()
+        for id_str in ids:
+            method(id_str)
+        query_seconds[method_name] = (time.time() - start) / num_queries
+
+    return {'size': len(skills_xml) + len(resources_xml),
+            'parse_seconds': parse_seconds,
+            'peak_bytes': peak_bytes,
+            'query_seconds': query_seconds}
+
+
+def fit_exponent(sizes, costs):
+    """Fit k in cost ~ size^k by least squares on a log-log scale.
+
+    Returns:
+        float. The exponent, or None with fewer than two usable points.
+    """
+    points = [(math.log(size), math.log(cost))
+              for size, cost in zip(sizes, costs) if size > 0 and cost > 0]
+    if len(set(x for x, _ in points)) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    return (sum((x - mean_x) * (y - mean_y) for x, y in points) /
+            sum((x - mean_x) ** 2 for x, _ in points))
+
+
+def analyze(results, tolerance=None):
+    """Fit the exponent of every measure and flag the super-linear ones.
+
+    Args:
+        results: list. Dicts as returned by measure(), one per size.
+        tolerance: float. How far an exponent may exceed the expected one.
+            Defaults to the tolerance of each measure.
+
+    Returns:
+        list. (measure, exponent, expected, flagged) tuples; query measures
+            are named 'query:<method>'.
+    """
+    sizes = [result['size'] for result in results]
+    series = []
+    for name, expectation in sorted(EXPECTED_EXPONENTS.items()):
+        costs = [result[name] for result in results]
+        if None not in costs:
+            series.append((name, costs, expectation))
+    for method_name, _, _, _ in QUERIES:
+        series.append((
+            'query:%s' % method_name,
+            [result['query_seconds'][method_name] for result in results],
+            EXPECTED_QUERY_EXPONENT))
+    rows = []
+    for name, costs, (expected, default_tolerance) in series:
+        exponent = fit_exponent(sizes, costs)
+        if tolerance is None:
+            limit = expected + default_tolerance
+        else:
+            limit = expected + tolerance
+        rows.append((name, exponent, expected,
+                     exponent is not None and exponent > limit))
+    return rows
+
+
+def run_suite(scales, num_queries=1000, **spec_options):
+    """Measure the maps at each scale.
+
+    Args:
+        scales: list. Scales as understood by MapSpec.at_scale.
+        num_queries: int. Random lookups per method and scale.
+        **spec_options: further MapSpec arguments.
+
+    Returns:
+        list. Dicts as returned by measure(), with the 'spec' added.
+    """
+    results = []
+    for scale in scales:
+        spec = map_generator.MapSpec.at_scale(scale, **spec_options)
+        result = measure(spec, num_queries=num_queries)
+        result['spec'] = spec
+        results.append(result)
+    return results
+
+
+def format_report(results, rows):
+    lines = ['%-56s %12s %10s %12s' % ('Maps', 'XML bytes', 'parse s',
+                                        'peak bytes')]
+    for result in results:
+        lines.append('%-56r %12d %10.3f %12s' % (
+            result['spec'], result['size'], result['parse_seconds'],
+            result['peak_bytes']))
+    lines.append('')
+    lines.append('%-40s %9s %9s' % ('Measure', 'exponent', 'expected'))
+    for name, exponent, expected, flagged in rows:
+        lines.append('%-40s %9s %9.1f%s' % (
+            name, '-' if exponent is None else '%.2f' % exponent, expected,
+            '  SUPER-LINEAR' if flagged else ''))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Measure how map parsing and lookups scale with size.')
+    parser.add_argument(
+        '--scales', default='1,4,16,64',
+        help='comma-separated scales; 50 skills, 5 objectives and 1000 '
+             'resources per unit (default: %(default)s)')
+    parser.add_argument(
+        '--queries', type=int, default=1000,
+        help='random lookups per method and scale (default: %(default)s)')
+    parser.add_argument(
+        '--tolerance', type=float,
+        help='excess over the expected exponent that is flagged '
+             '(default: 0.25 for parsing, 0.5 for lookups)')
+    map_generator.add_spec_arguments(parser)
+    args = parser.parse_args(argv)
+
+    scales = [float(scale) for scale in args.scales.split(',') if scale]
+    results = run_suite(scales, num_queries=args.queries,
+                        **map_generator.spec_options(args))
+    rows = analyze(results, tolerance=args.tolerance)
+    print(format_report(results, rows))
+    # A non-zero status lets CI fail on a regression:
+    sys.exit(1 if any(flagged for _, _, _, flagged in rows) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+"""Chunked columnar export of skill estimates for offline analysis.
+
+Pulling every student's estimates by reading and decoding one
+StudentPropertyEntity at a time is slow. A MasteryExporter streams the student
+state of a course into a directory of NumPy column files instead:
+
+    export/
+        manifest.json
+        chunk-00000/
+            students.json   ids of the students in this chunk
+            student.npy     int32 index into students.json
+            skill.npy       int32 index into the manifest's skills, or -1
+            objective.npy   int32 index into the manifest's objectives, or -1
+            estimate.npy    float32
+            timestamp.npy   float64 seconds since the epoch, NaN if unknown
+        chunk-00001/
+            ...
+
+Each row holds either a skill estimate (objective -1) or the mean estimate of
+an objective over its skills (skill -1), timestamped with the latest update of
+those skills. Students are written chunk_size at a time, so memory use does not
+grow with the size of the course.
+
+Chunks are written to a temporary directory and renamed into place, then
+recorded in the manifest, which is itself replaced atomically. An interrupted
+export therefore leaves only complete chunks behind, and running it again over
+the same student sequence skips the students already exported. The command
+line tool streams the students of a course from a checkpoint in the order they
+were written. It pins that checkpoint in the export directory as SOURCE_FILE,
+a hard link or else a copy, so that an interrupted export resumes from the
+same students even after the checkpointer rotated the original away, and
+removes the pin once the export is complete.
+
+Usage, from the Course Builder root, to export from the newest checkpoint:
+
+    python -m modules.learning_analytics.mastery_export \
+        --checkpoint-dir /var/lib/oli_schoolbus \
+        --course HumanitiesSciences/NCP-101/OnGoing --out /data/export
+"""
+
+import argparse
+import json
+import os
+import shutil
+
+import numpy
+
+from modules.learning_analytics import skills_updater
+
+
+COLUMNS = (
+    ('student', numpy.int32),
+    ('skill', numpy.int32),
+    ('objective', numpy.int32),
+    ('estimate', numpy.float32),
+    ('timestamp', numpy.float64),
+)
+
+
+class MasteryExporter(object):
+    """Writes student state to chunked column files, resumably."""
+
+    MANIFEST = 'manifest.json'
+    SOURCE_FILE = 'source.checkpoint'
+    VERSION = 2
+    DEFAULT_CHUNK_SIZE = 10000
+
+    def __init__(self, directory, skills_map, chunk_size=DEFAULT_CHUNK_SIZE,
+                 default_prior=skills_updater.SkillsUpdater.DEFAULT_PRIOR,
+                 source=None):
+        """Prepare an export, picking up the manifest of an earlier run.
+
+        Args:
+            directory: str. The export directory. Created if needed.
+            skills_map: SkillsMap. The skills and objectives of the course.
+            chunk_size: int. The number of students per chunk.
+            default_prior: float. The estimate of unexercised skills when
+                averaging objectives.
+            source: str. Where the students come from, recorded in the
+                manifest of a new export, e.g. a checkpoint path.
+
+        Raises:
+            ValueError: The directory holds an export of different skills,
+                objectives or chunk size.
+        """
+        self._directory = directory
+        self._skills_map = skills_map
+        self._chunk_size = chunk_size
+        self._default_prior = default_prior
+        self._skill_index = dict(
+            (skill.id, index) for index, skill in enumerate(skills_map.skills))
+        self._objective_skills = [
+            [self._skill_index[skill_id] for skill_id in sorted(
+                skills_map.get_skills_for_objective(objective.id))]
+            for objective in skills_map.objectives]
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        manifest = {
+            'version': self.VERSION,
+            'skills': [skill.id for skill in skills_map.skills],
+            'objectives': [objective.id for objective in skills_map.objectives],
+            'columns': dict((name, numpy.dtype(dtype).str)
+                            for name, dtype in COLUMNS),
+            'chunk_size': chunk_size,
+            'num_students': 0,
+            'num_rows': 0,
+            'chunks': [],
+            'complete': False,
+            'source': source,
+        }
+        previous = load_manifest(directory)
+        if previous is not None:
+            for key in ('version', 'skills', 'objectives', 'chunk_size'):
+                if previous[key] != manifest[key]:
+                    raise ValueError(
+                        'Cannot resume export in %s: %s differs' % (
+                            directory, key))
+            manifest = previous
+        self.manifest = manifest
+
+    def _write_manifest(self):
+        path = os.path.join(self._directory, self.MANIFEST)
+        with open(path + '.tmp', 'w') as manifest_file:
+            json.dump(self.manifest, manifest_file, indent=1, sort_keys=True)
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+        os.rename(path + '.tmp', path)
+
+    def _student_rows(self, student_skills):
+        """Get the skill and objective rows of one student.
+
+        Returns:
+            list. (skill, objective, estimate, timestamp) tuples.
+        """
+        timestamps = student_skills.get(
+            skills_updater.SkillsUpdater.TIMESTAMPS_KEY, {})
+        estimates = [None] * len(self._skill_index)
+        updated = [None] * len(self._skill_index)
+        rows = []
+        for skill_id, estimate in student_skills.items():
+            index = self._skill_index.get(skill_id)
+            if index is None:
+                continue
+            estimates[index] = estimate
+            updated[index] = timestamps.get(skill_id)
+            rows.append((index, -1, estimate, updated[index]))
+        for objective_index, skill_indices in enumerate(self._objective_skills):
+            touched = [index for index in skill_indices
+                       if estimates[index] is not None]
+            if not touched:
+                continue
+            mean = sum(
+                self._default_prior if estimates[index] is None
+                else estimates[index]
+                for index in skill_indices) / len(skill_indices)
+            times = [updated[index] for index in touched
+                     if updated[index] is not None]
+            rows.append((-1, objective_index, mean,
+                         max(times) if times else None))
+        return rows
+
+    def _write_chunk(self, students):
+        chunk_name = 'chunk-%05d' % len(self.manifest['chunks'])
+        chunk_dir = os.path.join(self._directory, chunk_name)
+        tmp_dir = chunk_dir + '.tmp'
+        # Leftovers of an interrupted run:
+        for stale_dir in (tmp_dir, chunk_dir):
+            if os.path.isdir(stale_dir):
+                shutil.rmtree(stale_dir)
+        os.makedirs(tmp_dir)
+
+        student_ids = []
+        columns = dict((name, []) for name, _ in COLUMNS)
+        for student_index, (student_id, student_skills) in enumerate(students):
+            student_ids.append(student_id)
+            for skill, objective, estimate, timestamp in self._student_rows(
+                    student_skills):
+                columns['student'].append(student_index)
+                columns['skill'].append(skill)
+                columns['objective'].append(objective)
+                columns['estimate'].append(estimate)
+                columns['timestamp'].append(
+                    numpy.nan if timestamp is None else timestamp)
+        with open(os.path.join(tmp_dir, 'students.json'), 'w') as ids_file:
+            json.dump(student_ids, ids_file)
+        for name, dtype in COLUMNS:
+            numpy.save(os.path.join(tmp_dir, name + '.npy'),
+                       numpy.array(columns[name], dtype=dtype))
+        os.rename(tmp_dir, chunk_dir)
+
+        num_rows = len(columns['student'])
+        self.manifest['chunks'].append({
+            'path': chunk_name,
+            'num_students': len(student_ids),
+            'num_rows': num_rows,
+            'last_student': student_ids[-1],
+        })
+        self.manifest['num_students'] += len(student_ids)
+        self.manifest['num_rows'] += num_rows
+        self._write_manifest()
+
+    def export(self, students):
+        """Export students, resuming after those already exported.
+
+        Args:
+            students: iterable. (student id, student state) pairs, in the
+                same order every time the export is run. States are dicts as
+                kept by StudentStateStore.
+
+        Returns:
+            dict. The manifest.
+
+        Raises:
+            ValueError: The student sequence differs from the one of the
+                interrupted run.
+        """
+        students = iter(students)
+        num_done = self.manifest['num_students']
+        if self.manifest['complete']:
+            return self.manifest
+        last_skipped = None
+        for _ in range(num_done):
+            last_skipped = next(students, (None, None))[0]
+        if num_done and last_skipped != self.manifest['chunks'][-1][
+                'last_student']:
+            raise ValueError(
+                'Student order changed since the interrupted export')
+
+        chunk = []
+        for student in students:
+            chunk.append(student)
+            if len(chunk) == self._chunk_size:
+                self._write_chunk(chunk)
+                chunk = []
+        if chunk:
+            self._write_chunk(chunk)
+        self.manifest['complete'] = True
+        self._write_manifest()
+        return self.manifest
+
+
+def pin_source(path, directory):
+    """Keep a checkpoint available to an export in its directory.
+
+    Args:
+        path: str. The checkpoint.
+        directory: str. The export directory.
+
+    Returns:
+        str. The path of the pinned checkpoint.
+    """
+    pinned = os.path.join(directory, MasteryExporter.SOURCE_FILE)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    try:
+        # A hard link costs no space, but needs the same file system:
+        os.link(path, pinned + '.tmp')
+    except (AttributeError, OSError):
+        shutil.copyfile(path, pinned + '.tmp')
+    os.rename(pinned + '.tmp', pinned)
+    return pinned
+
+
+def load_manifest(directory):
+    """Read the manifest of an export, or None if there is none."""
+    path = os.path.join(directory, MasteryExporter.MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def iter_chunks(directory, mmap_mode='r'):
+    """Read an export one chunk at a time.
+
+    Args:
+        directory: str. The export directory.
+        mmap_mode: str. Passed to numpy.load; memory-maps the columns by
+            default.
+
+    Yields:
+        dict. Column name to array, plus 'students', the list of student ids
+            that the student column indexes.
+    """
+    manifest = load_manifest(directory)
+    for chunk in manifest['chunks']:
+        chunk_dir = os.path.join(directory, chunk['path'])
+        columns = dict(
+            (name, numpy.load(os.path.join(chunk_dir, name + '.npy'),
+                              mmap_mode=mmap_mode))
+            for name, _ in COLUMNS)
+        with open(os.path.join(chunk_dir, 'students.json')) as ids_file:
+            columns['students'] = json.load(ids_file)
+        yield columns
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Export the student skill estimates of a course from the '
+                    'newest checkpoint to chunked NumPy column files.')
+    parser.add_argument('--checkpoint-dir', required=True)
+    parser.add_argument('--course', required=True, help='course id')
+    parser.add_argument('--out', required=True, help='export directory')
+    parser.add_argument(
+        '--chunk-size', type=int, default=MasteryExporter.DEFAULT_CHUNK_SIZE,
+        help='students per chunk (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    from modules.learning_analytics import checkpoint
+    # Resuming needs the same student order, i.e. the same checkpoint:
+    pinned = os.path.join(args.out, MasteryExporter.SOURCE_FILE)
+    previous = load_manifest(args.out)
+    path = previous and previous.get('source')
+    if not os.path.exists(pinned):
+        if previous is not None and not previous['complete']:
+            parser.error('The checkpoint of the interrupted export in %s is '
+                         'gone; remove the directory to start over' % args.out)
+        path = checkpoint.Checkpointer(args.checkpoint_dir).latest_path()
+        if path is None:
+            parser.error('No checkpoint in %s' % args.checkpoint_dir)
+        pin_source(path, args.out)
+    header, students = checkpoint.read_snapshot(pinned)
+    if args.course not in header['courses']:
+        parser.error('No checkpoint of course %s in %s' % (
+            args.course, args.checkpoint_dir))
+    exporter = MasteryExporter(
+        args.out, header['courses'][args.course]['skills_map'],
+        chunk_size=args.chunk_size, source=path)
+    manifest = exporter.export(
+        (student_id, student_state)
+        for course_id, student_id, student_state in students
+        if course_id == args.course)
+    os.remove(pinned)
+    print('Exported %d students, %d rows, in %d chunks to %s' % (
+        manifest['num_students'], manifest['num_rows'],
+        len(manifest['chunks']), args.out))
+
+
+if __name__ == '__main__':
+    main()
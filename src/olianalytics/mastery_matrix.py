@@ -0,0 +1,242 @@
+"""Columnar, memory-mapped student x skill mastery matrix.
+
+Bulk questions such as "mastery of skill S for every student in course C"
+should not require loading and decoding one StudentPropertyEntity per student.
+A MasteryMatrix keeps the estimates of one course in a dense float32 matrix
+backed by a memory-mapped file:
+
+    * Skills and students are interned to dense column and row indices. The
+      skill axis is fixed by the SkillsMap, the student axis grows as students
+      appear.
+    * The matrix is stored column-major, so the estimates of one skill across
+      all students are contiguous on disk and in memory.
+    * Column, row and whole-matrix reads are NumPy views on the mapped file;
+      slicing and reductions (mean, percentile, comparisons) never copy the
+      data into Python objects.
+
+The interned ids are kept in a small JSON file next to the matrix, so a
+matrix can be reopened after a restart.
+"""
+
+import json
+import os
+import re
+
+import numpy
+
+
+def matrix_path(directory, course_id):
+    """Get the file name of the matrix of a course inside directory."""
+    return os.path.join(
+        directory, re.sub(r'[^A-Za-z0-9_.-]', '_', course_id) + '.mastery')
+
+
+class IdInterner(object):
+    """Assigns dense integer indices to string ids in order of appearance."""
+
+    def __init__(self, ids=None):
+        self._ids = []
+        self._index = {}
+        for id_str in ids or []:
+            self.intern(id_str)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, id_str):
+        return id_str in self._index
+
+    @property
+    def ids(self):
+        return self._ids
+
+    def intern(self, id_str):
+        """Get the index of an id, assigning the next free index if needed."""
+        index = self._index.get(id_str)
+        if index is None:
+            index = len(self._ids)
+            self._index[id_str] = index
+            self._ids.append(id_str)
+        return index
+
+    def get(self, id_str):
+        """Get the index of an id, or None if it has not been interned."""
+        return self._index.get(id_str)
+
+
+class MasteryMatrix(object):
+    """Dense float32 student x skill estimates of one course."""
+
+    DTYPE = numpy.float32
+    INITIAL_CAPACITY = 1024
+    IDS_SUFFIX = '.ids.json'
+
+    @classmethod
+    def open(cls, path, skill_ids, default_value=0.0):
+        """Open the matrix at path, creating it if it does not exist.
+
+        Args:
+            path: str. The file backing the matrix.
+            skill_ids: list of str. The skills of the course, e.g. from
+                SkillsMap.skills. Skills already in an existing matrix keep
+                their columns; new skills require a fresh matrix.
+            default_value: float. Estimate of cells never written.
+
+        Returns:
+            MasteryMatrix. The opened matrix.
+        """
+        student_ids = []
+        ids_path = path + cls.IDS_SUFFIX
+        if os.path.exists(path) and os.path.exists(ids_path):
+            with open(ids_path) as ids_file:
+                ids = json.load(ids_file)
+            if ids['skills'] != list(skill_ids):
+                raise ValueError(
+                    'Matrix %s was built for a different set of skills.' % path)
+            student_ids = ids['students']
+        return cls(path, skill_ids, student_ids, default_value)
+
+    def __init__(self, path, skill_ids, student_ids=(), default_value=0.0):
+        self._path = path
+        self._skills = IdInterner(skill_ids)
+        self._students = IdInterner(student_ids)
+        self._default_value = default_value
+        self._data = None
+        if student_ids and os.path.exists(path):
+            capacity = os.path.getsize(path) // (
+                numpy.dtype(self.DTYPE).itemsize * max(len(self._skills), 1))
+            self._data = self._map(capacity, 'r+')
+        else:
+            self._resize(self.INITIAL_CAPACITY)
+
+    def _map(self, capacity, mode, path=None):
+        return numpy.memmap(
+            path or self._path, dtype=self.DTYPE, mode=mode, order='F',
+            shape=(capacity, max(len(self._skills), 1)))
+
+    def _resize(self, capacity):
+        # Column-major layout means rows cannot simply be appended to the
+        # file; copy into a larger file. Doubling keeps this amortized O(1).
+        tmp_path = self._path + '.tmp'
+        data = self._map(capacity, 'w+', path=tmp_path)
+        data[:] = self._default_value
+        num_students = len(self._students)
+        if self._data is not None:
+            data[:num_students] = self._data[:num_students]
+            del self._data
+        data.flush()
+        os.rename(tmp_path, self._path)
+        self._data = self._map(capacity, 'r+')
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def skill_ids(self):
+        return self._skills.ids
+
+    @property
+    def student_ids(self):
+        return self._students.ids
+
+    @property
+    def num_students(self):
+        return len(self._students)
+
+    @property
+    def values(self):
+        """All estimates as a (num_students, num_skills) view."""
+        return self._data[:len(self._students), :len(self._skills)]
+
+    def student_index(self, student_id):
+        return self._students.get(student_id)
+
+    def skill_index(self, skill_id):
+        return self._skills.get(skill_id)
+
+    def _row_for_write(self, student_id):
+        row = self._students.get(student_id)
+        if row is None:
+            if len(self._students) == self._data.shape[0]:
+                self._resize(2 * self._data.shape[0])
+            row = self._students.intern(student_id)
+        return row
+
+    def column(self, skill_id):
+        """Get the estimates of one skill for all students.
+
+        Args:
+            skill_id: str. The id of the skill.
+
+        Returns:
+            numpy.ndarray. A contiguous view with one entry per student, in
+                the order of student_ids.
+        """
+        index = self._skills.get(skill_id)
+        if index is None:
+            raise KeyError(skill_id)
+        return self._data[:len(self._students), index]
+
+    def row(self, student_id):
+        """Get the estimates of one student for all skills.
+
+        Args:
+            student_id: str. The id of the student.
+
+        Returns:
+            numpy.ndarray. A view with one entry per skill, in the order of
+                skill_ids.
+        """
+        index = self._students.get(student_id)
+        if index is None:
+            raise KeyError(student_id)
+        return self._data[index, :len(self._skills)]
+
+    def get(self, student_id, skill_id):
+        row = self._students.get(student_id)
+        column = self._skills.get(skill_id)
+        if row is None or column is None:
+            return self._default_value
+        return float(self._data[row, column])
+
+    def set(self, student_id, skill_id, value):
+        column = self._skills.get(skill_id)
+        if column is None:
+            raise KeyError(skill_id)
+        row = self._row_for_write(student_id)
+        self._data[row, column] = value
+
+    def skills_changed(self, student_id, student_skills, changed):
+        """Write changed estimates into the matrix.
+
+        Has the signature of a SkillsUpdater listener.
+        """
+        row = self._row_for_write(student_id)
+        for skill_id in changed:
+            column = self._skills.get(skill_id)
+            if column is not None:
+                self._data[row, column] = student_skills[skill_id]
+
+    def forget_student(self, student_id):
+        """Reset a student's estimates to the default value.
+
+        The row keeps its index, so the rows of other students do not move.
+        """
+        row = self._students.get(student_id)
+        if row is not None:
+            self._data[row, :] = self._default_value
+
+    def flush(self):
+        """Write the matrix and its interned ids to disk."""
+        self._data.flush()
+        ids_path = self._path + self.IDS_SUFFIX
+        with open(ids_path + '.tmp', 'w') as ids_file:
+            json.dump({'skills': self._skills.ids,
+                       'students': self._students.ids}, ids_file)
+        os.rename(ids_path + '.tmp', ids_path)
+
+    def close(self):
+        self.flush()
+        del self._data
+        self._data = None
@@ -0,0 +1,188 @@
+"""Approximate accounting of the memory held by the handler's structures.
+
+Containers are sized by guessing unless we know what takes the memory. A
+MemoryAccountant walks named structures, e.g. the maps of a course, its
+derived indexes, the student state and the intake queues, and reports for
+each the approximate bytes it keeps resident and the number of objects it is
+made of, with the growth since the previous report.
+
+Sizes are sums of sys.getsizeof over the objects reachable from a structure:
+
+    * Objects reachable from several structures are charged to the first
+      one walked, so the report adds up to the total.
+    * NumPy arrays count their own buffer; memory-mapped matrices count none,
+      since their pages belong to the page cache.
+    * Modules, classes, functions, bound methods, threads, locks and files
+      are not followed, so a structure does not drag in the handler it calls
+      back into.
+    * Containers larger than sample_size are extrapolated from a random
+      sample of their entries, so that reporting on millions of students
+      takes a bounded time. Their figures are estimates.
+"""
+
+import collections
+import functools
+import random
+import sys
+import threading
+import time
+import types
+
+DEFAULT_SAMPLE_SIZE = 1000
+
+# Objects that are not part of the structure referring to them:
+_OPAQUE_TYPES = (type, types.ModuleType, types.FunctionType, types.MethodType,
+                 types.BuiltinFunctionType, functools.partial,
+                 threading.Thread, type(threading.Lock()),
+                 type(threading.RLock()))
+try:
+    _OPAQUE_TYPES += (file,)
+except NameError:
+    import io
+    _OPAQUE_TYPES += (io.IOBase,)
+
+_SEQUENCE_TYPES = (list, tuple, set, frozenset, collections.deque)
+
+
+def _children(obj):
+    """Get the objects directly referred to by obj, as a list."""
+    if isinstance(obj, dict):
+        children = []
+        # list() copies in one step, even while another thread adds entries:
+        for key, value in list(obj.items()):
+            children.append(key)
+            children.append(value)
+        return children
+    if isinstance(obj, _SEQUENCE_TYPES):
+        return list(obj)
+    children = []
+    if hasattr(obj, '__dict__'):
+        children.append(obj.__dict__)
+    for slot in getattr(type(obj), '__slots__', ()):
+        if hasattr(obj, slot):
+            children.append(getattr(obj, slot))
+    return children
+
+
+def deep_size(obj, seen=None, sample_size=DEFAULT_SAMPLE_SIZE, rng=None):
+    """Estimate the bytes and the number of objects reachable from obj.
+
+    Args:
+        obj: object. The root of the structure.
+        seen: dict. Objects already charged elsewhere, by id; updated with
+            the objects charged to obj. Holding the objects rather than their
+            ids keeps them alive, so that the id of a freed temporary cannot
+            be reused by another object, which would then go uncharged.
+        sample_size: int. Containers with more entries are extrapolated from
+            this many.
+        rng: random.Random. Draws the samples.
+
+    Returns:
+        tuple. (bytes, number of objects).
+    """
+    if seen is None:
+        seen = {}
+    if rng is None:
+        rng = random.Random(0)
+    # Without NumPy imported there are no arrays, and no need to import it:
+    numpy = sys.modules.get('numpy')
+    total_bytes = 0
+    total_objects = 0
+    # (object, weight): entries of sampled containers stand for several.
+    stack = [(obj, 1.0)]
+    while stack:
+        current, weight = stack.pop()
+        if id(current) in seen or isinstance(current, _OPAQUE_TYPES):
+            continue
+        seen[id(current)] = current
+        total_bytes += sys.getsizeof(current) * weight
+        total_objects += weight
+        if numpy is not None and isinstance(current, numpy.ndarray):
+            continue
+        children = _children(current)
+        if len(children) > sample_size:
+            child_weight = weight * len(children) / float(sample_size)
+            children = rng.sample(children, sample_size)
+        else:
+            child_weight = weight
+        stack.extend((child, child_weight) for child in children)
+    return int(total_bytes), int(total_objects)
+
+
+class MemoryAccountant(object):
+    """Reports the size of named structures and their growth over time."""
+
+    def __init__(self, sample_size=DEFAULT_SAMPLE_SIZE):
+        """Create an accountant that has not reported yet.
+
+        Args:
+            sample_size: int. See deep_size().
+        """
+        self._sample_size = sample_size
+        # name -> (bytes, objects) of the previous report
+        self._previous = {}
+        self._previous_time = None
+
+    def report(self, structures, now=None):
+        """Size the structures.
+
+        Args:
+            structures: iterable. (name, object, lock) tuples, in the order in
+                which shared objects should be charged. The lock, if not None,
+                is held while the object is walked.
+            now: float. Seconds since the epoch. Defaults to the current time.
+
+        Returns:
+            dict. 'structures', a list of dicts with the 'name', 'bytes',
+                'objects', 'growth_bytes' and 'growth_objects' of each
+                structure, the growth being None on first report; the
+                'total_bytes'; and the 'seconds' since the previous report.
+        """
+        if now is None:
+            now = time.time()
+        seen = {}
+        rng = random.Random(0)
+        rows = []
+        current = {}
+        for name, obj, lock in structures:
+            if lock is not None:
+                with lock:
+                    num_bytes, num_objects = deep_size(
+                        obj, seen, self._sample_size, rng)
+            else:
+                num_bytes, num_objects = deep_size(
+                    obj, seen, self._sample_size, rng)
+            previous = self._previous.get(name)
+            rows.append({
+                'name': name,
+                'bytes': num_bytes,
+                'objects': num_objects,
+                'growth_bytes': (None if previous is None
+                                 else num_bytes - previous[0]),
+                'growth_objects': (None if previous is None
+                                   else num_objects - previous[1]),
+            })
+            current[name] = (num_bytes, num_objects)
+        report = {
+            'time': now,
+            'seconds': (None if self._previous_time is None
+                        else now - self._previous_time),
+            'total_bytes': sum(row['bytes'] for row in rows),
+            'structures': rows,
+        }
+        self._previous = current
+        self._previous_time = now
+        return report
+
+
+def format_report(report):
+    """Render a report as a table, largest structures first."""
+    lines = ['%-60s %14s %12s %14s' % ('Structure', 'bytes', 'objects',
+                                       'growth bytes')]
+    for row in sorted(report['structures'], key=lambda row: -row['bytes']):
+        lines.append('%-60s %14d %12d %14s' % (
+            row['name'], row['bytes'], row['objects'],
+            '-' if row['growth_bytes'] is None
+            else '%+d' % row['growth_bytes']))
+    lines.append('%-60s %14d' % ('total', report['total_bytes']))
+    return '\n'.join(lines)
@@ -0,0 +1,160 @@
+"""Incrementally maintained objective-level mastery aggregates.
+
+Objective mastery is summarized from the estimates of the skills linked to the
+objective in the SkillsMap, using the mean and the minimum skill estimate.
+Skills the student has not exercised yet count with the updater's default
+prior.
+
+Recomputing an objective means scanning all of its skills. Instead, the
+aggregates are kept per student and objective and adjusted whenever a skill
+estimate changes:
+
+    * Only the objectives returned by SkillsMap.get_objectives_for_skill for the
+      changed skill are touched, so an update is O(degree of the skill).
+    * The mean is kept as a running sum, which is adjusted in O(1).
+    * The minimum is kept together with the skill holding it. It only has to
+      be recomputed when that very skill's estimate rises.
+
+Reads of either aggregate are O(1) dictionary lookups.
+"""
+
+from modules.learning_analytics import skills_updater
+
+
+class ObjectiveMasteryAggregates(object):
+    """Per-student mean and minimum skill estimates for each objective."""
+
+    # Indices into the per-objective aggregate lists.
+    _SUM = 0
+    _MIN = 1
+    _MIN_SKILL = 2
+
+    def __init__(self, skills_map,
+                 default_prior=skills_updater.SkillsUpdater.DEFAULT_PRIOR):
+        self._skills_map = skills_map
+        self._default_prior = default_prior
+        # student id -> objective id -> [sum, min, skill id holding min]
+        self._students = {}
+        # objective id -> number of linked skills, precomputed from the map
+        self._num_skills = dict(
+            (objective.id, len(skills_map.get_skills_for_objective(
+                objective.id)))
+            for objective in skills_map.objectives)
+
+    def _compute(self, objective_id, student_skills):
+        total = 0.0
+        min_value = None
+        min_skill = None
+        for skill_id in self._skills_map.get_skills_for_objective(
+                objective_id):
+            value = student_skills.get(skill_id, self._default_prior)
+            total += value
+            if min_value is None or value < min_value:
+                min_value = value
+                min_skill = skill_id
+        return [total, min_value, min_skill]
+
+    def skills_changed(self, student_id, student_skills, changed):
+        """Adjust the aggregates of the objectives linked to changed skills.
+
+        Has the signature of a SkillsUpdater listener.
+
+        Args:
+            student_id: str. The id of the student.
+            student_skills: dict. The student's skill estimates after the
+                change.
+            changed: dict. Skill id to estimate before the change, or None if
+                the skill had not been estimated before.
+        """
+        aggregates = self._students.setdefault(student_id, {})
+        # Objectives first seen in this call; their scan covers all changes.
+        scanned = set()
+        for skill_id, old_value in changed.items():
+            if old_value is None:
+                old_value = self._default_prior
+            new_value = student_skills.get(skill_id, self._default_prior)
+            for objective_id in self._skills_map.get_objectives_for_skill(
+                    skill_id):
+                if objective_id in scanned:
+                    continue
+                entry = aggregates.get(objective_id)
+                if entry is None:
+                    aggregates[objective_id] = self._compute(
+                        objective_id, student_skills)
+                    scanned.add(objective_id)
+                    continue
+                entry[self._SUM] += new_value - old_value
+                if new_value <= entry[self._MIN]:
+                    entry[self._MIN] = new_value
+                    entry[self._MIN_SKILL] = skill_id
+                elif skill_id == entry[self._MIN_SKILL]:
+                    entry[self._MIN], entry[self._MIN_SKILL] = self._compute(
+                        objective_id, student_skills)[self._MIN:]
+
+    def load_student(self, student_id, student_skills):
+        """Rebuild all aggregates of a student from the full skill state.
+
+        Args:
+            student_id: str. The id of the student.
+            student_skills: dict. Skill id to estimate.
+        """
+        self._students[student_id] = dict(
+            (objective_id, self._compute(objective_id, student_skills))
+            for objective_id, num_skills in self._num_skills.items()
+            if num_skills)
+
+    def forget_student(self, student_id):
+        self._students.pop(student_id, None)
+
+    def get_mean(self, student_id, objective_id):
+        """Get the mean estimate of the skills linked to an objective.
+
+        Args:
+            student_id: str. The id of the student.
+            objective_id: str. The id of the objective.
+
+        Returns:
+            float. The mean skill estimate, or None if the objective has no
+                skills.
+        """
+        num_skills = self._num_skills.get(objective_id)
+        if not num_skills:
+            return None
+        entry = self._students.get(student_id, {}).get(objective_id)
+        if entry is None:
+            return self._default_prior
+        return entry[self._SUM] / num_skills
+
+    def get_min(self, student_id, objective_id):
+        """Get the lowest estimate of the skills linked to an objective.
+
+        Args:
+            student_id: str. The id of the student.
+            objective_id: str. The id of the objective.
+
+        Returns:
+            float. The minimum skill estimate, or None if the objective has no
+                skills.
+        """
+        if not self._num_skills.get(objective_id):
+            return None
+        entry = self._students.get(student_id, {}).get(objective_id)
+        if entry is None:
+            return self._default_prior
+        return entry[self._MIN]
+
+    def get_objectives(self, student_id):
+        """Get mean and minimum estimates for all objectives of a student.
+
+        Args:
+            student_id: str. The id of the student.
+
+        Returns:
+            dict. Objective id to a (mean, min) tuple, for all objectives with
+                at least one skill.
+        """
+        return dict(
+            (objective_id, (self.get_mean(student_id, objective_id),
+                            self.get_min(student_id, objective_id)))
+            for objective_id, num_skills in self._num_skills.items()
+            if num_skills)
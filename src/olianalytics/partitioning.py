@@ -0,0 +1,627 @@
+"""Student-partitioned deployment of several handler instances.
+
+A single AnalyticsSchoolbusHandler subscribing to the whole studentAction topic
+cannot scale beyond one machine, and two of them would process every action
+twice. In partitioned mode:
+
+    * Student ids are hashed onto a fixed number K of partitions.
+    * A PartitionRouter subscribes to studentAction and republishes each
+      action on the topic of its student's partition, e.g. studentAction.7,
+      wrapped in an envelope with a per-partition sequence number. Exactly
+      one router runs per deployment.
+    * Every handler instance runs a PartitionCoordinator. The coordinators
+      track each other through heartbeats on a shared coordination topic and
+      assign each partition to one live instance by rendezvous hashing: the
+      instance with the highest hash of (instance id, partition) owns it.
+      Each instance subscribes only to the topics of its partitions.
+
+Rendezvous hashing is consistent: when an instance joins, it takes over only
+the partitions for which it has the highest hash, and when one leaves, only
+its own partitions move. The cached state of the affected students is handed
+off through the coordination topic:
+
+    * A joining instance first asks the others to announce themselves, then
+      subscribes to the partitions it is going to own and buffers their
+      actions before it starts to heartbeat.
+    * Seeing the heartbeat of a new instance, a previous owner unsubscribes
+      from the partitions it loses, finishes its queued actions, exports the
+      state of their students and publishes it with the last sequence number
+      it took from each partition. Large handoffs are split into messages of
+      at most STUDENTS_PER_HANDOFF students; only the last message of a
+      partition carries its sequence number.
+    * The new owner imports the state, drops the buffered actions the previous
+      owner already processed and processes the rest. If no handoff arrives
+      within handoff_timeout it goes ahead without one.
+    * A leaving instance announces its departure, waits for the new owners to
+      subscribe and hands off all its partitions.
+
+An instance whose heartbeats stop is dropped after member_timeout, and the
+others take over its partitions without a handoff. The state of its students
+then starts from scratch unless a shared state backend or checkpoint holds it.
+
+Usage, to run the router for 16 partitions:
+
+    python -m modules.learning_analytics.partitioning --partitions 16
+"""
+
+import argparse
+import json
+import logging
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+PARTITION_CONTROL_TOPIC = 'schoolbusPartitions'
+STUDENTS_PER_HANDOFF = 1000
+
+
+def get_partition(student_id, num_partitions):
+    """Get the partition of a student.
+
+    Args:
+        student_id: str. The id of the student.
+        num_partitions: int. The number K of partitions.
+
+    Returns:
+        int. The partition, in range(K).
+    """
+    student_id = u'%s' % student_id
+    return zlib.crc32(student_id.encode('utf-8')) % num_partitions
+
+
+def partition_topic(base_topic, partition):
+    """Get the topic of a partition, e.g. 'studentAction.7'."""
+    return '%s.%d' % (base_topic, partition)
+
+
+def get_owner(partition, instance_ids):
+    """Assign a partition to one of the given instances.
+
+    The instance with the highest hash of (instance id, partition) wins, so
+    adding or removing an instance moves only the partitions it wins or won.
+
+    Args:
+        partition: int. The partition.
+        instance_ids: iterable. The ids of the live instances.
+
+    Returns:
+        str. The owner's id, or None if there are no instances.
+    """
+    def weight(instance_id):
+        key = u'%s:%d' % (instance_id, partition)
+        return zlib.crc32(key.encode('utf-8')) & 0xffffffff, instance_id
+    instance_ids = list(instance_ids)
+    if not instance_ids:
+        return None
+    return max(instance_ids, key=weight)
+
+
+def _split_courses(courses, size):
+    """Split exported state into parts of at most size entries.
+
+    Args:
+        courses: dict. Exported state as returned by
+            AnalyticsSchoolbusHandler.export_students().
+        size: int. The maximum number of students plus attempt histories
+            per part.
+
+    Yields:
+        dict. Parts in the format of courses; at least one, which may be
+            empty.
+    """
+    part = {}
+    num_entries = 0
+    for course_id, course in sorted(courses.items()):
+        entries = [('students', item) for item in sorted(course['students'].items())]
+        entries.extend(('history', item) for item in course.get('history', ()))
+        for kind, (student_id, value) in entries:
+            if num_entries == size:
+                yield part
+                part = {}
+                num_entries = 0
+            part_course = part.setdefault(course_id, {'students' : {}})
+            if kind == 'students':
+                part_course['students'][student_id] = value
+            else:
+                part_course.setdefault('history', []).append((student_id, value))
+            num_entries += 1
+    yield part
+
+
+def _message_class():
+    # The bus client is only needed to publish on Redis:
+    from redis_bus_python.bus_message import BusMessage
+    return BusMessage
+
+
+class PartitionRouter(object):
+    """Republishes student actions on the topics of their partitions."""
+
+    def __init__(self, bus_adapter, num_partitions,
+                 student_action_topic='studentAction', message_class=None):
+        """Prepare to route; nothing is subscribed until start().
+
+        Args:
+            bus_adapter: BusAdapter. The bus to route on.
+            num_partitions: int. The number K of partitions.
+            student_action_topic: str. The topic on which actions arrive, and
+                the base of the partition topics.
+            message_class: class. Constructor of outgoing messages, taking
+                content and topicName. Defaults to the bus client's
+                BusMessage.
+        """
+        self.bus_adapter = bus_adapter
+        self.num_partitions = num_partitions
+        self.student_action_topic = student_action_topic
+        self.message_class = message_class or _message_class()
+        # Sequence numbers restart with the router, so the epoch tells
+        # them apart from those of an earlier router:
+        self.epoch = time.time()
+        self.sequences = [0] * num_partitions
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.bus_adapter.subscribeToTopic(self.student_action_topic, self.route)
+
+    def stop(self):
+        self.bus_adapter.unsubscribeFromTopic(self.student_action_topic)
+
+    def route(self, bus_message):
+        try:
+            payload = json.loads(bus_message.content)
+            partition = get_partition(
+                payload.get('student_id', None), self.num_partitions)
+        except (ValueError, AttributeError):
+            logger.warning('Cannot route student action: %s', bus_message.content)
+            return
+        with self.lock:
+            self.sequences[partition] += 1
+            envelope = {'seq': [self.epoch, self.sequences[partition]],
+                        'action': payload}
+            self.bus_adapter.publish(self.message_class(
+                content=json.dumps(envelope),
+                topicName=partition_topic(self.student_action_topic, partition)))
+
+
+class _Envelope(object):
+    """Bus message carrying one action unwrapped from a partition envelope."""
+
+    def __init__(self, content, bus_message):
+        self.content = content
+        self.id = getattr(bus_message, 'id', None)
+        self.time = getattr(bus_message, 'time', None)
+
+
+class PartitionCoordinator(object):
+    """Claims partitions for one handler instance and hands students off."""
+
+    # Partition states:
+    PENDING = 'pending'
+    ACTIVE = 'active'
+
+    DEFAULT_HEARTBEAT_INTERVAL = 1.0
+    DEFAULT_MEMBER_TIMEOUT = 5.0
+    DEFAULT_HANDOFF_TIMEOUT = 10.0
+
+    def __init__(self, instance_id, num_partitions, bus_adapter=None,
+                 control_topic=PARTITION_CONTROL_TOPIC, message_class=None,
+                 heartbeat_interval=DEFAULT_HEARTBEAT_INTERVAL,
+                 member_timeout=DEFAULT_MEMBER_TIMEOUT,
+                 handoff_timeout=DEFAULT_HANDOFF_TIMEOUT,
+                 students_per_handoff=STUDENTS_PER_HANDOFF):
+        """Prepare to coordinate; nothing happens until start().
+
+        Args:
+            instance_id: str. Unique id of this instance.
+            num_partitions: int. The number K of partitions, the same for
+                all instances and the router.
+            bus_adapter: BusAdapter. The bus to coordinate on. Defaults to
+                the bus adapter of the handler passed to start().
+            control_topic: str. Topic for membership and handoff messages.
+            message_class: class. Constructor of outgoing messages. Defaults
+                to the bus client's BusMessage.
+            heartbeat_interval: float. Seconds between heartbeats.
+            member_timeout: float. Seconds without heartbeat after which an
+                instance is considered gone.
+            handoff_timeout: float. Seconds to wait for the state of a
+                partition from its previous owner before going ahead
+                without it.
+            students_per_handoff: int. The maximum number of students plus
+                attempt histories per handoff message.
+        """
+        self.instance_id = instance_id
+        self.num_partitions = num_partitions
+        self.bus_adapter = bus_adapter
+        self.control_topic = control_topic
+        self.message_class = message_class
+        self.heartbeat_interval = heartbeat_interval
+        self.member_timeout = member_timeout
+        self.handoff_timeout = handoff_timeout
+        self.students_per_handoff = students_per_handoff
+        self.handler = None
+        # Reentrant, as the bus may deliver on the thread that subscribes:
+        self.lock = threading.RLock()
+        # instance id -> time its last heartbeat arrived, without this one
+        self.members = {}
+        # partition -> PENDING or ACTIVE
+        self.partitions = {}
+        # partition -> last sequence number taken from its topic
+        self.sequences = {}
+        # partition -> (deadline, buffered messages) while PENDING
+        self.pending = {}
+        # partition -> handoff messages that arrived before the partition
+        # was claimed
+        self.early_handoffs = {}
+        self.num_handed_off = 0
+        self.num_taken_over = 0
+        self.joined = False
+        self.stopping = threading.Event()
+        self.heartbeat_thread = None
+
+    def _get_owner(self, partition, members):
+        return get_owner(partition, set(members) | set([self.instance_id]))
+
+    def _publish(self, message):
+        message['instance_id'] = self.instance_id
+        self.bus_adapter.publish(self.message_class(
+            content=json.dumps(message), topicName=self.control_topic))
+
+    def start(self, handler):
+        """Join the instances and claim partitions for a handler.
+
+        Args:
+            handler: AnalyticsSchoolbusHandler. Started except for the
+                subscription to student actions.
+        """
+        self.handler = handler
+        if self.bus_adapter is None:
+            self.bus_adapter = handler.busAdapter
+        if self.message_class is None:
+            self.message_class = _message_class()
+        self.bus_adapter.subscribeToTopic(self.control_topic, self.on_control)
+        # Running instances answer with a heartbeat:
+        self._publish({'type': 'join'})
+        self.stopping.wait(2 * self.heartbeat_interval)
+        with self.lock:
+            others = dict(self.members)
+            # Previous owners hand off once they see the first heartbeat:
+            released = self._rebalance(others, others, handing_off=set(others))
+            self.joined = True
+        self._hand_off(released)
+        self._publish({'type': 'heartbeat'})
+        self.heartbeat_thread = threading.Thread(
+            target=self._heartbeat, name='partition-heartbeat')
+        self.heartbeat_thread.daemon = True
+        self.heartbeat_thread.start()
+        logger.info('Instance %s claimed partitions %s of %d.', self.instance_id,
+                    sorted(self.partitions), self.num_partitions)
+
+    def stop(self):
+        """Hand all partitions to the remaining instances and leave."""
+        self.stopping.set()
+        if self.heartbeat_thread is not None:
+            self.heartbeat_thread.join()
+        self._publish({'type': 'leave'})
+        with self.lock:
+            others = dict(self.members)
+        if others:
+            # Let the new owners subscribe before giving the partitions up:
+            time.sleep(self.heartbeat_interval)
+        with self.lock:
+            released = self._release(set(self.partitions), others)
+        self._hand_off(released)
+        self.bus_adapter.unsubscribeFromTopic(self.control_topic)
+
+    def _heartbeat(self):
+        while not self.stopping.wait(self.heartbeat_interval):
+            self._publish({'type': 'heartbeat'})
+            now = time.time()
+            released = None
+            with self.lock:
+                expired = [instance_id for instance_id, seen in self.members.items()
+                           if now - seen > self.member_timeout]
+                if expired:
+                    logger.warning('Instances %s stopped heartbeating.', expired)
+                    previous = dict(self.members)
+                    for instance_id in expired:
+                        del self.members[instance_id]
+                    released = self._rebalance(previous, self.members, handing_off=set())
+                self._expire_pending(now)
+            self._hand_off(released)
+
+    def on_control(self, bus_message):
+        """Handle a membership or handoff message of any instance."""
+        try:
+            message = json.loads(bus_message.content)
+            kind = message['type']
+            sender = message['instance_id']
+        except (ValueError, KeyError, TypeError):
+            logger.warning('Ignoring malformed partition message: %s', bus_message.content)
+            return
+        if sender == self.instance_id or (
+                self.stopping.is_set() and kind != 'handoff'):
+            return
+        released = None
+        with self.lock:
+            if kind == 'join':
+                if self.joined:
+                    self._publish({'type': 'heartbeat'})
+            elif kind == 'heartbeat':
+                is_new = sender not in self.members
+                previous = dict(self.members)
+                self.members[sender] = time.time()
+                if is_new and self.joined:
+                    logger.info('Instance %s joined.', sender)
+                    released = self._rebalance(previous, self.members, handing_off=set())
+            elif kind == 'leave':
+                if sender in self.members:
+                    logger.info('Instance %s is leaving.', sender)
+                    previous = dict(self.members)
+                    del self.members[sender]
+                    released = self._rebalance(previous, self.members, handing_off=set([sender]))
+            elif kind == 'handoff' and message['to'] == self.instance_id:
+                self._take_over(message)
+        self._hand_off(released)
+
+    def _rebalance(self, previous, members, handing_off):
+        """Claim and release partitions after a membership change.
+
+        The caller holds the lock.
+
+        Args:
+            previous: iterable. Ids of the other instances before the change.
+            members: iterable. Ids of the other instances after the change.
+            handing_off: set. Ids of the instances that will hand off the
+                partitions they owned before the change.
+
+        Returns:
+            object. The released partitions, to pass to _hand_off() once the
+                lock is released.
+        """
+        gained = []
+        lost = set()
+        for partition in range(self.num_partitions):
+            owner = self._get_owner(partition, members)
+            if owner == self.instance_id and partition not in self.partitions:
+                gained.append(partition)
+            elif owner != self.instance_id and partition in self.partitions:
+                lost.add(partition)
+        released = self._release(lost, members)
+        deadline = time.time() + self.handoff_timeout
+        for partition in gained:
+            if self._get_owner(partition, previous) in handing_off:
+                self.partitions[partition] = self.PENDING
+                self.pending[partition] = (deadline, [])
+            else:
+                self.partitions[partition] = self.ACTIVE
+            self.bus_adapter.subscribeToTopic(
+                partition_topic(self.handler.student_action_topic, partition),
+                lambda bus_message, partition=partition: self.on_action(partition, bus_message))
+            for handoff in self.early_handoffs.pop(partition, ()):
+                self._apply_handoff(partition, handoff)
+        return released
+
+    def _release(self, partitions, members):
+        """Stop taking the actions of partitions.
+
+        The caller holds the lock. As actions are queued under the lock, none
+        of these partitions is queued afterwards. Draining the queue and
+        handing off the students is left to _hand_off(), which the caller
+        runs after releasing the lock.
+
+        Args:
+            partitions: set. The partitions to give up.
+            members: iterable. Ids of the other instances, among which the
+                new owners are.
+
+        Returns:
+            object. The released partitions, or None if there are none.
+        """
+        if not partitions:
+            return None
+        handoffs = {}
+        for partition in partitions:
+            self.bus_adapter.unsubscribeFromTopic(
+                partition_topic(self.handler.student_action_topic, partition))
+            owner = get_owner(partition, members)
+            state = self.partitions.pop(partition)
+            _, buffered = self.pending.pop(partition, (None, []))
+            self.early_handoffs.pop(partition, None)
+            handoffs.setdefault(owner, {})[partition] = {
+                'seq'      : self.sequences.pop(partition, None),
+                'courses'  : {},
+                # Actions buffered while waiting for a handoff ourselves:
+                'messages' : [message.content for message in buffered]}
+            if state == self.PENDING:
+                logger.warning('Partition %d moves on before its handoff arrived.', partition)
+            if owner is not None:
+                self.num_handed_off += 1
+        return set(partitions), handoffs
+
+    def _hand_off(self, released):
+        """Finish the queued actions of released partitions and hand them off.
+
+        Runs without the lock, so that the actions of the partitions kept
+        are taken meanwhile.
+
+        Args:
+            released: object. As returned by _release(), or None.
+        """
+        if released is None:
+            return
+        partitions, handoffs = released
+        self.handler.wait_for_intake()
+        courses = self.handler.export_students(
+            lambda student_id: get_partition(student_id, self.num_partitions) in partitions)
+        owners = dict((partition, owner) for owner, owner_partitions in handoffs.items()
+                      for partition in owner_partitions)
+        for course_id, course in courses.items():
+            for student_id, student_skills in course['students'].items():
+                partition = get_partition(student_id, self.num_partitions)
+                handoffs[owners[partition]][partition]['courses'].setdefault(
+                    course_id, {'students' : {}})['students'][student_id] = student_skills
+            for student_id, attempts in course.get('history', ()):
+                partition = get_partition(student_id, self.num_partitions)
+                handoffs[owners[partition]][partition]['courses'].setdefault(
+                    course_id, {'students' : {}}).setdefault('history', []).append(
+                        (student_id, attempts))
+        for owner, owner_partitions in handoffs.items():
+            if owner is None:
+                logger.warning('No instance left to take over partitions %s.',
+                               sorted(owner_partitions))
+                continue
+            message = {}
+            num_entries = 0
+            for partition, handoff in sorted(owner_partitions.items()):
+                parts = list(_split_courses(handoff['courses'], self.students_per_handoff))
+                for part_num, part in enumerate(parts):
+                    if part_num < len(parts) - 1:
+                        part_handoff = {'courses' : part, 'more' : True}
+                    else:
+                        part_handoff = dict(handoff, courses=part)
+                    size = sum(len(course['students']) + len(course.get('history', ()))
+                               for course in part.values())
+                    if message and (partition in message or
+                                    num_entries + size > self.students_per_handoff):
+                        self._publish_handoff(owner, message)
+                        message = {}
+                        num_entries = 0
+                    message[partition] = part_handoff
+                    num_entries += size
+            if message:
+                self._publish_handoff(owner, message)
+        logger.info('Handed off partitions %s.', sorted(partitions))
+
+    def _publish_handoff(self, owner, handoffs):
+        self._publish({'type'       : 'handoff',
+                       'to'         : owner,
+                       'partitions' : dict((str(partition), handoff)
+                                           for partition, handoff in handoffs.items())})
+
+    def _take_over(self, message):
+        """Apply a handoff addressed to this instance; the caller holds the lock."""
+        for partition, handoff in message['partitions'].items():
+            partition = int(partition)
+            if partition in self.partitions:
+                self._apply_handoff(partition, handoff)
+            else:
+                # The sender saw the membership change first:
+                self.early_handoffs.setdefault(partition, []).append(handoff)
+
+    def _apply_handoff(self, partition, handoff):
+        self.handler.import_students(handoff['courses'])
+        if handoff.get('more', False):
+            # The rest of the partition follows in later messages:
+            return
+        self.num_taken_over += 1
+        handed_seq = handoff['seq']
+        if handed_seq is not None:
+            self.sequences[partition] = max(
+                self.sequences.get(partition, handed_seq), handed_seq)
+        # Buffered by the sender, so older than those buffered here:
+        messages = [_Envelope(content, None) for content in handoff['messages']]
+        if self.partitions[partition] == self.PENDING:
+            self.pending[partition][1][:0] = messages
+            self._activate(partition)
+        else:
+            for bus_message in messages:
+                self.on_action(partition, bus_message)
+
+    def _expire_pending(self, now):
+        for partition, (deadline, _) in list(self.pending.items()):
+            if now >= deadline:
+                logger.warning('No handoff of partition %d arrived; going ahead without it.', partition)
+                self._activate(partition)
+
+    def _activate(self, partition):
+        """Process the actions buffered for a pending partition.
+
+        Those the previous owner processed are skipped. The caller holds the
+        lock.
+        """
+        self.partitions[partition] = self.ACTIVE
+        _, buffered = self.pending.pop(partition, (None, []))
+        for bus_message in buffered:
+            self.on_action(partition, bus_message)
+
+    def on_action(self, partition, bus_message):
+        """Take an action from the topic of a partition.
+
+        The action is buffered while the partition waits for a handoff, and
+        dropped if it was processed before. Otherwise it goes to the handler.
+
+        Args:
+            partition: int. The partition.
+            bus_message: object. Message whose content is a router envelope.
+        """
+        with self.lock:
+            state = self.partitions.get(partition, None)
+            if state is None:
+                # Released; the new owner takes it.
+                return
+            if state == self.PENDING:
+                self.pending[partition][1].append(bus_message)
+                return
+            try:
+                envelope = json.loads(bus_message.content)
+                content = json.dumps(envelope['action'])
+                seq = envelope.get('seq', None)
+            except (ValueError, KeyError, TypeError):
+                logger.warning('Ignoring malformed partition message: %s', bus_message.content)
+                return
+            if seq is not None:
+                last = self.sequences.get(partition, None)
+                if last is not None and seq <= last:
+                    return
+                self.sequences[partition] = seq
+            # Queued under the lock, so that none is queued after _release():
+            self.handler.new_student_info(_Envelope(content, bus_message))
+
+    def stats(self):
+        with self.lock:
+            return {'instance_id'    : self.instance_id,
+                    'members'        : sorted(self.members),
+                    'active'         : sorted(partition for partition, state in self.partitions.items()
+                                              if state == self.ACTIVE),
+                    'pending'        : sorted(self.pending),
+                    'num_handed_off' : self.num_handed_off,
+                    'num_taken_over' : self.num_taken_over}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Route student actions to the topics of their partitions.')
+    parser.add_argument('--partitions', type=int, required=True,
+                        help='number of partitions')
+    parser.add_argument('--topic', default='studentAction',
+                        help='topic on which student actions arrive (default: %(default)s)')
+    parser.add_argument('--local-bus', metavar='HOST:PORT',
+                        help='use a LocalBusServer instead of Redis')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.local_bus:
+        from modules.learning_analytics import local_bus
+        bus_adapter = local_bus.LocalBusAdapter(*local_bus.parse_address(args.local_bus))
+        message_class = local_bus.LocalBusMessage
+    else:
+        from redis_bus_python.redis_bus import BusAdapter
+        bus_adapter = BusAdapter()
+        message_class = None
+    router = PartitionRouter(bus_adapter, args.partitions,
+                             student_action_topic=args.topic,
+                             message_class=message_class)
+    router.start()
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        router.stop()
+
+
+if __name__ == '__main__':
+    main()
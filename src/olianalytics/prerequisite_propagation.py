@@ -0,0 +1,137 @@
+"""Prerequisite-aware adjustment of skill estimates.
+
+BKT estimates each skill from the evidence on that skill alone. When the
+SkillsMap declares prerequisites, evidence on one skill also says something
+about its neighbours:
+
+    * A student who masters an advanced skill very likely masters its
+      prerequisites. Support flows down the DAG: a skill's supported estimate
+      is at least down_weight times the best supported estimate among the
+      skills requiring it.
+    * A student who masters all prerequisites of a skill starts that skill
+      ahead. Support flows up the DAG: a skill's estimate is at least
+      up_weight times the lowest supported estimate among its prerequisites.
+
+The adjusted estimate of a skill is the larger of its BKT estimate and both
+supports. The stored BKT estimates are never modified, so the adjustment does
+not compound from one update to the next.
+
+Both supports are dynamic programs over the DAG in the topological order
+precomputed by the SkillsMap. After an update only the skills whose supports
+can change are recomputed: the changed skills and their ancestors for
+downward support, and the changed skills and their descendants for upward
+support. An update thus costs O(affected skills), independent of the size of
+the whole graph.
+"""
+
+from modules.learning_analytics import skills_updater
+
+
+class PrerequisitePropagator(object):
+    """Per-student prerequisite-adjusted skill estimates."""
+
+    DEFAULT_DOWN_WEIGHT = 0.9
+    DEFAULT_UP_WEIGHT = 0.5
+
+    def __init__(self, skills_map, down_weight=DEFAULT_DOWN_WEIGHT,
+                 up_weight=DEFAULT_UP_WEIGHT,
+                 default_prior=skills_updater.SkillsUpdater.DEFAULT_PRIOR):
+        self._skills_map = skills_map
+        self._down_weight = down_weight
+        self._up_weight = up_weight
+        self._default_prior = default_prior
+        # student id -> skill id -> support from dependents, resp. from
+        # prerequisites. Skills without an entry have their BKT estimate.
+        self._down = {}
+        self._up = {}
+
+    def _closure(self, skill_ids, neighbours):
+        reached = set(skill_ids)
+        pending = list(reached)
+        while pending:
+            for neighbour_id in neighbours(pending.pop()):
+                if neighbour_id not in reached:
+                    reached.add(neighbour_id)
+                    pending.append(neighbour_id)
+        return reached
+
+    def _propagate(self, student_id, student_skills, skill_ids):
+        skills_map = self._skills_map
+        down = self._down.setdefault(student_id, {})
+        up = self._up.setdefault(student_id, {})
+
+        def estimate(skill_id):
+            return student_skills.get(skill_id, self._default_prior)
+
+        # Dependents before prerequisites:
+        for skill_id in sorted(
+                self._closure(skill_ids, skills_map.get_prerequisites),
+                key=skills_map.get_topological_index, reverse=True):
+            value = estimate(skill_id)
+            for dependent_id in skills_map.get_dependents(skill_id):
+                value = max(value, self._down_weight * down.get(
+                    dependent_id, estimate(dependent_id)))
+            down[skill_id] = value
+
+        # Prerequisites before dependents:
+        for skill_id in sorted(
+                self._closure(skill_ids, skills_map.get_dependents),
+                key=skills_map.get_topological_index):
+            value = estimate(skill_id)
+            prerequisites = skills_map.get_prerequisites(skill_id)
+            if prerequisites:
+                value = max(value, self._up_weight * min(
+                    up.get(required_id, estimate(required_id))
+                    for required_id in prerequisites))
+            up[skill_id] = value
+
+    def skills_changed(self, student_id, student_skills, changed):
+        """Recompute the supports affected by changed skills.
+
+        Has the signature of a SkillsUpdater listener.
+
+        Args:
+            student_id: str. The id of the student.
+            student_skills: dict. The student's skill estimates after the
+                change.
+            changed: dict. Skill id to estimate before the change.
+        """
+        self._propagate(student_id, student_skills, changed)
+
+    def load_student(self, student_id, student_skills):
+        """Rebuild the supports of a student from the full skill state."""
+        self.forget_student(student_id)
+        self._propagate(student_id, student_skills, [
+            skill_id for skill_id in student_skills
+            if self._skills_map.get_skill_by_id(skill_id) is not None])
+
+    def forget_student(self, student_id):
+        self._down.pop(student_id, None)
+        self._up.pop(student_id, None)
+
+    def get_estimate(self, student_id, skill_id):
+        """Get the prerequisite-adjusted estimate of a skill.
+
+        Args:
+            student_id: str. The id of the student.
+            skill_id: str. The id of the skill.
+
+        Returns:
+            float. The adjusted estimate as of the last update.
+        """
+        value = self._default_prior
+        for supports in (self._down, self._up):
+            value = max(value, supports.get(student_id, {}).get(
+                skill_id, self._default_prior))
+        return value
+
+    def get_estimates(self, student_id):
+        """Get the adjusted estimates of all skills a student has support for.
+
+        Returns:
+            dict. Skill id to adjusted estimate.
+        """
+        skill_ids = set(self._down.get(student_id, ()))
+        skill_ids.update(self._up.get(student_id, ()))
+        return dict((skill_id, self.get_estimate(student_id, skill_id))
+                    for skill_id in skill_ids)
@@ -0,0 +1,214 @@
+"""On-demand profiling of the live SchoolBus handler.
+
+Production slowdowns are hard to reproduce locally, so the handler can profile
+itself while it runs. A ProfileSession covers the next N student actions or the
+next T seconds, whichever ends first, in one of two modes:
+
+    * 'sampling' periodically captures the stacks of the threads that are
+      processing an action. Overhead is low and independent of call depth.
+    * 'deterministic' traces every call and return in the processing threads
+      and charges the elapsed wall time to the exact call stack.
+
+Either mode accumulates a weight per call stack (samples, or microseconds).
+When the session ends it writes two files:
+
+    * <prefix>.collapsed with one "frame;frame;frame weight" line per stack,
+      the input format of flamegraph.pl and speedscope,
+    * <prefix>.txt with the functions of highest self and total weight.
+
+While no session is active the handler only tests one attribute per action.
+"""
+
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+def _frame_label(code):
+    return '%s:%s' % (os.path.basename(code.co_filename), code.co_name)
+
+
+class StackProfile(object):
+    """Weights accumulated per call stack."""
+
+    def __init__(self):
+        self._weights = collections.defaultdict(float)
+        self._lock = threading.Lock()
+
+    def add(self, stack, weight):
+        with self._lock:
+            self._weights[stack] += weight
+
+    def collapsed_lines(self):
+        """Get the profile in collapsed-stack format, heaviest stacks first."""
+        with self._lock:
+            items = sorted(self._weights.items(), key=lambda item: -item[1])
+        return ['%s %d' % (';'.join(stack), round(weight))
+                for stack, weight in items if stack and round(weight) > 0]
+
+    def top_functions(self, limit=25):
+        """Get the frames with the highest self weight.
+
+        Returns:
+            list. (frame label, self weight, total weight) tuples. The total
+                weight counts each stack once even for recursive frames.
+        """
+        self_weights = collections.defaultdict(float)
+        total_weights = collections.defaultdict(float)
+        with self._lock:
+            items = list(self._weights.items())
+        for stack, weight in items:
+            if not stack:
+                continue
+            self_weights[stack[-1]] += weight
+            for label in set(stack):
+                total_weights[label] += weight
+        top = sorted(self_weights.items(), key=lambda item: -item[1])[:limit]
+        return [(label, weight, total_weights[label]) for label, weight in top]
+
+
+class _Tracer(object):
+    """sys.setprofile callback charging wall time to the current stack."""
+
+    def __init__(self, profile):
+        self._profile = profile
+        self._stack = []
+        self._last = time.time()
+
+    def __call__(self, frame, event, arg):
+        now = time.time()
+        self._profile.add(tuple(self._stack), (now - self._last) * 1e6)
+        if event == 'call':
+            self._stack.append(_frame_label(frame.f_code))
+        elif event == 'c_call':
+            self._stack.append(getattr(arg, '__name__', '?') + ' (builtin)')
+        elif self._stack:
+            self._stack.pop()
+        self._last = time.time()
+
+
+class ProfileSession(object):
+    """Profiles a number of student actions or a period of time."""
+
+    SAMPLING = 'sampling'
+    DETERMINISTIC = 'deterministic'
+    MODES = (SAMPLING, DETERMINISTIC)
+
+    DEFAULT_SAMPLE_INTERVAL = 0.005
+
+    def __init__(self, output_prefix, mode=SAMPLING, max_messages=None,
+                 max_seconds=None, sample_interval=DEFAULT_SAMPLE_INTERVAL,
+                 on_finish=None):
+        """Start a session.
+
+        Args:
+            output_prefix: str. Path prefix of the two output files.
+            mode: str. One of MODES.
+            max_messages: int. End after this many actions.
+            max_seconds: float. End after this many seconds.
+            sample_interval: float. Seconds between samples in sampling mode.
+            on_finish: callable. Called with the session once it has ended
+                and its files are written.
+        """
+        assert mode in self.MODES, 'Unknown profiling mode %s' % mode
+        assert max_messages or max_seconds, 'Session needs an end condition'
+        self.output_prefix = output_prefix
+        self.mode = mode
+        self.profile = StackProfile()
+        self.num_messages = 0
+        self._max_messages = max_messages
+        self._sample_interval = sample_interval
+        self._on_finish = on_finish
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+        # Ids of the threads currently processing an action, for sampling:
+        self._active_threads = set()
+        self._started = time.time()
+
+        if mode == self.SAMPLING:
+            self._sampler = threading.Thread(
+                target=self._sample, name='schoolbus-profiler')
+            self._sampler.daemon = True
+            self._sampler.start()
+        if max_seconds is not None:
+            self._timer = threading.Timer(max_seconds, self.finish)
+            self._timer.daemon = True
+            self._timer.start()
+
+    @property
+    def finished(self):
+        return self._finished.is_set()
+
+    def _sample(self):
+        while not self._finished.wait(self._sample_interval):
+            frames = sys._current_frames()
+            with self._lock:
+                thread_ids = list(self._active_threads)
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                if stack:
+                    self.profile.add(tuple(reversed(stack)), 1)
+
+    def run(self, function, *args):
+        """Call function(*args) under the profiler, counting one action."""
+        if self.finished:
+            return function(*args)
+        thread_id = threading.current_thread().ident
+        try:
+            if self.mode == self.DETERMINISTIC:
+                sys.setprofile(_Tracer(self.profile))
+                try:
+                    return function(*args)
+                finally:
+                    sys.setprofile(None)
+            with self._lock:
+                self._active_threads.add(thread_id)
+            try:
+                return function(*args)
+            finally:
+                with self._lock:
+                    self._active_threads.discard(thread_id)
+        finally:
+            with self._lock:
+                self.num_messages += 1
+                done = (self._max_messages is not None and
+                        self.num_messages >= self._max_messages)
+            if done:
+                self.finish()
+
+    def finish(self):
+        """End the session and write its output files, once."""
+        with self._lock:
+            if self._finished.is_set():
+                return
+            self._finished.set()
+        duration = time.time() - self._started
+        unit = 'samples' if self.mode == self.SAMPLING else 'us'
+
+        with open(self.output_prefix + '.collapsed', 'w') as collapsed_file:
+            for line in self.profile.collapsed_lines():
+                collapsed_file.write(line + '\n')
+        with open(self.output_prefix + '.txt', 'w') as summary_file:
+            summary_file.write(
+                '%s profile of %d messages over %.1f s\n\n' % (
+                    self.mode, self.num_messages, duration))
+            summary_file.write('%14s %14s  %s\n' % (
+                'self ' + unit, 'total ' + unit, 'function'))
+            for label, self_weight, total_weight in (
+                    self.profile.top_functions()):
+                summary_file.write('%14d %14d  %s\n' % (
+                    self_weight, total_weight, label))
+        logger.info('Wrote %s profile to %s.{collapsed,txt}',
+                    self.mode, self.output_prefix)
+        if self._on_finish is not None:
+            self._on_finish(self)
@@ -0,0 +1,141 @@
+"""Significance filter for outgoing skill estimate updates.
+
+Most BKT updates move an estimate by a tiny amount, and publishing every one of
+them floods the bus and every subscriber. A PublicationFilter remembers the
+last value published for each (student, skill) and (student, objective) and
+lets a new value through only if
+
+    * it differs from the last published value by at least epsilon,
+    * it lies in a different mastery band, i.e. a band boundary such as the
+      at-risk threshold lies between the two values, or
+    * it differs at all and the last publication is older than max_staleness.
+
+The first value of every pair is always published. Subscribers thus see every
+meaningful change, while traffic drops with the share of small updates.
+
+A suppressed change is kept as pending until a later value is published. A
+student who stops practicing checks no more values, so flush_stale(), called
+periodically, publishes the pending changes whose last publication is older
+than max_staleness; no change stays unpublished for much longer than that.
+"""
+
+import bisect
+
+
+class PublicationFilter(object):
+    """Decides which estimate changes of one course are worth publishing."""
+
+    SKILL = 'skill'
+    OBJECTIVE = 'objective'
+
+    # A value means the reason for publishing.
+    FIRST = 'first'
+    EPSILON = 'epsilon'
+    BAND = 'band'
+    STALE = 'stale'
+
+    DEFAULT_EPSILON = 0.05
+    DEFAULT_BANDS = (0.4, 0.7, 0.95)
+    DEFAULT_MAX_STALENESS = 60 * 60
+
+    def __init__(self, epsilon=DEFAULT_EPSILON, bands=DEFAULT_BANDS,
+                 max_staleness=DEFAULT_MAX_STALENESS):
+        """Create a filter that has published nothing yet.
+
+        Args:
+            epsilon: float. The smallest change published on its own.
+            bands: sequence of float. Band boundaries, e.g. the at-risk and
+                mastery thresholds.
+            max_staleness: float. Seconds after which any change is published.
+        """
+        self._epsilon = epsilon
+        self._bands = sorted(bands)
+        self._max_staleness = max_staleness
+        # student id -> (kind, id) -> (published value, publication time)
+        self._published = {}
+        # student id -> (kind, id) -> suppressed value differing from the
+        # published one
+        self._pending = {}
+        self.num_checked = 0
+        self.num_published = 0
+
+    def _band(self, value):
+        return bisect.bisect_right(self._bands, value)
+
+    def check(self, student_id, kind, item_id, value, now):
+        """Decide whether to publish a new value, recording it if so.
+
+        Args:
+            student_id: str. The id of the student.
+            kind: str. SKILL or OBJECTIVE.
+            item_id: str. The id of the skill or objective.
+            value: float. The new estimate.
+            now: float. Seconds since the epoch.
+
+        Returns:
+            str. The reason for publishing, or None to suppress the value.
+        """
+        self.num_checked += 1
+        last = self._published.get(student_id, {}).get((kind, item_id))
+        if last is None:
+            reason = self.FIRST
+        else:
+            last_value, last_time = last
+            if abs(value - last_value) >= self._epsilon:
+                reason = self.EPSILON
+            elif self._band(value) != self._band(last_value):
+                reason = self.BAND
+            elif (value != last_value and
+                  now - last_time >= self._max_staleness):
+                reason = self.STALE
+            else:
+                self._set_pending(student_id, (kind, item_id),
+                                  None if value == last_value else value)
+                return None
+        self._publish(student_id, (kind, item_id), value, now)
+        return reason
+
+    def _set_pending(self, student_id, key, value):
+        pending = self._pending.get(student_id)
+        if value is not None:
+            if pending is None:
+                pending = self._pending[student_id] = {}
+            pending[key] = value
+        elif pending is not None:
+            pending.pop(key, None)
+            if not pending:
+                del self._pending[student_id]
+
+    def _publish(self, student_id, key, value, now):
+        self._published.setdefault(student_id, {})[key] = (value, now)
+        self._set_pending(student_id, key, None)
+        self.num_published += 1
+
+    def flush_stale(self, now):
+        """Publish the suppressed changes that have become stale.
+
+        Args:
+            now: float. Seconds since the epoch.
+
+        Returns:
+            list. Sorted (student id, kind, item id, value) tuples of the
+                values published, recorded as published at now.
+        """
+        flushed = []
+        for student_id, pending in list(self._pending.items()):
+            published = self._published[student_id]
+            for key, value in list(pending.items()):
+                if now - published[key][1] >= self._max_staleness:
+                    flushed.append((student_id, key[0], key[1], value))
+        flushed.sort()
+        for student_id, kind, item_id, value in flushed:
+            self._publish(student_id, (kind, item_id), value, now)
+        return flushed
+
+    def forget_student(self, student_id):
+        self._published.pop(student_id, None)
+        self._pending.pop(student_id, None)
+
+    def stats(self):
+        return {'num_checked': self.num_checked,
+                'num_published': self.num_published}
@@ -0,0 +1,413 @@
+"""Read-side HTTP API over the mastery state of a running handler.
+
+Dashboards poll for the mastery of students and cohorts. Answering them from
+the bus would put their queries in line with the student actions, so a
+QueryServer answers them over HTTP instead, on its own Tornado IOLoop thread,
+from the in-memory state of an AnalyticsSchoolbusHandler:
+
+    GET /courses/<course>/students/<student>
+        The student's skill estimates with the time of their last update,
+        objective means and minimums and, if the course has prerequisites,
+        the prerequisite-adjusted estimates.
+    GET /courses/<course>/students/<student>/recommendations
+        The k resources (?k=5) whose attempt most increases the student's
+        expected mastery, optionally of one objective (?objective=), leaving
+        out the resources the student attempted with ?unattempted=1.
+    GET /courses/<course>/skills/<skill>
+    GET /courses/<course>/objectives/<objective>
+        The cohort of a skill or objective: number of students, mean, a
+        histogram of the estimates (?bins=10), and the estimate of every
+        student with ?students=1.
+    GET /courses/<course>/at-risk/skills/<skill>
+    GET /courses/<course>/at-risk/objectives/<objective>
+        The students below the at-risk threshold (?threshold= overrides it),
+        or the k weakest students with ?k=, in ascending order of estimate.
+    GET /stats
+        Hits and misses of the response cache.
+
+Course ids contain slashes and must be URL-encoded. Estimates are as of each
+student's last update, like the published ones, so that responses only change
+when the state does.
+
+Every response carries an ETag made of the StateVersions version of what it
+depends on: a student, or a skill's or objective's cohort. A poll with a
+matching If-None-Match gets a 304 without any work, and responses are cached
+by URL and version, so only the first request after an update reads the state
+and takes the course lock that the workers contend for.
+"""
+
+import collections
+import json
+import logging
+import threading
+
+import tornado.httpserver
+import tornado.ioloop
+import tornado.netutil
+import tornado.web
+
+from modules.learning_analytics import state_versions
+
+logger = logging.getLogger(__name__)
+
+KINDS = {'skills': state_versions.StateVersions.SKILL,
+         'objectives': state_versions.StateVersions.OBJECTIVE}
+
+
+class ResponseCache(object):
+    """Least recently used response bodies, by URL and state version."""
+
+    DEFAULT_MAX_ENTRIES = 10000
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self._max_entries = max_entries
+        # URL -> (version, body)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.num_hits = 0
+        self.num_misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, version):
+        """Get the body cached for a URL if it is of the given version.
+
+        Returns:
+            str. The body, or None if none of this version is cached.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] != version:
+                self.num_misses += 1
+                return None
+            self._entries[key] = entry
+            self.num_hits += 1
+            return entry[1]
+
+    def put(self, key, version, body):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (version, body)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries),
+                    'hits': self.num_hits,
+                    'misses': self.num_misses}
+
+
+class QueryService(object):
+    """Answers queries from the state of an AnalyticsSchoolbusHandler.
+
+    The get_* methods return the version of the state they read, taken
+    before or together with the state, so a response is never cached under a
+    newer version than the state it shows.
+    """
+
+    def __init__(self, handler, cache_size=ResponseCache.DEFAULT_MAX_ENTRIES):
+        """Serve the state of a handler.
+
+        Args:
+            handler: AnalyticsSchoolbusHandler. The handler to read from.
+            cache_size: int. The maximum number of cached responses.
+        """
+        self.handler = handler
+        self.cache = ResponseCache(cache_size)
+
+    def get_versions(self, course_id):
+        versions = self.handler.state_versions.get(course_id)
+        if versions is None:
+            raise tornado.web.HTTPError(404, reason='Unknown course')
+        return versions
+
+    def get_student_version(self, course_id, student_id):
+        return self.get_versions(course_id).get_student_version(student_id)
+
+    def get_item_version(self, course_id, kind, item_id):
+        return self.get_versions(course_id).get_item_version(kind, item_id)
+
+    def get_student(self, course_id, student_id):
+        """Get the estimates of a student.
+
+        Returns:
+            tuple. The version and the response dict.
+        """
+        versions = self.get_versions(course_id)
+        updater = self.handler.updaters[course_id]
+        with self.handler.course_locks[course_id]:
+            version = versions.get_student_version(student_id)
+            if student_id not in updater.store:
+                raise tornado.web.HTTPError(404, reason='Unknown student')
+            student_skills = updater.store.get(student_id)
+            timestamps = student_skills.pop(updater.TIMESTAMPS_KEY, {})
+            objectives = self.handler.objective_mastery[course_id].get_objectives(
+                student_id)
+            response = {
+                'course_id': course_id,
+                'student_id': student_id,
+                'skills': dict(
+                    (skill_id, {'estimate': estimate,
+                                'updated': timestamps.get(skill_id)})
+                    for skill_id, estimate in student_skills.items()),
+                'objectives': dict(
+                    (objective_id, {'mean': mean, 'min': minimum})
+                    for objective_id, (mean, minimum) in objectives.items()),
+            }
+            propagator = self.handler.prerequisites.get(course_id)
+            if propagator is not None:
+                response['adjusted'] = propagator.get_estimates(student_id)
+        return version, response
+
+    def get_recommendations(self, course_id, student_id, k=5,
+                            objective_id=None, unattempted=False):
+        """Get the resources to recommend to a student.
+
+        Returns:
+            tuple. The version and the response dict.
+        """
+        version = self.get_student_version(course_id, student_id)
+        recommendations = self.handler.recommend(
+            course_id, student_id, k=k, objective_id=objective_id,
+            exclude_attempted=unattempted)
+        return version, {
+            'course_id': course_id,
+            'student_id': student_id,
+            'objective_id': objective_id,
+            'resources': [[resource_id, gain]
+                          for resource_id, gain in recommendations],
+        }
+
+    def get_cohort(self, course_id, kind, item_id, num_bins=10,
+                   with_students=False):
+        """Get the estimates of all students for a skill or objective.
+
+        Returns:
+            tuple. The version and the response dict.
+        """
+        versions = self.get_versions(course_id)
+        at_risk = self.handler.at_risk[course_id]
+        # The index maintains the aggregates, so the course lock is only
+        # held for a pass over its buckets, unless the students are asked for:
+        with self.handler.course_locks[course_id]:
+            version = versions.get_item_version(kind, item_id)
+            summary = at_risk.summarize(kind, item_id, num_bins)
+            if with_students:
+                cohort = at_risk.get_cohort(kind, item_id)
+        response = {
+            'course_id': course_id,
+            'kind': kind,
+            'id': item_id,
+            'threshold': at_risk.threshold,
+        }
+        response.update(summary)
+        if with_students:
+            response['students'] = cohort
+        return version, response
+
+    def get_at_risk(self, course_id, kind, item_id, threshold=None, k=None):
+        """Get the at-risk or the k weakest students of a skill or objective.
+
+        Returns:
+            tuple. The version and the response dict.
+        """
+        versions = self.get_versions(course_id)
+        at_risk = self.handler.at_risk[course_id]
+        with self.handler.course_locks[course_id]:
+            version = versions.get_item_version(kind, item_id)
+            if k is not None:
+                students = at_risk.weakest(kind, item_id, k)
+            else:
+                students = sorted(
+                    at_risk.students_below(kind, item_id, threshold).items(),
+                    key=lambda item: (item[1], item[0]))
+        response = {
+            'course_id': course_id,
+            'kind': kind,
+            'id': item_id,
+            'students': [[student_id, estimate]
+                         for student_id, estimate in students],
+        }
+        if k is None:
+            response['threshold'] = (at_risk.threshold if threshold is None
+                                     else threshold)
+        return version, response
+
+
+class _QueryHandler(tornado.web.RequestHandler):
+    """Serves cached, versioned JSON responses."""
+
+    def initialize(self, service):
+        self.service = service
+
+    def respond(self, version, compute):
+        """Answer a GET from the cache, or with compute() on a miss.
+
+        Args:
+            version: tuple. The current version of the state answered from.
+            compute: callable returning a (version, response dict) tuple.
+        """
+        self.set_header('Cache-Control', 'no-cache')
+        self._set_version(version)
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+        key = self.request.uri
+        body = self.service.cache.get(key, version)
+        if body is None:
+            version, response = compute()
+            body = json.dumps(response, sort_keys=True)
+            self.service.cache.put(key, version, body)
+            self._set_version(version)
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.write(body)
+
+    def _set_version(self, version):
+        self.set_header('ETag', '"%s"' % '.'.join(
+            str(part) for part in version))
+
+    def get_int_argument(self, name, default=None):
+        value = self.get_argument(name, None)
+        if value is None:
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason='Bad %s' % name)
+
+    def write_error(self, status_code, **kwargs):
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.finish(json.dumps({'error': self._reason}))
+
+
+class StudentHandler(_QueryHandler):
+
+    def get(self, course_id, student_id):
+        self.respond(
+            self.service.get_student_version(course_id, student_id),
+            lambda: self.service.get_student(course_id, student_id))
+
+
+class RecommendationHandler(_QueryHandler):
+
+    def get(self, course_id, student_id):
+        k = self.get_int_argument('k', 5)
+        objective_id = self.get_argument('objective', None)
+        unattempted = self.get_argument('unattempted', '0') not in ('0', '')
+        self.respond(
+            self.service.get_student_version(course_id, student_id),
+            lambda: self.service.get_recommendations(
+                course_id, student_id, k=k, objective_id=objective_id,
+                unattempted=unattempted))
+
+
+class CohortHandler(_QueryHandler):
+
+    def get(self, course_id, kinds, item_id):
+        kind = KINDS[kinds]
+        num_bins = self.get_int_argument('bins', 10)
+        if num_bins < 1:
+            raise tornado.web.HTTPError(400, reason='Bad bins')
+        with_students = self.get_argument('students', '0') not in ('0', '')
+        self.respond(
+            self.service.get_item_version(course_id, kind, item_id),
+            lambda: self.service.get_cohort(
+                course_id, kind, item_id, num_bins=num_bins,
+                with_students=with_students))
+
+
+class AtRiskHandler(_QueryHandler):
+
+    def get(self, course_id, kinds, item_id):
+        kind = KINDS[kinds]
+        k = self.get_int_argument('k')
+        threshold = self.get_argument('threshold', None)
+        if threshold is not None:
+            try:
+                threshold = float(threshold)
+            except ValueError:
+                raise tornado.web.HTTPError(400, reason='Bad threshold')
+        self.respond(
+            self.service.get_item_version(course_id, kind, item_id),
+            lambda: self.service.get_at_risk(
+                course_id, kind, item_id, threshold=threshold, k=k))
+
+
+class StatsHandler(_QueryHandler):
+
+    def get(self):
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.write(json.dumps(self.service.cache.stats(), sort_keys=True))
+
+
+def make_application(service):
+    """Create the Tornado application serving the queries of a service."""
+    kinds = '(%s)' % '|'.join(sorted(KINDS))
+    args = {'service': service}
+    return tornado.web.Application([
+        (r'/courses/([^/]+)/students/([^/]+)', StudentHandler, args),
+        (r'/courses/([^/]+)/students/([^/]+)/recommendations',
+         RecommendationHandler, args),
+        (r'/courses/([^/]+)/%s/([^/]+)' % kinds, CohortHandler, args),
+        (r'/courses/([^/]+)/at-risk/%s/([^/]+)' % kinds, AtRiskHandler, args),
+        (r'/stats', StatsHandler, args),
+    ])
+
+
+class QueryServer(object):
+    """Serves a QueryService over HTTP on a thread of its own."""
+
+    def __init__(self, handler, port, address='127.0.0.1',
+                 cache_size=ResponseCache.DEFAULT_MAX_ENTRIES):
+        """Bind to the port; serving starts with start().
+
+        Args:
+            handler: AnalyticsSchoolbusHandler. The handler to read from.
+            port: int. The port to listen on. 0 picks a free port.
+            address: str. The interface to listen on.
+            cache_size: int. The maximum number of cached responses.
+        """
+        self.service = QueryService(handler, cache_size=cache_size)
+        self._sockets = tornado.netutil.bind_sockets(port, address)
+        self.port = self._sockets[0].getsockname()[1]
+        self._io_loop = None
+        self._server = None
+        self._thread = None
+        self._started = threading.Event()
+
+    def start(self):
+        """Serve on a daemon thread."""
+        self._thread = threading.Thread(target=self._serve,
+                                        name='query-service')
+        self._thread.daemon = True
+        self._thread.start()
+        self._started.wait()
+        logger.info('Serving mastery queries on port %d.', self.port)
+
+    def _serve(self):
+        try:
+            import asyncio
+        except ImportError:
+            # Tornado 4 on Python 2 has loops of its own:
+            self._io_loop = tornado.ioloop.IOLoop()
+            self._io_loop.make_current()
+        else:
+            # Later versions run on asyncio, whose loops are per thread:
+            asyncio.set_event_loop(asyncio.new_event_loop())
+            self._io_loop = tornado.ioloop.IOLoop.current()
+        self._server = tornado.httpserver.HTTPServer(
+            make_application(self.service))
+        self._server.add_sockets(self._sockets)
+        self._started.set()
+        self._io_loop.start()
+        self._server.stop()
+        self._io_loop.close()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._io_loop.add_callback(self._io_loop.stop)
+        self._thread.join()
+        self._thread = None
@@ -0,0 +1,167 @@
+"""Next-best-resource recommendation by expected mastery gain.
+
+The practice problem worth recommending to a student is the one whose attempt
+most increases the student's expected mastery. Under BKT, the expected gain of
+attempting a resource is the sum over its skills of
+
+    E[posterior] - prior
+
+where the expectation is over the result of the attempt (see
+BKTEstimator.get_expected_posteriors). Skills the student already masters
+gain nothing from more practice and are left out of the sum.
+
+Scoring every resource with Python loops per request does not scale to large
+resources maps, so a ResourceGainIndex precomputes the resource x skill
+incidence of a ResourcesMap as CSR arrays:
+
+    indptr: int32, the skills of resource r are indices[indptr[r]:indptr[r+1]]
+    indices: int32, skill column indices
+
+A request then computes the per-skill gains of the student in one vectorized
+step, sums them per resource with a cumulative sum over the CSR rows, and
+selects the top k with a partial sort, so that it costs a few passes over
+NumPy arrays whatever the number of resources.
+"""
+
+import numpy
+
+
+class ResourceGainIndex(object):
+    """Resource x skill incidence of a course, for scoring resources."""
+
+    DEFAULT_MASTERY = 0.95
+
+    def __init__(self, skills_map, resources_map, estimator,
+                 default_prior, mastery=DEFAULT_MASTERY):
+        """Precompute the incidence arrays.
+
+        Args:
+            skills_map: SkillsMap. The skills map of the course.
+            resources_map: ResourcesMap. The resources to recommend from.
+            estimator: BKTEstimator. The estimator the student's estimates
+                are updated with.
+            default_prior: float. The estimate of skills a student has no
+                estimate for.
+            mastery: float. Estimates at or above this value count as
+                mastered and gain nothing.
+        """
+        self._skills_map = skills_map
+        self._estimator = estimator
+        self._default_prior = default_prior
+        self._mastery = mastery
+        self._skill_ids = [skill.id for skill in skills_map.skills]
+        self._skill_index = dict(
+            (skill_id, index) for index, skill_id in enumerate(self._skill_ids))
+
+        resource_ids = []
+        seen = set()
+        indptr = [0]
+        indices = []
+        for resource_id in resources_map.resource_ids:
+            skill_ids = resources_map.get_skills_for_resource(resource_id)
+            if resource_id in seen or not skill_ids:
+                continue
+            seen.add(resource_id)
+            resource_ids.append(resource_id)
+            indices.extend(sorted(
+                self._skill_index[skill_id] for skill_id in skill_ids))
+            indptr.append(len(indices))
+        self._resource_ids = resource_ids
+        self._resource_index = dict(
+            (resource_id, index)
+            for index, resource_id in enumerate(resource_ids))
+        self._indptr = numpy.array(indptr, dtype=numpy.int32)
+        self._indices = numpy.array(indices, dtype=numpy.int32)
+
+    def __len__(self):
+        return len(self._resource_ids)
+
+    @property
+    def resource_ids(self):
+        return self._resource_ids
+
+    def get_state_vector(self, estimates):
+        """Get a student's estimates as a vector over the skills.
+
+        Args:
+            estimates: dict. Skill id to estimate.
+
+        Returns:
+            numpy.ndarray. The estimate of every skill, in column order.
+        """
+        state = numpy.empty(len(self._skill_ids))
+        state.fill(self._default_prior)
+        for skill_id, estimate in estimates.items():
+            index = self._skill_index.get(skill_id)
+            if index is not None:
+                state[index] = estimate
+        return state
+
+    def get_skill_gains(self, state, skill_ids=None):
+        """Get the expected gain of one more attempt at each skill.
+
+        Args:
+            state: numpy.ndarray. As returned by get_state_vector().
+            skill_ids: iterable. If given, only these skills gain.
+
+        Returns:
+            numpy.ndarray. The expected gain of every skill.
+        """
+        gains = self._estimator.get_expected_posteriors(state) - state
+        gains[state >= self._mastery] = 0
+        if skill_ids is not None:
+            mask = numpy.zeros(len(gains), dtype=bool)
+            mask[[self._skill_index[skill_id] for skill_id in skill_ids
+                  if skill_id in self._skill_index]] = True
+            gains[~mask] = 0
+        return gains
+
+    def score(self, state, skill_ids=None):
+        """Get the expected gain of attempting each resource.
+
+        Args:
+            state: numpy.ndarray. As returned by get_state_vector().
+            skill_ids: iterable. If given, only these skills gain.
+
+        Returns:
+            numpy.ndarray. The expected gain of every resource, in the order
+                of resource_ids.
+        """
+        gains = self.get_skill_gains(state, skill_ids=skill_ids)
+        # Sum over the CSR rows as differences of a running total:
+        totals = numpy.concatenate(([0.0], numpy.cumsum(gains[self._indices])))
+        return totals[self._indptr[1:]] - totals[self._indptr[:-1]]
+
+    def recommend(self, estimates, k=5, objective_id=None, exclude=None):
+        """Get the k resources with the highest expected gain.
+
+        Args:
+            estimates: dict. The student's skill id to estimate.
+            k: int. The maximum number of resources to return.
+            objective_id: str. If given, only the skills of this objective
+                count.
+            exclude: iterable. Resource ids not to recommend, e.g. those the
+                student already attempted.
+
+        Returns:
+            list. (resource id, expected gain) tuples in descending order of
+                gain, for resources with some gain only.
+        """
+        skill_ids = None
+        if objective_id is not None:
+            skill_ids = self._skills_map.get_skills_for_objective(objective_id)
+        scores = self.score(self.get_state_vector(estimates), skill_ids)
+        for resource_id in exclude or ():
+            index = self._resource_index.get(resource_id)
+            if index is not None:
+                scores[index] = 0
+        if k <= 0 or not len(scores):
+            return []
+        if k < len(scores):
+            top = numpy.argpartition(-scores, k - 1)[:k]
+        else:
+            top = numpy.arange(len(scores))
+        # In descending order of gain, ties in map order:
+        top = top[numpy.lexsort((top, -scores[top]))]
+        return [(self._resource_ids[index], float(scores[index]))
+                for index in top if scores[index] > 0]
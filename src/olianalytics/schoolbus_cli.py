@@ -0,0 +1,423 @@
+"""Console entry point of the SchoolBus learning analytics module.
+
+Usage, from the Course Builder root:
+
+    python -m modules.learning_analytics.schoolbus_cli \
+        --course HumanitiesSciences/NCP-101/OnGoing skills.xml resources.xml \
+        --checkpoint-dir /var/lib/oli_schoolbus --report-startup
+
+This module only imports the standard library at load time. The bus client,
+NumPy, the XML parser and the state backend are imported when the options in
+effect need them, so that cold starts of autoscaled instances stay short.
+--report-startup breaks the start-up time down by phase, including how many
+modules each phase imported.
+"""
+
+import argparse
+import contextlib
+import functools
+import importlib
+import logging
+import os
+import sys
+import time
+
+
+# State backends by name: (module, class) of the store created per course.
+STATE_BACKENDS = {
+    'memory': ('modules.learning_analytics.skills_updater',
+               'StudentStateStore'),
+    'lru': ('modules.learning_analytics.state_cache', 'StudentStateCache'),
+}
+
+
+class StartupTimer(object):
+    """Records the duration and module imports of start-up phases."""
+
+    def __init__(self):
+        self._start = time.time()
+        self.phases = []
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        num_modules = len(sys.modules)
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phases.append((
+                name, time.time() - start, len(sys.modules) - num_modules))
+
+    def report(self):
+        """Format the recorded phases as a table."""
+        lines = ['%-40s %10s %8s' % ('Start-up phase', 'ms', 'modules')]
+        for name, duration, num_modules in self.phases:
+            lines.append('%-40s %10.1f %8d' % (
+                name, duration * 1000, num_modules))
+        lines.append('%-40s %10.1f %8d' % (
+            'total', (time.time() - self._start) * 1000, len(sys.modules)))
+        return '\n'.join(lines)
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description='Keep BKT skill estimates up to date from SchoolBus '
+                    'student actions.')
+    parser.add_argument(
+        '--course', nargs=3, action='append', default=[],
+        metavar=('COURSE_ID', 'SKILLS_MAP_XML', 'RESOURCES_MAP_XML'),
+        help='course to track, with its skills and resources map files; '
+             'may be repeated')
+    parser.add_argument(
+        '--topic', default='studentAction',
+        help='topic on which student actions arrive (default: %(default)s)')
+    parser.add_argument(
+        '--update-topic', default='skillmapUpdate',
+        help='topic for update notices (default: %(default)s)')
+    parser.add_argument(
+        '--at-risk-topic', default='atRiskAlert',
+        help='topic for at-risk alerts (default: %(default)s)')
+    parser.add_argument(
+        '--analytics-topic', default='courseAnalytics',
+        help='topic for approximate course analytics '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--control-topic', default='schoolbusControl',
+        help='topic on which operator commands arrive '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help='threads processing student actions; 0 processes them on the '
+             'bus thread (default: %(default)s)')
+    parser.add_argument(
+        '--batch-size', type=int, default=100,
+        help='maximum actions a worker takes at a time '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--queue-size', type=int, default=10000,
+        help='capacity of each worker\'s intake queue (default: %(default)s)')
+    parser.add_argument(
+        '--overflow-policy', default='block',
+        choices=['block', 'drop-oldest', 'drop-lowest-priority', 'spill'],
+        help='what to do when an intake queue is full (default: %(default)s)')
+    parser.add_argument(
+        '--spill-dir',
+        help='directory for the disk logs of the spill overflow policy')
+    parser.add_argument(
+        '--stats-interval', type=float, default=60,
+        help='seconds between statistics publications '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--analytics-interval', type=float, default=60,
+        help='seconds between course analytics publications '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--stale-interval', type=float, default=60,
+        help='seconds between publications of suppressed estimate changes '
+             'that became stale (default: %(default)s)')
+    parser.add_argument(
+        '--state-backend', choices=sorted(STATE_BACKENDS), default='memory',
+        help='where student state is kept (default: %(default)s)')
+    parser.add_argument(
+        '--state-cache-bytes', type=int, default=256 * 1024 * 1024,
+        help='RAM budget per course of the lru state backend '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--state-dir',
+        help='directory of the per-course files the lru state backend '
+             'writes evicted and flushed students to; required with it')
+    parser.add_argument(
+        '--state-spill-dir',
+        help='directory for the disk tier of the lru state backend '
+             '(default: the temporary directory)')
+    parser.add_argument(
+        '--publish-epsilon', type=float, default=0.05,
+        help='smallest estimate change published on its own '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--publish-bands', default='0.4,0.7,0.95',
+        help='comma-separated estimate boundaries whose crossing is always '
+             'published (default: %(default)s)')
+    parser.add_argument(
+        '--publish-max-staleness', type=float, default=3600,
+        help='seconds after which any estimate change is published '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--forgetting-half-life', type=float, metavar='DAYS',
+        help='let estimates decay towards zero between practice sessions, '
+             'halving in this many days (default: no forgetting)')
+    parser.add_argument(
+        '--keep-history', action='store_true',
+        help='log student attempts, so that map edits applied with the '
+             'reload_maps control command recompute affected students')
+    parser.add_argument(
+        '--mastery-dir',
+        help='directory for memory-mapped student x skill matrices')
+    parser.add_argument(
+        '--checkpoint-dir',
+        help='directory for warm-start checkpoints')
+    parser.add_argument(
+        '--checkpoint-interval', type=float, default=300,
+        help='seconds between checkpoints (default: %(default)s)')
+    parser.add_argument(
+        '--dedup-bytes', type=int, default=4 * 1024 * 1024,
+        help='memory cap of the duplicate event filter '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--dedup-window', type=float, default=15 * 60,
+        help='seconds for which event fingerprints are remembered '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--partitions', type=int, default=0,
+        help='number of student partitions for running several instances; '
+             'actions are then taken from the partition topics fed by the '
+             'partitioning router, 0 takes the whole topic '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--instance-id',
+        help='unique id of this instance among the partitioned ones '
+             '(default: host name and process id)')
+    parser.add_argument(
+        '--heartbeat-interval', type=float, default=1.0,
+        help='seconds between heartbeats of partitioned instances '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--member-timeout', type=float, default=5.0,
+        help='seconds without heartbeat after which a partitioned instance '
+             'is considered gone (default: %(default)s)')
+    parser.add_argument(
+        '--handoff-timeout', type=float, default=10.0,
+        help='seconds to wait for the student state of a partition taken '
+             'over from another instance (default: %(default)s)')
+    parser.add_argument(
+        '--local-bus', metavar='HOST:PORT',
+        help='use a local_bus server instead of Redis, for local testing')
+    parser.add_argument(
+        '--http-port', type=int,
+        help='serve the read API for dashboards on this port; Tornado is '
+             'only imported with this option')
+    parser.add_argument(
+        '--http-address', default='127.0.0.1',
+        help='interface the read API listens on (default: %(default)s)')
+    parser.add_argument(
+        '--http-cache-size', type=int, default=10000,
+        help='maximum number of responses the read API caches '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--profile-dir',
+        help='directory for the output of profiling sessions '
+             '(default: the temporary directory)')
+    parser.add_argument(
+        '--profile-signal', default='SIGUSR1',
+        help='signal that starts a profiling session, or "none" '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--log-level', default='INFO',
+        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+        help='(default: %(default)s)')
+    parser.add_argument(
+        '--report-startup', action='store_true',
+        help='print a breakdown of start-up time to stderr')
+    parser.add_argument(
+        '--report-memory', action='store_true',
+        help='print the approximate memory taken by each structure after '
+             'start-up, e.g. after restoring a checkpoint, to stderr; a '
+             'running instance publishes the same report on the "memory" '
+             'control command')
+    return parser
+
+
+def load_state_backend(name):
+    """Import the state store class registered under name."""
+    module_name, class_name = STATE_BACKENDS[name]
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def estimator_factory(args):
+    """Get the estimator factory of the handler, or None for the default."""
+    if args.forgetting_half_life is None:
+        return None
+    from modules.learning_analytics import skills_models
+    return functools.partial(
+        skills_models.ForgettingBKTEstimator.get_standard_estimator,
+        half_life=args.forgetting_half_life * 24 * 60 * 60)
+
+
+def parse_course_maps(skills_path, resources_path):
+    """Parse the skills and resources map files of a course.
+
+    Returns:
+        tuple. The SkillsMap and the ResourcesMap.
+    """
+    from modules.learning_analytics import skills_models
+
+    with open(skills_path) as skills_file:
+        skills_map = skills_models.SkillsMap.from_xml(skills_file.read())
+    with open(resources_path) as resources_file:
+        resources_map = skills_models.ResourcesMap.from_xml(
+            resources_file.read(), skills_map=skills_map)
+    return skills_map, resources_map
+
+
+def load_course_maps(courses, defer_before=None):
+    """Parse the skills and resources map files of the given courses.
+
+    Args:
+        courses: list. (course id, skills map path, resources map path)
+            tuples.
+        defer_before: float. If given, the maps of courses whose files are
+            all older than this time in seconds since the epoch are not
+            parsed, but left to a callable, e.g. because a checkpoint
+            written since holds them compiled.
+
+    Returns:
+        dict. Course id to (SkillsMap, ResourcesMap) tuple, or to a callable
+            returning one.
+    """
+    course_maps = {}
+    for course_id, skills_path, resources_path in courses:
+        parse = functools.partial(
+            parse_course_maps, skills_path, resources_path)
+        if defer_before is not None and max(
+                os.path.getmtime(skills_path),
+                os.path.getmtime(resources_path)) < defer_before:
+            course_maps[course_id] = parse
+        else:
+            course_maps[course_id] = parse()
+    return course_maps
+
+
+def build_handler(args, timer):
+    """Create and start the handler described by the parsed arguments."""
+    with timer.phase('import handler'):
+        from modules.learning_analytics import event_dedup
+        from modules.learning_analytics import learning_analytics_schoolbus
+
+    with timer.phase('import state backend (%s)' % args.state_backend):
+        store_class = load_state_backend(args.state_backend)
+        if args.state_backend == 'lru':
+            from modules.learning_analytics import state_cache
+            if not os.path.isdir(args.state_dir):
+                os.makedirs(args.state_dir)
+
+            def make_store(course_id):
+                return store_class(
+                    state_cache.ShelveStateStore(
+                        state_cache.store_path(args.state_dir, course_id)),
+                    max_bytes=args.state_cache_bytes,
+                    spill_dir=args.state_spill_dir)
+        else:
+            def make_store(course_id):
+                return store_class()
+
+    checkpointer = None
+    checkpoint_time = None
+    if args.checkpoint_dir:
+        from modules.learning_analytics import checkpoint
+        checkpointer = checkpoint.Checkpointer(
+            args.checkpoint_dir, interval=args.checkpoint_interval)
+        checkpoint_path = checkpointer.latest_path()
+        if checkpoint_path is not None:
+            checkpoint_time = os.path.getmtime(checkpoint_path)
+
+    with timer.phase('parse course maps'):
+        # Maps unchanged since the newest checkpoint are restored from it:
+        course_maps = load_course_maps(
+            args.course or [], defer_before=checkpoint_time)
+
+    from modules.learning_analytics import publication_filter
+    make_publication_filter = functools.partial(
+        publication_filter.PublicationFilter,
+        epsilon=args.publish_epsilon,
+        bands=[float(band) for band in args.publish_bands.split(',') if band],
+        max_staleness=args.publish_max_staleness)
+
+    bus_adapter = None
+    if args.local_bus:
+        from modules.learning_analytics import local_bus
+        bus_adapter = local_bus.LocalBusAdapter(
+            *local_bus.parse_address(args.local_bus))
+
+    coordinator = None
+    if args.partitions:
+        import socket
+        from modules.learning_analytics import partitioning
+        coordinator = partitioning.PartitionCoordinator(
+            args.instance_id or '%s-%d' % (socket.gethostname(), os.getpid()),
+            args.partitions,
+            heartbeat_interval=args.heartbeat_interval,
+            member_timeout=args.member_timeout,
+            handoff_timeout=args.handoff_timeout)
+
+    with timer.phase('initialize handler'):
+        handler = learning_analytics_schoolbus.AnalyticsSchoolbusHandler(
+            course_maps=course_maps,
+            mastery_dir=args.mastery_dir,
+            deduplicator=event_dedup.EventDeduplicator(
+                max_bytes=args.dedup_bytes, window=args.dedup_window),
+            checkpointer=checkpointer,
+            make_store=make_store,
+            make_publication_filter=make_publication_filter,
+            make_estimator=estimator_factory(args),
+            keep_history=args.keep_history,
+            bus_adapter=bus_adapter,
+            student_action_topic=args.topic,
+            skill_map_update_topic=args.update_topic,
+            at_risk_topic=args.at_risk_topic,
+            control_topic=args.control_topic,
+            analytics_topic=args.analytics_topic,
+            num_workers=args.workers,
+            batch_size=args.batch_size,
+            queue_size=args.queue_size,
+            overflow_policy=args.overflow_policy,
+            spill_dir=args.spill_dir,
+            stats_interval=args.stats_interval,
+            analytics_interval=args.analytics_interval,
+            stale_interval=args.stale_interval,
+            profile_dir=args.profile_dir,
+            coordinator=coordinator)
+
+    with timer.phase('connect to bus'):
+        handler.start()
+    return handler
+
+
+def main(argv=None):
+    timer = StartupTimer()
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    if args.state_backend == 'lru' and not args.state_dir:
+        parser.error('--state-dir is required with the lru state backend')
+    if args.queue_size < 1:
+        parser.error('--queue-size must be at least 1')
+    logging.basicConfig(
+        level=getattr(logging, args.log_level),
+        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    handler = build_handler(args, timer)
+    query_server = None
+    if args.http_port is not None:
+        with timer.phase('start read API'):
+            from modules.learning_analytics import query_service
+            query_server = query_service.QueryServer(
+                handler, args.http_port, address=args.http_address,
+                cache_size=args.http_cache_size)
+            query_server.start()
+    if args.profile_signal.lower() != 'none':
+        import signal
+        handler.install_profile_signal(getattr(signal, args.profile_signal))
+    if args.report_startup:
+        sys.stderr.write(timer.report() + '\n')
+    if args.report_memory:
+        from modules.learning_analytics import memory_report
+        sys.stderr.write(memory_report.format_report(
+            handler.get_memory_report()) + '\n')
+    try:
+        handler.serve_forever()
+    finally:
+        if query_server is not None:
+            query_server.stop()
+
+
+if __name__ == '__main__':
+    main()
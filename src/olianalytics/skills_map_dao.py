@@ -0,0 +1,70 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Datastore access for the skills mapping."""
+
+__author__ = 'John Orr (jorr@google.com)'
+
+from models import models
+
+from google.appengine.ext import db
+
+
+class SkillsMapEntity(models.BaseEntity):
+    """The base entity for storing skills mapping.
+
+    This entity is unique per course.
+    """
+
+    data = db.TextProperty(indexed=False)
+
+
+class SkillsMapDTO(object):
+    """The lightweight data object for the skills mapping data."""
+
+    SKILLS_MAP_XML_KEY = 'skills_map'
+    EMPTY_SKILLS_MAP_XML = """\
+<?xml version="1.0" encoding="UTF-8"?>
+<skills-map>
+    <skills></skills>
+    <objectives></objectives>
+</skills-map>
+"""
+
+
+    def __init__(self, the_id, the_dict):
+        self.id = the_id
+        self.dict = the_dict
+
+    @property
+    def skills_map_xml(self):
+        return self.dict.get(self.SKILLS_MAP_XML_KEY, self.EMPTY_SKILLS_MAP_XML)
+
+
+class SkillsMapDAO(models.BaseJsonDao):
+    """Access object for the skills mapping data."""
+
+    DTO = SkillsMapDTO
+    ENTITY = SkillsMapEntity
+    ENTITY_KEY_TYPE = models.BaseJsonDao.EntityKeyTypeName
+    SINGLETON_NAME = 'skills_map_entity'
+
+    @classmethod
+    def load_or_create(cls):
+        skills_map_dto = cls.load(cls.SINGLETON_NAME)
+        if not skills_map_dto:
+            skills_map_dto = SkillsMapDTO(cls.SINGLETON_NAME, {})
+            cls.save(skills_map_dto)
+        return skills_map_dto
@@ -26,16 +26,31 @@ Resources.
 The skills mapping consists of a many-many mapping between Resources and Skills,
 and a many-many mapping between Skills and Objectives. The mapping between
 Resources and Skills is handled by the ResourcesMap class and the mapping
-between Objectives and Skills is handled by the SkillsMap class.
+between Objectives and Skills is handled by the SkillsMap class. The SkillsMap
+may also hold prerequisites between skills, which must form a DAG.
+
+The classes storing the skills map in the datastore are in skills_map_dao, so
+that processes which only need the object model (e.g., the SchoolBus module) do
+not import the datastore.
 """
 
 __author__ = 'John Orr (jorr@google.com)'
 
-from xml.etree import cElementTree
+_numpy = None
+
 
-from models import models
+def load_numpy():
+    """Get the numpy module, importing it on first use.
 
-from google.appengine.ext import db
+    Callers on the update path need NumPy, but importing this module does not
+    pull it in; after the first call this costs a global lookup rather than an
+    import statement.
+    """
+    global _numpy
+    if _numpy is None:
+        import numpy
+        _numpy = numpy
+    return _numpy
 
 
 class BKTEstimator(object):
@@ -76,6 +91,105 @@ class BKTEstimator(object):
 
         return p + (1 - p) * self._p_learning
 
+    def get_posteriors(self, priors, is_correct):
+        """Compute the posterior probabilities of several skills at once.
+
+        Vectorized form of get_posterior.
+
+        Args:
+            priors: numpy.ndarray. The prior probability estimates.
+            is_correct: numpy.ndarray. Boolean array of the same shape, whether
+                the question was answered correctly for each skill.
+
+        Returns:
+            numpy.ndarray. The posterior probability estimates.
+        """
+        numpy = load_numpy()
+
+        not_priors = 1 - priors
+        p_evidence_known = numpy.where(
+            is_correct, 1 - self._p_slip, self._p_slip)
+        p_evidence_unknown = numpy.where(
+            is_correct, self._p_guess, 1 - self._p_guess)
+        p = priors * p_evidence_known / (
+            priors * p_evidence_known + not_priors * p_evidence_unknown)
+        return p + (1 - p) * self._p_learning
+
+    def get_expected_posteriors(self, priors):
+        """Compute the expected posteriors after one more attempt.
+
+        The expectation is over the result of the attempt, which is correct
+        with probability prior * (1 - p_slip) + (1 - prior) * p_guess.
+
+        Args:
+            priors: numpy.ndarray. The prior probability estimates.
+
+        Returns:
+            numpy.ndarray. The expected posterior probability estimates.
+        """
+        numpy = load_numpy()
+
+        p_correct = priors * (1 - self._p_slip) + (1 - priors) * self._p_guess
+        return (
+            p_correct * self.get_posteriors(
+                priors, numpy.ones(priors.shape, dtype=bool)) +
+            (1 - p_correct) * self.get_posteriors(
+                priors, numpy.zeros(priors.shape, dtype=bool)))
+
+    def get_decayed(self, estimate, elapsed):
+        """Compute the estimate after a period without practice.
+
+        The standard BKT model has no forgetting, so the estimate is unchanged.
+
+        Args:
+            estimate: float. The estimate at the last update.
+            elapsed: float. Seconds since the last update.
+
+        Returns:
+            float. The estimate now, between 0.0 and 1.0.
+        """
+        return estimate
+
+
+class ForgettingBKTEstimator(BKTEstimator):
+    """A BKT estimator whose estimates decay between practice sessions.
+
+    Knowledge decays exponentially towards p_floor with the given half-life.
+    The decay term is in closed form, so it can be applied lazily whenever an
+    estimate is read or next updated, however long the skill sat idle.
+    """
+
+    DEFAULT_HALF_LIFE = 30 * 24 * 60 * 60
+
+    @classmethod
+    def get_standard_estimator(cls, half_life=DEFAULT_HALF_LIFE):
+        return ForgettingBKTEstimator(
+            p_learning=0.1, p_guess=0.3, p_slip=0.2, half_life=half_life)
+
+    def __init__(self, p_learning=0.0, p_guess=0.0, p_slip=0.0,
+                 half_life=DEFAULT_HALF_LIFE, p_floor=0.0):
+        super(ForgettingBKTEstimator, self).__init__(
+            p_learning=p_learning, p_guess=p_guess, p_slip=p_slip)
+        if not half_life > 0:
+            raise ValueError('Half-life must be positive, not %r' % half_life)
+        self._half_life = float(half_life)
+        self._p_floor = p_floor
+
+    def get_decayed(self, estimate, elapsed):
+        """Compute the estimate after a period without practice.
+
+        Args:
+            estimate: float. The estimate at the last update.
+            elapsed: float. Seconds since the last update.
+
+        Returns:
+            float. The decayed estimate, between p_floor and estimate.
+        """
+        if elapsed <= 0 or estimate <= self._p_floor:
+            return estimate
+        return self._p_floor + (estimate - self._p_floor) * 0.5 ** (
+            elapsed / self._half_life)
+
 
 class SkillsMap(object):
     """Class to manage the mappings between skills and objectives."""
@@ -90,6 +204,8 @@ class SkillsMap(object):
         Returns:
             SkillsMap. The skill map as an object model.
 """
+        from xml.etree import cElementTree
+
         skills_map = SkillsMap()
         root = cElementTree.XML(xml_str)
 
@@ -118,6 +234,19 @@ class SkillsMap(object):
                 skills_map._objectives_to_skills_map.setdefault(
                     objective.id, set()).add(skill_id)
 
+        # Optional: <prerequisite skill="multiply" requires="add"/> elements.
+        for prerequisite_elt in root.findall('./prerequisites/prerequisite'):
+            skill_id = prerequisite_elt.get('skill')
+            required_id = prerequisite_elt.get('requires')
+            for id_str in (skill_id, required_id):
+                assert id_str in skills_map._skills_by_id, (
+                    'Prerequisite references unknown skill %s' % id_str)
+            skills_map._prerequisites.setdefault(
+                skill_id, set()).add(required_id)
+            skills_map._dependents.setdefault(
+                required_id, set()).add(skill_id)
+        skills_map._sort_topologically()
+
         return skills_map
 
     def __init__(self):
@@ -127,6 +256,30 @@ class SkillsMap(object):
         self._skills_by_id = {}
         self._skills_to_objectives_map = {}
         self._objectives_to_skills_map = {}
+        self._prerequisites = {}
+        self._dependents = {}
+        self._topological_index = {}
+
+    def _sort_topologically(self):
+        """Order the skills so that prerequisites come before dependents."""
+        num_missing = dict(
+            (skill_id, len(required))
+            for skill_id, required in self._prerequisites.items())
+        ready = [skill.id for skill in reversed(self._skills)
+                 if not num_missing.get(skill.id)]
+        order = []
+        while ready:
+            skill_id = ready.pop()
+            order.append(skill_id)
+            for dependent_id in self._dependents.get(skill_id, ()):
+                num_missing[dependent_id] -= 1
+                if not num_missing[dependent_id]:
+                    ready.append(dependent_id)
+        assert len(order) == len(self._skills), (
+            'Prerequisites of skills %s form a cycle' % sorted(
+                skill_id for skill_id, count in num_missing.items() if count))
+        self._topological_index = dict(
+            (skill_id, index) for index, skill_id in enumerate(order))
 
     def to_xml(self):
         raise NotImplementedError()
@@ -169,6 +322,37 @@ class SkillsMap(object):
         """
         return frozenset(self._skills_to_objectives_map.get(skill_id, []))
 
+    @property
+    def has_prerequisites(self):
+        return bool(self._prerequisites)
+
+    def get_prerequisites(self, skill_id):
+        """Get the skills directly required by a given skill.
+
+        Args:
+            skill_id: str. The id of the skill.
+
+        Returns:
+            set. The id's of the prerequisite skills. May be empty.
+        """
+        return frozenset(self._prerequisites.get(skill_id, []))
+
+    def get_dependents(self, skill_id):
+        """Get the skills that directly require a given skill.
+
+        Args:
+            skill_id: str. The id of the skill.
+
+        Returns:
+            set. The id's of the dependent skills. May be empty.
+        """
+        return frozenset(self._dependents.get(skill_id, []))
+
+    def get_topological_index(self, skill_id):
+        """Get the position of a skill in an order of all skills in which
+        prerequisites precede the skills requiring them. Computed at load."""
+        return self._topological_index[skill_id]
+
 
 class ResourcesMap(object):
     """Class to manage the mappings between skills and resources."""
@@ -186,6 +370,8 @@ class ResourcesMap(object):
         Returns:
             ResourcesMap. The resources map as an object model.
 """
+        from xml.etree import cElementTree
+
         root = cElementTree.XML(xml_str)
 
         # TODO(jorr): Determine what value there is on putting an id field here
@@ -293,51 +479,3 @@ class Skill(object):
     @property
     def description(self):
         return self._description
-
-
-class SkillsMapEntity(models.BaseEntity):
-    """The base entity for storing skills mapping.
-
-    This entity is unique per course.
-    """
-
-    data = db.TextProperty(indexed=False)
-
-
-class SkillsMapDTO(object):
-    """The lightweight data object for the skills mapping data."""
-
-    SKILLS_MAP_XML_KEY = 'skills_map'
-    EMPTY_SKILLS_MAP_XML = """\
-<?xml version="1.0" encoding="UTF-8"?>
-<skills-map>
-    <skills></skills>
-    <objectives></objectives>
-</skills-map>
-"""
-
-
-    def __init__(self, the_id, the_dict):
-        self.id = the_id
-        self.dict = the_dict
-
-    @property
-    def skills_map_xml(self):
-        return self.dict.get(self.SKILLS_MAP_XML_KEY, self.EMPTY_SKILLS_MAP_XML)
-
-
-class SkillsMapDAO(models.BaseJsonDao):
-    """Access object for the skills mapping data."""
-
-    DTO = SkillsMapDTO
-    ENTITY = SkillsMapEntity
-    ENTITY_KEY_TYPE = models.BaseJsonDao.EntityKeyTypeName
-    SINGLETON_NAME = 'skills_map_entity'
-
-    @classmethod
-    def load_or_create(cls):
-        skills_map_dto = cls.load(cls.SINGLETON_NAME)
-        if not skills_map_dto:
-            skills_map_dto = SkillsMapDTO(cls.SINGLETON_NAME, {})
-            cls.save(skills_map_dto)
-        return skills_map_dto
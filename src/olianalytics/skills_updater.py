@@ -0,0 +1,319 @@
+"""Applies Bayesian Knowledge Tracing updates to student skill state.
+
+The SchoolBus module receives student actions of the form
+
+    {'event_type': 'problem_check',
+     'resource_id': u'i4x://HumanitiesSciences/NCP-101/problem/__61',
+     'student_id': 'd4dfbbce6c4e9c8a0e036fb4049c0ba3',
+     'answers': {...},
+     'result': False,
+     'course_id': u'HumanitiesSciences/NCP-101/OnGoing'}
+
+A SkillsUpdater resolves the resource to its skills through the course's
+ResourcesMap, runs the BKT estimator over the student's current estimates and
+writes the new estimates back to a StudentStateStore. The per-student state has
+the same shape as the value of the 'learning-analytics' StudentPropertyEntity:
+a dict mapping skill ids to estimates between 0.0 and 1.0. Next to the
+estimates, under TIMESTAMPS_KEY, it holds the time each skill was last updated.
+
+Estimators that model forgetting are applied lazily: an estimate is decayed
+from its last update time only when it is read through get_estimates or when it
+is next updated. Stored estimates, and the structures fed by listeners, keep
+the value as of the last update, so idle students never need to be touched.
+
+Derived structures (e.g., objective aggregates) register as listeners and are
+told which skills changed by each update, so they never have to rescan a
+student's full state.
+"""
+
+import time
+
+from modules.learning_analytics import skills_models
+
+
+class StudentStateStore(object):
+    """In-memory store of per-student skill estimates."""
+
+    def __init__(self):
+        self._students = {}
+
+    def __contains__(self, student_id):
+        return student_id in self._students
+
+    def __len__(self):
+        return len(self._students)
+
+    @property
+    def student_ids(self):
+        return self._students.keys()
+
+    def items(self):
+        """Get (student id, skill estimates) pairs for all students."""
+        return self._students.items()
+
+    def get(self, student_id):
+        """Get the skill estimates of a student.
+
+        Args:
+            student_id: str. The id of the student.
+
+        Returns:
+            dict. Skill id to estimate. Empty if the student is unknown.
+        """
+        return dict(self._students.get(student_id, {}))
+
+    def put(self, student_id, student_skills):
+        """Replace the skill estimates of a student.
+
+        Args:
+            student_id: str. The id of the student.
+            student_skills: dict. Skill id to estimate.
+        """
+        self._students[student_id] = dict(student_skills)
+
+    def delete(self, student_id):
+        """Remove a student, e.g. after handing it off to another node."""
+        self._students.pop(student_id, None)
+
+
+class SkillsUpdater(object):
+    """Keeps the skill estimates of the students in one course up to date."""
+
+    # Estimate assumed for a skill the student has never exercised.
+    DEFAULT_PRIOR = 0.0
+    # Key of the skill id -> last update time dict in the student state.
+    TIMESTAMPS_KEY = '__updated__'
+
+    def __init__(self, skills_map, resources_map, estimator=None, store=None):
+        self._skills_map = skills_map
+        self._resources_map = resources_map
+        self._estimator = (
+            estimator or skills_models.BKTEstimator.get_standard_estimator())
+        self._store = store if store is not None else StudentStateStore()
+        self._listeners = []
+
+    @property
+    def skills_map(self):
+        return self._skills_map
+
+    @property
+    def resources_map(self):
+        return self._resources_map
+
+    def set_resources_map(self, resources_map):
+        """Resolve future actions through an edited ResourcesMap.
+
+        Estimates already stored are not touched; see replay_skills.
+        """
+        self._resources_map = resources_map
+
+    @property
+    def store(self):
+        return self._store
+
+    @property
+    def estimator(self):
+        return self._estimator
+
+    def add_listener(self, listener):
+        """Register a callable to be told about changed estimates.
+
+        The listener is called once per update as
+
+            listener(student_id, student_skills, changed)
+
+        where student_skills is the student's state after the update and
+        changed maps each updated skill id to its stored estimate before the
+        update (None if the skill had never been estimated). Listeners must
+        not modify student_skills, and should look up skills by id rather than
+        iterate it, since it also holds TIMESTAMPS_KEY.
+
+        Args:
+            listener: callable. The listener.
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def get_estimates(self, student_id, now=None):
+        """Get a student's skill estimates as of now.
+
+        Args:
+            student_id: str. The id of the student.
+            now: float. Seconds since the epoch. Defaults to the current time.
+
+        Returns:
+            dict. Skill id to estimate, decayed by the estimator since each
+                skill's last update.
+        """
+        if now is None:
+            now = time.time()
+        student_skills = self._store.get(student_id)
+        timestamps = student_skills.pop(self.TIMESTAMPS_KEY, {})
+        return dict(
+            (skill_id, self._estimator.get_decayed(
+                estimate, now - timestamps.get(skill_id, now)))
+            for skill_id, estimate in student_skills.items())
+
+    def _get_observations(self, payload):
+        """Resolve every skill touched by a student action.
+
+        Each answer part that the ResourcesMap knows by its own id contributes
+        its skills, scored by the part's entry in the edX correct_map if there
+        is one. Unless every answered part was resolved, the problem's
+        resource_id contributes those of its skills that no resolved part
+        observed, once, scored by the overall result.
+
+        Args:
+            payload: dict. The student action.
+
+        Returns:
+            dict. Skill id to the list of results (bools) observed for it, in
+                part order.
+        """
+        result = bool(payload.get('result'))
+        correct_map = payload.get('correct_map') or {}
+        observations = {}
+        unresolved = False
+        for part_id in sorted(payload.get('answers') or {}):
+            part_skill_ids = self._resources_map.get_skills_for_resource(
+                part_id)
+            if not part_skill_ids:
+                unresolved = True
+                continue
+            part_result = correct_map.get(part_id)
+            if part_result is None:
+                is_correct = result
+            else:
+                is_correct = part_result.get('correctness') == 'correct'
+            for skill_id in part_skill_ids:
+                observations.setdefault(skill_id, []).append(is_correct)
+        if unresolved or not observations:
+            resolved = set(observations)
+            for skill_id in self._resources_map.get_skills_for_resource(
+                    payload.get('resource_id')):
+                if skill_id not in resolved:
+                    observations[skill_id] = [result]
+        return observations
+
+    def update_student(self, student_id, payload, now=None, skill_ids=None):
+        """Apply one student action to the student's skill estimates.
+
+        All skills touched by the action, across all of its answer parts, are
+        updated in a single read and write of the student's state. The BKT
+        posteriors are computed for all skills in one vectorized step; a skill
+        observed by several parts is advanced once per part.
+
+        Args:
+            student_id: str. The id of the student.
+            payload: dict. The student action, holding at least 'resource_id'
+                and 'result', and optionally 'answers' and 'correct_map'.
+            now: float. Seconds since the epoch at which the action happened.
+                Defaults to the current time.
+            skill_ids: set. If given, only these skills are updated.
+
+        Returns:
+            dict. The estimates before the update of the skills that changed,
+                as passed to the listeners. Empty if the action measures no
+                known skills.
+        """
+        numpy = skills_models.load_numpy()
+
+        observations = self._get_observations(payload)
+        if skill_ids is not None:
+            observations = dict(
+                (skill_id, results) for skill_id, results in observations.items()
+                if skill_id in skill_ids)
+        if not observations:
+            return {}
+        if now is None:
+            now = time.time()
+
+        student_skills = self._store.get(student_id)
+        timestamps = dict(student_skills.get(self.TIMESTAMPS_KEY, {}))
+        skill_ids = list(observations)
+        changed = {}
+        priors = numpy.empty(len(skill_ids))
+        for index, skill_id in enumerate(skill_ids):
+            prior = student_skills.get(skill_id)
+            changed[skill_id] = prior
+            if prior is None:
+                prior = self.DEFAULT_PRIOR
+            else:
+                prior = self._estimator.get_decayed(
+                    prior, now - timestamps.get(skill_id, now))
+            priors[index] = prior
+
+        # Round n applies the n-th observation of every skill that has one.
+        num_rounds = max(len(results) for results in observations.values())
+        for round_index in range(num_rounds):
+            if round_index == 0:
+                indices = slice(None)
+                results = [observations[skill_id][0] for skill_id in skill_ids]
+            else:
+                indices = [
+                    index for index, skill_id in enumerate(skill_ids)
+                    if len(observations[skill_id]) > round_index]
+                results = [observations[skill_ids[index]][round_index]
+                           for index in indices]
+            priors[indices] = self._estimator.get_posteriors(
+                priors[indices], numpy.array(results, dtype=bool))
+
+        for index, skill_id in enumerate(skill_ids):
+            student_skills[skill_id] = float(priors[index])
+            timestamps[skill_id] = now
+        student_skills[self.TIMESTAMPS_KEY] = timestamps
+        self._store.put(student_id, student_skills)
+
+        for listener in self._listeners:
+            listener(student_id, student_skills, changed)
+        return changed
+
+    def replay_skills(self, student_id, skill_ids, attempts):
+        """Recompute some skills of a student from the student's history.
+
+        The attempts are replayed through the current maps, considering the
+        given skills only, and the results replace the stored estimates of
+        these skills. A skill that no attempt measures any more goes back to
+        DEFAULT_PRIOR. The listeners are told about the skills that changed.
+
+        Args:
+            student_id: str. The id of the student.
+            skill_ids: set. The skills to recompute.
+            attempts: iterable. (time, payload) pairs in the order in which
+                they were first applied.
+
+        Returns:
+            dict. The estimates before the replay of the skills that changed.
+        """
+        skill_ids = set(skill_ids)
+        scratch = SkillsUpdater(
+            self._skills_map, self._resources_map, estimator=self._estimator)
+        for now, payload in attempts:
+            scratch.update_student(
+                student_id, payload, now=now, skill_ids=skill_ids)
+        replayed = scratch.store.get(student_id)
+        replayed_timestamps = replayed.get(self.TIMESTAMPS_KEY, {})
+
+        student_skills = self._store.get(student_id)
+        timestamps = dict(student_skills.get(self.TIMESTAMPS_KEY, {}))
+        changed = {}
+        for skill_id in skill_ids:
+            old_value = student_skills.get(skill_id)
+            new_value = replayed.get(skill_id, self.DEFAULT_PRIOR)
+            if old_value == new_value or (
+                    old_value is None and skill_id not in replayed):
+                continue
+            changed[skill_id] = old_value
+            student_skills[skill_id] = new_value
+            if skill_id in replayed_timestamps:
+                timestamps[skill_id] = replayed_timestamps[skill_id]
+        if not changed:
+            return changed
+        student_skills[self.TIMESTAMPS_KEY] = timestamps
+        self._store.put(student_id, student_skills)
+
+        for listener in self._listeners:
+            listener(student_id, student_skills, changed)
+        return changed
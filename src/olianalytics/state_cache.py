@@ -0,0 +1,300 @@
+"""Memory-bounded cache of per-student skill state.
+
+Holding every active student's state in RAM does not scale to MOOCs with
+millions of learners, and reading the datastore on every event is too slow. A
+StudentStateCache sits in front of a slower backing store and holds the most
+recently used students within a budget of bytes. It has the interface of
+StudentStateStore, so a SkillsUpdater can use it in place of one.
+
+There are three tiers:
+
+    * RAM, in least-recently-used order, up to max_bytes of estimated size.
+    * A local disk tier (a shelve file). Students evicted from RAM while
+      dirty, i.e. changed since they were last written to the backing store,
+      are spilled here first so that no update is lost to eviction.
+    * The backing store. flush() writes dirty students from RAM and the
+      disk tier to it, and close() flushes before it deletes the disk tier.
+      A ShelveStateStore keeps the students of a course in a local file.
+
+stats() reports the hit ratio, the eviction rate and the resident bytes.
+"""
+
+import collections
+import os
+import re
+import shelve
+import shutil
+import sys
+import tempfile
+import time
+
+
+def estimate_size(student_skills):
+    """Estimate the bytes a student's state occupies in RAM."""
+    size = sys.getsizeof(student_skills)
+    for key, value in student_skills.items():
+        size += sys.getsizeof(key)
+        if isinstance(value, dict):
+            size += estimate_size(value)
+        else:
+            size += sys.getsizeof(value)
+    return size
+
+
+def _shelf_key(student_id):
+    # shelve needs native string keys:
+    if not isinstance(student_id, str):
+        student_id = student_id.encode('utf-8')
+    return student_id
+
+
+def store_path(directory, course_id):
+    """Get the file name of the state store of a course inside directory."""
+    return os.path.join(
+        directory, re.sub(r'[^A-Za-z0-9_.-]', '_', course_id) + '.students')
+
+
+class ShelveStateStore(object):
+    """Student state kept in a shelve file, e.g. behind a StudentStateCache."""
+
+    def __init__(self, path):
+        """Open the store, creating the file if needed.
+
+        Args:
+            path: str. The shelve file, e.g. from store_path().
+        """
+        self._shelf = shelve.open(path, protocol=2)
+
+    def __contains__(self, student_id):
+        return _shelf_key(student_id) in self._shelf
+
+    def __len__(self):
+        return len(self._shelf)
+
+    @property
+    def student_ids(self):
+        return list(self._shelf.keys())
+
+    def items(self):
+        """Get (student id, skill estimates) pairs, reading one at a time."""
+        for key in list(self._shelf.keys()):
+            yield key, self._shelf[key]
+
+    def get(self, student_id):
+        return dict(self._shelf.get(_shelf_key(student_id), {}))
+
+    def put(self, student_id, student_skills):
+        self._shelf[_shelf_key(student_id)] = dict(student_skills)
+
+    def delete(self, student_id):
+        self._shelf.pop(_shelf_key(student_id), None)
+
+    def close(self):
+        self._shelf.close()
+
+
+class StudentStateCache(object):
+    """LRU cache of student state, bounded in bytes, with disk spill."""
+
+    DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+    def __init__(self, backing_store, max_bytes=DEFAULT_MAX_BYTES,
+                 spill_dir=None):
+        """Create an empty cache.
+
+        Args:
+            backing_store: object. Store with the get and put methods of
+                StudentStateStore, and optionally student_ids, items, delete
+                and close, consulted on misses and written by flush().
+                Without one, closing the cache would lose the spilled
+                students. Without student_ids, its students are only counted
+                once they are read.
+            max_bytes: int. Budget for the estimated size of the students
+                held in RAM.
+            spill_dir: str. Directory in which the disk tier is created.
+                Defaults to the system's temporary directory.
+        """
+        if backing_store is None:
+            raise ValueError('A student state cache needs a backing store')
+        self._max_bytes = max_bytes
+        self._backing_store = backing_store
+        # student id -> (state, size, dirty), least recently used first
+        self._resident = collections.OrderedDict()
+        self._resident_bytes = 0
+        self._spill_dir = tempfile.mkdtemp(prefix='students-', dir=spill_dir)
+        self._spilled = shelve.open(
+            os.path.join(self._spill_dir, 'spilled'), protocol=2)
+        # The ids of the students of all tiers, so that counting and listing
+        # them reads no state:
+        self._student_ids = set()
+        if hasattr(backing_store, 'student_ids'):
+            self._student_ids.update(backing_store.student_ids)
+        self._started = self._stats_time = time.time()
+        self._stats_evictions = 0
+        self.num_hits = 0
+        self.num_misses = 0
+        self.num_evictions = 0
+        self.num_spills = 0
+
+    def __contains__(self, student_id):
+        return student_id in self._student_ids
+
+    def __len__(self):
+        return len(self._student_ids)
+
+    @property
+    def resident_bytes(self):
+        return self._resident_bytes
+
+    @property
+    def student_ids(self):
+        return list(self._student_ids)
+
+    def items(self):
+        """Get (student id, skill estimates) pairs for all students.
+
+        Covers all tiers without loading the students into RAM.
+        """
+        seen = set()
+        for student_id, (state, _, _) in list(self._resident.items()):
+            seen.add(student_id)
+            yield student_id, state
+        for key in list(self._spilled.keys()):
+            if key not in seen:
+                seen.add(key)
+                yield key, self._spilled[key]
+        if hasattr(self._backing_store, 'items'):
+            for student_id, state in self._backing_store.items():
+                if student_id not in seen:
+                    yield student_id, state
+
+    def _insert(self, student_id, state, dirty):
+        size = estimate_size(state)
+        self._resident[student_id] = (state, size, dirty)
+        self._resident_bytes += size
+        # Always keep the newest student, even if it exceeds the budget:
+        while self._resident_bytes > self._max_bytes and len(self._resident) > 1:
+            self._evict()
+
+    def _evict(self):
+        student_id, (state, size, dirty) = self._resident.popitem(last=False)
+        self._resident_bytes -= size
+        self.num_evictions += 1
+        if dirty:
+            self._spilled[_shelf_key(student_id)] = state
+            self.num_spills += 1
+
+    def _remove(self, student_id):
+        entry = self._resident.pop(student_id, None)
+        if entry is not None:
+            self._resident_bytes -= entry[1]
+        return entry
+
+    def get(self, student_id):
+        """Get the skill estimates of a student.
+
+        Args:
+            student_id: str. The id of the student.
+
+        Returns:
+            dict. Skill id to estimate. Empty if the student is unknown.
+        """
+        entry = self._remove(student_id)
+        if entry is not None:
+            self.num_hits += 1
+            state, _, dirty = entry
+        else:
+            self.num_misses += 1
+            key = _shelf_key(student_id)
+            if key in self._spilled:
+                # Stays dirty until flushed to the backing store:
+                state, dirty = self._spilled.pop(key), True
+            else:
+                state, dirty = self._backing_store.get(student_id), False
+                if not state:
+                    return {}
+                self._student_ids.add(student_id)
+        self._insert(student_id, state, dirty)
+        return dict(state)
+
+    def peek(self, student_id):
+        """Get the skill estimates of a student like get(), but without
+        making the student the most recently used or counting a lookup,
+        e.g. when writing a checkpoint."""
+        entry = self._resident.get(student_id)
+        if entry is not None:
+            return dict(entry[0])
+        key = _shelf_key(student_id)
+        if key in self._spilled:
+            return dict(self._spilled[key])
+        return dict(self._backing_store.get(student_id) or {})
+
+    def put(self, student_id, student_skills):
+        """Replace the skill estimates of a student.
+
+        Args:
+            student_id: str. The id of the student.
+            student_skills: dict. Skill id to estimate.
+        """
+        self._remove(student_id)
+        self._insert(student_id, dict(student_skills), True)
+        self._student_ids.add(student_id)
+
+    def delete(self, student_id):
+        """Remove a student from every tier, including the backing store
+        if it supports deletion."""
+        self._remove(student_id)
+        self._spilled.pop(_shelf_key(student_id), None)
+        self._student_ids.discard(student_id)
+        if hasattr(self._backing_store, 'delete'):
+            self._backing_store.delete(student_id)
+
+    def flush(self):
+        """Write all dirty students to the backing store."""
+        for student_id, (state, size, dirty) in list(self._resident.items()):
+            if dirty:
+                self._backing_store.put(student_id, state)
+                self._resident[student_id] = (state, size, False)
+        for key in list(self._spilled.keys()):
+            self._backing_store.put(key, self._spilled.pop(key))
+
+    def close(self):
+        """Flush, delete the disk tier and close the backing store."""
+        self.flush()
+        self._spilled.close()
+        shutil.rmtree(self._spill_dir, ignore_errors=True)
+        if hasattr(self._backing_store, 'close'):
+            self._backing_store.close()
+
+    def stats(self, now=None):
+        """Get hit, eviction and size figures of the cache.
+
+        The eviction rate covers the time since the previous call.
+
+        Args:
+            now: float. Seconds since the epoch. Defaults to the current time.
+
+        Returns:
+            dict. The figures.
+        """
+        if now is None:
+            now = time.time()
+        elapsed = now - self._stats_time
+        lookups = self.num_hits + self.num_misses
+        stats = {
+            'hit_ratio': float(self.num_hits) / lookups if lookups else None,
+            'num_hits': self.num_hits,
+            'num_misses': self.num_misses,
+            'num_evictions': self.num_evictions,
+            'evictions_per_second': (
+                (self.num_evictions - self._stats_evictions) / elapsed
+                if elapsed > 0 else 0.0),
+            'num_spills': self.num_spills,
+            'num_resident': len(self._resident),
+            'num_spilled': len(self._spilled),
+            'resident_bytes': self._resident_bytes,
+            'max_bytes': self._max_bytes,
+        }
+        self._stats_time = now
+        self._stats_evictions = self.num_evictions
+        return stats
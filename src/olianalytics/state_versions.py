@@ -0,0 +1,84 @@
+"""Version counters of the in-memory mastery state of a course.
+
+Readers of the state, such as the query service, cache their responses and
+need to know when a cached response went stale without comparing the state
+itself. StateVersions keeps a counter per student, per skill and per
+objective, bumped by a SkillsUpdater listener whenever an update changes them:
+
+    * A student's version changes with any of the student's estimates.
+    * A skill's version changes with the estimate of any student for it, and
+      an objective's version with any of its skills.
+
+Changes that bypass the listeners, such as students handed to another node,
+bump the epoch instead, which is part of every version. The epoch starts at
+the creation time in milliseconds, so versions from before a restart never
+recur.
+"""
+
+import time
+
+
+class StateVersions(object):
+    """Version counters of the students, skills and objectives of a course."""
+
+    SKILL = 'skill'
+    OBJECTIVE = 'objective'
+
+    def __init__(self, skills_map):
+        """Start all counters at zero.
+
+        Args:
+            skills_map: SkillsMap. The skills map of the course.
+        """
+        self._skills_map = skills_map
+        self._epoch = int(time.time() * 1000)
+        self._students = {}
+        self._items = {self.SKILL: {}, self.OBJECTIVE: {}}
+
+    def _bump(self, counters, key):
+        counters[key] = counters.get(key, 0) + 1
+
+    def skills_changed(self, student_id, student_skills, changed):
+        """Bump the student, the changed skills and their objectives.
+
+        Has the signature of a SkillsUpdater listener.
+        """
+        if not changed:
+            return
+        self._bump(self._students, student_id)
+        objective_ids = set()
+        for skill_id in changed:
+            self._bump(self._items[self.SKILL], skill_id)
+            objective_ids.update(
+                self._skills_map.get_objectives_for_skill(skill_id))
+        for objective_id in objective_ids:
+            self._bump(self._items[self.OBJECTIVE], objective_id)
+
+    def invalidate(self):
+        """Make every version change, after a change of unknown extent."""
+        self._epoch += 1
+
+    def forget_student(self, student_id):
+        self._students.pop(student_id, None)
+        # The student left the cohort of every skill and objective:
+        self.invalidate()
+
+    def get_student_version(self, student_id):
+        """Get the version of a student's estimates.
+
+        Returns:
+            tuple. Changes whenever any estimate of the student changes.
+        """
+        return (self._epoch, self._students.get(student_id, 0))
+
+    def get_item_version(self, kind, item_id):
+        """Get the version of a skill's or objective's cohort estimates.
+
+        Args:
+            kind: str. SKILL or OBJECTIVE.
+            item_id: str. The id of the skill or objective.
+
+        Returns:
+            tuple. Changes whenever the estimate of any student changes.
+        """
+        return (self._epoch, self._items[kind].get(item_id, 0))
@@ -0,0 +1,354 @@
+"""Recording and replay of student actions, for reproducible load runs.
+
+Synthetic load lacks the bursts and the skew of real Lagunita traffic. A
+TrafficRecorder subscribes to the student action topic and writes every
+message with its arrival time to a recording, and a TrafficReplayer publishes
+a recording again, on a local bus or Redis:
+
+    * at the original pace (speed 1),
+    * an accelerated multiple of it (e.g. speed 10), or
+    * as fast as possible (speed 0).
+
+A recording is a gzip-compressed file of JSON lines. The first line is a
+header, each further line an [offset, content] pair, offset being the seconds
+since the start of the recording:
+
+    {"format": "schoolbus-recording", "version": 1, "topic": "studentAction",
+     "start": 1479945600.0}
+    [0.0, "{\\"event_type\\": \\"problem_check\\", ...}"]
+    [0.012311, "..."]
+
+Replaying the same recording against two builds compares them on identical
+input. With --measure, the replayer asks the handlers for their statistics
+until they consumed every replayed action, and reports the throughput and
+the drain time, i.e. how long after the last send the handlers caught up.
+Handlers count the actions they drop as duplicates, shed or malformed as
+consumed too, so a measurement completes either way; replay into instances
+that did not see the recording yet to measure actual processing.
+
+Usage, to record for ten minutes, then replay at ten times the pace:
+
+    python -m modules.learning_analytics.traffic_replay record \\
+        --out /tmp/traffic.jsonl.gz --seconds 600
+    python -m modules.learning_analytics.traffic_replay replay \\
+        --in /tmp/traffic.jsonl.gz --speed 10 --local-bus 127.0.0.1:5555 \\
+        --measure
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+FORMAT = 'schoolbus-recording'
+VERSION = 1
+
+STUDENT_ACTION_TOPIC = 'studentAction'
+CONTROL_TOPIC = 'schoolbusControl'
+STATS_TOPIC = 'schoolbusStats'
+
+
+def _message_class():
+    # The bus client is only needed when no other message class is given:
+    from redis_bus_python.bus_message import BusMessage
+    return BusMessage
+
+
+class TrafficRecorder(object):
+    """Writes the messages of a topic to a recording as they arrive."""
+
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self, bus_adapter, path, topic=STUDENT_ACTION_TOPIC):
+        """Prepare to record; nothing is subscribed until start().
+
+        Args:
+            bus_adapter: BusAdapter or LocalBusAdapter. The bus to record.
+            path: str. The recording file to write.
+            topic: str. The topic to record.
+        """
+        self.bus_adapter = bus_adapter
+        self.path = path
+        self.topic = topic
+        self.num_recorded = 0
+        self._file = None
+        self._start = None
+        self._last_flush = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        self._start = self._last_flush = time.time()
+        self._file = gzip.open(self.path, 'wb')
+        self._write({'format': FORMAT, 'version': VERSION,
+                     'topic': self.topic, 'start': self._start})
+        self.bus_adapter.subscribeToTopic(self.topic, self.record)
+        logger.info('Recording topic %s to %s.', self.topic, self.path)
+
+    def _write(self, record):
+        self._file.write((json.dumps(record) + '\n').encode('utf-8'))
+
+    def record(self, bus_message):
+        """Write one message; has the signature of a bus callback."""
+        now = time.time()
+        content = bus_message.content
+        if isinstance(content, bytes):
+            content = content.decode('utf-8')
+        with self._lock:
+            if self._file is None:
+                return
+            self._write([round(now - self._start, 6), content])
+            self.num_recorded += 1
+            # Bounds what a crash loses without flushing every message:
+            if now - self._last_flush >= self.FLUSH_INTERVAL:
+                self._file.flush()
+                self._last_flush = now
+
+    def stop(self):
+        self.bus_adapter.unsubscribeFromTopic(self.topic)
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        logger.info('Recorded %d messages.', self.num_recorded)
+
+
+def read_recording(path):
+    """Read a recording.
+
+    Returns:
+        tuple. The header dict, and a generator of (offset, content) tuples
+            in the order they were recorded.
+
+    Raises:
+        ValueError: The file is not a recording.
+    """
+    recording = gzip.open(path, 'rb')
+    try:
+        header = json.loads(recording.readline().decode('utf-8'))
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or header.get('format') != FORMAT:
+        recording.close()
+        raise ValueError('%s is not a recording' % path)
+
+    def records():
+        with recording:
+            for line in recording:
+                offset, content = json.loads(line.decode('utf-8'))
+                yield offset, content
+
+    return header, records()
+
+
+class TrafficReplayer(object):
+    """Publishes a recording at its original pace or a multiple of it."""
+
+    def __init__(self, bus_adapter, path, speed=1.0, topic=None,
+                 message_class=None):
+        """Prepare to replay.
+
+        Args:
+            bus_adapter: BusAdapter or LocalBusAdapter. The bus to publish on.
+            path: str. The recording to replay.
+            speed: float. Multiple of the original pace; 0 publishes as fast
+                as possible.
+            topic: str. The topic to publish on. Defaults to the recorded one.
+            message_class: class. Constructor of outgoing messages, taking
+                content and topicName keyword arguments. Defaults to the
+                bus client's BusMessage.
+        """
+        if speed < 0:
+            raise ValueError('Speed must not be negative')
+        self.bus_adapter = bus_adapter
+        self.path = path
+        self.speed = speed
+        self.topic = topic
+        self.message_class = message_class or _message_class()
+
+    def run(self, sleep=time.sleep, clock=time.time):
+        """Publish the whole recording.
+
+        Args:
+            sleep: callable. Waits for a number of seconds.
+            clock: callable. Returns the current time in seconds.
+
+        Returns:
+            dict. The number of messages 'sent', the 'seconds' it took, the
+                'recorded_seconds' they spanned when recorded, and the
+                'max_lag', the most seconds a message went out behind
+                schedule.
+        """
+        header, records = read_recording(self.path)
+        topic = self.topic or header['topic']
+        start = clock()
+        num_sent = 0
+        max_lag = 0.0
+        offset = 0.0
+        for offset, content in records:
+            if self.speed:
+                due = start + offset / self.speed
+                now = clock()
+                if due > now:
+                    sleep(due - now)
+                else:
+                    max_lag = max(max_lag, now - due)
+            self.bus_adapter.publish(
+                self.message_class(content=content, topicName=topic))
+            num_sent += 1
+        return {'sent': num_sent,
+                'seconds': clock() - start,
+                'recorded_seconds': offset,
+                'max_lag': max_lag}
+
+
+class ProcessingProbe(object):
+    """Counts the actions the handlers on a bus consumed, from their stats."""
+
+    def __init__(self, bus_adapter, message_class=None,
+                 control_topic=CONTROL_TOPIC, stats_topic=STATS_TOPIC):
+        self.bus_adapter = bus_adapter
+        self.message_class = message_class or _message_class()
+        self.control_topic = control_topic
+        self.stats_topic = stats_topic
+        # instance id -> number of actions consumed
+        self._consumed = {}
+        self._lock = threading.Lock()
+        self.bus_adapter.subscribeToTopic(stats_topic, self._on_stats)
+
+    def _on_stats(self, bus_message):
+        try:
+            stats = json.loads(bus_message.content)
+            num_consumed = stats['position']['num_consumed']
+        except (ValueError, KeyError, TypeError):
+            return
+        instance_id = stats.get('partitions', {}).get('instance_id')
+        with self._lock:
+            self._consumed[instance_id] = num_consumed
+
+    def get_consumed(self, wait=0.5):
+        """Ask the handlers for their stats.
+
+        Returns:
+            int. The actions consumed by all handlers that answered within
+                wait seconds, whether processed or dropped.
+        """
+        self.bus_adapter.publish(self.message_class(
+            content=json.dumps({'command': 'stats'}),
+            topicName=self.control_topic))
+        time.sleep(wait)
+        with self._lock:
+            return sum(self._consumed.values())
+
+    def wait_for(self, num_consumed, timeout=600, wait=0.5):
+        """Poll until the handlers consumed num_consumed actions.
+
+        Returns:
+            bool. Whether they did before timeout seconds.
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.get_consumed(wait) >= num_consumed:
+                return True
+        return False
+
+    def close(self):
+        self.bus_adapter.unsubscribeFromTopic(self.stats_topic)
+
+
+def replay_and_measure(replayer, probe, timeout=600):
+    """Replay a recording and time its processing by the handlers.
+
+    Returns:
+        dict. The figures of TrafficReplayer.run(), with the
+            'processed_seconds' from the start of the replay until the
+            handlers consumed every sent action, the 'drain_seconds' of
+            these after the last send, and the 'throughput' in actions per
+            second; the latter are None if the handlers did not catch up
+            within timeout seconds.
+    """
+    baseline = probe.get_consumed()
+    start = time.time()
+    result = replayer.run()
+    sent = time.time()
+    done = probe.wait_for(baseline + result['sent'], timeout=timeout, wait=0.1)
+    finished = time.time()
+    processed_seconds = finished - start if done else None
+    result.update({
+        'processed_seconds': processed_seconds,
+        'drain_seconds': finished - sent if done else None,
+        'throughput': (result['sent'] / processed_seconds
+                       if processed_seconds else None),
+    })
+    return result
+
+
+def _connect(args):
+    if args.local_bus:
+        from modules.learning_analytics import local_bus
+        return (local_bus.LocalBusAdapter(
+            *local_bus.parse_address(args.local_bus)),
+            local_bus.LocalBusMessage)
+    from redis_bus_python.redis_bus import BusAdapter
+    return BusAdapter(), None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Record student actions from the bus, or replay them.')
+    parser.add_argument('--local-bus', metavar='HOST:PORT',
+                        help='use a LocalBusServer instead of Redis')
+    subparsers = parser.add_subparsers(dest='command')
+    record = subparsers.add_parser('record', help='record a topic')
+    record.add_argument('--out', required=True, help='recording to write')
+    record.add_argument('--topic', default=STUDENT_ACTION_TOPIC,
+                        help='(default: %(default)s)')
+    record.add_argument('--seconds', type=float,
+                        help='stop after this long (default: on Ctrl-C)')
+    replay = subparsers.add_parser('replay', help='replay a recording')
+    replay.add_argument('--in', dest='path', required=True,
+                        help='recording to replay')
+    replay.add_argument('--topic',
+                        help='topic to publish on (default: the recorded one)')
+    replay.add_argument('--speed', type=float, default=1.0,
+                        help='multiple of the recorded pace, 0 for as fast as '
+                             'possible (default: %(default)s)')
+    replay.add_argument('--measure', action='store_true',
+                        help='wait for the handlers to process the actions '
+                             'and report the throughput')
+    replay.add_argument('--timeout', type=float, default=600,
+                        help='seconds to wait for the handlers with --measure '
+                             '(default: %(default)s)')
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.error('a command is required')
+    logging.basicConfig(level=logging.INFO)
+
+    bus_adapter, message_class = _connect(args)
+    if args.command == 'record':
+        recorder = TrafficRecorder(bus_adapter, args.out, topic=args.topic)
+        recorder.start()
+        try:
+            time.sleep(args.seconds if args.seconds is not None else 1e9)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            recorder.stop()
+        return
+
+    replayer = TrafficReplayer(bus_adapter, args.path, speed=args.speed,
+                               topic=args.topic, message_class=message_class)
+    if args.measure:
+        probe = ProcessingProbe(bus_adapter, message_class=message_class)
+        result = replay_and_measure(replayer, probe, timeout=args.timeout)
+        probe.close()
+    else:
+        result = replayer.run()
+    print(json.dumps(result, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""Tests for the at-risk student index."""
+
+import random
+import unittest
+
+from modules.learning_analytics import at_risk_index
+from modules.learning_analytics import objective_mastery
+from modules.learning_analytics import skills_updater
+from tests.ext.learning_analytics import skills_updater_tests
+
+
+class MasteryBucketsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.buckets = at_risk_index.MasteryBuckets(10)
+        rnd = random.Random(3)
+        self.values = dict(('s%d' % n, rnd.random()) for n in range(300))
+        for student_id, value in self.values.items():
+            self.buckets.set(student_id, value)
+
+    def test_below_matches_scan(self):
+        for threshold in [0.0, 0.05, 0.33, 0.5, 0.999, 1.0]:
+            self.assertEquals(
+                dict((student_id, value) for student_id, value
+                     in self.values.items() if value < threshold),
+                self.buckets.below(threshold))
+
+    def test_lowest_matches_sort(self):
+        ordered = sorted(self.values.items(), key=lambda item: item[1])
+        for k in [0, 1, 7, 299, 300, 400]:
+            self.assertEquals(ordered[:k], self.buckets.lowest(k))
+
+    def test_set_moves_student(self):
+        self.buckets.set('s0', 0.0)
+        self.assertEquals(('s0', 0.0), self.buckets.lowest(1)[0])
+        self.buckets.set('s0', 1.0)
+        self.assertNotIn('s0', self.buckets.below(0.99))
+        self.assertEquals(300, len(self.buckets))
+
+    def test_histogram_matches_scan(self):
+        expected = [0] * 5
+        for value in self.values.values():
+            expected[min(int(value * 5), 4)] += 1
+        self.assertEquals(expected, self.buckets.histogram(5))
+        self.assertEquals(self.values, self.buckets.values())
+
+    def test_remove(self):
+        self.buckets.remove('s0')
+        self.assertNotIn('s0', self.buckets)
+        self.assertNotIn('s0', self.buckets.below(1.0))
+        self.assertAlmostEqual(
+            sum(self.values.values()) - self.values['s0'], self.buckets.total)
+
+    def test_count_below_matches_below(self):
+        for threshold in [0.0, 0.05, 0.33, 0.5, 0.999, 1.0]:
+            self.assertEquals(len(self.buckets.below(threshold)),
+                              self.buckets.count_below(threshold))
+
+
+class AtRiskIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        skills_map, resources_map = skills_updater_tests.make_maps()
+        self.updater = skills_updater.SkillsUpdater(skills_map, resources_map)
+        aggregates = objective_mastery.ObjectiveMasteryAggregates(skills_map)
+        self.crossings = []
+        self.index = at_risk_index.AtRiskIndex(
+            skills_map, aggregates, threshold=0.25,
+            on_crossing=self.crossings.append)
+        self.updater.add_listener(aggregates.skills_changed)
+        self.updater.add_listener(self.index.skills_changed)
+
+    def _answer(self, student_id, resource_id, result):
+        self.updater.update_student(
+            student_id, {'resource_id': resource_id, 'result': result})
+
+    def test_students_below_threshold(self):
+        self._answer('strong', 'q_add', True)
+        self._answer('strong', 'q_add', True)
+        self._answer('weak', 'q_add', False)
+        self.assertEquals(
+            ['weak'], list(self.index.students_below(
+                at_risk_index.AtRiskIndex.SKILL, 'add')))
+        self.assertEquals(
+            set(['strong', 'weak']), set(self.index.students_below(
+                at_risk_index.AtRiskIndex.OBJECTIVE, 'all').keys()))
+
+    def test_weakest_students_of_objective(self):
+        for _ in range(3):
+            self._answer('a', 'q_mixed', True)
+        self._answer('b', 'q_mixed', False)
+        self._answer('c', 'q_add', True)
+        weakest = self.index.weakest(
+            at_risk_index.AtRiskIndex.OBJECTIVE, 'all', 2)
+        self.assertEquals(['c', 'b'], [student for student, _ in weakest])
+
+    def test_summary_matches_cohort(self):
+        self._answer('strong', 'q_add', True)
+        self._answer('strong', 'q_add', True)
+        self._answer('weak', 'q_add', False)
+        self._answer('weak', 'q_add', False)
+        cohort = self.index.get_cohort(at_risk_index.AtRiskIndex.SKILL, 'add')
+        summary = self.index.summarize(
+            at_risk_index.AtRiskIndex.SKILL, 'add', num_bins=5)
+        self.assertEquals(2, summary['num_students'])
+        self.assertAlmostEqual(sum(cohort.values()) / 2, summary['mean'])
+        self.assertEquals(
+            self.index.histogram(at_risk_index.AtRiskIndex.SKILL, 'add', 5),
+            summary['histogram'])
+        self.assertEquals(1, summary['num_at_risk'])
+        self.assertEquals(
+            {'num_students': 0, 'mean': None, 'histogram': [0, 0],
+             'num_at_risk': 0},
+            self.index.summarize(
+                at_risk_index.AtRiskIndex.SKILL, 'bad_id', num_bins=2))
+
+    def test_unknown_items_are_empty(self):
+        self.assertEquals({}, self.index.students_below(
+            at_risk_index.AtRiskIndex.SKILL, 'bad_id'))
+        self.assertEquals([], self.index.weakest(
+            at_risk_index.AtRiskIndex.OBJECTIVE, 'bad_id', 3))
+
+    def test_crossings_are_reported(self):
+        self._answer('student', 'q_add', True)
+        self.assertEquals([], self.crossings)
+        self._answer('student', 'q_add', True)
+        self.assertEquals(
+            [('skill', 'add', 'above')],
+            [(c['kind'], c['id'], c['direction']) for c in self.crossings])
+        del self.crossings[:]
+        self._answer('student', 'q_add', False)
+        self.assertEquals(
+            [('skill', 'add', 'below')],
+            [(c['kind'], c['id'], c['direction']) for c in self.crossings])
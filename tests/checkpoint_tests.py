@@ -0,0 +1,122 @@
+"""Tests for checkpoints of the SchoolBus module."""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from modules.learning_analytics import checkpoint
+from tests.ext.learning_analytics import skills_updater_tests
+
+
+class CheckpointerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.checkpointer = checkpoint.Checkpointer(
+            os.path.join(self.tmp_dir, 'checkpoints'), interval=60, keep=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_no_snapshot_loads_none(self):
+        self.assertIsNone(self.checkpointer.load_latest())
+
+    def test_loads_latest_snapshot(self):
+        self.checkpointer.save({'n': 1}, now=100)
+        self.checkpointer.save({'n': 2}, now=200)
+        self.assertEquals({'n': 2}, self.checkpointer.load_latest())
+
+    def test_keeps_newest_snapshots_only(self):
+        for n in range(5):
+            self.checkpointer.save({'n': n}, now=100 + n)
+        self.assertEquals(
+            2, len(os.listdir(self.checkpointer.directory)))
+
+    def test_maybe_save_respects_interval(self):
+        self.checkpointer.save({'n': 1}, now=100)
+        self.assertIsNone(
+            self.checkpointer.maybe_save(lambda: {'n': 2}, now=130))
+        self.assertIsNotNone(
+            self.checkpointer.maybe_save(lambda: {'n': 3}, now=160))
+        self.assertEquals({'n': 3}, self.checkpointer.load_latest())
+
+    def test_streams_students_of_courses(self):
+        students = (('s%04d' % n, {'add': 0.5})
+                    for n in range(checkpoint.STUDENTS_PER_RECORD + 1))
+        path = self.checkpointer.save({
+            'courses': {'course': {'students': students, 'history': []}},
+            'position': {'id': 'm1'}})
+        header, records = checkpoint.read_snapshot(path)
+        self.assertEquals(
+            {'courses': {'course': {'history': []}}, 'position': {'id': 'm1'}},
+            header)
+        records = list(records)
+        self.assertEquals(checkpoint.STUDENTS_PER_RECORD + 1, len(records))
+        self.assertEquals(('course', 's0000', {'add': 0.5}), records[0])
+        snapshot = self.checkpointer.load_latest()
+        self.assertEquals(
+            checkpoint.STUDENTS_PER_RECORD + 1,
+            len(snapshot['courses']['course']['students']))
+
+    def test_falls_back_to_previous_snapshot_if_truncated(self):
+        self.checkpointer.save({'n': 1}, now=100)
+        path = self.checkpointer.save({'n': 2}, now=200)
+        with open(path, 'rb') as snapshot_file:
+            content = snapshot_file.read()
+        with open(path, 'wb') as snapshot_file:
+            snapshot_file.write(content[:-5])
+        self.assertRaises(ValueError, checkpoint.read_snapshot, path)
+        self.assertEquals({'n': 1}, self.checkpointer.load_latest())
+
+    def test_rejects_snapshots_of_other_versions(self):
+        path = self.checkpointer.save({'n': 1}, now=100)
+        version = checkpoint.VERSION
+        checkpoint.VERSION = version + 1
+        try:
+            self.assertRaises(ValueError, checkpoint.read_snapshot, path)
+            self.assertEquals((None, None), self.checkpointer.read_latest())
+        finally:
+            checkpoint.VERSION = version
+
+    def test_concurrent_callers_save_once(self):
+        self.checkpointer.save({'n': 1}, now=100)
+        snapshots = []
+
+        def make_snapshot():
+            snapshots.append(True)
+            return {'n': 2}
+        threads = [threading.Thread(target=self.checkpointer.maybe_save,
+                                    args=(make_snapshot, 200))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals([True], snapshots)
+        self.assertEquals(2, len(os.listdir(self.checkpointer.directory)))
+
+    def test_background_thread_writes_snapshots(self):
+        checkpointer = checkpoint.Checkpointer(
+            os.path.join(self.tmp_dir, 'background'), interval=0.05)
+        checkpointer.start(lambda: {'n': 1})
+        for _ in range(100):
+            if checkpointer.latest_path() is not None:
+                break
+            time.sleep(0.05)
+        checkpointer.stop()
+        self.assertEquals({'n': 1}, checkpointer.load_latest())
+
+    def test_compiled_maps_survive_round_trip(self):
+        skills_map, resources_map = skills_updater_tests.make_maps()
+        self.checkpointer.save(
+            {'skills_map': skills_map, 'resources_map': resources_map})
+        snapshot = self.checkpointer.load_latest()
+        self.assertEquals(
+            set(['add', 'multiply']),
+            snapshot['resources_map'].get_skills_for_resource('q_mixed'))
+        self.assertEquals(
+            set(['sums', 'all']),
+            snapshot['resources_map'].get_objectives_for_resource('q_add'))
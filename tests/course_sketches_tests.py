@@ -0,0 +1,110 @@
+"""Tests for the streaming course analytics sketches."""
+
+import unittest
+
+from modules.learning_analytics import course_sketches
+
+
+class CountMinSketchTests(unittest.TestCase):
+
+    def test_estimates_bound_true_counts(self):
+        sketch = course_sketches.CountMinSketch.from_error_bounds(0.01, 0.01)
+        for n in range(1000):
+            sketch.add('key-%d' % (n % 50))
+        for n in range(50):
+            estimate = sketch.estimate('key-%d' % n)
+            self.assertTrue(20 <= estimate <= 20 + 0.01 * 1000)
+
+    def test_merge_adds_counts(self):
+        first = course_sketches.CountMinSketch(64, 3)
+        second = course_sketches.CountMinSketch(64, 3)
+        first.add('a', 3)
+        second.add('a', 4)
+        first.merge(second)
+        self.assertEquals(7, first.estimate('a'))
+        self.assertEquals(7, first.total)
+
+
+class HyperLogLogTests(unittest.TestCase):
+
+    def test_counts_distinct_keys(self):
+        counter = course_sketches.HyperLogLog(precision=10)
+        for n in range(20000):
+            counter.add('student-%d' % (n % 5000))
+        # The standard error at precision 10 is about 3%:
+        self.assertTrue(abs(counter.count() - 5000) < 500)
+
+    def test_merge_is_union(self):
+        first = course_sketches.HyperLogLog(precision=10)
+        second = course_sketches.HyperLogLog(precision=10)
+        for n in range(300):
+            first.add(n)
+            second.add(n + 200)
+        first.merge(second)
+        self.assertTrue(abs(first.count() - 500) < 50)
+
+
+class SpaceSavingTests(unittest.TestCase):
+
+    def test_keeps_heavy_hitters(self):
+        summary = course_sketches.SpaceSaving(capacity=5)
+        for n in range(1000):
+            summary.add('hot' if n % 3 == 0 else 'cold-%d' % n)
+        key, count, error = summary.top(1)[0]
+        self.assertEquals('hot', key)
+        self.assertTrue(count - error <= 334 <= count)
+
+    def test_replaces_smallest_counter(self):
+        summary = course_sketches.SpaceSaving(capacity=4)
+        counters = {}
+        for n in range(500):
+            key = 'key-%d' % (n * n % 13)
+            count = n % 3 + 1
+            summary.add(key, count)
+            if key in counters:
+                counters[key][0] += count
+            elif len(counters) < 4:
+                counters[key] = [count, 0]
+            else:
+                smallest = min(counters, key=lambda k: (counters[k][0], k))
+                min_count = counters.pop(smallest)[0]
+                counters[key] = [min_count + count, min_count]
+        self.assertEquals(
+            sorted((key, count, error) for key, (count, error) in counters.items()),
+            sorted(summary.top()))
+
+    def test_merge_keeps_heavy_hitters_of_both(self):
+        first = course_sketches.SpaceSaving(capacity=3)
+        second = course_sketches.SpaceSaving(capacity=3)
+        first.add('a', 10)
+        first.add('b', 1)
+        second.add('c', 8)
+        second.add('b', 1)
+        first.merge(second)
+        self.assertEquals(
+            [('a', 10, 0), ('c', 8, 0), ('b', 2, 0)], first.top())
+
+
+class CourseSketchesTests(unittest.TestCase):
+
+    def test_summary(self):
+        sketches = course_sketches.CourseSketches()
+        other = course_sketches.CourseSketches()
+        for n in range(10):
+            sketch = sketches if n % 2 else other
+            sketch.observe({'student_id': 's%d' % (n % 4),
+                            'resource_id': 'q_add' if n < 8 else 'q_mixed',
+                            'result': n % 4 != 0}, ['add'])
+        sketches.merge(other)
+        summary = sketches.summary(['add', 'multiply'])
+        self.assertEquals(10, summary['num_events'])
+        self.assertEquals(4, summary['distinct_students'])
+        self.assertEquals({'add': 10, 'multiply': 0}, summary['skill_attempts'])
+        self.assertEquals(
+            [{'resource_id': 'q_add', 'attempts': 8, 'correct_rate': 0.75},
+             {'resource_id': 'q_mixed', 'attempts': 2, 'correct_rate': 0.5}],
+            summary['top_resources'])
+
+
+if __name__ == '__main__':
+    unittest.main()
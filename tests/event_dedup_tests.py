@@ -0,0 +1,115 @@
+"""Tests for suppression of redelivered student actions."""
+
+import unittest
+
+from modules.learning_analytics import event_dedup
+
+
+PAYLOAD = {
+    'event_type': 'problem_check',
+    'resource_id': u'i4x://HumanitiesSciences/NCP-101/problem/__61',
+    'student_id': 'd4dfbbce6c4e9c8a0e036fb4049c0ba3',
+    'answers': {
+        u'i4x-HumanitiesSciences-NCP-101-problem-_61_2_1': [
+            u'choice_3', u'choice_4']},
+    'result': False,
+    'course_id': u'HumanitiesSciences/NCP-101/OnGoing',
+    'time': 1479945600.0}
+
+
+class EventFingerprintTests(unittest.TestCase):
+
+    def test_fingerprint_ignores_key_order(self):
+        reordered = dict(reversed(list(PAYLOAD.items())))
+        self.assertEquals(
+            event_dedup.event_fingerprint(PAYLOAD),
+            event_dedup.event_fingerprint(reordered))
+
+    def test_fingerprint_distinguishes_payloads(self):
+        other = dict(PAYLOAD, result=True)
+        self.assertNotEquals(
+            event_dedup.event_fingerprint(PAYLOAD),
+            event_dedup.event_fingerprint(other))
+
+    def test_fingerprint_distinguishes_resubmissions(self):
+        resubmitted = dict(PAYLOAD, time=PAYLOAD['time'] + 30)
+        self.assertNotEquals(
+            event_dedup.event_fingerprint(PAYLOAD),
+            event_dedup.event_fingerprint(resubmitted))
+
+    def test_fingerprint_falls_back_to_message_id(self):
+        untimed = dict(PAYLOAD)
+        del untimed['time']
+        self.assertEquals(
+            event_dedup.event_fingerprint(untimed, 'message-1'),
+            event_dedup.event_fingerprint(dict(untimed), 'message-1'))
+        self.assertNotEquals(
+            event_dedup.event_fingerprint(untimed, 'message-1'),
+            event_dedup.event_fingerprint(untimed, 'message-2'))
+        self.assertEquals(None, event_dedup.event_fingerprint(untimed))
+
+
+class RotatingBloomFilterTests(unittest.TestCase):
+
+    def _fingerprint(self, n):
+        return event_dedup.event_fingerprint({'n': n, 'time': 0})
+
+    def test_memory_cap_is_respected(self):
+        bloom_filter = event_dedup.RotatingBloomFilter.from_memory_cap(
+            64 * 1024, 1e-4, 60)
+        self.assertTrue(bloom_filter.num_bytes <= 64 * 1024 + 2)
+
+    def test_detects_repeats_within_generation(self):
+        bloom_filter = event_dedup.RotatingBloomFilter(1000, 1e-4, 60)
+        self.assertFalse(bloom_filter.add(self._fingerprint(1), now=0))
+        self.assertTrue(bloom_filter.add(self._fingerprint(1), now=1))
+
+    def test_remembers_previous_generation(self):
+        bloom_filter = event_dedup.RotatingBloomFilter(1000, 1e-4, 60)
+        bloom_filter.add(self._fingerprint(1), now=0)
+        self.assertTrue(bloom_filter.add(self._fingerprint(1), now=70))
+        self.assertEquals(1, bloom_filter.num_rotations)
+
+    def test_forgets_after_two_windows(self):
+        bloom_filter = event_dedup.RotatingBloomFilter(1000, 1e-4, 60)
+        bloom_filter.add(self._fingerprint(1), now=0)
+        bloom_filter.add(self._fingerprint(2), now=70)
+        self.assertFalse(bloom_filter.add(self._fingerprint(1), now=140))
+
+    def test_rotates_at_capacity(self):
+        bloom_filter = event_dedup.RotatingBloomFilter(100, 1e-4, 60)
+        for n in range(250):
+            bloom_filter.add(self._fingerprint(n), now=0)
+        self.assertEquals(2, bloom_filter.num_rotations)
+
+    def test_false_positive_rate_within_budget(self):
+        bloom_filter = event_dedup.RotatingBloomFilter(5000, 1e-2, 60)
+        false_positives = 0
+        for n in range(20000):
+            if bloom_filter.add(self._fingerprint(n), now=0):
+                false_positives += 1
+        self.assertTrue(false_positives < 20000 * 1e-2)
+
+
+class EventDeduplicatorTests(unittest.TestCase):
+
+    def test_drops_redelivered_event(self):
+        deduplicator = event_dedup.EventDeduplicator()
+        self.assertFalse(deduplicator.is_duplicate(PAYLOAD, now=0))
+        self.assertTrue(deduplicator.is_duplicate(dict(PAYLOAD), now=5))
+        self.assertFalse(
+            deduplicator.is_duplicate(dict(PAYLOAD, result=True), now=6))
+        self.assertEquals(3, deduplicator.num_events)
+        self.assertEquals(1, deduplicator.num_duplicates)
+
+    def test_passes_events_without_timestamp_or_id(self):
+        deduplicator = event_dedup.EventDeduplicator()
+        untimed = dict(PAYLOAD)
+        del untimed['time']
+        self.assertFalse(deduplicator.is_duplicate(untimed, now=0))
+        self.assertFalse(deduplicator.is_duplicate(untimed, now=5))
+        self.assertFalse(
+            deduplicator.is_duplicate(untimed, now=6, message_id='message-1'))
+        self.assertTrue(
+            deduplicator.is_duplicate(untimed, now=7, message_id='message-1'))
+        self.assertEquals(2, deduplicator.num_unkeyed)
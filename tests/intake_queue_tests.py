@@ -0,0 +1,120 @@
+"""Tests for the bounded intake queue."""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from modules.learning_analytics import intake_queue
+
+
+IntakeQueue = intake_queue.IntakeQueue
+
+
+class IntakeQueueTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _drain(self, queue):
+        items = []
+        while True:
+            try:
+                batch = queue.get_batch(100, timeout=0)
+            except intake_queue.QueueEmpty:
+                return items
+            items.extend(batch)
+            queue.task_done(len(batch))
+
+    def test_fifo_across_priorities(self):
+        queue = IntakeQueue(10)
+        for n in range(6):
+            queue.put(n, priority=n % 3)
+        self.assertEquals([0, 1, 2, 3], queue.get_batch(4))
+        self.assertEquals([4, 5], queue.get_batch(4))
+
+    def test_size_must_be_positive(self):
+        for policy in IntakeQueue.POLICIES:
+            self.assertRaises(ValueError, IntakeQueue, 0, policy, spill_path='spill')
+
+    def test_get_batch_times_out(self):
+        with self.assertRaises(intake_queue.QueueEmpty):
+            IntakeQueue(10).get_batch(1, timeout=0.01)
+
+    def test_block_times_out_when_full(self):
+        queue = IntakeQueue(2)
+        self.assertTrue(queue.put(1))
+        self.assertTrue(queue.put(2))
+        self.assertFalse(queue.put(3, timeout=0.01))
+        self.assertEquals(1, queue.stats()['num_shed'])
+
+    def test_block_waits_for_room(self):
+        queue = IntakeQueue(1)
+        queue.put(1)
+        threading.Timer(0.05, lambda: queue.get_batch(1)).start()
+        self.assertTrue(queue.put(2, timeout=5))
+
+    def test_drop_oldest(self):
+        queue = IntakeQueue(3, IntakeQueue.DROP_OLDEST)
+        for n in range(5):
+            self.assertTrue(queue.put(n))
+        self.assertEquals([2, 3, 4], self._drain(queue))
+        self.assertEquals(2, queue.stats()['num_shed'])
+
+    def test_drop_lowest_priority(self):
+        queue = IntakeQueue(3, IntakeQueue.DROP_LOWEST_PRIORITY)
+        queue.put('low-1', priority=0)
+        queue.put('high-1', priority=1)
+        queue.put('low-2', priority=0)
+        self.assertTrue(queue.put('high-2', priority=1))
+        self.assertFalse(queue.put('low-3', priority=0))
+        self.assertEquals(['high-1', 'low-2', 'high-2'], self._drain(queue))
+        self.assertEquals(2, queue.stats()['num_shed'])
+
+    def test_spill_keeps_order_and_cleans_up(self):
+        spill_path = os.path.join(self.tmp_dir, 'spill.log')
+        queue = IntakeQueue(2, IntakeQueue.SPILL, spill_path=spill_path)
+        for n in range(7):
+            self.assertTrue(queue.put({'n': n}))
+        self.assertEquals(7, len(queue))
+        self.assertEquals(5, queue.stats()['num_spilled'])
+        self.assertEquals(
+            list(range(7)), [item['n'] for item in self._drain(queue)])
+        self.assertFalse(os.path.exists(spill_path))
+        self.assertTrue(queue.join(timeout=0))
+
+    def test_spill_keeps_priorities(self):
+        spill_path = os.path.join(self.tmp_dir, 'spill.log')
+        queue = IntakeQueue(1, IntakeQueue.SPILL, spill_path=spill_path)
+        queue.put({'n': 0}, priority=0)
+        queue.put({'n': 1}, priority=2)
+        with open(spill_path) as spill_file:
+            self.assertEquals([[2, {'n': 1}]],
+                              [json.loads(line) for line in spill_file])
+        self.assertEquals([0, 1], [item['n'] for item in self._drain(queue)])
+
+    def test_stale_spill_log_is_set_aside(self):
+        spill_path = os.path.join(self.tmp_dir, 'spill.log')
+        with open(spill_path, 'w') as spill_file:
+            spill_file.write(json.dumps([0, {'n': 'stale'}]) + '\n')
+        queue = IntakeQueue(1, IntakeQueue.SPILL, spill_path=spill_path)
+        for n in range(3):
+            queue.put({'n': n})
+        self.assertEquals([0, 1, 2], [item['n'] for item in self._drain(queue)])
+        stale = [name for name in os.listdir(self.tmp_dir)
+                 if name.endswith('.stale')]
+        self.assertEquals(1, len(stale))
+        self.assertTrue(stale[0].startswith('spill.log.'))
+
+    def test_join_waits_for_task_done(self):
+        queue = IntakeQueue(10)
+        queue.put(1)
+        self.assertFalse(queue.join(timeout=0.01))
+        queue.get_batch(1)
+        queue.task_done()
+        self.assertTrue(queue.join(timeout=0.01))
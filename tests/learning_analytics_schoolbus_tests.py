@@ -0,0 +1,498 @@
+"""Tests for the SchoolBus learning analytics module."""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from modules.learning_analytics import checkpoint
+from modules.learning_analytics import learning_analytics_schoolbus
+from modules.learning_analytics import schoolbus_cli
+from tests.ext.learning_analytics import skills_updater_tests
+
+
+class FakeBusAdapter(object):
+    """Records subscriptions and publications instead of using Redis."""
+
+    def __init__(self):
+        self.subscriptions = {}
+        self.published = []
+
+    def subscribeToTopic(self, topic, callback):
+        self.subscriptions[topic] = callback
+
+    def unsubscribeFromTopic(self, topic):
+        self.subscriptions.pop(topic, None)
+
+    def publish(self, bus_message):
+        self.published.append(bus_message)
+
+    def deliver(self, topic, content, message_id=None):
+        self.subscriptions[topic](
+            FakeBusMessage(json.dumps(content), message_id))
+
+
+class FakeBusMessage(object):
+
+    def __init__(self, content, message_id=None):
+        self.content = content
+        self.id = message_id
+
+
+def student_action(student_id='student', resource_id='q_add', result=True):
+    return {
+        'event_type': 'problem_check',
+        'course_id': 'course',
+        'student_id': student_id,
+        'resource_id': resource_id,
+        'answers': {},
+        'result': result}
+
+
+class AnalyticsSchoolbusHandlerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.bus = FakeBusAdapter()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _make_handler(self, **kwargs):
+        kwargs.setdefault('num_workers', 0)
+        handler = learning_analytics_schoolbus.AnalyticsSchoolbusHandler(
+            course_maps={'course': skills_updater_tests.make_maps()},
+            bus_adapter=self.bus, **kwargs)
+        handler.start()
+        return handler
+
+    def test_constructor_does_not_subscribe(self):
+        learning_analytics_schoolbus.AnalyticsSchoolbusHandler(
+            bus_adapter=self.bus)
+        self.assertEquals({}, self.bus.subscriptions)
+
+    def test_student_action_updates_estimates(self):
+        handler = self._make_handler()
+        self.bus.deliver('studentAction', student_action())
+        self.assertIn('add', handler.updaters['course'].get_estimates(
+            'student'))
+        self.assertEquals(
+            ['skillmapUpdate'],
+            [message.topicName for message in self.bus.published])
+
+    def test_publishes_significant_changes_only(self):
+        handler = self._make_handler()
+        for n in range(30):
+            self.bus.deliver('studentAction', student_action())
+        updates = [json.loads(message.content) for message in self.bus.published]
+        self.assertEquals(30, handler.position['num_processed'])
+        # Estimates converge, so later changes fall below epsilon:
+        self.assertTrue(0 < len(updates) < 15)
+        first = updates[0]['updates']
+        self.assertEquals(
+            [('skill', 'add', 'first'), ('objective', 'all', 'first'),
+             ('objective', 'sums', 'first')],
+            [(update['kind'], update['id'], update['reason']) for update in first])
+        publication = handler.get_stats()['publication']
+        self.assertEquals(90, publication['num_checked'])
+        self.assertTrue(publication['num_published'] < 45)
+
+    def test_estimator_is_selectable(self):
+        from modules.learning_analytics import skills_models
+        handler = self._make_handler(
+            make_estimator=skills_models.ForgettingBKTEstimator
+            .get_standard_estimator)
+        self.assertIsInstance(handler.updaters['course'].estimator,
+                              skills_models.ForgettingBKTEstimator)
+
+    def test_actions_of_untracked_courses_are_echoed(self):
+        self._make_handler()
+        action = student_action()
+        action['course_id'] = 'other'
+        self.bus.deliver('studentAction', action)
+        self.assertIn('Received Lagunita event', self.bus.published[0].content)
+
+    def test_redelivered_action_is_dropped(self):
+        handler = self._make_handler()
+        self.bus.deliver('studentAction', student_action(), message_id='m1')
+        self.bus.deliver('studentAction', student_action(), message_id='m1')
+        self.assertEquals(1, handler.position['num_processed'])
+
+    def test_counts_dropped_actions_as_consumed(self):
+        handler = self._make_handler()
+        self.bus.deliver('studentAction', student_action(), message_id='m1')
+        self.bus.deliver('studentAction', student_action(), message_id='m1')
+        self.bus.subscriptions['studentAction'](FakeBusMessage('not json'))
+        self.assertEquals(1, handler.position['num_processed'])
+        self.assertEquals(3, handler.position['num_consumed'])
+        self.assertEquals(1, handler.position['num_malformed'])
+
+    def test_resubmitted_answer_is_processed(self):
+        handler = self._make_handler()
+        self.bus.deliver('studentAction', student_action(), message_id='m1')
+        self.bus.deliver('studentAction', student_action(), message_id='m2')
+        self.bus.deliver('studentAction', student_action())
+        self.assertEquals(3, handler.position['num_processed'])
+
+    def test_workers_process_queued_actions(self):
+        handler = self._make_handler(num_workers=3, batch_size=2)
+        for n in range(20):
+            action = student_action(
+                student_id='student-%d' % (n % 5), result=n % 2 == 0)
+            self.bus.deliver('studentAction', action)
+        self.assertTrue(handler.wait_for_intake(timeout=10))
+        self.assertEquals(20, handler.position['num_processed'])
+        self.assertEquals(20, handler.get_stats()['intake']['num_put'])
+        handler.close()
+        self.assertEquals([], [w for w in handler.workers if w.is_alive()])
+
+    def test_publishes_stats(self):
+        handler = self._make_handler()
+        self.bus.deliver('studentAction', student_action())
+        handler.publish_stats()
+        stats = json.loads(self.bus.published[-1].content)
+        self.assertEquals('schoolbusStats', self.bus.published[-1].topicName)
+        self.assertEquals(1, stats['dedup']['num_events'])
+
+    def test_publishes_analytics_merged_across_workers(self):
+        handler = self._make_handler(num_workers=3)
+        for n in range(12):
+            self.bus.deliver('studentAction',
+                             student_action(student_id='student-%d' % n))
+        self.assertTrue(handler.wait_for_intake(timeout=10))
+        handler.publish_analytics()
+        message = self.bus.published[-1]
+        self.assertEquals('courseAnalytics', message.topicName)
+        analytics = json.loads(message.content)
+        self.assertEquals('course', analytics['course_id'])
+        self.assertEquals(12, analytics['num_events'])
+        self.assertEquals(12, analytics['distinct_students'])
+        self.assertEquals(12, analytics['skill_attempts']['add'])
+        handler.close()
+
+    def test_failing_publisher_does_not_stop_the_others(self):
+        handler = self._make_handler(stats_interval=0, analytics_interval=0)
+        published = []
+
+        def fail():
+            raise RuntimeError('bus down')
+
+        def publish():
+            published.append(True)
+            handler.stop()
+
+        handler.publish_stats = fail
+        handler.publish_analytics = publish
+        handler.serve_forever()
+        self.assertEquals([True], published)
+
+    def test_map_edit_recomputes_affected_students(self):
+        from tests.ext.learning_analytics import map_replay_tests
+        handler = self._make_handler(keep_history=True)
+        self.bus.deliver('studentAction', student_action(resource_id='q_mixed'))
+        self.assertIn('multiply', handler.updaters['course'].get_estimates('student'))
+        diff = handler.update_course_maps('course', *map_replay_tests.edited_maps())
+        self.assertEquals(set([('q_mixed', 'multiply')]), diff.resource_links[1])
+        self.assertEquals(
+            0.0, handler.updaters['course'].get_estimates('student')['multiply'])
+        self.assertEquals(
+            0.0, handler.at_risk['course'].weakest('skill', 'multiply', 1)[0][1])
+        # The recomputed estimate is published like any other change:
+        update = json.loads(self.bus.published[-1].content)
+        self.assertEquals(('student', None),
+                          (update['student_id'], update['resource_id']))
+        self.assertIn(('skill', 'multiply', 0.0),
+                      [(item['kind'], item['id'], item['value'])
+                       for item in update['updates']])
+
+    def test_publishes_stale_suppressed_changes(self):
+        from modules.learning_analytics import publication_filter
+        handler = self._make_handler(
+            make_publication_filter=lambda: publication_filter.PublicationFilter(
+                epsilon=1, bands=(), max_staleness=100))
+        self.bus.deliver('studentAction', student_action())
+        self.bus.deliver('studentAction', student_action())
+        # Only the first values went out, with the action:
+        self.assertEquals(1, len(self.bus.published))
+        handler.publish_stale()
+        self.assertEquals(1, len(self.bus.published))
+        handler.publish_stale(now=time.time() + 100)
+        update = json.loads(self.bus.published[-1].content)
+        self.assertEquals(
+            [('objective', 'all', 'stale'), ('objective', 'sums', 'stale'),
+             ('skill', 'add', 'stale')],
+            [(item['kind'], item['id'], item['reason'])
+             for item in update['updates']])
+        self.assertEquals(
+            handler.updaters['course'].get_estimates('student')['add'],
+            update['updates'][-1]['value'])
+        handler.publish_stale(now=time.time() + 200)
+        self.assertEquals(2, len(self.bus.published))
+
+    def test_recommendations_leave_out_attempted_resources(self):
+        handler = self._make_handler(keep_history=True)
+        self.bus.deliver('studentAction', student_action(resource_id='q_mixed'))
+        recommended = [resource_id for resource_id, _ in
+                       handler.recommend('course', 'student', k=2)]
+        # Subtraction, untouched, gains most:
+        self.assertEquals(['q_parts_2', 'q_mixed'], recommended)
+        recommended = [resource_id for resource_id, _ in handler.recommend(
+            'course', 'student', k=2, exclude_attempted=True)]
+        self.assertEquals(['q_parts_2', 'q_add'], recommended)
+
+    def test_recommenders_are_built_on_first_use_with_the_maps(self):
+        from tests.ext.learning_analytics import map_replay_tests
+        handler = self._make_handler()
+        self.assertNotIn('course', handler.recommenders)
+        handler.recommend('course', 'student')
+        index = handler.recommenders['course']
+        handler.update_course_maps('course', *map_replay_tests.edited_maps())
+        self.assertNotIn('course', handler.recommenders)
+        # q_add now measures the untouched subtraction too:
+        self.assertEquals(
+            ['q_add', 'q_parts_2'],
+            sorted(resource_id for resource_id, _ in handler.recommend(
+                'course', 'student', k=2)))
+        self.assertIsNot(index, handler.recommenders['course'])
+
+    def test_memory_report_covers_maps_state_and_indexes(self):
+        handler = self._make_handler(num_workers=1)
+        handler.get_memory_report()
+        for n in range(20):
+            self.bus.deliver('studentAction', student_action(student_id='s%d' % n))
+        handler.wait_for_intake()
+        self.bus.deliver('schoolbusControl', {'command': 'memory'})
+        report = json.loads(self.bus.published[-1].content)
+        self.assertEquals('schoolbusMemory', self.bus.published[-1].topicName)
+        rows = dict((row['name'], row) for row in report['structures'])
+        for name in ['skills_map', 'resources_map', 'student_state', 'at_risk']:
+            self.assertTrue(rows['course/course/' + name]['bytes'] > 0)
+        self.assertTrue(rows['course/course/student_state']['growth_objects'] > 20)
+        self.assertIn('intake_queue/0', rows)
+        self.assertEquals(report['total_bytes'],
+                          sum(row['bytes'] for row in report['structures']))
+        handler.close()
+
+    def test_exported_students_move_to_importing_handler(self):
+        handler = self._make_handler(keep_history=True)
+        for student_id in ('alice', 'bob'):
+            self.bus.deliver('studentAction', student_action(student_id=student_id))
+        estimates = handler.updaters['course'].get_estimates('alice')
+        courses = handler.export_students(lambda student_id: student_id == 'alice')
+        self.assertEquals(['alice'], list(courses['course']['students']))
+        self.assertEquals({}, handler.updaters['course'].get_estimates('alice'))
+        self.assertEquals(
+            ['bob'], [student_id for student_id, _ in
+                      handler.at_risk['course'].weakest('skill', 'add', 5)])
+        self.assertEquals(set(['bob']), handler.attempt_histories['course'].get_students('q_add'))
+
+        other = learning_analytics_schoolbus.AnalyticsSchoolbusHandler(
+            course_maps={'course': skills_updater_tests.make_maps()},
+            keep_history=True, bus_adapter=FakeBusAdapter())
+        other.import_students(json.loads(json.dumps(courses)))
+        self.assertEquals(estimates, other.updaters['course'].get_estimates('alice'))
+        self.assertEquals(set(['alice']), other.attempt_histories['course'].get_students('q_add'))
+
+    def test_exported_students_move_between_mastery_matrices(self):
+        other_dir = os.path.join(self.tmp_dir, 'other')
+        os.mkdir(other_dir)
+        handler = self._make_handler(mastery_dir=self.tmp_dir)
+        self.bus.deliver('studentAction', student_action(student_id='alice'))
+        estimate = handler.updaters['course'].get_estimates('alice')['add']
+        courses = handler.export_students(lambda student_id: student_id == 'alice')
+        self.assertEquals(0.0, handler.mastery_matrices['course'].get('alice', 'add'))
+
+        other = learning_analytics_schoolbus.AnalyticsSchoolbusHandler(
+            course_maps={'course': skills_updater_tests.make_maps()},
+            mastery_dir=other_dir, bus_adapter=FakeBusAdapter())
+        other.import_students(json.loads(json.dumps(courses)))
+        self.assertAlmostEqual(
+            estimate, other.mastery_matrices['course'].get('alice', 'add'), places=6)
+        handler.close()
+        other.close()
+
+    def test_topics_are_configurable(self):
+        self._make_handler(
+            student_action_topic='actions', control_topic='control')
+        self.assertEquals(
+            ['actions', 'control'], sorted(self.bus.subscriptions))
+
+    def test_control_message_profiles_next_actions(self):
+        handler = self._make_handler(profile_dir=self.tmp_dir)
+        self.bus.deliver('schoolbusControl', {
+            'command': 'profile', 'mode': 'deterministic', 'messages': 2})
+        session = handler.profile_session
+        self.assertIsNotNone(session)
+        for n in range(3):
+            self.bus.deliver('studentAction', student_action(result=n != 1))
+        self.assertIsNone(handler.profile_session)
+        self.assertEquals(2, session.num_messages)
+        with open(session.output_prefix + '.collapsed') as collapsed_file:
+            self.assertIn('process_action', collapsed_file.read())
+
+    def test_warm_start_from_checkpoint(self):
+        checkpointer = checkpoint.Checkpointer(self.tmp_dir)
+        handler = self._make_handler(checkpointer=checkpointer)
+        self.bus.deliver('studentAction', student_action())
+        estimates = handler.updaters['course'].get_estimates('student')
+        handler.close()
+
+        restarted = learning_analytics_schoolbus.AnalyticsSchoolbusHandler(
+            checkpointer=checkpointer, bus_adapter=FakeBusAdapter())
+        self.assertEquals(
+            estimates, restarted.updaters['course'].get_estimates('student'))
+        self.assertEquals(
+            handler.objective_mastery['course'].get_objectives('student'),
+            restarted.objective_mastery['course'].get_objectives('student'))
+        self.assertEquals(1, restarted.position['num_processed'])
+
+    def test_checkpointed_course_maps_are_not_parsed(self):
+        checkpointer = checkpoint.Checkpointer(self.tmp_dir)
+        handler = self._make_handler(checkpointer=checkpointer)
+        self.bus.deliver('studentAction', student_action())
+        handler.close()
+
+        def parse():
+            self.fail('Parsed maps held by the checkpoint')
+        restarted = learning_analytics_schoolbus.AnalyticsSchoolbusHandler(
+            course_maps={'course': parse}, checkpointer=checkpointer,
+            bus_adapter=FakeBusAdapter())
+        self.assertIn('course', restarted.updaters)
+
+    def test_course_maps_missing_from_checkpoint_are_parsed(self):
+        from modules.learning_analytics import skills_models
+
+        skills_map = skills_models.SkillsMap.from_xml(
+            skills_updater_tests.SKILLS_MAP_XML)
+        resources_map = skills_models.ResourcesMap.from_xml(
+            skills_updater_tests.RESOURCES_MAP_XML, skills_map=skills_map)
+        handler = learning_analytics_schoolbus.AnalyticsSchoolbusHandler(
+            course_maps={'other': lambda: (skills_map, resources_map)},
+            bus_adapter=FakeBusAdapter())
+        self.assertIs(skills_map, handler.updaters['other'].skills_map)
+
+    def test_streamed_students_release_the_course_lock_between_chunks(self):
+        handler = self._make_handler()
+        handler.STUDENTS_PER_CHUNK = 2
+        for n in range(5):
+            self.bus.deliver('studentAction',
+                             student_action(student_id='student-%d' % n))
+        lock = handler.course_locks['course']
+        students = handler.stream_students('course')
+        streamed = [next(students)]
+        # Workers can take the lock while a chunk is written:
+        self.assertTrue(lock.acquire(False))
+        lock.release()
+        streamed.extend(students)
+        self.assertEquals(
+            sorted('student-%d' % n for n in range(5)),
+            sorted(student_id for student_id, _ in streamed))
+
+    def test_checkpoint_streams_students_from_cache(self):
+        from modules.learning_analytics import skills_updater
+        from modules.learning_analytics import state_cache
+
+        def make_store(course_id):
+            return state_cache.StudentStateCache(
+                skills_updater.StudentStateStore(), max_bytes=1,
+                spill_dir=self.tmp_dir)
+        checkpointer = checkpoint.Checkpointer(self.tmp_dir)
+        handler = self._make_handler(
+            checkpointer=checkpointer, make_store=make_store)
+        for n in range(5):
+            self.bus.deliver('studentAction',
+                             student_action(student_id='student-%d' % n))
+        # All but one student are spilled to disk:
+        self.assertEquals(
+            4, handler.updaters['course'].store.stats()['num_spilled'])
+        handler.close()
+
+        snapshot = checkpointer.load_latest()
+        self.assertEquals(
+            sorted('student-%d' % n for n in range(5)),
+            sorted(snapshot['courses']['course']['students']))
+
+
+class SchoolbusCliTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'w') as out_file:
+            out_file.write(content)
+        return path
+
+    def test_parses_options(self):
+        args = schoolbus_cli.make_parser().parse_args([
+            '--course', 'c1', 's1.xml', 'r1.xml',
+            '--course', 'c2', 's2.xml', 'r2.xml',
+            '--topic', 'actions', '--report-startup'])
+        self.assertEquals(
+            [['c1', 's1.xml', 'r1.xml'], ['c2', 's2.xml', 'r2.xml']],
+            args.course)
+        self.assertEquals('actions', args.topic)
+        self.assertEquals('memory', args.state_backend)
+        self.assertTrue(args.report_startup)
+
+    def test_forgetting_half_life_selects_forgetting_estimator(self):
+        from modules.learning_analytics import skills_models
+        parser = schoolbus_cli.make_parser()
+        self.assertIsNone(
+            schoolbus_cli.estimator_factory(parser.parse_args([])))
+        estimator = schoolbus_cli.estimator_factory(
+            parser.parse_args(['--forgetting-half-life', '7']))()
+        self.assertIsInstance(estimator, skills_models.ForgettingBKTEstimator)
+        self.assertAlmostEqual(
+            0.5, estimator.get_decayed(1.0, 7 * 24 * 60 * 60))
+
+    def test_lru_state_backend_is_registered(self):
+        from modules.learning_analytics import state_cache
+        self.assertIs(state_cache.StudentStateCache,
+                      schoolbus_cli.load_state_backend('lru'))
+
+    def test_lru_state_backend_needs_state_dir(self):
+        self.assertRaises(SystemExit, schoolbus_cli.main,
+                          ['--state-backend', 'lru'])
+
+    def test_loads_course_maps(self):
+        course_maps = schoolbus_cli.load_course_maps([(
+            'course',
+            self._write('skills.xml', skills_updater_tests.SKILLS_MAP_XML),
+            self._write('resources.xml',
+                        skills_updater_tests.RESOURCES_MAP_XML))])
+        skills_map, resources_map = course_maps['course']
+        self.assertEquals(3, len(skills_map.skills))
+        self.assertEquals(
+            set(['add']), resources_map.get_skills_for_resource('q_add'))
+
+    def test_defers_parsing_course_maps_older_than_checkpoint(self):
+        courses = [('course',
+                    self._write('skills.xml',
+                                skills_updater_tests.SKILLS_MAP_XML),
+                    self._write('resources.xml',
+                                skills_updater_tests.RESOURCES_MAP_XML))]
+        for path in courses[0][1:]:
+            os.utime(path, (1000, 1000))
+        course_maps = schoolbus_cli.load_course_maps(
+            courses, defer_before=2000)
+        self.assertTrue(callable(course_maps['course']))
+        skills_map, _ = course_maps['course']()
+        self.assertEquals(3, len(skills_map.skills))
+        course_maps = schoolbus_cli.load_course_maps(
+            courses, defer_before=500)
+        self.assertFalse(callable(course_maps['course']))
+
+    def test_startup_report_lists_phases(self):
+        timer = schoolbus_cli.StartupTimer()
+        with timer.phase('first'):
+            pass
+        report = timer.report()
+        self.assertIn('first', report)
+        self.assertIn('total', report)
@@ -18,16 +18,20 @@ __author__ = 'John Orr (jorr@google.com)'
 
 import unittest
 
+import numpy
+
 from common import crypto
 from controllers import utils
 from models import config
 from models import courses
 from models import models
 from models import transforms
+from modules.learning_analytics import learning_analytics
 from modules.learning_analytics import skills_models
 from tests.functional import actions
 
 from google.appengine.api import namespace_manager
+from google.appengine.api import users
 
 
 class AnalyticsEventRestHandlerTests(actions.TestBase):
@@ -83,6 +87,7 @@ class AnalyticsEventRestHandlerTests(actions.TestBase):
         response = transforms.loads(self._post_request('{}').body)
         self.assertEquals(200, response['status'])
         self.assertEquals('OK', response['message'])
+        self.execute_all_deferred_tasks()
         events = models.EventEntity.all().fetch(1000)
         self.assertEquals(1, len(events))
         event = events[0]
@@ -90,6 +95,51 @@ class AnalyticsEventRestHandlerTests(actions.TestBase):
         self.assertEquals('user@foo.bar', event.user_id)
         self.assertEquals('{}', event.data)
 
+    def test_rejects_malformed_payload(self):
+        actions.login('user@foo.bar')
+        response = transforms.loads(self._post_request('{').body)
+        self.assertEquals(400, response['status'])
+        self.assertEquals('Malformed payload', response['message'])
+
+    def _patch_update_skills(self):
+        def update_skills(student_skills_dict, skills_map, payload):
+            student_skills_dict.setdefault('applied', []).append(payload['n'])
+        learning_analytics.updater.update_skills = update_skills
+        self.addCleanup(delattr, learning_analytics.updater, 'update_skills')
+
+    def _get_applied(self):
+        entities = models.StudentPropertyEntity.all().filter(
+            'name =', learning_analytics.AnalyticsUpdater.PROPERTY_KEY).fetch(10)
+        self.assertEquals(1, len(entities))
+        return transforms.loads(entities[0].value)['applied']
+
+    def test_defers_recording_and_skill_updates(self):
+        self._patch_update_skills()
+        actions.login('user@foo.bar')
+        self._post_request(transforms.dumps({'n': 1}))
+        self.assertEquals([], models.EventEntity.all().fetch(1000))
+        self.execute_all_deferred_tasks()
+        self.assertEquals([1], self._get_applied())
+        self.assertEquals(1, len(models.EventEntity.all().fetch(1000)))
+
+    def test_applies_events_of_a_student_in_order(self):
+        self._patch_update_skills()
+        actions.login('user@foo.bar')
+        self._post_request(transforms.dumps({'n': 1}))
+        self._post_request(transforms.dumps({'n': 2}))
+        # The task of the second event runs first, and applies both:
+        user = users.get_current_user()
+        learning_analytics.apply_events(
+            namespace_manager.get_namespace(),
+            learning_analytics.AnalyticsEventRestHandler.EVENT_SOURCE, user)
+        self._post_request(transforms.dumps({'n': 3}))
+        self.execute_all_deferred_tasks()
+        # No update is lost or applied twice:
+        self.assertEquals([1, 2, 3], self._get_applied())
+        self.assertEquals(
+            ['{"n": 1}', '{"n": 2}', '{"n": 3}'],
+            sorted(event.data for event in models.EventEntity.all().fetch(10)))
+
 
 class BKTEstimatorTests(unittest.TestCase):
     """Unit tests for the Baysian Knowledge Tracing model."""
@@ -133,6 +183,27 @@ class BKTEstimatorTests(unittest.TestCase):
             posterior = estimator.get_posterior(prior, is_correct=False)
             self.assertTrue(0.0 < posterior and posterior < 1)
 
+    def test_vectorized_posteriors_match_scalar(self):
+        estimator = skills_models.BKTEstimator.get_standard_estimator()
+        priors = numpy.arange(1, 100) / 100.0
+        for is_correct in [True, False]:
+            posteriors = estimator.get_posteriors(
+                priors, numpy.array([is_correct] * len(priors)))
+            for prior, posterior in zip(priors, posteriors):
+                self.assertAlmostEquals(
+                    estimator.get_posterior(prior, is_correct), posterior)
+
+    def test_expected_posteriors_average_over_results(self):
+        estimator = skills_models.BKTEstimator.get_standard_estimator()
+        priors = numpy.arange(1, 100) / 100.0
+        for prior, expected in zip(
+                priors, estimator.get_expected_posteriors(priors)):
+            p_correct = prior * 0.8 + (1 - prior) * 0.3
+            self.assertAlmostEquals(
+                p_correct * estimator.get_posterior(prior, True) +
+                (1 - p_correct) * estimator.get_posterior(prior, False),
+                expected)
+
     def test_p_converges_to_1_with_sequence_of_correct_responses(self):
         """Test the outcome of a long run of correct responses.
 
@@ -165,6 +236,45 @@ class BKTEstimatorTests(unittest.TestCase):
         self.assertEquals(0.14, p)
 
 
+class ForgettingBKTEstimatorTests(unittest.TestCase):
+    """Unit tests for the BKT model with exponential forgetting."""
+
+    def test_standard_estimator_does_not_forget(self):
+        estimator = skills_models.BKTEstimator.get_standard_estimator()
+        self.assertEquals(0.7, estimator.get_decayed(0.7, 10 ** 9))
+
+    def test_estimate_halves_after_half_life(self):
+        estimator = skills_models.ForgettingBKTEstimator(half_life=100)
+        self.assertAlmostEquals(0.4, estimator.get_decayed(0.8, 100))
+        self.assertAlmostEquals(0.2, estimator.get_decayed(0.8, 200))
+
+    def test_decay_is_composable(self):
+        """Decaying lazily once equals decaying at every intermediate read."""
+        estimator = skills_models.ForgettingBKTEstimator(half_life=7)
+        p = 0.9
+        for _ in xrange(10):
+            p = estimator.get_decayed(p, 3)
+        self.assertAlmostEquals(p, estimator.get_decayed(0.9, 30))
+
+    def test_estimate_decays_towards_floor(self):
+        estimator = skills_models.ForgettingBKTEstimator(
+            half_life=1, p_floor=0.2)
+        self.assertAlmostEquals(0.2, estimator.get_decayed(0.9, 1000))
+        self.assertEquals(0.1, estimator.get_decayed(0.1, 1000))
+
+    def test_no_decay_without_elapsed_time(self):
+        estimator = skills_models.ForgettingBKTEstimator.get_standard_estimator()
+        self.assertEquals(0.9, estimator.get_decayed(0.9, 0))
+
+    def test_half_life_must_be_positive(self):
+        self.assertAlmostEquals(
+            0.4, skills_models.ForgettingBKTEstimator().get_decayed(
+                0.8, skills_models.ForgettingBKTEstimator.DEFAULT_HALF_LIFE))
+        for half_life in (0, -1):
+            self.assertRaises(ValueError, skills_models.ForgettingBKTEstimator,
+                              half_life=half_life)
+
+
 class SkillsMapTests(unittest.TestCase):
     def test_should_parse_well_formed_xml(self):
         skills_map = skills_models.SkillsMap.from_xml(SAMPLE_SKILLS_MAP)
@@ -244,6 +354,31 @@ class SkillsMapTests(unittest.TestCase):
         self.assertEquals(
             set([]), skills_map.get_objectives_for_skill('skill-1'))
 
+    def test_prerequisites_are_optional(self):
+        skills_map = skills_models.SkillsMap.from_xml(SAMPLE_SKILLS_MAP)
+        self.assertFalse(skills_map.has_prerequisites)
+        self.assertEquals(
+            set([]),
+            skills_map.get_prerequisites('arithmetic_operations_whole'))
+
+    def test_parses_prerequisites_in_topological_order(self):
+        skills_map = skills_models.SkillsMap.from_xml(PREREQUISITES_SKILLS_MAP)
+        self.assertTrue(skills_map.has_prerequisites)
+        self.assertEquals(
+            set(['add', 'multiply']), skills_map.get_prerequisites('power'))
+        self.assertEquals(
+            set(['multiply', 'power']), skills_map.get_dependents('add'))
+        order = sorted(['power', 'multiply', 'add'],
+                       key=skills_map.get_topological_index)
+        self.assertEquals(['add', 'multiply', 'power'], order)
+
+    def test_parse_rejects_prerequisite_cycle(self):
+        xml = PREREQUISITES_SKILLS_MAP.replace(
+            '</prerequisites>',
+            '<prerequisite skill="add" requires="power"/></prerequisites>')
+        with self.assertRaises(AssertionError):
+            skills_models.SkillsMap.from_xml(xml)
+
 
 class ResourcesMapTests(unittest.TestCase):
     def test_should_parse_well_formed_xml(self):
@@ -379,6 +514,23 @@ SAMPLE_SKILLS_MAP = """\
 </skills-map>
 """
 
+PREREQUISITES_SKILLS_MAP = """\
+<?xml version="1.0" encoding="UTF-8"?>
+<skills-map>
+    <skills>
+        <skill id="power">Powers</skill>
+        <skill id="multiply">Multiplication</skill>
+        <skill id="add">Addition</skill>
+    </skills>
+    <objectives></objectives>
+    <prerequisites>
+        <prerequisite skill="power" requires="multiply"/>
+        <prerequisite skill="power" requires="add"/>
+        <prerequisite skill="multiply" requires="add"/>
+    </prerequisites>
+</skills-map>
+"""
+
 SAMPLE_RESOURCES_MAP = """\
 <?xml version="1.0" encoding="UTF-8"?>
 <resources id="stem_readiness">
@@ -0,0 +1,92 @@
+"""Tests for the synthetic skills and resources map generator."""
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from modules.learning_analytics import map_generator
+from modules.learning_analytics import skills_models
+
+
+def parse(spec):
+    skills_map = skills_models.SkillsMap.from_xml(
+        ''.join(map_generator.iter_skills_map_xml(spec)))
+    resources_map = skills_models.ResourcesMap.from_xml(
+        ''.join(map_generator.iter_resources_map_xml(spec)),
+        skills_map=skills_map)
+    return skills_map, resources_map
+
+
+class CountDistributionTests(unittest.TestCase):
+
+    def test_samples_lie_within_bounds(self):
+        rng = random.Random(0)
+        for spec, low, high in [('fixed:3', 3, 3), ('uniform:1-4', 1, 4),
+                                ('powerlaw:1-50:2', 1, 50)]:
+            distribution = map_generator.CountDistribution(spec)
+            samples = [distribution.sample(rng) for _ in range(1000)]
+            self.assertEquals(low, min(samples))
+            self.assertTrue(max(samples) <= high)
+
+    def test_mean(self):
+        self.assertEquals(
+            2.5, map_generator.CountDistribution('uniform:1-4').mean)
+        self.assertTrue(
+            map_generator.CountDistribution('powerlaw:1-50:2').mean < 3)
+
+    def test_rejects_malformed_spec(self):
+        for spec in ['uniform:4-1', 'poisson:3', 'fixed:x', 'powerlaw:1-5']:
+            with self.assertRaises(ValueError):
+                map_generator.CountDistribution(spec)
+        with self.assertRaises(ValueError):
+            map_generator.MapSpec(10, 1, 10, skill_popularity='zipf')
+
+
+class MapGeneratorTests(unittest.TestCase):
+
+    def test_generated_maps_are_valid_and_sized(self):
+        spec = map_generator.MapSpec(
+            200, 20, 1000, skills_per_resource='fixed:3',
+            prerequisites_per_skill='uniform:0-2')
+        skills_map, resources_map = parse(spec)
+        self.assertEquals(200, len(skills_map.skills))
+        self.assertEquals(20, len(skills_map.objectives))
+        self.assertEquals(1000, len(resources_map.resource_ids))
+        self.assertTrue(skills_map.has_prerequisites)
+        for resource_id in resources_map.resource_ids[:100]:
+            self.assertEquals(
+                3, len(resources_map.get_skills_for_resource(resource_id)))
+        for objective in skills_map.objectives:
+            self.assertTrue(
+                5 <= len(skills_map.get_skills_for_objective(objective.id))
+                <= 20)
+
+    def test_zipf_popularity_is_skewed(self):
+        spec = map_generator.MapSpec(100, 5, 2000, skill_popularity='zipf:1.2')
+        skills_map, resources_map = parse(spec)
+        fan_in = sorted(
+            len(resources_map.get_resources_for_skill(skill.id))
+            for skill in skills_map.skills)
+        self.assertTrue(fan_in[-1] > 10 * max(fan_in[len(fan_in) // 2], 1))
+
+    def test_same_seed_generates_same_maps(self):
+        def generate(seed):
+            spec = map_generator.MapSpec.at_scale(0.2, seed=seed)
+            return (list(map_generator.iter_skills_map_xml(spec)),
+                    list(map_generator.iter_resources_map_xml(spec)))
+        self.assertEquals(generate(1), generate(1))
+        self.assertNotEquals(generate(1), generate(2))
+
+    def test_writes_map_files(self):
+        out_dir = tempfile.mkdtemp()
+        try:
+            map_generator.main(['--skills', '30', '--objectives', '3',
+                                '--resources', '100', '--out-dir', out_dir])
+            with open(os.path.join(out_dir, 'resources.xml')) as xml_file:
+                resources_map = skills_models.ResourcesMap.from_xml(
+                    xml_file.read())
+            self.assertEquals(100, len(resources_map.resource_ids))
+        finally:
+            shutil.rmtree(out_dir)
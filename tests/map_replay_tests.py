@@ -0,0 +1,153 @@
+"""Tests for targeted recomputation after a skills map edit."""
+
+import unittest
+
+from modules.learning_analytics import map_replay
+from modules.learning_analytics import skills_models
+from modules.learning_analytics import skills_updater
+from tests.ext.learning_analytics import skills_updater_tests
+
+
+# q_add now also measures subtract; q_mixed no longer measures multiply.
+EDITED_RESOURCES_MAP_XML = skills_updater_tests.RESOURCES_MAP_XML.replace(
+    """    <resource id="q_add">
+        <skills>
+            <skill idref="add"/>
+        </skills>""",
+    """    <resource id="q_add">
+        <skills>
+            <skill idref="add"/>
+            <skill idref="subtract"/>
+        </skills>""").replace(
+    """            <skill idref="add"/>
+            <skill idref="multiply"/>""",
+    """            <skill idref="add"/>""")
+
+ATTEMPTS = [
+    ('alice', 'q_add', True),
+    ('bob', 'q_parts_2', False),
+    ('alice', 'q_mixed', True),
+    ('carol', 'q_mixed', False),
+    ('alice', 'q_parts_2', True),
+    ('alice', 'q_add', False),
+]
+
+
+def edited_maps():
+    skills_map, _ = skills_updater_tests.make_maps()
+    return skills_map, skills_models.ResourcesMap.from_xml(
+        EDITED_RESOURCES_MAP_XML, skills_map=skills_map)
+
+
+class DiffMapsTests(unittest.TestCase):
+
+    def test_lists_changed_resource_links(self):
+        skills_map, resources_map = skills_updater_tests.make_maps()
+        new_skills_map, new_resources_map = edited_maps()
+        diff = map_replay.diff_maps(
+            skills_map, resources_map, new_skills_map, new_resources_map)
+        self.assertEquals(
+            (set([('q_add', 'subtract')]), set([('q_mixed', 'multiply')])),
+            diff.resource_links)
+        self.assertFalse(diff.skills_map_changed)
+        self.assertEquals(
+            {'q_add': set(['subtract']), 'q_mixed': set(['multiply'])},
+            diff.get_changed_resources())
+
+    def test_identical_maps_have_empty_diff(self):
+        maps = skills_updater_tests.make_maps()
+        self.assertTrue(map_replay.diff_maps(*(maps + maps)).is_empty)
+
+
+class ReplayTests(unittest.TestCase):
+
+    def setUp(self):
+        skills_map, resources_map = skills_updater_tests.make_maps()
+        self.store = skills_updater_tests.CountingStore()
+        self.updater = skills_updater.SkillsUpdater(
+            skills_map, resources_map, store=self.store)
+        self.history = map_replay.AttemptHistory()
+        for now, (student_id, resource_id, result) in enumerate(ATTEMPTS):
+            payload = {'resource_id': resource_id, 'result': result,
+                       'student_id': student_id}
+            self.updater.update_student(student_id, payload, now=now)
+            self.history.record(student_id, payload, now)
+
+    def test_inverted_index(self):
+        self.assertEquals(
+            set(['alice', 'carol']), self.history.get_students('q_mixed'))
+        self.assertEquals(set(), self.history.get_students('q_parts_1'))
+
+    def test_forgotten_student_leaves_index(self):
+        self.history.forget_student('alice')
+        self.assertEquals(set(['carol']), self.history.get_students('q_mixed'))
+        self.assertEquals(set(), self.history.get_students('q_add'))
+        self.assertEquals([], self.history.get_attempts('alice'))
+
+    def test_replay_matches_full_recomputation(self):
+        new_skills_map, new_resources_map = edited_maps()
+        diff = map_replay.diff_maps(
+            self.updater.skills_map, self.updater.resources_map,
+            new_skills_map, new_resources_map)
+        self.updater.set_resources_map(new_resources_map)
+        changes = []
+        self.updater.add_listener(
+            lambda student_id, skills, changed: changes.append(
+                (student_id, sorted(changed))))
+        self.store.num_puts = 0
+        affected = map_replay.replay(self.updater, diff, self.history)
+
+        # bob attempted no edited resource:
+        self.assertEquals(['alice', 'carol'], sorted(affected))
+        self.assertEquals(2, self.store.num_puts)
+        self.assertEquals(
+            [('alice', ['multiply', 'subtract']), ('carol', ['multiply'])],
+            sorted(changes))
+
+        full = skills_updater.SkillsUpdater(new_skills_map, new_resources_map)
+        for now, (student_id, resource_id, result) in enumerate(ATTEMPTS):
+            full.update_student(student_id, {
+                'resource_id': resource_id, 'result': result}, now=now)
+        for student_id in ['alice', 'bob', 'carol']:
+            expected = full.get_estimates(student_id, now=10)
+            actual = self.updater.get_estimates(student_id, now=10)
+            # Skills no longer measured fall back to the prior:
+            for skill_id, value in list(actual.items()):
+                if skill_id not in expected:
+                    self.assertEquals(
+                        skills_updater.SkillsUpdater.DEFAULT_PRIOR, value)
+                    del actual[skill_id]
+            self.assertEquals(sorted(expected), sorted(actual))
+            for skill_id in expected:
+                self.assertAlmostEqual(expected[skill_id], actual[skill_id])
+
+    def test_replay_covers_problems_of_edited_parts(self):
+        # The part no longer resolves, so q_mixed contributes its skills:
+        skills_map, _ = edited_maps()
+        new_resources_map = skills_models.ResourcesMap.from_xml(
+            skills_updater_tests.RESOURCES_MAP_XML.replace(
+                """    <resource id="q_parts_1">
+        <skills>
+            <skill idref="add"/>""",
+                """    <resource id="q_parts_1">
+        <skills>"""), skills_map=skills_map)
+        payload = {'resource_id': 'q_mixed', 'result': False,
+                   'answers': {'q_parts_1': 'answer'}}
+        self.updater.update_student('dave', payload, now=0)
+        self.history.record('dave', payload, 0)
+        self.assertNotIn('multiply', self.updater.get_estimates('dave'))
+        diff = map_replay.diff_maps(
+            self.updater.skills_map, self.updater.resources_map,
+            skills_map, new_resources_map)
+        self.updater.set_resources_map(new_resources_map)
+
+        affected = map_replay.replay(self.updater, diff, self.history)
+        self.assertEquals(set(['add', 'multiply']), affected['dave'])
+        full = skills_updater.SkillsUpdater(skills_map, new_resources_map)
+        full.update_student('dave', payload, now=0)
+        self.assertEquals(full.get_estimates('dave', now=10),
+                          self.updater.get_estimates('dave', now=10))
+
+
+if __name__ == '__main__':
+    unittest.main()
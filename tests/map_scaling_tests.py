@@ -0,0 +1,51 @@
+"""Tests for the map scaling suite."""
+
+import unittest
+
+from modules.learning_analytics import map_generator
+from modules.learning_analytics import map_scaling
+
+
+def fake_results(parse_exponent, query_exponent):
+    sizes = [1000, 4000, 16000, 64000]
+    return [{'size': size,
+             'parse_seconds': 1e-6 * size ** parse_exponent,
+             'peak_bytes': 100 * size,
+             'query_seconds': dict(
+                 (method_name, 1e-7 * size ** query_exponent)
+                 for method_name, _, _, _ in map_scaling.QUERIES)}
+            for size in sizes]
+
+
+class MapScalingTests(unittest.TestCase):
+
+    def test_fits_exponent(self):
+        self.assertAlmostEqual(
+            2.0, map_scaling.fit_exponent([1, 2, 4], [3, 12, 48]))
+        self.assertIsNone(map_scaling.fit_exponent([5], [1]))
+
+    def test_flags_only_super_linear_measures(self):
+        rows = map_scaling.analyze(fake_results(1.0, 0.0))
+        self.assertEquals([], [row for row in rows if row[3]])
+        rows = dict((row[0], row) for row in map_scaling.analyze(
+            fake_results(2.0, 1.0)))
+        self.assertTrue(rows['parse_seconds'][3])
+        self.assertFalse(rows['peak_bytes'][3])
+        self.assertTrue(rows['query:get_resources_for_skill'][3])
+
+    def test_runs_suite_on_small_maps(self):
+        results = map_scaling.run_suite([0.1, 0.2], num_queries=10)
+        self.assertEquals(2, len(results))
+        self.assertTrue(results[0]['size'] < results[1]['size'])
+        self.assertEquals(set(name for name, _, _, _ in map_scaling.QUERIES),
+                          set(results[0]['query_seconds']))
+        report = map_scaling.format_report(
+            results, map_scaling.analyze(results))
+        self.assertIn('parse_seconds', report)
+
+    def test_measures_rss_growth_of_parsing(self):
+        spec = map_generator.MapSpec.at_scale(2)
+        growth = map_scaling.measure_rss_growth(
+            ''.join(map_generator.iter_skills_map_xml(spec)),
+            ''.join(map_generator.iter_resources_map_xml(spec)))
+        self.assertTrue(growth > 0)
@@ -0,0 +1,156 @@
+"""Tests for the chunked columnar export of skill estimates."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from modules.learning_analytics import mastery_export
+from tests.ext.learning_analytics import skills_updater_tests
+
+
+def make_students(num_students):
+    return [('s%02d' % n, {'add': n / 100.0,
+                           '__updated__': {'add': 1000.0 + n}})
+            for n in range(num_students)]
+
+
+class ExportInterrupted(Exception):
+    pass
+
+
+def interrupt_after(students, num_students):
+    for n, student in enumerate(students):
+        if n == num_students:
+            raise ExportInterrupted()
+        yield student
+
+
+class MasteryExporterTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.skills_map, _ = skills_updater_tests.make_maps()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _make_exporter(self, chunk_size=4):
+        return mastery_export.MasteryExporter(
+            self.tmp_dir, self.skills_map, chunk_size=chunk_size)
+
+    def test_writes_skill_and_objective_rows(self):
+        self._make_exporter().export(make_students(2))
+        chunk = list(mastery_export.iter_chunks(self.tmp_dir))[0]
+        self.assertEquals(['s00', 's01'], chunk['students'])
+        manifest = mastery_export.load_manifest(self.tmp_dir)
+        self.assertTrue(manifest['complete'])
+        # One skill row and two objective rows per student:
+        self.assertEquals(6, manifest['num_rows'])
+
+        rows = [r for r in range(6) if chunk['student'][r] == 1]
+        skill_index = manifest['skills'].index('add')
+        sums_index = manifest['objectives'].index('sums')
+        by_kind = dict(((int(chunk['skill'][r]), int(chunk['objective'][r])),
+                        (float(chunk['estimate'][r]),
+                         float(chunk['timestamp'][r]))) for r in rows)
+        self.assertAlmostEqual(0.01, by_kind[(skill_index, -1)][0])
+        self.assertEquals(1001.0, by_kind[(skill_index, -1)][1])
+        # 'sums' averages 'add' with the unexercised 'subtract':
+        self.assertAlmostEqual(0.005, by_kind[(-1, sums_index)][0])
+        self.assertEquals(1001.0, by_kind[(-1, sums_index)][1])
+
+    def test_resumes_after_interruption(self):
+        students = make_students(10)
+        self.assertRaises(ExportInterrupted, self._make_exporter().export,
+                          interrupt_after(students, 9))
+        manifest = mastery_export.load_manifest(self.tmp_dir)
+        self.assertFalse(manifest['complete'])
+        self.assertEquals(8, manifest['num_students'])
+
+        manifest = self._make_exporter().export(students)
+        self.assertTrue(manifest['complete'])
+        self.assertEquals([4, 4, 2], [
+            chunk['num_students'] for chunk in manifest['chunks']])
+        exported = []
+        for chunk in mastery_export.iter_chunks(self.tmp_dir):
+            exported.extend(chunk['students'])
+        self.assertEquals([student_id for student_id, _ in students], exported)
+
+    def test_refuses_changed_student_order(self):
+        students = make_students(10)
+        self.assertRaises(ExportInterrupted, self._make_exporter().export,
+                          interrupt_after(students, 5))
+        self.assertRaises(ValueError, self._make_exporter().export,
+                          reversed(students))
+
+    def test_refuses_different_chunk_size(self):
+        self._make_exporter().export(make_students(1))
+        self.assertRaises(ValueError, self._make_exporter, chunk_size=5)
+
+    def test_main_exports_from_checkpoint(self):
+        from modules.learning_analytics import checkpoint
+        checkpoint_dir = os.path.join(self.tmp_dir, 'checkpoints')
+        skills_map, resources_map = skills_updater_tests.make_maps()
+        checkpoint.Checkpointer(checkpoint_dir).save({
+            'courses': {'course': {
+                'skills_map': skills_map,
+                'resources_map': resources_map,
+                'students': dict(make_students(3))}},
+            'position': {}})
+        out_dir = os.path.join(self.tmp_dir, 'export')
+        mastery_export.main([
+            '--checkpoint-dir', checkpoint_dir, '--course', 'course',
+            '--out', out_dir])
+        chunks = list(mastery_export.iter_chunks(out_dir))
+        self.assertEquals(['s00', 's01', 's02'], chunks[0]['students'])
+        self.assertEquals(numpy.float32, chunks[0]['estimate'].dtype)
+        self.assertEquals(numpy.int32, chunks[0]['skill'].dtype)
+        self.assertEquals(
+            checkpoint.Checkpointer(checkpoint_dir).latest_path(),
+            mastery_export.load_manifest(out_dir)['source'])
+
+    def test_main_resumes_from_rotated_checkpoint(self):
+        from modules.learning_analytics import checkpoint
+        checkpointer = checkpoint.Checkpointer(
+            os.path.join(self.tmp_dir, 'checkpoints'), keep=1)
+        skills_map, resources_map = skills_updater_tests.make_maps()
+
+        def save(students, now):
+            checkpointer.save({
+                'courses': {'course': {
+                    'skills_map': skills_map,
+                    'resources_map': resources_map,
+                    'students': students}},
+                'position': {}}, now=now)
+        save(make_students(3), 100)
+        out_dir = os.path.join(self.tmp_dir, 'export')
+        args = ['--checkpoint-dir', checkpointer.directory,
+                '--course', 'course', '--out', out_dir, '--chunk-size', '1']
+        write_chunk = mastery_export.MasteryExporter._write_chunk
+
+        def write_one_chunk(exporter, students):
+            if exporter.manifest['chunks']:
+                raise ExportInterrupted()
+            write_chunk(exporter, students)
+        mastery_export.MasteryExporter._write_chunk = write_one_chunk
+        try:
+            self.assertRaises(ExportInterrupted, mastery_export.main, args)
+        finally:
+            mastery_export.MasteryExporter._write_chunk = write_chunk
+        # The checkpoint the export started from is rotated away:
+        save(list(reversed(make_students(5))), 200)
+
+        mastery_export.main(args)
+        exported = []
+        for chunk in mastery_export.iter_chunks(out_dir):
+            exported.extend(chunk['students'])
+        self.assertEquals(['s00', 's01', 's02'], exported)
+        self.assertFalse(os.path.exists(os.path.join(
+            out_dir, mastery_export.MasteryExporter.SOURCE_FILE)))
+
+
+if __name__ == '__main__':
+    unittest.main()
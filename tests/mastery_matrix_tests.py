@@ -0,0 +1,69 @@
+"""Tests for the memory-mapped student x skill mastery matrix."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from modules.learning_analytics import mastery_matrix
+
+
+class MasteryMatrixTests(unittest.TestCase):
+
+    SKILL_IDS = ['add', 'subtract', 'multiply']
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = mastery_matrix.matrix_path(
+            self.tmp_dir, 'HumanitiesSciences/NCP-101/OnGoing')
+        self.matrix = mastery_matrix.MasteryMatrix.open(
+            self.path, self.SKILL_IDS)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_unwritten_cells_have_default_value(self):
+        self.assertEquals(0.0, self.matrix.get('nobody', 'add'))
+
+    def test_column_and_row_reads(self):
+        self.matrix.set('s1', 'add', 0.5)
+        self.matrix.set('s2', 'add', 0.25)
+        self.matrix.set('s2', 'multiply', 0.75)
+        self.assertEquals([0.5, 0.25], list(self.matrix.column('add')))
+        self.assertEquals([0.25, 0.0, 0.75], list(self.matrix.row('s2')))
+        self.assertEquals((2, 3), self.matrix.values.shape)
+        self.assertEquals(0.375, self.matrix.column('add').mean())
+
+    def test_column_is_a_contiguous_view(self):
+        self.matrix.set('s1', 'add', 0.5)
+        column = self.matrix.column('add')
+        self.assertTrue(column.flags['C_CONTIGUOUS'])
+        self.matrix.set('s1', 'add', 0.25)
+        self.assertEquals(0.25, column[0])
+
+    def test_grows_past_initial_capacity(self):
+        num_students = mastery_matrix.MasteryMatrix.INITIAL_CAPACITY + 10
+        for n in range(num_students):
+            self.matrix.set('s%d' % n, 'subtract', n % 2)
+        self.assertEquals(num_students, self.matrix.num_students)
+        self.assertEquals(num_students // 2, self.matrix.column(
+            'subtract').sum())
+
+    def test_listener_writes_changed_skills(self):
+        self.matrix.skills_changed(
+            's1', {'add': 0.5, 'subtract': 0.25}, {'add': None})
+        self.assertEquals(0.5, self.matrix.get('s1', 'add'))
+        self.assertEquals(0.0, self.matrix.get('s1', 'subtract'))
+
+    def test_reopen_keeps_data(self):
+        self.matrix.set('s1', 'multiply', 0.5)
+        self.matrix.close()
+        matrix = mastery_matrix.MasteryMatrix.open(self.path, self.SKILL_IDS)
+        self.assertEquals(['s1'], matrix.student_ids)
+        self.assertEquals(0.5, matrix.get('s1', 'multiply'))
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_reopen_rejects_different_skills(self):
+        self.matrix.close()
+        with self.assertRaises(ValueError):
+            mastery_matrix.MasteryMatrix.open(self.path, ['add'])
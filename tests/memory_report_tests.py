@@ -0,0 +1,71 @@
+"""Tests for the memory accounting of the handler's structures."""
+
+import sys
+import threading
+import unittest
+
+from modules.learning_analytics import memory_report
+
+
+class Node(object):
+
+    def __init__(self, value):
+        self.value = value
+        self.lock = threading.Lock()
+        self.callback = self.get_value
+
+    def get_value(self):
+        return self.value
+
+
+class DeepSizeTests(unittest.TestCase):
+
+    def test_sums_reachable_objects(self):
+        key = 'key'
+        value = [1.5, 'text']
+        obj = {key: value}
+        expected = sum(sys.getsizeof(part) for part in
+                       [obj, key, value, value[0], value[1]])
+        self.assertEquals((expected, 5), memory_report.deep_size(obj))
+
+    def test_shared_objects_are_charged_once(self):
+        shared = list(range(100, 200))
+        seen = {}
+        first = memory_report.deep_size([shared], seen)
+        second = memory_report.deep_size([shared], seen)
+        self.assertEquals((sys.getsizeof([shared]), 1), second)
+        self.assertTrue(first[0] > 10 * second[0])
+
+    def test_callbacks_and_locks_are_not_followed(self):
+        node = Node(2.5)
+        size, num_objects = memory_report.deep_size(node)
+        # The node, its __dict__, the three attribute names and the value:
+        self.assertEquals(6, num_objects)
+        self.assertTrue(size < 2000)
+
+    def test_large_containers_are_extrapolated(self):
+        students = dict(('student-%d' % n, {'add': n / 7.0, 'sub': n / 3.0})
+                        for n in range(20000))
+        exact = memory_report.deep_size(students, sample_size=10 ** 6)
+        estimate = memory_report.deep_size(students, sample_size=500)
+        self.assertAlmostEqual(1.0, float(estimate[0]) / exact[0], delta=0.05)
+        self.assertAlmostEqual(1.0, float(estimate[1]) / exact[1], delta=0.05)
+
+
+class MemoryAccountantTests(unittest.TestCase):
+
+    def test_reports_growth_since_last_report(self):
+        accountant = memory_report.MemoryAccountant()
+        state = {}
+        first = accountant.report([('state', state, threading.Lock())],
+                                  now=10)
+        self.assertEquals([None], [row['growth_bytes']
+                                   for row in first['structures']])
+        state.update(('s%d' % n, float(n)) for n in range(100))
+        second = accountant.report([('state', state, None)], now=70)
+        row = second['structures'][0]
+        self.assertEquals(row['bytes'] - first['structures'][0]['bytes'],
+                          row['growth_bytes'])
+        self.assertEquals(200, row['growth_objects'])
+        self.assertEquals(60, second['seconds'])
+        self.assertIn('state', memory_report.format_report(second))
@@ -0,0 +1,66 @@
+"""Tests for the incrementally maintained objective aggregates."""
+
+import random
+import unittest
+
+from modules.learning_analytics import objective_mastery
+from modules.learning_analytics import skills_updater
+from tests.ext.learning_analytics import skills_updater_tests
+
+
+class ObjectiveMasteryAggregatesTests(unittest.TestCase):
+
+    def setUp(self):
+        skills_map, resources_map = skills_updater_tests.make_maps()
+        self.skills_map = skills_map
+        self.updater = skills_updater.SkillsUpdater(skills_map, resources_map)
+        self.aggregates = objective_mastery.ObjectiveMasteryAggregates(
+            skills_map)
+        self.updater.add_listener(self.aggregates.skills_changed)
+
+    def _assert_matches_full_scan(self, student_id):
+        student_skills = self.updater.store.get(student_id)
+        for objective in self.skills_map.objectives:
+            values = [
+                student_skills.get(skill_id, 0.0) for skill_id in
+                self.skills_map.get_skills_for_objective(objective.id)]
+            self.assertAlmostEquals(
+                sum(values) / len(values),
+                self.aggregates.get_mean(student_id, objective.id))
+            self.assertEquals(
+                min(values), self.aggregates.get_min(student_id, objective.id))
+
+    def test_untouched_objective_reports_default_prior(self):
+        self.assertEquals(0.0, self.aggregates.get_mean('student', 'sums'))
+        self.assertEquals(0.0, self.aggregates.get_min('student', 'sums'))
+
+    def test_unknown_objective_reports_none(self):
+        self.assertIsNone(self.aggregates.get_mean('student', 'bad_id'))
+        self.assertIsNone(self.aggregates.get_min('student', 'bad_id'))
+
+    def test_aggregates_follow_updates(self):
+        self.updater.update_student(
+            'student', {'resource_id': 'q_mixed', 'result': True})
+        self._assert_matches_full_scan('student')
+        self.updater.update_student(
+            'student', {'resource_id': 'q_add', 'result': False})
+        self._assert_matches_full_scan('student')
+
+    def test_random_updates_match_full_scan(self):
+        rnd = random.Random(7)
+        for _ in range(200):
+            self.updater.update_student('student', {
+                'resource_id': rnd.choice(['q_add', 'q_mixed']),
+                'result': rnd.random() < 0.6})
+            self._assert_matches_full_scan('student')
+
+    def test_load_student_rebuilds_from_state(self):
+        self.updater.store.put(
+            'student', {'add': 0.9, 'subtract': 0.4, 'multiply': 0.2})
+        self.aggregates.load_student(
+            'student', self.updater.store.get('student'))
+        self._assert_matches_full_scan('student')
+        self.assertEquals(
+            {'sums': (0.65, 0.4), 'all': (0.5, 0.2)},
+            dict((key, (round(mean, 2), low)) for key, (mean, low) in
+                 self.aggregates.get_objectives('student').items()))
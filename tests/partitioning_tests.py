@@ -0,0 +1,277 @@
+"""Tests for the student-partitioned deployment of several instances."""
+
+import json
+import multiprocessing
+import threading
+import time
+import unittest
+
+from modules.learning_analytics import learning_analytics_schoolbus
+from modules.learning_analytics import local_bus
+from modules.learning_analytics import partitioning
+from tests.ext.learning_analytics import learning_analytics_schoolbus_tests
+from tests.ext.learning_analytics import skills_updater_tests
+
+
+NUM_PARTITIONS = 8
+
+
+def run_instance(address, instance_id, stop_event):
+    """Run a partitioned handler instance until stop_event is set."""
+    bus = local_bus.LocalBusAdapter(*address)
+    coordinator = partitioning.PartitionCoordinator(
+        instance_id, NUM_PARTITIONS, message_class=local_bus.LocalBusMessage,
+        heartbeat_interval=0.05, member_timeout=2, handoff_timeout=5)
+    handler = learning_analytics_schoolbus.AnalyticsSchoolbusHandler(
+        course_maps={'course': skills_updater_tests.make_maps()},
+        bus_adapter=bus, coordinator=coordinator)
+    handler.start()
+    stop_event.wait()
+    handler.close()
+    bus.close()
+
+
+class PartitionAssignmentTests(unittest.TestCase):
+
+    def test_partition_is_stable_and_in_range(self):
+        partitions = [partitioning.get_partition('student-%d' % n, 8)
+                      for n in range(100)]
+        self.assertEquals(partitions, [
+            partitioning.get_partition(u'student-%d' % n, 8)
+            for n in range(100)])
+        self.assertEquals(set(range(8)), set(partitions))
+
+    def test_joining_instance_takes_only_partitions_it_wins(self):
+        before = [partitioning.get_owner(partition, ['a', 'b'])
+                  for partition in range(64)]
+        after = [partitioning.get_owner(partition, ['a', 'b', 'c'])
+                 for partition in range(64)]
+        moved = [partition for partition in range(64)
+                 if before[partition] != after[partition]]
+        self.assertTrue(moved)
+        self.assertEquals(['c'] * len(moved), [after[p] for p in moved])
+        self.assertEquals(set(['a', 'b']), set(before))
+        self.assertEquals(None, partitioning.get_owner(0, []))
+
+    def test_router_numbers_actions_per_partition(self):
+        bus = learning_analytics_schoolbus_tests.FakeBusAdapter()
+        router = partitioning.PartitionRouter(
+            bus, 4, message_class=local_bus.LocalBusMessage)
+        router.start()
+        for _ in range(2):
+            bus.deliver('studentAction',
+                        learning_analytics_schoolbus_tests.student_action())
+        partition = partitioning.get_partition('student', 4)
+        self.assertEquals(
+            ['studentAction.%d' % partition] * 2,
+            [message.topicName for message in bus.published])
+        envelopes = [json.loads(message.content) for message in bus.published]
+        self.assertEquals([1, 2], [envelope['seq'][1] for envelope in envelopes])
+        self.assertEquals('student', envelopes[0]['action']['student_id'])
+
+
+class PartitionHandoffTests(unittest.TestCase):
+
+    def _make_coordinator(self, instance_id, bus):
+        coordinator = partitioning.PartitionCoordinator(
+            instance_id, NUM_PARTITIONS, bus_adapter=bus,
+            message_class=local_bus.LocalBusMessage, students_per_handoff=2)
+        coordinator.handler = learning_analytics_schoolbus.AnalyticsSchoolbusHandler(
+            course_maps={'course': skills_updater_tests.make_maps()},
+            bus_adapter=bus)
+        return coordinator
+
+    def test_large_handoffs_are_split_and_sent_without_the_lock(self):
+        bus = learning_analytics_schoolbus_tests.FakeBusAdapter()
+        sender = self._make_coordinator('a', bus)
+        partition = 3
+        students = [student_id for student_id in ('student-%d' % n for n in range(100))
+                    if partitioning.get_partition(student_id, NUM_PARTITIONS) == partition][:5]
+        for student_id in students:
+            sender.handler.new_student_info(learning_analytics_schoolbus_tests.FakeBusMessage(
+                json.dumps(learning_analytics_schoolbus_tests.student_action(student_id))))
+        estimates = sender.handler.updaters['course'].get_estimates(students[0])
+        sender.partitions[partition] = sender.ACTIVE
+        sender.sequences[partition] = [0, 5]
+
+        export_students = sender.handler.export_students
+        unlocked = []
+
+        def probe_lock():
+            acquired = sender.lock.acquire(False)
+            if acquired:
+                sender.lock.release()
+            unlocked.append(acquired)
+
+        def export_while_probing_lock(belongs):
+            probe = threading.Thread(target=probe_lock)
+            probe.start()
+            probe.join()
+            return export_students(belongs)
+
+        sender.handler.export_students = export_while_probing_lock
+        with sender.lock:
+            released = sender._release(set([partition]), ['b'])
+        sender._hand_off(released)
+        self.assertEquals([True], unlocked)
+        messages = [json.loads(message.content) for message in bus.published
+                    if message.topicName == partitioning.PARTITION_CONTROL_TOPIC]
+        handoffs = [message['partitions'][str(partition)] for message in messages]
+        self.assertEquals([True, True, False],
+                          [handoff.get('more', False) for handoff in handoffs])
+        self.assertEquals([2, 2, 1], [len(handoff['courses']['course']['students'])
+                                      for handoff in handoffs])
+
+        receiver = self._make_coordinator(
+            'b', learning_analytics_schoolbus_tests.FakeBusAdapter())
+        receiver.partitions[partition] = receiver.PENDING
+        receiver.pending[partition] = (time.time() + 10, [])
+        for message in bus.published[:-1]:
+            receiver.on_control(message)
+            self.assertEquals(receiver.PENDING, receiver.partitions[partition])
+        receiver.on_control(bus.published[-1])
+        self.assertEquals(receiver.ACTIVE, receiver.partitions[partition])
+        self.assertEquals(1, receiver.num_taken_over)
+        self.assertEquals([0, 5], receiver.sequences[partition])
+        self.assertEquals(
+            estimates, receiver.handler.updaters['course'].get_estimates(students[0]))
+        self.assertEquals(
+            set(students), set(receiver.handler.updaters['course'].store.student_ids))
+
+
+class PartitionedDeploymentTests(unittest.TestCase):
+    """Runs instances as separate processes on a local bus."""
+
+    def setUp(self):
+        self.server = local_bus.LocalBusServer()
+        self.server.start()
+        self.bus = local_bus.LocalBusAdapter(*self.server.address)
+        self.router = partitioning.PartitionRouter(
+            self.bus, NUM_PARTITIONS, message_class=local_bus.LocalBusMessage)
+        self.router.start()
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.updates = []
+        self.bus.subscribeToTopic('schoolbusStats', self._on_stats)
+        self.bus.subscribeToTopic('skillmapUpdate', self._on_update)
+        self.instances = {}
+        self.num_sent = 0
+
+    def tearDown(self):
+        for stop_event, process in self.instances.values():
+            stop_event.set()
+            process.join(10)
+        self.bus.close()
+        self.server.stop()
+
+    def _on_stats(self, bus_message):
+        stats = json.loads(bus_message.content)
+        with self.lock:
+            self.stats[stats['partitions']['instance_id']] = stats
+
+    def _on_update(self, bus_message):
+        with self.lock:
+            self.updates.append(json.loads(bus_message.content))
+
+    def _start_instance(self, instance_id):
+        stop_event = multiprocessing.Event()
+        process = multiprocessing.Process(
+            target=run_instance,
+            args=(self.server.address, instance_id, stop_event))
+        process.daemon = True
+        process.start()
+        self.instances[instance_id] = (stop_event, process)
+
+    def _stop_instance(self, instance_id):
+        stop_event, process = self.instances.pop(instance_id)
+        stop_event.set()
+        process.join(10)
+
+    def _send(self, student_id):
+        action = learning_analytics_schoolbus_tests.student_action(
+            student_id=student_id)
+        # Distinct actions, so that none is taken for a duplicate:
+        action['time'] = self.num_sent
+        self.num_sent += 1
+        self.bus.publish(local_bus.LocalBusMessage(
+            content=json.dumps(action), topicName='studentAction'))
+
+    def _wait_for(self, condition, timeout=20):
+        """Poll the stats of all instances until condition holds of them."""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self.lock:
+                self.stats = {}
+            self.bus.publish(local_bus.LocalBusMessage(
+                content=json.dumps({'command': 'stats'}),
+                topicName='schoolbusControl'))
+            time.sleep(0.2)
+            with self.lock:
+                stats = dict(self.stats)
+            if set(stats) == set(self.instances) and condition(stats):
+                return stats
+        self.fail('Instances did not reach the expected state: %s' % stats)
+
+    def _wait_for_balance(self):
+        def balanced(stats):
+            active = [partition for instance_stats in stats.values()
+                      for partition in instance_stats['partitions']['active']]
+            return (sorted(active) == list(range(NUM_PARTITIONS)) and
+                    all(len(instance_stats['partitions']['members']) ==
+                        len(stats) - 1 for instance_stats in stats.values()))
+        return self._wait_for(balanced)
+
+    def _wait_for_processed(self):
+        return self._wait_for(lambda stats: self.num_sent == sum(
+            instance_stats['position']['num_processed']
+            for instance_stats in stats.values()))
+
+    def _last_estimate(self, student_id):
+        with self.lock:
+            updates = [message['updates'] for message in self.updates
+                       if message['student_id'] == student_id]
+        return [update['value'] for update in updates[-1]
+                if update['kind'] == 'skill' and update['id'] == 'add'][0]
+
+    def test_students_are_handed_off_on_join_and_leave(self):
+        # The estimates a single instance computes for three correct answers:
+        bus = learning_analytics_schoolbus_tests.FakeBusAdapter()
+        reference = learning_analytics_schoolbus.AnalyticsSchoolbusHandler(
+            course_maps={'course': skills_updater_tests.make_maps()},
+            bus_adapter=bus, num_workers=0)
+        reference.start()
+        expected = []
+        for n in range(3):
+            action = learning_analytics_schoolbus_tests.student_action()
+            action['time'] = n
+            bus.deliver('studentAction', action)
+            expected.append(
+                reference.updaters['course'].get_estimates('student')['add'])
+
+        students = ['student-%d' % n for n in range(20)]
+        moving = [student_id for student_id in students
+                  if partitioning.get_owner(partitioning.get_partition(
+                      student_id, NUM_PARTITIONS), ['a', 'b']) == 'b'][0]
+
+        self._start_instance('a')
+        self._wait_for_balance()
+        for student_id in students:
+            self._send(student_id)
+        self._wait_for_processed()
+        self.assertAlmostEqual(expected[0], self._last_estimate(moving))
+
+        self._start_instance('b')
+        stats = self._wait_for_balance()
+        self.assertTrue(stats['a']['partitions']['num_handed_off'] > 0)
+        self._send(moving)
+        stats = self._wait_for_processed()
+        # Taken up by the new owner where the old one left off:
+        self.assertEquals(1, stats['b']['position']['num_processed'])
+        self.assertAlmostEqual(expected[1], self._last_estimate(moving))
+
+        self._stop_instance('b')
+        self._wait_for_balance()
+        self._send(moving)
+        self._wait_for(lambda stats: stats['a']['position']['num_processed'] ==
+                       len(students) + 1)
+        self.assertAlmostEqual(expected[2], self._last_estimate(moving))
@@ -0,0 +1,96 @@
+"""Tests for prerequisite-aware adjustment of skill estimates."""
+
+import unittest
+
+from modules.learning_analytics import prerequisite_propagation
+from modules.learning_analytics import skills_models
+
+
+# A chain a <- b <- c, plus d requiring b:
+SKILLS_MAP_XML = """\
+<?xml version="1.0" encoding="UTF-8"?>
+<skills-map>
+    <skills>
+        <skill id="a">A</skill>
+        <skill id="b">B</skill>
+        <skill id="c">C</skill>
+        <skill id="d">D</skill>
+        <skill id="e">Unrelated</skill>
+    </skills>
+    <objectives></objectives>
+    <prerequisites>
+        <prerequisite skill="b" requires="a"/>
+        <prerequisite skill="c" requires="b"/>
+        <prerequisite skill="d" requires="b"/>
+    </prerequisites>
+</skills-map>
+"""
+
+
+class PrerequisitePropagatorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.skills_map = skills_models.SkillsMap.from_xml(SKILLS_MAP_XML)
+        self.propagator = prerequisite_propagation.PrerequisitePropagator(
+            self.skills_map, down_weight=0.9, up_weight=0.5)
+
+    def _change(self, student_skills, changed):
+        self.propagator.skills_changed(
+            'student', student_skills,
+            dict((skill_id, None) for skill_id in changed))
+
+    def test_mastery_supports_prerequisites(self):
+        self._change({'c': 1.0}, ['c'])
+        self.assertAlmostEqual(0.9, self.propagator.get_estimate('student', 'b'))
+        self.assertAlmostEqual(0.81, self.propagator.get_estimate('student', 'a'))
+        self.assertEquals(1.0, self.propagator.get_estimate('student', 'c'))
+        # d only shares a prerequisite with c:
+        self.assertEquals(0.0, self.propagator.get_estimate('student', 'd'))
+
+    def test_prerequisites_support_dependents(self):
+        student_skills = {'a': 0.8}
+        self._change(student_skills, ['a'])
+        self.assertAlmostEqual(0.4, self.propagator.get_estimate('student', 'b'))
+        self.assertAlmostEqual(0.2, self.propagator.get_estimate('student', 'c'))
+
+        student_skills['b'] = 0.6
+        self._change(student_skills, ['b'])
+        self.assertAlmostEqual(0.6, self.propagator.get_estimate('student', 'b'))
+        self.assertAlmostEqual(0.3, self.propagator.get_estimate('student', 'd'))
+        self.assertAlmostEqual(0.8, self.propagator.get_estimate('student', 'a'))
+
+    def test_bkt_estimate_is_a_lower_bound(self):
+        self._change({'a': 0.1, 'b': 0.95}, ['a', 'b'])
+        self.assertAlmostEqual(0.855, self.propagator.get_estimate('student', 'a'))
+        self.assertEquals(0.95, self.propagator.get_estimate('student', 'b'))
+
+    def test_incremental_matches_full_recomputation(self):
+        student_skills = {}
+        for skill_id, value in [('a', 0.3), ('c', 0.7), ('b', 0.2),
+                                ('d', 0.9), ('a', 0.95), ('e', 0.5)]:
+            student_skills[skill_id] = value
+            self._change(student_skills, [skill_id])
+        full = prerequisite_propagation.PrerequisitePropagator(
+            self.skills_map, down_weight=0.9, up_weight=0.5)
+        full.load_student('student', student_skills)
+        for skill_id in 'abcde':
+            self.assertAlmostEqual(
+                full.get_estimate('student', skill_id),
+                self.propagator.get_estimate('student', skill_id))
+
+    def test_update_only_visits_affected_skills(self):
+        visited = []
+        get_dependents = self.skills_map.get_dependents
+
+        def counting_get_dependents(skill_id):
+            visited.append(skill_id)
+            return get_dependents(skill_id)
+
+        self.skills_map.get_dependents = counting_get_dependents
+        self._change({'e': 1.0}, ['e'])
+        # The unrelated skill is reached alone, once in each pass:
+        self.assertEquals(['e', 'e'], visited)
+        self.assertEquals({'e': 1.0}, self.propagator.get_estimates('student'))
+
+if __name__ == '__main__':
+    unittest.main()
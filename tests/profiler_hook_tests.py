@@ -0,0 +1,86 @@
+"""Tests for on-demand profiling sessions."""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from modules.learning_analytics import profiler_hook
+
+
+ProfileSession = profiler_hook.ProfileSession
+
+
+def busy_leaf(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+def busy_root(seconds):
+    busy_leaf(seconds)
+
+
+class StackProfileTests(unittest.TestCase):
+
+    def test_collapsed_lines_and_top_functions(self):
+        profile = profiler_hook.StackProfile()
+        profile.add(('main', 'parse'), 3)
+        profile.add(('main', 'update', 'parse'), 2)
+        profile.add(('main',), 1)
+        self.assertEquals(
+            ['main;parse 3', 'main;update;parse 2', 'main 1'],
+            profile.collapsed_lines())
+        top = profile.top_functions()
+        self.assertEquals(('parse', 5, 5), top[0])
+        self.assertEquals(('main', 1, 6), top[1])
+
+
+class ProfileSessionTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.prefix = os.path.join(self.tmp_dir, 'profile')
+        self.finished = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _read(self, suffix):
+        with open(self.prefix + suffix) as output_file:
+            return output_file.read()
+
+    def test_deterministic_session_ends_after_messages(self):
+        session = ProfileSession(
+            self.prefix, mode=ProfileSession.DETERMINISTIC, max_messages=2,
+            on_finish=self.finished.append)
+        self.assertEquals(3, session.run(lambda x: x + 1, 2))
+        session.run(busy_root, 0.01)
+        self.assertEquals([session], self.finished)
+        self.assertIn(
+            'profiler_hook_tests.py:busy_root;profiler_hook_tests.py:busy_leaf',
+            self._read('.collapsed'))
+        summary = self._read('.txt')
+        self.assertIn('deterministic profile of 2 messages', summary)
+        self.assertIn('busy_leaf', summary)
+
+        # Later runs are not profiled:
+        session.run(busy_root, 0)
+        self.assertEquals(2, session.num_messages)
+
+    def test_sampling_session_ends_after_seconds(self):
+        session = ProfileSession(
+            self.prefix, max_seconds=0.2, sample_interval=0.001,
+            on_finish=self.finished.append)
+        session.run(busy_root, 0.1)
+        deadline = time.time() + 5
+        while not self.finished and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEquals([session], self.finished)
+        self.assertIn('busy_leaf', self._read('.collapsed'))
+        self.assertIn('sampling profile of 1 messages', self._read('.txt'))
+
+
+if __name__ == '__main__':
+    unittest.main()
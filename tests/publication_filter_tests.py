@@ -0,0 +1,73 @@
+"""Tests for the significance filter of outgoing estimate updates."""
+
+import unittest
+
+from modules.learning_analytics import publication_filter
+
+
+PublicationFilter = publication_filter.PublicationFilter
+
+
+class PublicationFilterTests(unittest.TestCase):
+
+    def setUp(self):
+        self.filter = PublicationFilter(
+            epsilon=0.1, bands=[0.4, 0.95], max_staleness=100)
+
+    def _check(self, value, now=0, item_id='add'):
+        return self.filter.check(
+            'student', PublicationFilter.SKILL, item_id, value, now)
+
+    def test_first_value_is_published(self):
+        self.assertEquals(PublicationFilter.FIRST, self._check(0.1))
+        self.assertEquals(
+            PublicationFilter.FIRST, self._check(0.1, item_id='subtract'))
+
+    def test_small_changes_are_suppressed(self):
+        self._check(0.1)
+        self.assertIsNone(self._check(0.15))
+        self.assertIsNone(self._check(0.19))
+        # Compared with the last published value, not the last seen one:
+        self.assertEquals(PublicationFilter.EPSILON, self._check(0.21))
+        self.assertIsNone(self._check(0.25))
+
+    def test_band_crossing_is_published(self):
+        self._check(0.35)
+        self.assertEquals(PublicationFilter.BAND, self._check(0.41))
+        self.assertEquals(PublicationFilter.BAND, self._check(0.39))
+
+    def test_stale_change_is_published(self):
+        self._check(0.1, now=0)
+        self.assertIsNone(self._check(0.12, now=50))
+        self.assertEquals(PublicationFilter.STALE, self._check(0.12, now=100))
+        # Unchanged values are never republished:
+        self.assertIsNone(self._check(0.12, now=1000))
+
+    def test_stale_suppressed_change_is_flushed(self):
+        self._check(0.1, now=0)
+        self._check(0.3, now=0, item_id='subtract')
+        self.assertIsNone(self._check(0.12, now=50))
+        self.assertIsNone(self._check(0.3, now=50, item_id='subtract'))
+        self.assertEquals([], self.filter.flush_stale(99))
+        self.assertEquals(
+            [('student', PublicationFilter.SKILL, 'add', 0.12)],
+            self.filter.flush_stale(100))
+        # Flushed values count as published:
+        self.assertEquals([], self.filter.flush_stale(1000))
+        self.assertIsNone(self._check(0.12, now=1000))
+
+    def test_change_back_is_not_flushed(self):
+        self._check(0.1, now=0)
+        self._check(0.12, now=50)
+        self._check(0.1, now=60)
+        self.assertEquals([], self.filter.flush_stale(1000))
+
+    def test_stats(self):
+        for value in [0.1, 0.11, 0.12, 0.5]:
+            self._check(value)
+        self.assertEquals({'num_checked': 4, 'num_published': 2},
+                          self.filter.stats())
+
+
+if __name__ == '__main__':
+    unittest.main()
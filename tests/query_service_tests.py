@@ -0,0 +1,137 @@
+"""Tests for the read-side HTTP API."""
+
+import json
+import unittest
+
+try:
+    from urllib.parse import quote
+    from urllib.request import urlopen
+except ImportError:
+    from urllib import quote
+    from urllib2 import urlopen
+
+import tornado.testing
+
+from modules.learning_analytics import learning_analytics_schoolbus
+from modules.learning_analytics import query_service
+from tests.ext.learning_analytics import learning_analytics_schoolbus_tests
+from tests.ext.learning_analytics import skills_updater_tests
+
+COURSE_ID = 'Humanities/NCP-101/OnGoing'
+
+
+def make_handler(bus):
+    handler = learning_analytics_schoolbus.AnalyticsSchoolbusHandler(
+        course_maps={COURSE_ID: skills_updater_tests.make_maps()},
+        bus_adapter=bus, num_workers=0)
+    handler.start()
+    return handler
+
+
+def answer(bus, student_id, resource_id='q_add', result=True, time=0):
+    action = learning_analytics_schoolbus_tests.student_action(
+        student_id=student_id, resource_id=resource_id, result=result)
+    action['course_id'] = COURSE_ID
+    action['time'] = time
+    bus.deliver('studentAction', action)
+
+
+class QueryServiceTests(tornado.testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.bus = learning_analytics_schoolbus_tests.FakeBusAdapter()
+        self.handler = make_handler(self.bus)
+        self.service = query_service.QueryService(self.handler)
+        return query_service.make_application(self.service)
+
+    def _get(self, path, etag=None):
+        headers = {'If-None-Match': etag} if etag is not None else {}
+        return self.fetch('/courses/%s%s' % (quote(COURSE_ID, safe=''), path),
+                          headers=headers)
+
+    def test_student_estimates(self):
+        answer(self.bus, 'student', 'q_mixed')
+        response = self._get('/students/student')
+        self.assertEquals(200, response.code)
+        body = json.loads(response.body.decode('utf-8'))
+        estimates = self.handler.updaters[COURSE_ID].get_estimates(
+            'student', now=0)
+        self.assertEquals(set(['add', 'multiply']), set(body['skills']))
+        self.assertAlmostEqual(estimates['add'],
+                               body['skills']['add']['estimate'])
+        self.assertEquals(set(['all', 'sums']), set(body['objectives']))
+
+    def test_unchanged_state_is_not_modified(self):
+        answer(self.bus, 'student')
+        first = self._get('/students/student')
+        etag = first.headers['ETag']
+        self.assertEquals(304, self._get('/students/student', etag).code)
+        # Other students do not change the student's version:
+        answer(self.bus, 'other')
+        self.assertEquals(304, self._get('/students/student', etag).code)
+        answer(self.bus, 'student', time=1)
+        second = self._get('/students/student', etag)
+        self.assertEquals(200, second.code)
+        self.assertNotEquals(etag, second.headers['ETag'])
+        self.assertNotEquals(first.body, second.body)
+
+    def test_recommendations(self):
+        answer(self.bus, 'student', 'q_mixed')
+        response = self._get('/students/student/recommendations?k=1')
+        body = json.loads(response.body.decode('utf-8'))
+        self.assertEquals(
+            [[resource_id, gain] for resource_id, gain in
+             self.handler.recommend(COURSE_ID, 'student', k=1)],
+            body['resources'])
+        self.assertEquals(
+            304, self._get('/students/student/recommendations?k=1',
+                           response.headers['ETag']).code)
+
+    def test_responses_are_cached_until_updated(self):
+        answer(self.bus, 'student')
+        bodies = [self._get('/skills/add').body for _ in range(3)]
+        self.assertEquals(1, len(set(bodies)))
+        self.assertEquals({'entries': 1, 'hits': 2, 'misses': 1},
+                          self.service.cache.stats())
+        answer(self.bus, 'other', result=False)
+        body = json.loads(self._get('/skills/add').body.decode('utf-8'))
+        self.assertEquals(2, self.service.cache.stats()['misses'])
+        self.assertEquals(2, body['num_students'])
+        self.assertEquals(2, sum(body['histogram']))
+        self.assertNotIn('students', body)
+
+    def test_at_risk_and_weakest_students(self):
+        for n in range(5):
+            answer(self.bus, 'strong', time=n)
+        answer(self.bus, 'weak', result=False)
+        below = json.loads(self._get('/at-risk/skills/add').body.decode('utf-8'))
+        self.assertEquals(['weak'], [entry[0] for entry in below['students']])
+        weakest = json.loads(
+            self._get('/at-risk/objectives/all?k=2').body.decode('utf-8'))
+        self.assertEquals(['weak', 'strong'],
+                          [entry[0] for entry in weakest['students']])
+
+    def test_errors(self):
+        self.assertEquals(404, self.fetch('/courses/other/skills/add').code)
+        self.assertEquals(404, self._get('/students/nobody').code)
+        response = self._get('/at-risk/skills/add?k=many')
+        self.assertEquals(400, response.code)
+        self.assertEquals({'error': 'Bad k'},
+                          json.loads(response.body.decode('utf-8')))
+
+
+class QueryServerTests(unittest.TestCase):
+
+    def test_serves_on_its_own_thread(self):
+        bus = learning_analytics_schoolbus_tests.FakeBusAdapter()
+        handler = make_handler(bus)
+        answer(bus, 'student')
+        server = query_service.QueryServer(handler, 0)
+        server.start()
+        try:
+            body = urlopen('http://127.0.0.1:%d/courses/%s/students/student' % (
+                server.port, quote(COURSE_ID, safe=''))).read()
+        finally:
+            server.stop()
+        self.assertEquals('student',
+                          json.loads(body.decode('utf-8'))['student_id'])
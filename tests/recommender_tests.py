@@ -0,0 +1,77 @@
+"""Tests for the next-best-resource recommender."""
+
+import unittest
+
+from modules.learning_analytics import map_generator
+from modules.learning_analytics import recommender
+from modules.learning_analytics import skills_models
+from modules.learning_analytics import skills_updater
+from tests.ext.learning_analytics import skills_updater_tests
+
+DEFAULT_PRIOR = skills_updater.SkillsUpdater.DEFAULT_PRIOR
+
+
+def expected_gain(estimator, prior):
+    p_correct = prior * 0.8 + (1 - prior) * 0.3
+    return (p_correct * estimator.get_posterior(prior, True) +
+            (1 - p_correct) * estimator.get_posterior(prior, False) - prior)
+
+
+class ResourceGainIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.estimator = skills_models.BKTEstimator.get_standard_estimator()
+        skills_map, resources_map = skills_updater_tests.make_maps()
+        self.index = recommender.ResourceGainIndex(
+            skills_map, resources_map, self.estimator, DEFAULT_PRIOR)
+
+    def test_scores_sum_expected_gains_of_skills(self):
+        estimates = {'add': 0.3, 'multiply': 0.6}
+        scores = dict(zip(self.index.resource_ids, self.index.score(
+            self.index.get_state_vector(estimates))))
+        gain = dict((skill_id, expected_gain(
+            self.estimator, estimates.get(skill_id, DEFAULT_PRIOR)))
+            for skill_id in ('add', 'subtract', 'multiply'))
+        self.assertAlmostEqual(gain['add'], scores['q_add'])
+        self.assertAlmostEqual(gain['add'] + gain['multiply'],
+                               scores['q_mixed'])
+        self.assertAlmostEqual(gain['add'] + gain['subtract'],
+                               scores['q_parts_2'])
+
+    def test_mastered_skills_gain_nothing(self):
+        recommendations = self.index.recommend(
+            {'add': 0.99, 'subtract': 0.99, 'multiply': 0.5}, k=10)
+        self.assertEquals(['q_mixed'], [resource_id for resource_id, _
+                                        in recommendations])
+
+    def test_objective_and_exclusions_restrict_candidates(self):
+        recommendations = self.index.recommend(
+            {'add': 0.99}, k=10, objective_id='sums', exclude=['q_add'])
+        self.assertEquals(['q_parts_2'], [resource_id for resource_id, _
+                                          in recommendations])
+
+    def test_top_k_matches_scoring_every_resource(self):
+        spec = map_generator.MapSpec.at_scale(1)
+        skills_map = skills_models.SkillsMap.from_xml(
+            ''.join(map_generator.iter_skills_map_xml(spec)))
+        resources_map = skills_models.ResourcesMap.from_xml(
+            ''.join(map_generator.iter_resources_map_xml(spec)),
+            skills_map=skills_map)
+        index = recommender.ResourceGainIndex(
+            skills_map, resources_map, self.estimator, DEFAULT_PRIOR)
+        estimates = dict(
+            (map_generator.skill_id(n), (n % 10) / 10.0)
+            for n in range(spec.num_skills))
+        expected = sorted(
+            ((resource_id, sum(
+                expected_gain(self.estimator, estimates[skill_id])
+                for skill_id in resources_map.get_skills_for_resource(
+                    resource_id)))
+             for resource_id in resources_map.resource_ids),
+            key=lambda item: -item[1])
+        recommendations = index.recommend(estimates, k=20)
+        self.assertEquals(20, len(recommendations))
+        for (_, expected_score), (_, score) in zip(expected, recommendations):
+            self.assertAlmostEqual(expected_score, score)
+        for resource_id, score in recommendations:
+            self.assertAlmostEqual(dict(expected)[resource_id], score)
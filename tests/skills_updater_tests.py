@@ -0,0 +1,224 @@
+"""Tests for applying BKT updates to student skill state."""
+
+import unittest
+
+from modules.learning_analytics import skills_models
+from modules.learning_analytics import skills_updater
+
+
+SKILLS_MAP_XML = """\
+<?xml version="1.0" encoding="UTF-8"?>
+<skills-map>
+    <skills>
+        <skill id="add">Addition</skill>
+        <skill id="subtract">Subtraction</skill>
+        <skill id="multiply">Multiplication</skill>
+    </skills>
+    <objectives>
+        <objective id="sums">
+            <description>Sums and differences</description>
+            <skills>
+                <skill idref="add"/>
+                <skill idref="subtract"/>
+            </skills>
+        </objective>
+        <objective id="all">
+            <description>All operators</description>
+            <skills>
+                <skill idref="add"/>
+                <skill idref="subtract"/>
+                <skill idref="multiply"/>
+            </skills>
+        </objective>
+    </objectives>
+</skills-map>
+"""
+
+RESOURCES_MAP_XML = """\
+<?xml version="1.0" encoding="UTF-8"?>
+<resources id="arithmetic">
+    <resource id="q_add">
+        <skills>
+            <skill idref="add"/>
+        </skills>
+    </resource>
+    <resource id="q_mixed">
+        <skills>
+            <skill idref="add"/>
+            <skill idref="multiply"/>
+        </skills>
+    </resource>
+    <resource id="q_parts_1">
+        <skills>
+            <skill idref="add"/>
+        </skills>
+    </resource>
+    <resource id="q_parts_2">
+        <skills>
+            <skill idref="add"/>
+            <skill idref="subtract"/>
+        </skills>
+    </resource>
+</resources>
+"""
+
+
+def make_maps():
+    skills_map = skills_models.SkillsMap.from_xml(SKILLS_MAP_XML)
+    resources_map = skills_models.ResourcesMap.from_xml(
+        RESOURCES_MAP_XML, skills_map=skills_map)
+    return skills_map, resources_map
+
+
+class CountingStore(skills_updater.StudentStateStore):
+
+    def __init__(self):
+        super(CountingStore, self).__init__()
+        self.num_gets = 0
+        self.num_puts = 0
+
+    def get(self, student_id):
+        self.num_gets += 1
+        return super(CountingStore, self).get(student_id)
+
+    def put(self, student_id, student_skills):
+        self.num_puts += 1
+        super(CountingStore, self).put(student_id, student_skills)
+
+
+class SkillsUpdaterTests(unittest.TestCase):
+
+    def setUp(self):
+        self.estimator = skills_models.BKTEstimator.get_standard_estimator()
+        self.updater = skills_updater.SkillsUpdater(*make_maps())
+
+    def test_updates_every_skill_of_the_resource(self):
+        self.updater.update_student(
+            'student', {'resource_id': 'q_mixed', 'result': True})
+        expected = self.estimator.get_posterior(
+            skills_updater.SkillsUpdater.DEFAULT_PRIOR, is_correct=True)
+        self.assertEquals(
+            {'add': expected, 'multiply': expected},
+            self.updater.get_estimates('student'))
+
+    def test_uses_previous_estimate_as_prior(self):
+        self.updater.store.put('student', {'add': 0.5})
+        self.updater.update_student(
+            'student', {'resource_id': 'q_add', 'result': False})
+        self.assertEquals(
+            self.estimator.get_posterior(0.5, is_correct=False),
+            self.updater.store.get('student')['add'])
+
+    def test_records_update_time(self):
+        self.updater.update_student(
+            'student', {'resource_id': 'q_add', 'result': True}, now=100.0)
+        self.assertEquals(
+            {'add': 100.0}, self.updater.store.get('student')[
+                skills_updater.SkillsUpdater.TIMESTAMPS_KEY])
+
+    def test_forgetting_is_applied_when_read_and_updated(self):
+        estimator = skills_models.ForgettingBKTEstimator(
+            p_learning=0.1, p_guess=0.3, p_slip=0.2, half_life=10.0)
+        updater = skills_updater.SkillsUpdater(
+            *make_maps(), estimator=estimator)
+        updater.store.put('student', {
+            'add': 0.8, skills_updater.SkillsUpdater.TIMESTAMPS_KEY: {
+                'add': 0.0}})
+
+        self.assertAlmostEquals(
+            0.4, updater.get_estimates('student', now=10.0)['add'])
+        # Reading does not touch the stored estimate.
+        self.assertEquals(0.8, updater.store.get('student')['add'])
+
+        updater.update_student(
+            'student', {'resource_id': 'q_add', 'result': True}, now=20.0)
+        self.assertAlmostEquals(
+            estimator.get_posterior(0.2, is_correct=True),
+            updater.get_estimates('student', now=20.0)['add'])
+
+    def test_unknown_resource_is_ignored(self):
+        changed = self.updater.update_student(
+            'student', {'resource_id': 'unknown', 'result': True})
+        self.assertEquals({}, changed)
+        self.assertNotIn('student', self.updater.store)
+
+    def test_listeners_receive_previous_estimates(self):
+        calls = []
+        self.updater.add_listener(
+            lambda student_id, skills, changed: calls.append(
+                (student_id, dict(skills), changed)))
+        self.updater.store.put('student', {'add': 0.5})
+        self.updater.update_student(
+            'student', {'resource_id': 'q_mixed', 'result': True})
+        self.assertEquals(1, len(calls))
+        student_id, skills, changed = calls[0]
+        self.assertEquals('student', student_id)
+        self.assertEquals({'add': 0.5, 'multiply': None}, changed)
+        self.assertEquals(self.updater.store.get('student'), skills)
+
+
+class MultiPartUpdateTests(unittest.TestCase):
+
+    def setUp(self):
+        self.estimator = skills_models.BKTEstimator.get_standard_estimator()
+        self.store = CountingStore()
+        self.updater = skills_updater.SkillsUpdater(
+            *make_maps(), store=self.store)
+
+    def test_parts_are_updated_in_one_round_trip(self):
+        self.updater.update_student('student', {
+            'resource_id': 'q_parts',
+            'answers': {'q_parts_1': ['choice_1'], 'q_parts_2': ['choice_2']},
+            'result': True})
+        self.assertEquals(1, self.store.num_gets)
+        self.assertEquals(1, self.store.num_puts)
+
+    def test_skill_shared_by_parts_is_advanced_per_part(self):
+        self.updater.update_student('student', {
+            'resource_id': 'q_parts',
+            'answers': {'q_parts_1': ['choice_1'], 'q_parts_2': ['choice_2']},
+            'result': True})
+        once = self.estimator.get_posterior(0.0, is_correct=True)
+        twice = self.estimator.get_posterior(once, is_correct=True)
+        estimates = self.updater.get_estimates('student')
+        self.assertAlmostEquals(twice, estimates['add'])
+        self.assertAlmostEquals(once, estimates['subtract'])
+        self.assertNotIn('multiply', estimates)
+
+    def test_correct_map_scores_parts(self):
+        self.updater.update_student('student', {
+            'resource_id': 'q_parts',
+            'answers': {'q_parts_1': ['choice_1'], 'q_parts_2': ['choice_2']},
+            'correct_map': {
+                'q_parts_1': {'correctness': 'correct'},
+                'q_parts_2': {'correctness': 'incorrect'}},
+            'result': False})
+        once = self.estimator.get_posterior(0.0, is_correct=True)
+        estimates = self.updater.get_estimates('student')
+        self.assertAlmostEquals(
+            self.estimator.get_posterior(once, is_correct=False),
+            estimates['add'])
+        self.assertAlmostEquals(
+            self.estimator.get_posterior(0.0, is_correct=False),
+            estimates['subtract'])
+
+    def test_fallback_skips_skills_of_resolved_parts(self):
+        self.updater.update_student('student', {
+            'resource_id': 'q_mixed',
+            'answers': {'q_parts_1': ['a'], 'q_mixed_2': ['b']},
+            'correct_map': {'q_parts_1': {'correctness': 'incorrect'}},
+            'result': True})
+        self.assertEquals(
+            {'add': self.estimator.get_posterior(0.0, is_correct=False),
+             'multiply': self.estimator.get_posterior(0.0, is_correct=True)},
+            self.updater.get_estimates('student'))
+
+    def test_unknown_parts_fall_back_to_problem(self):
+        self.updater.update_student('student', {
+            'resource_id': 'q_mixed',
+            'answers': {'q_mixed_1': ['a'], 'q_mixed_2': ['b']},
+            'result': True})
+        once = self.estimator.get_posterior(0.0, is_correct=True)
+        self.assertEquals(
+            {'add': once, 'multiply': once},
+            self.updater.get_estimates('student'))
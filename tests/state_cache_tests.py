@@ -0,0 +1,137 @@
+"""Tests for the memory-bounded student state cache."""
+
+import shutil
+import tempfile
+import unittest
+
+from modules.learning_analytics import skills_updater
+from modules.learning_analytics import state_cache
+from tests.ext.learning_analytics import skills_updater_tests
+
+
+def student_state(value):
+    return {'add': value, 'subtract': value, '__updated__': {'add': 1.0}}
+
+
+class StudentStateCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.entry_size = state_cache.estimate_size(student_state(0.5))
+        self.caches = []
+
+    def tearDown(self):
+        for cache in self.caches:
+            cache.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def _make_cache(self, num_resident, backing_store=None):
+        if backing_store is None:
+            backing_store = skills_updater.StudentStateStore()
+        cache = state_cache.StudentStateCache(
+            backing_store, max_bytes=num_resident * self.entry_size,
+            spill_dir=self.tmp_dir)
+        self.caches.append(cache)
+        return cache
+
+    def test_evicts_least_recently_used(self):
+        backing_store = skills_updater.StudentStateStore()
+        cache = self._make_cache(2, backing_store)
+        cache.put('s1', student_state(0.1))
+        cache.put('s2', student_state(0.2))
+        cache.get('s1')
+        cache.put('s3', student_state(0.3))
+        stats = cache.stats()
+        self.assertEquals(1, stats['num_evictions'])
+        self.assertEquals(2, stats['num_resident'])
+        self.assertTrue(stats['resident_bytes'] <= 2 * self.entry_size)
+
+        # s2 was evicted while dirty, so it was spilled, not dropped:
+        self.assertEquals(1, stats['num_spilled'])
+        self.assertEquals(student_state(0.2), cache.get('s2'))
+        self.assertEquals(0.5, cache.stats()['hit_ratio'])
+
+    def test_flush_writes_dirty_students_to_backing_store(self):
+        backing_store = skills_updater.StudentStateStore()
+        cache = self._make_cache(1, backing_store)
+        cache.put('s1', student_state(0.1))
+        cache.put('s2', student_state(0.2))
+        self.assertEquals(0, len(backing_store))
+        cache.flush()
+        self.assertEquals(student_state(0.1), backing_store.get('s1'))
+        self.assertEquals(student_state(0.2), backing_store.get('s2'))
+        self.assertEquals(0, cache.stats()['num_spilled'])
+
+        # Clean students are evicted without spilling:
+        cache.get('s1')
+        self.assertEquals(1, cache.num_spills)
+
+    def test_misses_read_backing_store(self):
+        backing_store = skills_updater.StudentStateStore()
+        backing_store.put('s1', student_state(0.1))
+        cache = self._make_cache(1, backing_store)
+        self.assertEquals(student_state(0.1), cache.get('s1'))
+        self.assertEquals({}, cache.get('unknown'))
+        self.assertIn('s1', cache)
+        self.assertEquals(1, len(cache))
+
+    def test_items_cover_all_tiers(self):
+        cache = self._make_cache(1)
+        for n in range(3):
+            cache.put('s%d' % n, student_state(n / 10.0))
+        self.assertEquals(
+            dict(('s%d' % n, student_state(n / 10.0)) for n in range(3)),
+            dict(cache.items()))
+        self.assertEquals(3, len(cache))
+
+    def test_counts_and_lists_students_without_reading_them(self):
+        backing_store = skills_updater_tests.CountingStore()
+        backing_store.put('s0', student_state(0.0))
+        cache = self._make_cache(1, backing_store)
+        for n in range(1, 3):
+            cache.put('s%d' % n, student_state(n / 10.0))
+        backing_store.num_gets = 0
+        self.assertEquals(3, len(cache))
+        self.assertEquals(['s0', 's1', 's2'], sorted(cache.student_ids))
+        self.assertIn('s0', cache)
+        self.assertEquals(0, backing_store.num_gets)
+        cache.delete('s0')
+        self.assertNotIn('s0', cache)
+
+    def test_requires_backing_store(self):
+        self.assertRaises(ValueError, state_cache.StudentStateCache, None)
+
+    def test_close_keeps_spilled_students(self):
+        path = state_cache.store_path(self.tmp_dir, 'Org/Course/Run')
+        cache = state_cache.StudentStateCache(
+            state_cache.ShelveStateStore(path), max_bytes=self.entry_size,
+            spill_dir=self.tmp_dir)
+        for n in range(3):
+            cache.put('s%d' % n, student_state(n / 10.0))
+        self.assertEquals(2, cache.stats()['num_spilled'])
+        cache.close()
+
+        reopened = state_cache.ShelveStateStore(path)
+        self.assertEquals(
+            dict(('s%d' % n, student_state(n / 10.0)) for n in range(3)),
+            dict(reopened.items()))
+        reopened.close()
+
+    def test_serves_skills_updater(self):
+        skills_map, resources_map = skills_updater_tests.make_maps()
+        cache = self._make_cache(1)
+        updater = skills_updater.SkillsUpdater(
+            skills_map, resources_map, store=cache)
+        payload = {'resource_id': 'q_add', 'result': True}
+        for student_id in ['s1', 's2', 's1']:
+            updater.update_student(student_id, payload, now=0)
+        reference = skills_updater.SkillsUpdater(skills_map, resources_map)
+        for _ in range(2):
+            reference.update_student('s1', payload, now=0)
+        self.assertEquals(
+            reference.get_estimates('s1', now=0),
+            updater.get_estimates('s1', now=0))
+
+
+if __name__ == '__main__':
+    unittest.main()
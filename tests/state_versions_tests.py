@@ -0,0 +1,53 @@
+"""Tests for the version counters of a course's mastery state."""
+
+import unittest
+
+from modules.learning_analytics import skills_updater
+from modules.learning_analytics import state_versions
+from tests.ext.learning_analytics import skills_updater_tests
+
+SKILL = state_versions.StateVersions.SKILL
+OBJECTIVE = state_versions.StateVersions.OBJECTIVE
+
+
+class StateVersionsTests(unittest.TestCase):
+
+    def setUp(self):
+        skills_map, resources_map = skills_updater_tests.make_maps()
+        self.updater = skills_updater.SkillsUpdater(skills_map, resources_map)
+        self.versions = state_versions.StateVersions(skills_map)
+        self.updater.add_listener(self.versions.skills_changed)
+
+    def _answer(self, student_id, resource_id):
+        self.updater.update_student(
+            student_id, {'resource_id': resource_id, 'result': True})
+
+    def test_update_bumps_student_skills_and_objectives(self):
+        before = [self.versions.get_student_version('a'),
+                  self.versions.get_student_version('b'),
+                  self.versions.get_item_version(SKILL, 'add'),
+                  self.versions.get_item_version(SKILL, 'multiply'),
+                  self.versions.get_item_version(OBJECTIVE, 'sums')]
+        self._answer('a', 'q_add')
+        after = [self.versions.get_student_version('a'),
+                 self.versions.get_student_version('b'),
+                 self.versions.get_item_version(SKILL, 'add'),
+                 self.versions.get_item_version(SKILL, 'multiply'),
+                 self.versions.get_item_version(OBJECTIVE, 'sums')]
+        self.assertEquals([True, False, True, False, True],
+                          [old != new for old, new in zip(before, after)])
+
+    def test_forgetting_a_student_changes_every_version(self):
+        self._answer('a', 'q_add')
+        student = self.versions.get_student_version('b')
+        skill = self.versions.get_item_version(SKILL, 'multiply')
+        self.versions.forget_student('a')
+        self.assertNotEquals(student, self.versions.get_student_version('b'))
+        self.assertNotEquals(
+            skill, self.versions.get_item_version(SKILL, 'multiply'))
+
+    def test_versions_do_not_recur_across_instances(self):
+        self._answer('a', 'q_add')
+        restarted = state_versions.StateVersions(self.updater.skills_map)
+        self.assertNotEquals(self.versions.get_student_version('a'),
+                             restarted.get_student_version('a'))
@@ -0,0 +1,158 @@
+"""Tests for recording and replaying bus traffic."""
+
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from modules.learning_analytics import learning_analytics_schoolbus
+from modules.learning_analytics import local_bus
+from modules.learning_analytics import traffic_replay
+from tests.ext.learning_analytics import learning_analytics_schoolbus_tests
+from tests.ext.learning_analytics import skills_updater_tests
+
+
+class FakeClock(object):
+    """A clock that only advances when slept on."""
+
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(round(seconds, 6))
+        self.now += seconds
+
+
+class TrafficReplayTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'traffic.jsonl.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, offsets):
+        recording = gzip.open(self.path, 'wb')
+        recording.write((json.dumps({
+            'format': 'schoolbus-recording', 'version': 1,
+            'topic': 'studentAction', 'start': 0}) + '\n').encode('utf-8'))
+        for n, offset in enumerate(offsets):
+            action = learning_analytics_schoolbus_tests.student_action(
+                student_id='student-%d' % n)
+            recording.write((json.dumps([offset, json.dumps(action)]) +
+                             '\n').encode('utf-8'))
+        recording.close()
+
+    def _replay(self, speed):
+        bus = learning_analytics_schoolbus_tests.FakeBusAdapter()
+        clock = FakeClock()
+        replayer = traffic_replay.TrafficReplayer(
+            bus, self.path, speed=speed, message_class=local_bus.LocalBusMessage)
+        result = replayer.run(sleep=clock.sleep, clock=clock.time)
+        return bus, clock, result
+
+    def test_recorded_messages_are_read_back_in_order(self):
+        bus = learning_analytics_schoolbus_tests.FakeBusAdapter()
+        recorder = traffic_replay.TrafficRecorder(bus, self.path)
+        recorder.start()
+        for n in range(3):
+            bus.deliver('studentAction',
+                        learning_analytics_schoolbus_tests.student_action(
+                            student_id='student-%d' % n))
+        recorder.stop()
+        self.assertEquals({}, bus.subscriptions)
+        header, records = traffic_replay.read_recording(self.path)
+        self.assertEquals('studentAction', header['topic'])
+        records = list(records)
+        self.assertEquals(['student-0', 'student-1', 'student-2'],
+                          [json.loads(content)['student_id']
+                           for _, content in records])
+        offsets = [offset for offset, _ in records]
+        self.assertEquals(sorted(offsets), offsets)
+
+    def test_other_files_are_rejected(self):
+        with open(self.path, 'wb') as other:
+            other.write(b'not a recording')
+        self.assertRaises((ValueError, IOError, OSError),
+                          traffic_replay.read_recording, self.path)
+
+    def test_replay_keeps_original_pace(self):
+        self._write([0.0, 0.5, 0.5, 2.0])
+        bus, clock, result = self._replay(1)
+        self.assertEquals([0.5, 1.5], clock.sleeps)
+        self.assertEquals(4, result['sent'])
+        self.assertEquals(2.0, result['seconds'])
+        self.assertEquals(['studentAction'] * 4,
+                          [message.topicName for message in bus.published])
+
+    def test_replay_accelerates_or_runs_flat_out(self):
+        self._write([0.0, 0.5, 2.0])
+        _, clock, _ = self._replay(10)
+        self.assertEquals([0.05, 0.15], clock.sleeps)
+        _, clock, result = self._replay(0)
+        self.assertEquals([], clock.sleeps)
+        self.assertEquals(3, result['sent'])
+
+
+class ReplayMeasurementTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.server = local_bus.LocalBusServer()
+        self.server.start()
+        self.bus = local_bus.LocalBusAdapter(*self.server.address)
+        self.handler = learning_analytics_schoolbus.AnalyticsSchoolbusHandler(
+            course_maps={'course': skills_updater_tests.make_maps()},
+            bus_adapter=local_bus.LocalBusAdapter(*self.server.address))
+        self.handler.start()
+
+    def tearDown(self):
+        self.handler.close()
+        self.bus.close()
+        self.server.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_replay_reports_throughput_of_handler(self):
+        path = os.path.join(self.tmp_dir, 'traffic.jsonl.gz')
+        recorder = traffic_replay.TrafficRecorder(
+            local_bus.LocalBusAdapter(*self.server.address), path,
+            topic='recordedAction')
+        recorder.start()
+        # The last ten repeat the first ten, so the handler drops them:
+        for n in range(50):
+            action = learning_analytics_schoolbus_tests.student_action(
+                student_id='student-%d' % (n % 40 % 7))
+            action['time'] = n % 40
+            self.bus.publish(local_bus.LocalBusMessage(
+                content=json.dumps(action), topicName='recordedAction'))
+        self.bus.publish(local_bus.LocalBusMessage(
+            content='not json', topicName='recordedAction'))
+        # Wait until the recorder saw every message:
+        for _ in range(100):
+            if recorder.num_recorded == 51:
+                break
+            time.sleep(0.05)
+        recorder.stop()
+        recorder.bus_adapter.close()
+
+        probe = traffic_replay.ProcessingProbe(
+            self.bus, message_class=local_bus.LocalBusMessage)
+
+        replayer = traffic_replay.TrafficReplayer(
+            self.bus, path, speed=0, topic='studentAction',
+            message_class=local_bus.LocalBusMessage)
+        result = traffic_replay.replay_and_measure(replayer, probe, timeout=20)
+        probe.close()
+        self.assertEquals(51, result['sent'])
+        self.assertEquals(40, self.handler.position['num_processed'])
+        self.assertEquals(51, self.handler.position['num_consumed'])
+        self.assertEquals(1, self.handler.position['num_malformed'])
+        self.assertTrue(result['throughput'] > 0)